@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class AgendamentosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'agendamentos'
+
+    def ready(self):
+        # Registra os signals de invalidação de cache e de estatísticas
+        from . import cache  # noqa: F401
+        from . import estatisticas  # noqa: F401
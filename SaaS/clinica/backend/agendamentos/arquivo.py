@@ -0,0 +1,135 @@
+"""
+Arquivamento de agendamentos antigos
+
+Agendamentos concluídos, cancelados ou marcados como falta anteriores ao
+horizonte (AGENDAMENTOS_ARQUIVO_MESES, contados em meses inteiros) saem da
+tabela principal para AgendamentoArquivado. Confirmados nunca são
+arquivados, então a verificação de conflito e a agenda do dia não mudam,
+só passam a percorrer uma tabela pequena.
+
+Leitura unificada para relatórios que atravessam as duas camadas:
+
+- consultar(): linhas das duas tabelas (UNION ALL de values())
+- totais(): aggregate() nas duas, somado
+- agregar(): values().annotate() nas duas, somado por grupo
+
+Os agregados precisam ser aditivos (Count, Sum).
+"""
+
+import logging
+from datetime import date, datetime, time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Agendamento, AgendamentoArquivado
+
+logger = logging.getLogger(__name__)
+
+
+STATUS_ARQUIVAVEIS = ('concluido', 'cancelado', 'falta')
+CAMPOS = [
+    'id', 'cliente_id', 'servico_id', 'horario', 'status', 'observacoes',
+    'valor_cobrado', 'criado_em', 'atualizado_em',
+]
+CAMADAS = (Agendamento, AgendamentoArquivado)
+
+
+def horizonte(meses=None, agora=None):
+    """Início (meia-noite local) do mês mais antigo mantido na tabela principal"""
+    if meses is None:
+        meses = getattr(settings, 'AGENDAMENTOS_ARQUIVO_MESES', 12)
+    hoje = timezone.localdate(agora)
+    indice = hoje.year * 12 + hoje.month - 1 - meses
+    return timezone.make_aware(datetime.combine(date(indice // 12, indice % 12 + 1, 1), time.min))
+
+
+def arquivar_lote(antes_de, limite=5000):
+    """Move até `limite` agendamentos arquiváveis anteriores a `antes_de`; retorna as linhas movidas"""
+    from . import estatisticas
+
+    with transaction.atomic():
+        linhas = list(
+            Agendamento.objects.select_for_update(skip_locked=True).filter(
+                horario__lt=antes_de,
+                status__in=STATUS_ARQUIVAVEIS
+            ).order_by('horario').values(*CAMPOS)[:limite]
+        )
+        if not linhas:
+            return []
+
+        AgendamentoArquivado.objects.bulk_create(
+            [AgendamentoArquivado(**linha) for linha in linhas]
+        )
+        # DELETE direto: delete() carregaria e sinalizaria cada linha
+        Agendamento.objects.filter(
+            pk__in=[linha['id'] for linha in linhas]
+        )._raw_delete(Agendamento.objects.db)
+        # Último agendamento pode ter saído da tabela principal
+        estatisticas.atualizar({linha['cliente_id'] for linha in linhas})
+    return linhas
+
+
+def arquivar(meses=None, limite=5000):
+    """Arquiva, em lotes, tudo o que passou do horizonte; retorna o total movido"""
+    from .cache import CacheService
+
+    antes_de = horizonte(meses)
+    total = 0
+    meses_afetados = set()
+    while True:
+        linhas = arquivar_lote(antes_de, limite)
+        total += len(linhas)
+        for linha in linhas:
+            data = timezone.localtime(linha['horario']).date()
+            meses_afetados.add(CacheService.ns_mes(data.year, data.month))
+        if len(linhas) < limite:
+            break
+
+    # Só saem agendamentos não confirmados: a ocupação dos dias não muda
+    if total:
+        CacheService.incrementar('agendamentos', *meses_afetados)
+
+    logger.info(f"Arquivados {total} agendamentos anteriores a {antes_de}")
+    return total
+
+
+def consultar(campos=CAMPOS, **filtros):
+    """Agendamentos das duas camadas (values, UNION ALL); aceita order_by por campo selecionado"""
+    principal = Agendamento.objects.filter(**filtros).order_by().values(*campos)
+    arquivados = AgendamentoArquivado.objects.filter(**filtros).order_by().values(*campos)
+    return principal.union(arquivados, all=True)
+
+
+def totais(agregados, **filtros):
+    """aggregate(**agregados) das duas camadas, somado"""
+    resultado = dict.fromkeys(agregados, 0)
+    for modelo in CAMADAS:
+        for nome, valor in modelo.objects.filter(**filtros).aggregate(**agregados).items():
+            resultado[nome] += valor or 0
+    return resultado
+
+
+def agregar(agrupar_por, agregados, **filtros):
+    """values(*agrupar_por).annotate(**agregados) das duas camadas, somado por grupo"""
+    grupos = {}
+    for modelo in CAMADAS:
+        linhas = modelo.objects.filter(**filtros).order_by().values(*agrupar_por).annotate(**agregados)
+        for linha in linhas:
+            chave = tuple(linha[campo] for campo in agrupar_por)
+            if chave not in grupos:
+                grupos[chave] = {campo: linha[campo] for campo in agrupar_por}
+                grupos[chave].update(dict.fromkeys(agregados, 0))
+            for nome in agregados:
+                grupos[chave][nome] += linha[nome] or 0
+    return list(grupos.values())
+
+
+# Tarefa Celery para arquivamento periódico (agendar no beat)
+from celery import shared_task
+
+@shared_task
+def arquivar_agendamentos_antigos():
+    """Tarefa periódica de arquivamento"""
+    return arquivar()
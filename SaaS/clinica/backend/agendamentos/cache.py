@@ -3,50 +3,304 @@ Sistema de Cache Inteligente para Performance
 Cache automatizado com invalidação inteligente
 """
 
+from django.conf import settings
 from django.core.cache import cache
 from django.core.cache.utils import make_template_fragment_key
+from django.db import transaction
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from django.db.models import Model
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date, datetime, time as dt_time, timedelta
+from decimal import Decimal
 from functools import wraps
-from datetime import timedelta
 import hashlib
-import json
+import inspect
+import math
+import random
+import threading
+import time
+import uuid
+
+
+def _parte_da_chave(valor):
+    """
+    Representação estável de um argumento para a chave de cache
+
+    Instâncias de model entram pela identidade (model, pk e atualizado_em,
+    quando existir): a chave muda quando o registro é alterado. Objetos sem
+    representação estável (ex.: self, request) levantam TypeError; nesse
+    caso declare `campos` ou `chave` no cache_result.
+    """
+    if valor is None or isinstance(valor, (bool, int, float, str, Decimal)):
+        return repr(valor)
+    if isinstance(valor, (date, datetime, dt_time)):
+        return valor.isoformat()
+    if isinstance(valor, Model):
+        versao = getattr(valor, 'atualizado_em', None)
+        partes = [valor._meta.label_lower, str(valor.pk)]
+        if versao is not None:
+            partes.append(versao.isoformat())
+        return ':'.join(partes)
+    if isinstance(valor, (list, tuple)):
+        return '[' + ','.join(_parte_da_chave(item) for item in valor) + ']'
+    if isinstance(valor, (set, frozenset)):
+        return '{' + ','.join(sorted(_parte_da_chave(item) for item in valor)) + '}'
+    if isinstance(valor, dict):
+        return '{' + ','.join(
+            f"{_parte_da_chave(k)}={_parte_da_chave(v)}"
+            for k, v in sorted(valor.items(), key=lambda item: str(item[0]))
+        ) + '}'
+    raise TypeError(
+        f"{type(valor).__name__} não tem representação estável para chave de cache"
+    )
 
 
 def cache_key_generator(*args, **kwargs):
-    """Gera chave de cache baseada nos argumentos"""
-    key_data = {
-        'args': args,
-        'kwargs': sorted(kwargs.items())
-    }
-    key_string = json.dumps(key_data, sort_keys=True, default=str)
-    return hashlib.md5(key_string.encode()).hexdigest()
+    """Gera chave de cache baseada nos argumentos (blake2b de 128 bits)"""
+    partes = [_parte_da_chave(arg) for arg in args]
+    partes += [f"{nome}={_parte_da_chave(valor)}" for nome, valor in sorted(kwargs.items())]
+    return hashlib.blake2b('|'.join(partes).encode(), digest_size=16).hexdigest()
+
+
+# Contadores do get_or_compute neste processo (ver get_cache_stats)
+_contadores = {
+    'hits': 0,
+    'misses': 0,
+    'recomputes': 0,
+    'refresh_antecipado': 0,
+    'stale_servido': 0,
+    'espera_lock': 0,
+}
+_contadores_lock = threading.Lock()
+_AUSENTE = object()
+
+
+def _contar(nome):
+    with _contadores_lock:
+        _contadores[nome] += 1
+
+
+class CacheLocal:
+    """
+    LRU com TTL na memória do processo (L1, na frente do cache do Django)
+
+    Os valores são compartilhados entre as threads: quem lê não deve
+    alterá-los.
+    """
+
+    def __init__(self, maximo=256):
+        self.maximo = maximo
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, chave, padrao=None):
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None or item[1] <= time.monotonic():
+                if item is not None:
+                    del self._itens[chave]
+                self.misses += 1
+                return padrao
+            self._itens.move_to_end(chave)
+            self.hits += 1
+            return item[0]
+
+    def set(self, chave, valor, timeout):
+        with self._lock:
+            self._itens[chave] = (valor, time.monotonic() + timeout)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.maximo:
+                self._itens.popitem(last=False)
+
+    def delete(self, *chaves):
+        with self._lock:
+            for chave in chaves:
+                self._itens.pop(chave, None)
+
+    def clear(self):
+        with self._lock:
+            self._itens.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / max(self.hits + self.misses, 1) * 100, 2),
+                'tamanho': len(self._itens),
+                'maximo': self.maximo,
+            }
+
+
+# L1 de valores e de versões de namespace (ver CacheService._versoes)
+l1_valores = CacheLocal(getattr(settings, 'CACHE_L1_MAXIMO', 256))
+l1_versoes = CacheLocal(getattr(settings, 'CACHE_L1_MAXIMO', 256))
+
+
+def get_or_compute(key, compute, timeout=1800, beta=1.0, stale_timeout=600,
+                   lock_timeout=30, espera=5.0, local=False):
+    """
+    Busca `key` no cache ou calcula com `compute()`, sem stampede
+
+    - o valor é guardado com o instante de expiração lógica e o tempo de
+      cálculo; fica fisicamente `stale_timeout` segundos a mais no cache;
+    - refresh antecipado probabilístico (XFetch): quanto mais perto da
+      expiração e mais caro o cálculo, maior a chance de um request
+      recalcular antes da hora;
+    - só quem obtém o lock (cache.add) recalcula; os demais recebem o valor
+      vencido enquanto isso ou, sem valor algum, esperam até `espera`
+      segundos pelo resultado antes de calcular por conta própria.
+
+    Com chaves versionadas (CacheService.chave) a invalidação troca a chave:
+    valor vencido só é servido após o timeout, nunca após uma invalidação.
+
+    local=True consulta antes o L1 do processo (CACHE_L1_TTL segundos); a
+    chave versionada também garante que o L1 nunca serve valor invalidado.
+    """
+    if local:
+        valor = l1_valores.get(key, _AUSENTE)
+        if valor is not _AUSENTE:
+            return valor
+        valor = get_or_compute(key, compute, timeout, beta, stale_timeout, lock_timeout, espera)
+        l1_valores.set(key, valor, min(timeout, getattr(settings, 'CACHE_L1_TTL', 60)))
+        return valor
+
+    item = cache.get(key)
+    agora = time.time()
+
+    if item is not None:
+        restante = item['expira'] - agora
+        # XFetch: -delta * beta * log(U) > 0, maior para cálculos lentos
+        if restante > -item['delta'] * beta * math.log(1.0 - random.random()):
+            _contar('hits')
+            return item['valor']
+    else:
+        _contar('misses')
+
+    lock_key = f"{key}_lock"
+    token = uuid.uuid4().hex
+    if not cache.add(lock_key, token, lock_timeout):
+        if item is not None:
+            # Outro worker já está recalculando: serve o valor atual
+            _contar('stale_servido' if item['expira'] <= agora else 'hits')
+            return item['valor']
+
+        _contar('espera_lock')
+        limite = agora + espera
+        while time.time() < limite:
+            time.sleep(0.05)
+            item = cache.get(key)
+            if item is not None:
+                return item['valor']
+            if cache.get(lock_key) is None:
+                break
+    elif item is not None and item['expira'] > agora:
+        _contar('refresh_antecipado')
+
+    try:
+        inicio = time.time()
+        valor = compute()
+        delta = time.time() - inicio
+        _contar('recomputes')
+        cache.set(
+            key,
+            {'valor': valor, 'expira': inicio + delta + timeout, 'delta': delta},
+            timeout + stale_timeout
+        )
+    finally:
+        # Só libera o lock se ainda for nosso (pode ter expirado durante o cálculo)
+        if cache.get(lock_key) == token:
+            cache.delete(lock_key)
+
+    return valor
+
+
+# Memoização por request (ver memoizacao_request e MemoizacaoRequestMiddleware)
+_memo_request = ContextVar('agendamentos_memo_request', default=None)
+
+
+@contextmanager
+def memoizacao_request():
+    """Ativa a memoização do cache_result(por_request=True) no bloco"""
+    token = _memo_request.set({})
+    try:
+        yield
+    finally:
+        _memo_request.reset(token)
+
+
+class MemoizacaoRequestMiddleware:
+    """Middleware que limita a memoização por request ao ciclo de cada request"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
 
+    def __call__(self, request):
+        with memoizacao_request():
+            return self.get_response(request)
+
+
+def cache_result(timeout=3600, key_prefix="", campos=None, chave=None, por_request=False):
+    """
+    Decorator para cachear resultados de funções
 
-def cache_result(timeout=3600, key_prefix=""):
-    """Decorator para cachear resultados de funções"""
+    campos: nomes dos parâmetros que compõem a chave (os demais, como self,
+        são ignorados); sem campos, todos os argumentos entram na chave
+    chave: função com a mesma assinatura da decorada que retorna a parte
+        variável da chave (substitui campos)
+    por_request: também memoiza o resultado durante o request (evita até a
+        leitura do cache quando a função é chamada várias vezes)
+    """
     def decorator(func):
+        assinatura = inspect.signature(func) if campos else None
+
+        def gerar_chave(args, kwargs):
+            if chave is not None:
+                return cache_key_generator(chave(*args, **kwargs))
+            if campos:
+                ligados = assinatura.bind(*args, **kwargs)
+                ligados.apply_defaults()
+                return cache_key_generator(**{nome: ligados.arguments[nome] for nome in campos})
+            return cache_key_generator(*args, **kwargs)
+
         @wraps(func)
         def wrapper(*args, **kwargs):
             # Gerar chave de cache
-            cache_key = f"{key_prefix}_{func.__name__}_{cache_key_generator(*args, **kwargs)}"
-
-            # Tentar buscar no cache
-            result = cache.get(cache_key)
-            if result is not None:
-                return result
+            cache_key = f"{key_prefix}_{func.__qualname__}_{gerar_chave(args, kwargs)}"
 
-            # Executar função e cachear resultado
-            result = func(*args, **kwargs)
-            cache.set(cache_key, result, timeout)
+            memo = _memo_request.get() if por_request else None
+            if memo is not None and cache_key in memo:
+                return memo[cache_key]
 
-            return result
+            resultado = get_or_compute(cache_key, lambda: func(*args, **kwargs), timeout)
+            if memo is not None:
+                memo[cache_key] = resultado
+            return resultado
         return wrapper
     return decorator
 
 
 class CacheService:
-    """Serviço centralizado de cache"""
+    """
+    Serviço centralizado de cache
+
+    As chaves embutem a versão (geração) dos namespaces de que o dado
+    depende; invalidar é incrementar a versão, e as entradas antigas
+    simplesmente deixam de ser lidas (expiram pelo timeout).
+
+    Namespaces:
+        agendamentos  qualquer alteração de agendamento (dashboard)
+        dia_<data>    agendamentos que ocupam a data
+        mes_<aaaa-mm> agendamentos do mês
+        clientes      cadastro de clientes (nomes, ativos)
+        servicos      cadastro de serviços (nomes, durações, valores)
+        dashboard     invalidação manual do dashboard
+    """
 
     # Prefixos de cache
     DASHBOARD_PREFIX = "dashboard"
@@ -54,6 +308,7 @@ class CacheService:
     CLIENTES_PREFIX = "clientes"
     SERVICOS_PREFIX = "servicos"
     RELATORIOS_PREFIX = "relatorios"
+    VERSAO_PREFIX = "versao"
 
     # Timeouts de cache (em segundos)
     CACHE_SHORT = 300      # 5 minutos
@@ -61,29 +316,93 @@ class CacheService:
     CACHE_LONG = 3600      # 1 hora
     CACHE_VERY_LONG = 86400  # 24 horas
 
+    @staticmethod
+    def ns_dia(data):
+        """Namespace dos agendamentos de uma data"""
+        return f"dia_{data}"
+
+    @staticmethod
+    def ns_mes(ano, mes):
+        """Namespace dos agendamentos de um mês"""
+        return f"mes_{ano}-{int(mes):02d}"
+
+    @staticmethod
+    def _versao_inicial():
+        # Se a versão some do cache (eviction), recomeça do relógio em µs:
+        # sempre acima das versões já usadas, nunca reaproveita entradas antigas
+        return time.time_ns() // 1000
+
+    @staticmethod
+    def em_l1(*namespaces):
+        """Verifica se os namespaces estão configurados para o L1 (CACHE_L1_NAMESPACES)"""
+        configurados = getattr(settings, 'CACHE_L1_NAMESPACES', ('servicos',))
+        return all(ns in configurados for ns in namespaces)
+
     @classmethod
-    def get_dashboard_data(cls, user_id=None):
-        """Cache para dados do dashboard"""
-        cache_key = f"{cls.DASHBOARD_PREFIX}_data_{user_id or 'all'}"
+    def _versoes(cls, namespaces):
+        """Versões atuais dos namespaces (uma leitura em lote)"""
+        chaves = [f"{cls.VERSAO_PREFIX}_{ns}" for ns in namespaces]
+
+        # Versões de namespaces do L1 são relidas a cada CACHE_L1_VERIFICACAO
+        # segundos (0: sempre); o processo que incrementa limpa a sua na hora
+        verificacao = getattr(settings, 'CACHE_L1_VERIFICACAO', 0)
+        versoes = {}
+        if verificacao:
+            for ns, chave in zip(namespaces, chaves):
+                if cls.em_l1(ns):
+                    versao = l1_versoes.get(chave)
+                    if versao is not None:
+                        versoes[chave] = versao
+
+        buscar = [chave for chave in chaves if chave not in versoes]
+        if buscar:
+            lidas = cache.get_many(buscar)
+            faltando = [chave for chave in buscar if chave not in lidas]
+            if faltando:
+                for chave in faltando:
+                    cache.add(chave, cls._versao_inicial(), None)
+                # Outro processo pode ter criado a versão antes (add não sobrescreve)
+                lidas.update(cache.get_many(faltando))
+            versoes.update(lidas)
+
+            if verificacao:
+                for ns, chave in zip(namespaces, chaves):
+                    if cls.em_l1(ns) and chave in lidas:
+                        l1_versoes.set(chave, lidas[chave], verificacao)
+
+        return [versoes.get(chave, 0) for chave in chaves]
 
-        data = cache.get(cache_key)
-        if data is None:
-            # Importar aqui para evitar import circular
-            from .views import AgendamentoViewSet
-            from rest_framework.request import Request
-            from django.http import HttpRequest
+    @classmethod
+    def chave(cls, base, *namespaces):
+        """Chave de cache com as versões dos namespaces embutidas"""
+        versoes = cls._versoes(namespaces)
+        return f"{base}_v" + ".".join(str(versao) for versao in versoes)
+
+    @classmethod
+    def incrementar(cls, *namespaces):
+        """Nova geração dos namespaces: invalida tudo que depende deles"""
+        for ns in dict.fromkeys(namespaces):
+            chave = f"{cls.VERSAO_PREFIX}_{ns}"
+            l1_versoes.delete(chave)
+            try:
+                cache.incr(chave)
+            except ValueError:
+                cache.set(chave, cls._versao_inicial(), None)
 
-            # Simular request para o dashboard
-            request = Request(HttpRequest())
-            viewset = AgendamentoViewSet()
-            viewset.request = request
+    @classmethod
+    def get_dashboard_data(cls, user_id=None):
+        """Cache para dados do dashboard"""
+        from django.utils import timezone
 
-            response = viewset.dashboard(request)
-            data = response.data
+        # Contagens de hoje/semana/mês mudam com a data
+        cache_key = cls.chave(
+            f"{cls.DASHBOARD_PREFIX}_data_{user_id or 'all'}_{timezone.localdate()}",
+            'agendamentos', 'clientes', 'servicos', 'dashboard'
+        )
 
-            cache.set(cache_key, data, cls.CACHE_MEDIUM)
+        from .dashboard import dados_dashboard
 
-        return data
+        return get_or_compute(cache_key, dados_dashboard, cls.CACHE_MEDIUM)
 
     @classmethod
     def get_agendamentos_hoje(cls):
@@ -91,39 +410,70 @@ class CacheService:
         from django.utils import timezone
         from .models import Agendamento
 
-        cache_key = f"{cls.AGENDAMENTOS_PREFIX}_hoje_{timezone.now().date()}"
+        hoje = timezone.localdate()
+        cache_key = cls.chave(
+            f"{cls.AGENDAMENTOS_PREFIX}_hoje_{hoje}",
+            cls.ns_dia(hoje), 'clientes', 'servicos'
+        )
 
-        agendamentos = cache.get(cache_key)
-        if agendamentos is None:
-            hoje = timezone.now().date()
-            agendamentos = list(
+        return get_or_compute(
+            cache_key,
+            lambda: list(
                 Agendamento.objects.filter(
                     horario__date=hoje
                 ).select_related('cliente', 'servico').values(
                     'id', 'cliente__nome', 'servico__nome',
                     'horario', 'status', 'valor_cobrado'
                 )
+            ),
+            cls.CACHE_SHORT
+        )
+
+    @classmethod
+    def get_ocupacao(cls, datas):
+        """Cache dos blocos ocupados (agendamentos confirmados) de cada dia"""
+        from .disponibilidade import carregar_ocupacao
+
+        # Versões de todas as datas (e dos serviços, pelas durações) em uma leitura
+        namespaces = [cls.ns_dia(data) for data in datas]
+        versoes = cls._versoes(namespaces + ['servicos'])
+        servicos = versoes.pop()
+        chaves = {
+            f"{cls.AGENDAMENTOS_PREFIX}_ocupacao_{data}_v{versao}.{servicos}": data
+            for data, versao in zip(datas, versoes)
+        }
+        encontrados = cache.get_many(list(chaves))
+        ocupacao = {chaves[chave]: blocos for chave, blocos in encontrados.items()}
+
+        faltando = {chave: data for chave, data in chaves.items() if chave not in encontrados}
+        if faltando:
+            # Dias ausentes carregados em uma única consulta
+            carregados = carregar_ocupacao(list(faltando.values()))
+            cache.set_many(
+                {chave: carregados[data] for chave, data in faltando.items()},
+                cls.CACHE_LONG
             )
-            cache.set(cache_key, agendamentos, cls.CACHE_SHORT)
+            ocupacao.update(carregados)
 
-        return agendamentos
+        return ocupacao
 
     @classmethod
     def get_servicos_ativos(cls):
         """Cache para serviços ativos"""
-        cache_key = f"{cls.SERVICOS_PREFIX}_ativos"
+        cache_key = cls.chave(f"{cls.SERVICOS_PREFIX}_ativos", 'servicos')
 
-        servicos = cache.get(cache_key)
-        if servicos is None:
-            from .models import Servico
-            servicos = list(
+        from .models import Servico
+
+        return get_or_compute(
+            cache_key,
+            lambda: list(
                 Servico.objects.filter(ativo=True).values(
                     'id', 'nome', 'valor', 'duracao_minutos', 'cor_calendario'
                 )
-            )
-            cache.set(cache_key, servicos, cls.CACHE_LONG)
-
-        return servicos
+            ),
+            cls.CACHE_LONG,
+            local=cls.em_l1('servicos')
+        )
 
     @classmethod
     def get_estatisticas_mes(cls, mes=None, ano=None):
@@ -135,72 +485,69 @@ class CacheService:
             mes = hoje.month
             ano = hoje.year
 
-        cache_key = f"{cls.RELATORIOS_PREFIX}_estatisticas_{ano}_{mes}"
-
-        stats = cache.get(cache_key)
-        if stats is None:
-            from .models import Agendamento
-            from django.db.models import Count, Sum
-
-            # Calcular estatísticas
-            agendamentos_mes = Agendamento.objects.filter(
-                horario__year=ano,
-                horario__month=mes
+        cache_key = cls.chave(
+            f"{cls.RELATORIOS_PREFIX}_estatisticas_{ano}_{mes}",
+            cls.ns_mes(ano, mes), 'servicos'
+        )
+
+        def calcular():
+            from . import arquivo
+            from django.db.models import Count, Q, Sum
+
+            # Calcular estatísticas (tabela principal e arquivo)
+            filtros = {'horario__year': ano, 'horario__month': mes}
+            totais = arquivo.totais({
+                'total': Count('id'),
+                'receita': Sum('valor_cobrado', filter=Q(status='concluido')),
+            }, **filtros)
+            por_servico = arquivo.agregar(
+                ['servico__nome'], {'count': Count('id'), 'receita': Sum('valor_cobrado')}, **filtros
             )
 
-            stats = {
-                'total_agendamentos': agendamentos_mes.count(),
-                'receita_total': agendamentos_mes.filter(
-                    status='concluido'
-                ).aggregate(
-                    total=Sum('valor_cobrado')
-                )['total'] or 0,
-                'por_status': list(
-                    agendamentos_mes.values('status').annotate(
-                        count=Count('id')
-                    )
-                ),
-                'por_servico': list(
-                    agendamentos_mes.values(
-                        'servico__nome'
-                    ).annotate(
-                        count=Count('id'),
-                        receita=Sum('valor_cobrado')
-                    ).order_by('-count')[:10]
-                )
+            return {
+                'total_agendamentos': totais['total'],
+                'receita_total': totais['receita'],
+                'por_status': arquivo.agregar(['status'], {'count': Count('id')}, **filtros),
+                'por_servico': sorted(por_servico, key=lambda item: -item['count'])[:10]
             }
 
-            # Cache por mais tempo se for mês passado
-            timeout = cls.CACHE_VERY_LONG if mes < timezone.now().month else cls.CACHE_MEDIUM
-            cache.set(cache_key, stats, timeout)
-
-        return stats
+        # Cache por mais tempo se for mês passado
+        hoje = timezone.now()
+        passado = (int(ano), int(mes)) < (hoje.year, hoje.month)
+        timeout = cls.CACHE_VERY_LONG if passado else cls.CACHE_MEDIUM
+        return get_or_compute(cache_key, calcular, timeout)
 
     @classmethod
     def invalidate_dashboard(cls):
         """Invalida cache do dashboard"""
-        cache.delete_many([
-            f"{cls.DASHBOARD_PREFIX}_data_all",
-            f"{cls.DASHBOARD_PREFIX}_data_None"
-        ])
+        cls.incrementar('dashboard')
 
     @classmethod
-    def invalidate_agendamentos(cls):
-        """Invalida cache de agendamentos"""
+    def invalidate_agendamentos(cls, *horarios):
+        """Invalida o que depende dos agendamentos nos horários informados"""
         from django.utils import timezone
 
-        # Invalidar agendamentos de hoje
-        hoje = timezone.now().date()
-        cache.delete(f"{cls.AGENDAMENTOS_PREFIX}_hoje_{hoje}")
+        namespaces = ['agendamentos']
+        for horario in horarios:
+            if horario:
+                data = timezone.localtime(horario).date()
+                namespaces += [
+                    cls.ns_dia(data),
+                    # O agendamento pode terminar no dia seguinte
+                    cls.ns_dia(data + timedelta(days=1)),
+                    cls.ns_mes(data.year, data.month),
+                ]
+        cls.incrementar(*namespaces)
 
-        # Invalidar dashboard
-        cls.invalidate_dashboard()
+    @classmethod
+    def invalidate_clientes(cls):
+        """Invalida cache que exibe dados de clientes"""
+        cls.incrementar('clientes')
 
     @classmethod
     def invalidate_servicos(cls):
         """Invalida cache de serviços"""
-        cache.delete(f"{cls.SERVICOS_PREFIX}_ativos")
-        cls.invalidate_dashboard()
+        cls.incrementar('servicos')
 
     @classmethod
     def invalidate_estatisticas(cls, mes=None, ano=None):
@@ -212,22 +559,27 @@ class CacheService:
             mes = hoje.month
             ano = hoje.year
 
-        cache.delete(f"{cls.RELATORIOS_PREFIX}_estatisticas_{ano}_{mes}")
+        cls.incrementar(cls.ns_mes(ano, mes))
 
 
 # Signals para invalidação automática de cache
 @receiver(post_save, sender='agendamentos.Agendamento')
 @receiver(post_delete, sender='agendamentos.Agendamento')
-def invalidate_agendamento_cache(sender, **kwargs):
+def invalidate_agendamento_cache(sender, instance, **kwargs):
     """Invalida cache quando agendamento é alterado"""
-    CacheService.invalidate_agendamentos()
+    # Dia/mês novos e, se o horário mudou, os antigos (Agendamento.from_db)
+    horarios = (instance.horario, getattr(instance, '_horario_anterior', None))
+    # Só após o commit: antes disso uma leitura concorrente ainda vê os dados
+    # antigos e os gravaria sob a versão nova
+    transaction.on_commit(lambda: CacheService.invalidate_agendamentos(*horarios))
+    instance._horario_anterior = instance.horario
 
 
 @receiver(post_save, sender='agendamentos.Cliente')
 @receiver(post_delete, sender='agendamentos.Cliente')
 def invalidate_cliente_cache(sender, **kwargs):
     """Invalida cache quando cliente é alterado"""
-    CacheService.invalidate_dashboard()
+    CacheService.invalidate_clientes()
 
 
 @receiver(post_save, sender='agendamentos.Servico')
@@ -297,11 +649,21 @@ def warm_cache():
 def clear_all_cache():
     """Limpa todo o cache da aplicação"""
     cache.clear()
+    l1_valores.clear()
+    l1_versoes.clear()
     return True
 
 
 def get_cache_stats():
     """Retorna estatísticas do cache"""
+    with _contadores_lock:
+        contadores = dict(_contadores)
+    leituras = contadores['hits'] + contadores['stale_servido'] + contadores['misses']
+    contadores['hit_rate'] = round(
+        (contadores['hits'] + contadores['stale_servido']) / max(leituras, 1) * 100, 2
+    )
+    contadores['l1'] = l1_valores.stats()
+
     try:
         # Esta implementação depende do backend de cache usado
         # Para Redis, podemos usar redis.info()
@@ -321,10 +683,14 @@ def get_cache_stats():
                     info.get('keyspace_hits', 0) /
                     max(info.get('keyspace_hits', 0) + info.get('keyspace_misses', 0), 1) * 100,
                     2
-                )
+                ),
+                'get_or_compute': contadores
             }
         else:
-            return {'message': 'Estatísticas não disponíveis para este backend de cache'}
+            return {
+                'message': 'Estatísticas não disponíveis para este backend de cache',
+                'get_or_compute': contadores
+            }
 
     except Exception as e:
-        return {'error': str(e)}
+        return {'error': str(e), 'get_or_compute': contadores}
@@ -0,0 +1,95 @@
+"""
+Dados do dashboard principal
+
+Usado pela action AgendamentoViewSet.dashboard e pelo cache
+(CacheService.get_dashboard_data). Quatro consultas independentes do volume
+de dados:
+
+- contadores(): hoje/semana/mês e receita do mês em um único aggregate
+  com Count/Sum condicionais, limitado pelo índice de horário
+- servicos_mais_procurados(): ranking só da janela móvel recente
+- clientes ativos e próximos agendamentos
+"""
+
+from datetime import datetime, time, timedelta
+
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from .models import Agendamento, Cliente
+
+
+# Janela (em dias) do ranking de serviços mais procurados
+JANELA_POPULARIDADE_DIAS = 90
+
+
+def inicio_dos_periodos(agora=None):
+    """Início (meia-noite local) de hoje, da semana (segunda) e do mês"""
+    hoje = timezone.localtime(agora or timezone.now()).date()
+
+    def meia_noite(data):
+        return timezone.make_aware(datetime.combine(data, time.min))
+
+    return {
+        'hoje': meia_noite(hoje),
+        'semana': meia_noite(hoje - timedelta(days=hoje.weekday())),
+        'mes': meia_noite(hoje.replace(day=1)),
+    }
+
+
+def contadores(agora=None):
+    """Agendamentos de hoje/semana/mês e receita do mês (uma consulta)"""
+    inicio = inicio_dos_periodos(agora)
+    no_mes = Q(horario__gte=inicio['mes'])
+
+    return Agendamento.objects.filter(
+        # Só o que algum contador usa: a consulta percorre o índice de horário
+        horario__gte=min(inicio['semana'], inicio['mes'])
+    ).aggregate(
+        agendamentos_hoje=Count(
+            'id', filter=Q(horario__gte=inicio['hoje'], horario__lt=inicio['hoje'] + timedelta(days=1))
+        ),
+        agendamentos_semana=Count('id', filter=Q(horario__gte=inicio['semana'])),
+        agendamentos_mes=Count('id', filter=no_mes),
+        receita_mes=Sum('valor_cobrado', filter=no_mes & Q(status='concluido')),
+    )
+
+
+def servicos_mais_procurados(agora=None, dias=JANELA_POPULARIDADE_DIAS, limite=5):
+    """Serviços com mais agendamentos nos últimos `dias` dias"""
+    desde = (agora or timezone.now()) - timedelta(days=dias)
+    ranking = Agendamento.objects.filter(horario__gte=desde).values(
+        'servico__nome', 'servico__valor'
+    ).annotate(total=Count('id')).order_by('-total', 'servico__nome')[:limite]
+
+    return [
+        {
+            'nome': item['servico__nome'],
+            'total': item['total'],
+            'valor': float(item['servico__valor'])
+        }
+        for item in ranking
+    ]
+
+
+def proximos_agendamentos(agora=None, limite=10):
+    """Próximos agendamentos confirmados"""
+    return Agendamento.objects.filter(
+        horario__gte=agora or timezone.now(),
+        status='confirmado'
+    ).select_related('cliente', 'servico').order_by('horario')[:limite]
+
+
+def dados_dashboard(agora=None):
+    """Dados do dashboard já serializados (prontos para resposta ou cache)"""
+    from .serializers import DashboardSerializer
+
+    agora = agora or timezone.now()
+    dados = contadores(agora)
+    dados['receita_mes'] = dados['receita_mes'] or 0
+    dados.update({
+        'clientes_ativos': Cliente.objects.filter(ativo=True).count(),
+        'servicos_mais_procurados': servicos_mais_procurados(agora),
+        'proximos_agendamentos': proximos_agendamentos(agora),
+    })
+    return DashboardSerializer(dados).data
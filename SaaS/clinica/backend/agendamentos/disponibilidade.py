@@ -0,0 +1,185 @@
+"""
+Motor de disponibilidade da agenda
+
+Os agendamentos confirmados de um período viram uma lista ordenada de
+blocos ocupados (união dos intervalos [horario, horario + duração)). A mesma
+estrutura atende qualquer duração de serviço: conflito e próximo horário
+livre saem por busca binária (bisect), sem novas consultas ao banco.
+
+- Agenda.carregar(): uma consulta, usada na validação de conflito
+  (serializer e Agendamento.clean compartilham a mesma agenda)
+- Agenda.carregar_periodos(): idem para um lote de horários
+- agenda_do_dia() / horarios_livres(): ocupação por dia em cache
+  (CacheService.get_ocupacao), invalidada pelos sinais de Agendamento
+"""
+
+from bisect import bisect_left
+from datetime import datetime, time, timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Agendamento
+
+
+# Regras de atendimento (as mesmas validadas no AgendamentoCreateSerializer)
+HORA_ABERTURA = 8
+HORA_FECHAMENTO = 19
+DOMINGO = 6
+INTERVALO_MINUTOS = 15
+# Duração máxima de um serviço (ServicoSerializer): até onde um agendamento
+# iniciado antes do período ainda pode ocupá-lo
+DURACAO_MAXIMA = 480
+
+
+def _unir(intervalos):
+    """Ordena e une intervalos sobrepostos; retorna (inicios, fins)"""
+    inicios, fins = [], []
+    for inicio, fim in sorted(intervalos):
+        if fins and inicio <= fins[-1]:
+            fins[-1] = max(fins[-1], fim)
+        else:
+            inicios.append(inicio)
+            fins.append(fim)
+    return inicios, fins
+
+
+class Agenda:
+    """Blocos ocupados, disjuntos e ordenados, de um período"""
+
+    def __init__(self, intervalos=()):
+        self.inicios, self.fins = _unir(intervalos)
+
+    @classmethod
+    def carregar(cls, inicio, fim, excluir=None):
+        """Agendamentos confirmados que ocupam algo de [inicio, fim)"""
+        return cls.carregar_periodos([(inicio, fim)], excluir=excluir)
+
+    @classmethod
+    def carregar_periodos(cls, periodos, excluir=None):
+        """Agendamentos confirmados que ocupam algo de algum dos períodos (uma consulta)"""
+        faixas = Q()
+        for inicio, fim in periodos:
+            faixas |= Q(horario__lt=fim, horario__gte=inicio - timedelta(minutes=DURACAO_MAXIMA))
+        agendamentos = Agendamento.objects.filter(faixas, status='confirmado')
+        if excluir:
+            agendamentos = agendamentos.exclude(pk=excluir)
+
+        return cls(
+            (horario, horario + timedelta(minutes=duracao))
+            for horario, duracao in agendamentos.values_list('horario', 'servico__duracao_minutos')
+        )
+
+    def intervalos(self):
+        """Blocos ocupados como lista de (inicio, fim)"""
+        return list(zip(self.inicios, self.fins))
+
+    def _bloco(self, inicio, fim):
+        """Índice do bloco que conflita com [inicio, fim) ou None"""
+        # Último bloco que começa antes do fim: os anteriores terminam antes dele
+        indice = bisect_left(self.inicios, fim) - 1
+        if indice >= 0 and self.fins[indice] > inicio:
+            return indice
+        return None
+
+    def conflita(self, inicio, fim):
+        """Verifica se [inicio, fim) se sobrepõe a algum bloco ocupado"""
+        return self._bloco(inicio, fim) is not None
+
+    def livres(self, duracao_minutos, inicio, fim, passo=INTERVALO_MINUTOS):
+        """Inícios na grade de `passo` minutos, entre inicio e fim, em que cabe o serviço"""
+        duracao = timedelta(minutes=duracao_minutos)
+        passo = timedelta(minutes=passo)
+
+        horarios = []
+        horario = inicio
+        while horario < fim:
+            indice = self._bloco(horario, horario + duracao)
+            if indice is None:
+                horarios.append(horario)
+                horario += passo
+            else:
+                # Pula direto para o primeiro horário da grade após o bloco
+                horario += -(-(self.fins[indice] - horario) // passo) * passo
+        return horarios
+
+
+def limites_do_dia(data):
+    """(início, fim) do dia no fuso local"""
+    inicio = timezone.make_aware(datetime.combine(data, time.min))
+    return inicio, timezone.make_aware(datetime.combine(data + timedelta(days=1), time.min))
+
+
+def expediente(data):
+    """(abertura, fechamento) do dia no fuso local; None aos domingos"""
+    if data.weekday() == DOMINGO:
+        return None
+    return (
+        timezone.make_aware(datetime.combine(data, time(HORA_ABERTURA))),
+        timezone.make_aware(datetime.combine(data, time(HORA_FECHAMENTO))),
+    )
+
+
+def carregar_ocupacao(datas):
+    """Blocos ocupados de cada data ({data: [(inicio, fim), ...]}) em uma consulta"""
+    primeira, ultima = min(datas), max(datas)
+    agendamentos = Agendamento.objects.filter(
+        status='confirmado',
+        horario__lt=limites_do_dia(ultima)[1],
+        horario__gte=limites_do_dia(primeira)[0] - timedelta(minutes=DURACAO_MAXIMA)
+    ).values_list('horario', 'servico__duracao_minutos')
+
+    intervalos = {data: [] for data in datas}
+    for horario, duracao in agendamentos:
+        termino = horario + timedelta(minutes=duracao)
+        # Um agendamento pode ocupar mais de um dia (ex.: termina após a meia-noite)
+        data = max(timezone.localtime(horario).date(), primeira)
+        while data <= ultima and limites_do_dia(data)[0] < termino:
+            if data in intervalos:
+                intervalos[data].append((horario, termino))
+            data += timedelta(days=1)
+
+    return {data: Agenda(blocos).intervalos() for data, blocos in intervalos.items()}
+
+
+def agenda_do_dia(data):
+    """Agenda do dia a partir do cache de ocupação"""
+    from .cache import CacheService
+
+    return Agenda(CacheService.get_ocupacao([data])[data])
+
+
+def horarios_livres(duracao_minutos, data_inicial, dias=7):
+    """Horários livres por dia para um serviço de `duracao_minutos`"""
+    from .cache import CacheService
+
+    datas = [data_inicial + timedelta(days=n) for n in range(dias)]
+    ocupacao = CacheService.get_ocupacao(datas)
+    agora = timezone.now()
+
+    resultado = []
+    for data in datas:
+        periodo = expediente(data)
+        horarios = []
+        if periodo and periodo[1] > agora:
+            abertura, fechamento = periodo
+            if abertura < agora:
+                # Hoje: a partir do próximo horário da grade
+                passo = timedelta(minutes=INTERVALO_MINUTOS)
+                abertura += -(-(agora - abertura) // passo) * passo
+            horarios = Agenda(ocupacao[data]).livres(duracao_minutos, abertura, fechamento)
+        resultado.append({'data': data, 'horarios': horarios})
+    return resultado
+
+
+def horario_disponivel(horario, duracao_minutos):
+    """Verifica se um serviço de `duracao_minutos` pode ser marcado em `horario`"""
+    local = timezone.localtime(horario)
+    periodo = expediente(local.date())
+    if periodo is None or horario < timezone.now():
+        return False
+    if not periodo[0] <= horario < periodo[1]:
+        return False
+    return not agenda_do_dia(local.date()).conflita(
+        horario, horario + timedelta(minutes=duracao_minutos)
+    )
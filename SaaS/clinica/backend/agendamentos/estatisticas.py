@@ -0,0 +1,139 @@
+"""
+Estatísticas de agendamentos por cliente (ClienteEstatisticas)
+
+A cada alteração de agendamento as estatísticas dos clientes afetados são
+recalculadas a partir das tabelas de agendamentos (principal e arquivo):
+uma consulta agregada e um upsert, sem acumular deltas que possam divergir.
+Os signals rodam na transação de quem salva; por isso os caminhos de
+escrita das views envolvem o save() em transaction.atomic() (em
+autocommit, alteração e estatísticas seriam confirmadas separadamente).
+
+- atualizar(): clientes afetados (signals abaixo e caminhos em lote, que
+  não disparam signals: AgendamentoLoteSerializer, marcar_faltas e
+  arquivo.arquivar_lote)
+- reconstruir(): todos os clientes (comando recalcular_estatisticas_clientes)
+- divergencias(): compara o armazenado com o calculado
+  (comando verificar_estatisticas_clientes)
+"""
+
+from decimal import Decimal
+
+from django.db.models import Count, Max, OuterRef, Q, Subquery, Sum
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Agendamento, AgendamentoArquivado, Cliente, ClienteEstatisticas
+
+
+CAMPOS = [
+    'total_agendamentos', 'ultimo_agendamento', 'ultimo_agendamento_horario',
+    'valor_total_pago', 'total_faltas',
+]
+
+
+def calcular(cliente_ids=None):
+    """Estatísticas calculadas a partir dos agendamentos ({cliente_id: ClienteEstatisticas})"""
+    clientes = Cliente.objects.order_by()
+    if cliente_ids is not None:
+        clientes = clientes.filter(pk__in=cliente_ids)
+
+    ultimo = Agendamento.objects.filter(cliente=OuterRef('pk')).order_by('-horario')
+    # Agendamentos arquivados também contam (subconsultas na mesma consulta)
+    arquivados = AgendamentoArquivado.objects.filter(cliente=OuterRef('pk')).order_by().values('cliente')
+
+    def arquivado(agregado):
+        return Subquery(arquivados.annotate(valor=agregado).values('valor'))
+
+    linhas = clientes.annotate(
+        total=Count('agendamento'),
+        pago=Sum('agendamento__valor_cobrado', filter=Q(agendamento__status='concluido')),
+        faltas=Count('agendamento', filter=Q(agendamento__status='falta')),
+        ultimo_horario=Max('agendamento__horario'),
+        ultimo_id=Subquery(ultimo.values('pk')[:1]),
+        arquivados_total=arquivado(Count('pk')),
+        arquivados_pago=arquivado(Sum('valor_cobrado', filter=Q(status='concluido'))),
+        arquivados_faltas=arquivado(Count('pk', filter=Q(status='falta'))),
+        arquivados_ultimo_horario=arquivado(Max('horario')),
+    ).values_list(
+        'pk', 'total', 'pago', 'faltas', 'ultimo_id', 'ultimo_horario',
+        'arquivados_total', 'arquivados_pago', 'arquivados_faltas', 'arquivados_ultimo_horario'
+    )
+
+    estatisticas = {}
+    for (pk, total, pago, faltas, ultimo_id, ultimo_horario,
+         arq_total, arq_pago, arq_faltas, arq_ultimo_horario) in linhas:
+        estatisticas[pk] = ClienteEstatisticas(
+            cliente_id=pk,
+            total_agendamentos=total + (arq_total or 0),
+            # Só a tabela principal (FK); se o mais recente foi arquivado, o
+            # ClienteSerializer o busca no arquivo pelo horário abaixo
+            ultimo_agendamento_id=ultimo_id,
+            ultimo_agendamento_horario=max(
+                filter(None, [ultimo_horario, arq_ultimo_horario]), default=None
+            ),
+            valor_total_pago=(pago or Decimal('0')) + (arq_pago or Decimal('0')),
+            total_faltas=faltas + (arq_faltas or 0)
+        )
+    return estatisticas
+
+
+def atualizar(cliente_ids):
+    """Recalcula e grava (upsert) as estatísticas dos clientes informados"""
+    cliente_ids = {pk for pk in cliente_ids if pk is not None}
+    if not cliente_ids:
+        return 0
+
+    estatisticas = list(calcular(cliente_ids).values())
+    ClienteEstatisticas.objects.bulk_create(
+        estatisticas,
+        update_conflicts=True,
+        unique_fields=['cliente'],
+        update_fields=CAMPOS + ['atualizado_em']
+    )
+    return len(estatisticas)
+
+
+def _lotes_de_clientes(tamanho_lote):
+    ids = list(Cliente.objects.order_by('pk').values_list('pk', flat=True))
+    for inicio in range(0, len(ids), tamanho_lote):
+        yield ids[inicio:inicio + tamanho_lote]
+
+
+def reconstruir(tamanho_lote=1000):
+    """Recalcula as estatísticas de todos os clientes, em lotes"""
+    total = 0
+    for lote in _lotes_de_clientes(tamanho_lote):
+        total += atualizar(lote)
+    return total
+
+
+def divergencias(tamanho_lote=1000):
+    """Gera (cliente_id, campo, armazenado, calculado) para cada valor divergente"""
+    for lote in _lotes_de_clientes(tamanho_lote):
+        armazenadas = ClienteEstatisticas.objects.in_bulk(lote)
+        for pk, calculada in calcular(lote).items():
+            # Cliente sem linha: equivale a estatísticas zeradas
+            armazenada = armazenadas.get(pk) or ClienteEstatisticas(cliente_id=pk)
+            for campo in CAMPOS:
+                atributo = ClienteEstatisticas._meta.get_field(campo).attname
+                esperado, atual = getattr(calculada, atributo), getattr(armazenada, atributo)
+                if esperado != atual:
+                    yield pk, campo, atual, esperado
+
+
+@receiver(post_save, sender=Agendamento)
+@receiver(post_delete, sender=Agendamento)
+def atualizar_estatisticas_cliente(sender, instance, **kwargs):
+    """Recalcula as estatísticas do cliente (e do anterior, se o agendamento mudou de cliente)"""
+    # Exclusão em cascata do próprio cliente: não há o que atualizar
+    if isinstance(kwargs.get('origin'), Cliente):
+        return
+    atualizar({instance.cliente_id, getattr(instance, '_cliente_anterior_id', None)})
+    instance._cliente_anterior_id = instance.cliente_id
+
+
+@receiver(post_save, sender=Cliente)
+def criar_estatisticas_cliente(sender, instance, created, **kwargs):
+    """Cliente novo começa com estatísticas zeradas (toda listagem encontra a linha)"""
+    if created:
+        ClienteEstatisticas.objects.create(cliente=instance)
@@ -0,0 +1,221 @@
+"""
+Instrumentação Prometheus da aplicação
+
+As métricas são definidas uma única vez, na importação do módulo. As de
+request usam o nome da rota resolvida (ex.: "agendamento-detail") como
+label, nunca o path: IDs na URL não criam novas séries.
+
+As métricas de negócio e de sistema vêm de um snapshot guardado no cache
+do Django e recalculado a cada METRICAS_SNAPSHOT_INTERVALO segundos (pela
+tarefa atualizar_snapshot_metricas ou, sem ela, em segundo plano pelo
+primeiro scrape que encontrar o snapshot vencido). O scrape só lê o snapshot.
+
+Gunicorn com vários workers: defina PROMETHEUS_MULTIPROC_DIR (diretório
+vazio a cada deploy) antes de iniciar os workers e, no gunicorn.conf.py,
+
+    def child_exit(server, worker):
+        from agendamentos.instrumentation import marcar_processo_encerrado
+        marcar_processo_encerrado(worker.pid)
+
+Sem prometheus_client instalado, as métricas de request são ignoradas e o
+endpoint exporta apenas o snapshot em formato texto.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import psutil
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Count, Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+try:
+    from prometheus_client import (
+        CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram,
+        REGISTRY, generate_latest, multiprocess,
+    )
+    PROMETHEUS_DISPONIVEL = True
+except ImportError:  # prometheus_client não instalado
+    CONTENT_TYPE_LATEST = 'text/plain; version=0.0.4; charset=utf-8'
+    PROMETHEUS_DISPONIVEL = False
+
+
+MULTIPROCESSO = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+SNAPSHOT_CHAVE = 'metricas_snapshot'
+SNAPSHOT_LOCK = 'metricas_snapshot_lock'
+# Rota de requests que não casaram com nenhuma URL (404)
+ROTA_NAO_RESOLVIDA = 'nao_resolvida'
+
+
+def _intervalo():
+    return getattr(settings, 'METRICAS_SNAPSHOT_INTERVALO', 60)
+
+
+if PROMETHEUS_DISPONIVEL:
+    REQUEST_DURACAO = Histogram(
+        'django_request_duration_seconds',
+        'Tempo de processamento da request',
+        ['method', 'rota'],
+    )
+    REQUEST_TOTAL = Counter(
+        'django_requests_total',
+        'Requests processadas',
+        ['method', 'rota', 'status'],
+    )
+
+    # Gauges do snapshot: vale o valor publicado pelo último scrape
+    # (multiprocess_mode 'mostrecent' requer prometheus_client >= 0.17)
+    _modo = {'multiprocess_mode': 'mostrecent'}
+    GAUGES = {
+        'agendamentos_total': Gauge('agendamentos_total', 'Agendamentos cadastrados', **_modo),
+        'clientes_ativos_total': Gauge('clientes_ativos_total', 'Clientes ativos', **_modo),
+        'servicos_ativos_total': Gauge('servicos_ativos_total', 'Serviços ativos', **_modo),
+        'agendamentos_hoje': Gauge('agendamentos_hoje', 'Agendamentos do dia', **_modo),
+        'memory_usage_percent': Gauge('memory_usage_percent', 'Uso de memória (%)', **_modo),
+        'disk_usage_percent': Gauge('disk_usage_percent', 'Uso de disco (%)', **_modo),
+        'cpu_usage_percent': Gauge('cpu_usage_percent', 'Uso de CPU (%)', **_modo),
+        'metrics_last_updated': Gauge(
+            'metrics_last_updated', 'Timestamp do snapshot das métricas', **_modo
+        ),
+    }
+    AGENDAMENTOS_POR_STATUS = Gauge(
+        'agendamentos_por_status', 'Agendamentos por status', ['status'], **_modo
+    )
+
+
+def nome_da_rota(request):
+    """Label da rota: nome da URL resolvida (cardinalidade limitada)"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return ROTA_NAO_RESOLVIDA
+    return match.view_name or match.route or ROTA_NAO_RESOLVIDA
+
+
+def observar_request(request, response, duracao):
+    """Registra duração e contagem de uma request"""
+    if not PROMETHEUS_DISPONIVEL:
+        return
+    rota = nome_da_rota(request)
+    REQUEST_DURACAO.labels(method=request.method, rota=rota).observe(duracao)
+    REQUEST_TOTAL.labels(method=request.method, rota=rota, status=response.status_code).inc()
+
+
+def calcular_snapshot():
+    """Métricas de negócio (quatro consultas) e de sistema (sem bloquear)"""
+    from . import arquivo
+    from .models import Agendamento, Cliente, Servico
+
+    hoje = timezone.localdate()
+    status = [codigo for codigo, _ in Agendamento.STATUS_CHOICES]
+    # Totais das duas camadas (tabela principal e arquivo)
+    agregados = arquivo.totais(dict(
+        total=Count('id'),
+        hoje=Count('id', filter=Q(horario__date=hoje)),
+        **{f"status_{codigo}": Count('id', filter=Q(status=codigo)) for codigo in status}
+    ))
+
+    disco = psutil.disk_usage('/')
+    return {
+        'agendamentos_total': agregados['total'],
+        'clientes_ativos_total': Cliente.objects.filter(ativo=True).count(),
+        'servicos_ativos_total': Servico.objects.filter(ativo=True).count(),
+        'agendamentos_hoje': agregados['hoje'],
+        'agendamentos_por_status': {codigo: agregados[f"status_{codigo}"] for codigo in status},
+        'memory_usage_percent': psutil.virtual_memory().percent,
+        'disk_usage_percent': round((disco.total - disco.free) / disco.total * 100, 2),
+        # interval=None: uso desde a chamada anterior, sem esperar
+        'cpu_usage_percent': psutil.cpu_percent(interval=None),
+        'metrics_last_updated': int(time.time()),
+    }
+
+
+def atualizar_snapshot():
+    """Recalcula o snapshot e o guarda no cache (compartilhado entre workers)"""
+    snapshot = calcular_snapshot()
+    # Mantido além do intervalo: um snapshot vencido ainda é servido
+    # enquanto o próximo é calculado
+    cache.set(SNAPSHOT_CHAVE, snapshot, _intervalo() * 10)
+    return snapshot
+
+
+def _atualizar_em_segundo_plano():
+    try:
+        atualizar_snapshot()
+    except Exception as e:
+        logger.error(f"Erro ao atualizar snapshot de métricas: {e}")
+    finally:
+        cache.delete(SNAPSHOT_LOCK)
+        # Conexões abertas por esta thread não são fechadas pelo ciclo de request
+        connections.close_all()
+
+
+def obter_snapshot():
+    """Snapshot atual; se vencido, um único worker o recalcula em segundo plano"""
+    snapshot = cache.get(SNAPSHOT_CHAVE)
+    if snapshot is None:
+        return atualizar_snapshot()
+
+    if time.time() - snapshot['metrics_last_updated'] > _intervalo():
+        if cache.add(SNAPSHOT_LOCK, True, _intervalo()):
+            threading.Thread(target=_atualizar_em_segundo_plano, daemon=True).start()
+    return snapshot
+
+
+def _publicar(snapshot):
+    """Copia o snapshot para os gauges deste processo"""
+    for nome, gauge in GAUGES.items():
+        gauge.set(snapshot[nome])
+    for codigo, total in snapshot['agendamentos_por_status'].items():
+        AGENDAMENTOS_POR_STATUS.labels(status=codigo).set(total)
+
+
+def _exportar_texto(snapshot):
+    """Formato texto do Prometheus sem prometheus_client"""
+    linhas = []
+    for nome, valor in snapshot.items():
+        if nome == 'agendamentos_por_status':
+            linhas += [
+                f'agendamentos_por_status{{status="{codigo}"}} {total}'
+                for codigo, total in valor.items()
+            ]
+        else:
+            linhas.append(f"{nome} {valor}")
+    return "\n".join(linhas) + "\n"
+
+
+def exportar():
+    """(conteúdo, content_type) para o endpoint de métricas"""
+    snapshot = obter_snapshot()
+    if not PROMETHEUS_DISPONIVEL:
+        return _exportar_texto(snapshot), CONTENT_TYPE_LATEST
+
+    _publicar(snapshot)
+    if MULTIPROCESSO:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def marcar_processo_encerrado(pid):
+    """Remove os arquivos de gauges de um worker encerrado (hook child_exit do gunicorn)"""
+    if PROMETHEUS_DISPONIVEL and MULTIPROCESSO:
+        multiprocess.mark_process_dead(pid)
+
+
+# Tarefa Celery para manter o snapshot atualizado (agendar no beat)
+from celery import shared_task
+
+@shared_task
+def atualizar_snapshot_metricas():
+    """Tarefa periódica de atualização do snapshot de métricas"""
+    snapshot = atualizar_snapshot()
+    return snapshot['metrics_last_updated']
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from agendamentos import arquivo
+from agendamentos.models import Agendamento
+
+
+class Command(BaseCommand):
+    help = 'Move agendamentos concluídos, cancelados e faltas antigos para o arquivo'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--meses', type=int, default=None,
+            help='Meses mantidos na tabela principal (padrão: AGENDAMENTOS_ARQUIVO_MESES)'
+        )
+        parser.add_argument(
+            '--lote', type=int, default=5000,
+            help='Agendamentos movidos por transação (padrão: 5000)'
+        )
+        parser.add_argument(
+            '--simular', action='store_true',
+            help='Apenas informa quantos agendamentos seriam arquivados'
+        )
+
+    def handle(self, *args, **options):
+        antes_de = arquivo.horizonte(options['meses'])
+
+        if options['simular']:
+            total = Agendamento.objects.filter(
+                horario__lt=antes_de, status__in=arquivo.STATUS_ARQUIVAVEIS
+            ).count()
+            self.stdout.write(f'{total} agendamentos anteriores a {antes_de:%d/%m/%Y} seriam arquivados')
+            return
+
+        total = arquivo.arquivar(options['meses'], options['lote'])
+        self.stdout.write(
+            self.style.SUCCESS(f'✓ {total} agendamentos anteriores a {antes_de:%d/%m/%Y} arquivados')
+        )
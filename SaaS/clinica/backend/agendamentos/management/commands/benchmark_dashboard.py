@@ -0,0 +1,114 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from agendamentos import dashboard, estatisticas
+from agendamentos.cache import clear_all_cache
+from agendamentos.models import (
+    Agendamento, Cliente, ClienteEstatisticas, HistoricoStatusAgendamento, Servico
+)
+
+
+# Marca dos registros sintéticos (removidos com --limpar)
+MARCA = '[benchmark]'
+
+
+class Command(BaseCommand):
+    help = 'Mede o tempo e as consultas do dashboard, opcionalmente sobre agendamentos sintéticos'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--gerar', type=int, default=0,
+            help='Insere N agendamentos sintéticos antes de medir (ex.: 1000000)'
+        )
+        parser.add_argument(
+            '--limpar', action='store_true',
+            help='Remove os dados sintéticos ao final'
+        )
+        parser.add_argument(
+            '--repeticoes', type=int, default=5,
+            help='Execuções medidas de cada etapa (padrão: 5)'
+        )
+
+    def handle(self, *args, **options):
+        if options['gerar']:
+            self._gerar(options['gerar'])
+
+        total = Agendamento.objects.count()
+        if not total:
+            raise CommandError('Nenhum agendamento para medir; use --gerar N')
+        self.stdout.write(f'Medindo o dashboard sobre {total} agendamentos...')
+
+        etapas = [
+            ('contadores', dashboard.contadores),
+            ('servicos_mais_procurados', dashboard.servicos_mais_procurados),
+            ('dados_dashboard', dashboard.dados_dashboard),
+        ]
+        for nome, funcao in etapas:
+            tempos = []
+            for _ in range(options['repeticoes']):
+                with CaptureQueriesContext(connection) as consultas:
+                    inicio = time.perf_counter()
+                    funcao()
+                    tempos.append((time.perf_counter() - inicio) * 1000)
+            tempos.sort()
+            self.stdout.write(
+                f'  {nome}: mediana {tempos[len(tempos) // 2]:.1f}ms, '
+                f'máximo {tempos[-1]:.1f}ms, {len(consultas)} consultas'
+            )
+
+        if options['limpar']:
+            self._limpar()
+
+    def _gerar(self, quantidade, lote=10000):
+        """Agendamentos espalhados pelos últimos dois anos e pelos próximos 60 dias"""
+        self.stdout.write(f'Gerando {quantidade} agendamentos sintéticos...')
+        servicos = [
+            Servico.objects.create(nome=f'{MARCA} Serviço {n}', duracao_minutos=60, valor=50 + n * 10)
+            for n in range(10)
+        ]
+        clientes = Cliente.objects.bulk_create([
+            Cliente(nome=f'{MARCA} Cliente {n}', whatsapp=f'+5500{n:011d}', observacoes=MARCA)
+            for n in range(1000)
+        ])
+
+        inicio = timezone.now() - timedelta(days=730)
+        # Horários distintos: a restrição de unicidade vale para os confirmados
+        passo = timedelta(days=790) / quantidade
+        status = ['concluido'] * 6 + ['confirmado'] * 2 + ['cancelado', 'falta']
+
+        for inicio_lote in range(0, quantidade, lote):
+            agendamentos = []
+            for n in range(inicio_lote, min(inicio_lote + lote, quantidade)):
+                servico = random.choice(servicos)
+                agendamentos.append(Agendamento(
+                    cliente=random.choice(clientes),
+                    servico=servico,
+                    horario=inicio + passo * n,
+                    status=random.choice(status),
+                    valor_cobrado=servico.valor,
+                    observacoes=MARCA
+                ))
+            with transaction.atomic():
+                Agendamento.objects.bulk_create(agendamentos)
+
+        # bulk_create não dispara signals
+        estatisticas.atualizar([cliente.pk for cliente in clientes])
+        clear_all_cache()
+
+    def _limpar(self):
+        self.stdout.write('Removendo dados sintéticos...')
+        clientes = Cliente.objects.filter(observacoes=MARCA)
+        with transaction.atomic():
+            ClienteEstatisticas.objects.filter(cliente__in=clientes).delete()
+            HistoricoStatusAgendamento.objects.filter(agendamento__observacoes=MARCA).delete()
+            # DELETE direto: delete() carregaria e sinalizaria cada linha
+            Agendamento.objects.filter(observacoes=MARCA)._raw_delete(Agendamento.objects.db)
+            clientes.delete()
+        Servico.objects.filter(nome__startswith=MARCA).delete()
+        clear_all_cache()
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from agendamentos import estatisticas
+
+
+class Command(BaseCommand):
+    help = 'Recalcula as estatísticas de agendamentos de todos os clientes (ClienteEstatisticas)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lote', type=int, default=1000,
+            help='Clientes recalculados por transação (padrão: 1000)'
+        )
+
+    def handle(self, *args, **options):
+        total = estatisticas.reconstruir(tamanho_lote=options['lote'])
+        self.stdout.write(self.style.SUCCESS(f'✓ Estatísticas recalculadas para {total} clientes'))
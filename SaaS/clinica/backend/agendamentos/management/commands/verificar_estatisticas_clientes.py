@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from agendamentos import estatisticas
+
+
+class Command(BaseCommand):
+    help = 'Compara as estatísticas armazenadas dos clientes com as calculadas dos agendamentos'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--corrigir', action='store_true',
+            help='Recalcula os clientes com divergência'
+        )
+        parser.add_argument(
+            '--lote', type=int, default=1000,
+            help='Clientes verificados por consulta (padrão: 1000)'
+        )
+
+    def handle(self, *args, **options):
+        divergentes = set()
+        for cliente_id, campo, armazenado, calculado in estatisticas.divergencias(options['lote']):
+            divergentes.add(cliente_id)
+            self.stdout.write(
+                self.style.WARNING(f'⚠ Cliente {cliente_id}: {campo} = {armazenado} (esperado {calculado})')
+            )
+
+        if not divergentes:
+            self.stdout.write(self.style.SUCCESS('✓ Estatísticas dos clientes consistentes'))
+            return
+
+        if options['corrigir']:
+            estatisticas.atualizar(divergentes)
+            self.stdout.write(self.style.SUCCESS(f'✓ {len(divergentes)} clientes corrigidos'))
+            return
+
+        raise CommandError(f'{len(divergentes)} clientes com estatísticas divergentes')
@@ -78,7 +78,7 @@ class Cliente(models.Model):
 
     def ultimo_agendamento(self):
         """Retorna último agendamento do cliente"""
-        return self.agendamento_set.order_by('-horario').first()
+        return self.agendamento_set.select_related('servico').order_by('-horario').first()
 
 
 class Servico(models.Model):
@@ -192,6 +192,15 @@ class Agendamento(models.Model):
     def __str__(self):
         return f"{self.cliente.nome} - {self.servico.nome} ({self.horario})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Horário gravado: a invalidação do cache alcança também o dia antigo
+        instance._horario_anterior = instance.__dict__.get('horario')
+        # Cliente gravado: troca de cliente atualiza as estatísticas dos dois
+        instance._cliente_anterior_id = instance.__dict__.get('cliente_id')
+        return instance
+
     def clean(self):
         """Validações customizadas"""
         if self.horario:
@@ -201,15 +210,15 @@ class Agendamento(models.Model):
 
             # Verificar conflito de horários apenas para agendamentos confirmados
             if self.status == 'confirmado':
-                fim_agendamento = self.horario + timedelta(minutes=self.servico.duracao_minutos)
+                from .disponibilidade import Agenda
 
-                conflitos = Agendamento.objects.filter(
-                    status='confirmado',
-                    horario__lt=fim_agendamento,
-                    horario__gte=self.horario - timedelta(minutes=self.servico.duracao_minutos)
-                ).exclude(pk=self.pk)
+                fim_agendamento = self.horario_fim
+                # Agenda já carregada pelo AgendamentoCreateSerializer (uso único)
+                agenda = self.__dict__.pop('_agenda', None) or Agenda.carregar(
+                    self.horario, fim_agendamento, excluir=self.pk
+                )
 
-                if conflitos.exists():
+                if agenda.conflita(self.horario, fim_agendamento):
                     raise ValidationError("Existe conflito de horário com outro agendamento")
 
     def save(self, *args, **kwargs):
@@ -242,3 +251,165 @@ class Agendamento(models.Model):
             self.status == 'confirmado' and
             self.horario < timezone.now()
         )
+
+
+class AgendamentoArquivado(models.Model):
+    """
+    Agendamento antigo (concluído, cancelado ou falta) movido da tabela principal
+
+    Mantém o id original. A tabela principal fica só com o período recente,
+    que é o que a agenda, os conflitos e as telas do dia consultam; relatórios
+    leem as duas (ver arquivo.py).
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    cliente = models.ForeignKey(
+        Cliente,
+        on_delete=models.CASCADE,
+        related_name='agendamentos_arquivados'
+    )
+    servico = models.ForeignKey(
+        Servico,
+        on_delete=models.CASCADE,
+        related_name='agendamentos_arquivados'
+    )
+    horario = models.DateTimeField()
+    status = models.CharField(max_length=20, choices=Agendamento.STATUS_CHOICES)
+    observacoes = models.TextField(blank=True)
+    valor_cobrado = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True)
+    criado_em = models.DateTimeField()
+    atualizado_em = models.DateTimeField()
+    arquivado_em = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-horario']
+        indexes = [
+            models.Index(fields=['horario']),
+            models.Index(fields=['cliente', 'horario']),
+            models.Index(fields=['servico', 'horario']),
+        ]
+
+    def __str__(self):
+        return f"{self.cliente_id} - {self.servico_id} ({self.horario}, arquivado)"
+
+
+class ClienteEstatisticas(models.Model):
+    """
+    Agregados de agendamentos por cliente (desnormalizados)
+
+    Recalculados na mesma transação de cada alteração de agendamento
+    (ver estatisticas.py); listagens de clientes leem daqui em vez de
+    agregar a tabela de agendamentos.
+    """
+
+    cliente = models.OneToOneField(
+        Cliente,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='estatisticas'
+    )
+    total_agendamentos = models.PositiveIntegerField(default=0)
+    ultimo_agendamento = models.ForeignKey(
+        'Agendamento',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    ultimo_agendamento_horario = models.DateTimeField(null=True, blank=True)
+    valor_total_pago = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        default=0,
+        help_text="Soma do valor cobrado dos agendamentos concluídos"
+    )
+    total_faltas = models.PositiveIntegerField(default=0)
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'Estatísticas de clientes'
+
+    def __str__(self):
+        return f"Estatísticas de {self.cliente_id}"
+
+
+class HistoricoStatusAgendamento(models.Model):
+    """Registro de auditoria das mudanças de status feitas em lote"""
+
+    # Sem constraint: o histórico continua valendo após o arquivamento
+    agendamento = models.ForeignKey(
+        Agendamento,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='historico_status'
+    )
+    status_anterior = models.CharField(max_length=20, choices=Agendamento.STATUS_CHOICES)
+    status_novo = models.CharField(max_length=20, choices=Agendamento.STATUS_CHOICES)
+    motivo = models.CharField(max_length=100)
+    criado_em = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-criado_em']
+
+    def __str__(self):
+        return f"{self.agendamento_id}: {self.status_anterior} -> {self.status_novo} ({self.motivo})"
+
+
+class NotificacaoOutbox(models.Model):
+    """
+    Notificação pendente de envio (outbox)
+
+    Gravada na mesma transação da alteração do agendamento e enviada pelo
+    worker (notifications.despachar_notificacoes): a request nunca espera
+    pelo WhatsApp ou pelo SMTP.
+    """
+
+    TIPO_CHOICES = [
+        ('confirmacao', 'Confirmação'),
+        ('confirmacao_lote', 'Confirmação de lote'),
+        ('lembrete', 'Lembrete'),
+        ('cancelamento', 'Cancelamento'),
+    ]
+    CANAL_CHOICES = [
+        ('email', 'Email'),
+        ('whatsapp', 'WhatsApp'),
+    ]
+    STATUS_CHOICES = [
+        ('pendente', 'Pendente'),
+        ('enviando', 'Enviando'),
+        ('enviado', 'Enviado'),
+        ('falhou', 'Falhou'),
+    ]
+
+    tipo = models.CharField(max_length=20, choices=TIPO_CHOICES)
+    canal = models.CharField(max_length=10, choices=CANAL_CHOICES)
+    cliente = models.ForeignKey(
+        Cliente,
+        on_delete=models.CASCADE,
+        help_text="Destinatário da notificação"
+    )
+    agendamentos = models.JSONField(
+        default=list,
+        help_text="IDs dos agendamentos notificados"
+    )
+    chave_idempotencia = models.CharField(
+        max_length=64,
+        unique=True,
+        help_text="Impede que a mesma notificação seja enfileirada duas vezes"
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pendente')
+    tentativas = models.PositiveSmallIntegerField(default=0)
+    proxima_tentativa = models.DateTimeField(default=timezone.now)
+    ultimo_erro = models.TextField(blank=True)
+    enviado_em = models.DateTimeField(null=True, blank=True)
+    criado_em = models.DateTimeField(auto_now_add=True)
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['criado_em']
+        indexes = [
+            models.Index(fields=['status', 'proxima_tentativa']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} via {self.get_canal_display()} - {self.cliente_id} ({self.status})"
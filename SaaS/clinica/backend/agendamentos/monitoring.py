@@ -19,6 +19,8 @@ from rest_framework.response import Response
 from datetime import datetime, timedelta
 import json
 
+from . import instrumentation
+
 logger = logging.getLogger(__name__)
 
 
@@ -231,46 +233,10 @@ def health_detailed(request):
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def metrics(request):
-    """Endpoint de métricas para Prometheus"""
+    """Endpoint de métricas para Prometheus (snapshot periódico, ver instrumentation)"""
     try:
-        from .models import Agendamento, Cliente, Servico
-
-        # Métricas de contadores
-        metrics_data = []
-
-        # Contadores totais
-        metrics_data.append(f"agendamentos_total {Agendamento.objects.count()}")
-        metrics_data.append(f"clientes_ativos_total {Cliente.objects.filter(ativo=True).count()}")
-        metrics_data.append(f"servicos_ativos_total {Servico.objects.filter(ativo=True).count()}")
-
-        # Agendamentos por status
-        for status_info in Agendamento.objects.values('status').annotate(count=models.Count('id')):
-            status = status_info['status']
-            count = status_info['count']
-            metrics_data.append(f'agendamentos_por_status{{status="{status}"}} {count}')
-
-        # Agendamentos hoje
-        hoje = timezone.now().date()
-        agendamentos_hoje = Agendamento.objects.filter(horario__date=hoje).count()
-        metrics_data.append(f"agendamentos_hoje {agendamentos_hoje}")
-
-        # Métricas de sistema
-        memory = psutil.virtual_memory()
-        metrics_data.append(f"memory_usage_percent {memory.percent}")
-
-        disk = psutil.disk_usage('/')
-        disk_usage_percent = ((disk.total - disk.free) / disk.total) * 100
-        metrics_data.append(f"disk_usage_percent {disk_usage_percent}")
-
-        cpu_percent = psutil.cpu_percent(interval=1)
-        metrics_data.append(f"cpu_usage_percent {cpu_percent}")
-
-        # Timestamp da última atualização
-        metrics_data.append(f"metrics_last_updated {int(time.time())}")
-
-        # Retornar no formato Prometheus
-        response_text = "\n".join(metrics_data)
-        return HttpResponse(response_text, content_type='text/plain')
+        conteudo, content_type = instrumentation.exportar()
+        return HttpResponse(conteudo, content_type=content_type)
 
     except Exception as e:
         logger.error(f"Erro ao gerar métricas: {e}")
@@ -355,27 +321,8 @@ class PerformanceMonitoringMiddleware:
         response['X-Response-Time'] = f"{duration:.3f}s"
 
         # Métricas para Prometheus (se configurado)
-        if hasattr(settings, 'PROMETHEUS_METRICS') and settings.PROMETHEUS_METRICS:
-            try:
-                from prometheus_client import Histogram, Counter
-
-                # Histogram de tempo de resposta
-                REQUEST_TIME = Histogram('django_request_duration_seconds',
-                                       'Time spent processing request',
-                                       ['method', 'endpoint'])
-                REQUEST_TIME.labels(method=request.method,
-                                  endpoint=request.path).observe(duration)
-
-                # Contador de requests
-                REQUEST_COUNT = Counter('django_requests_total',
-                                      'Total requests',
-                                      ['method', 'endpoint', 'status'])
-                REQUEST_COUNT.labels(method=request.method,
-                                   endpoint=request.path,
-                                   status=response.status_code).inc()
-
-            except ImportError:
-                pass  # prometheus_client não instalado
+        if getattr(settings, 'PROMETHEUS_METRICS', False):
+            instrumentation.observar_request(request, response, duration)
 
         return response
 
@@ -3,11 +3,17 @@ Sistema de Notificações para Agendamentos
 Notificações via WhatsApp, email e push notifications
 """
 
-from django.core.mail import send_mail
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
 from django.template.loader import render_to_string
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
+from requests.adapters import HTTPAdapter
+import hashlib
+import random
 import requests
 import logging
 
@@ -20,6 +26,25 @@ class NotificationService:
     def __init__(self):
         self.whatsapp_api_url = getattr(settings, 'WHATSAPP_API_URL', None)
         self.whatsapp_token = getattr(settings, 'WHATSAPP_TOKEN', None)
+        self._session = None
+
+    @property
+    def whatsapp_configurado(self):
+        return bool(self.whatsapp_api_url and self.whatsapp_token)
+
+    @property
+    def session(self):
+        """Sessão HTTP com pool de conexões (reaproveitada entre os envios)"""
+        if self._session is None:
+            self._session = requests.Session()
+            tamanho = getattr(settings, 'NOTIFICACOES_CONCORRENCIA', 4)
+            self._session.mount('https://', HTTPAdapter(pool_maxsize=tamanho))
+            self._session.mount('http://', HTTPAdapter(pool_maxsize=tamanho))
+            self._session.headers.update({
+                'Authorization': f'Bearer {self.whatsapp_token}',
+                'Content-Type': 'application/json'
+            })
+        return self._session
 
     def enviar_confirmacao_agendamento(self, agendamento):
         """Envia confirmação de agendamento por múltiplos canais"""
@@ -39,6 +64,31 @@ class NotificationService:
             logger.error(f"Erro ao enviar confirmação: {e}")
             return False
 
+    def enviar_confirmacao_lote(self, agendamentos):
+        """Envia uma única confirmação por cliente para agendamentos criados em lote"""
+        por_cliente = {}
+        for agendamento in agendamentos:
+            por_cliente.setdefault(agendamento.cliente, []).append(agendamento)
+
+        enviados = 0
+        for cliente, sessoes in por_cliente.items():
+            sessoes.sort(key=lambda agendamento: agendamento.horario)
+            try:
+                # Email
+                if cliente.email:
+                    self._enviar_email_confirmacao_lote(cliente, sessoes)
+
+                # WhatsApp
+                if self.whatsapp_api_url and self.whatsapp_token:
+                    self._enviar_whatsapp_confirmacao_lote(cliente, sessoes)
+
+                enviados += 1
+            except Exception as e:
+                logger.error(f"Erro ao enviar confirmação do lote para cliente {cliente.id}: {e}")
+
+        logger.info(f"Confirmação de {len(agendamentos)} agendamentos enviada para {enviados} clientes")
+        return enviados
+
     def enviar_lembrete_agendamento(self, agendamento, horas_antes=24):
         """Envia lembrete de agendamento"""
         try:
@@ -80,8 +130,19 @@ class NotificationService:
             logger.error(f"Erro ao enviar cancelamento: {e}")
             return False
 
-    def _enviar_email_confirmacao(self, agendamento):
-        """Envia email de confirmação"""
+    def _email(self, subject, template, context, destinatario):
+        """Email em texto e HTML a partir dos templates emails/<template>.(txt|html)"""
+        email = EmailMultiAlternatives(
+            subject=subject,
+            body=render_to_string(f'emails/{template}.txt', context),
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[destinatario]
+        )
+        email.attach_alternative(render_to_string(f'emails/{template}.html', context), 'text/html')
+        return email
+
+    def _email_confirmacao(self, agendamento):
+        """Monta o email de confirmação"""
         subject = f"Agendamento Confirmado - {agendamento.servico.nome}"
 
         context = {
@@ -91,20 +152,32 @@ class NotificationService:
             'horario_formatado': agendamento.horario.strftime('%d/%m/%Y às %H:%M'),
         }
 
-        html_message = render_to_string('emails/confirmacao_agendamento.html', context)
-        plain_message = render_to_string('emails/confirmacao_agendamento.txt', context)
+        return self._email(subject, 'confirmacao_agendamento', context, agendamento.cliente.email)
 
-        send_mail(
-            subject=subject,
-            message=plain_message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[agendamento.cliente.email],
-            html_message=html_message,
-            fail_silently=False
-        )
+    def _enviar_email_confirmacao(self, agendamento):
+        """Envia email de confirmação"""
+        self._email_confirmacao(agendamento).send(fail_silently=False)
 
-    def _enviar_email_lembrete(self, agendamento):
-        """Envia email de lembrete"""
+    def _email_confirmacao_lote(self, cliente, agendamentos):
+        """Monta o email de confirmação com todas as sessões do lote"""
+        subject = f"Agendamentos Confirmados - {len(agendamentos)} sessões"
+
+        context = {
+            'cliente': cliente,
+            'agendamentos': agendamentos,
+            'horarios_formatados': [
+                agendamento.horario.strftime('%d/%m/%Y às %H:%M') for agendamento in agendamentos
+            ],
+        }
+
+        return self._email(subject, 'confirmacao_lote', context, cliente.email)
+
+    def _enviar_email_confirmacao_lote(self, cliente, agendamentos):
+        """Envia email de confirmação com todas as sessões do lote"""
+        self._email_confirmacao_lote(cliente, agendamentos).send(fail_silently=False)
+
+    def _email_lembrete(self, agendamento):
+        """Monta o email de lembrete"""
         subject = f"Lembrete: {agendamento.servico.nome} amanhã"
 
         context = {
@@ -114,20 +187,14 @@ class NotificationService:
             'horario_formatado': agendamento.horario.strftime('%d/%m/%Y às %H:%M'),
         }
 
-        html_message = render_to_string('emails/lembrete_agendamento.html', context)
-        plain_message = render_to_string('emails/lembrete_agendamento.txt', context)
+        return self._email(subject, 'lembrete_agendamento', context, agendamento.cliente.email)
 
-        send_mail(
-            subject=subject,
-            message=plain_message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[agendamento.cliente.email],
-            html_message=html_message,
-            fail_silently=False
-        )
+    def _enviar_email_lembrete(self, agendamento):
+        """Envia email de lembrete"""
+        self._email_lembrete(agendamento).send(fail_silently=False)
 
-    def _enviar_email_cancelamento(self, agendamento):
-        """Envia email de cancelamento"""
+    def _email_cancelamento(self, agendamento):
+        """Monta o email de cancelamento"""
         subject = f"Agendamento Cancelado - {agendamento.servico.nome}"
 
         context = {
@@ -137,21 +204,15 @@ class NotificationService:
             'horario_formatado': agendamento.horario.strftime('%d/%m/%Y às %H:%M'),
         }
 
-        html_message = render_to_string('emails/cancelamento_agendamento.html', context)
-        plain_message = render_to_string('emails/cancelamento_agendamento.txt', context)
+        return self._email(subject, 'cancelamento_agendamento', context, agendamento.cliente.email)
 
-        send_mail(
-            subject=subject,
-            message=plain_message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[agendamento.cliente.email],
-            html_message=html_message,
-            fail_silently=False
-        )
+    def _enviar_email_cancelamento(self, agendamento):
+        """Envia email de cancelamento"""
+        self._email_cancelamento(agendamento).send(fail_silently=False)
 
-    def _enviar_whatsapp_confirmacao(self, agendamento):
-        """Envia WhatsApp de confirmação"""
-        mensagem = """
+    def _mensagem_whatsapp_confirmacao(self, agendamento):
+        """Texto do WhatsApp de confirmação"""
+        return f"""
 ✅ *Agendamento Confirmado*
 
 Olá {agendamento.cliente.nome}!
@@ -166,11 +227,36 @@ Seu agendamento foi confirmado:
 Estaremos te esperando! 😊
         """.strip()
 
-        self._enviar_whatsapp(agendamento.cliente.whatsapp, mensagem)
+    def _enviar_whatsapp_confirmacao(self, agendamento):
+        """Envia WhatsApp de confirmação"""
+        self._enviar_whatsapp(agendamento.cliente.whatsapp, self._mensagem_whatsapp_confirmacao(agendamento))
 
-    def _enviar_whatsapp_lembrete(self, agendamento):
-        """Envia WhatsApp de lembrete"""
-        mensagem = """
+    def _mensagem_whatsapp_confirmacao_lote(self, cliente, agendamentos):
+        """Texto do WhatsApp de confirmação com todas as sessões do lote"""
+        sessoes = "\n".join(
+            f"🕐 {agendamento.horario.strftime('%d/%m/%Y às %H:%M')} - {agendamento.servico.nome}"
+            for agendamento in agendamentos
+        )
+        return f"""
+✅ *Agendamentos Confirmados*
+
+Olá {cliente.nome}!
+
+Suas {len(agendamentos)} sessões foram confirmadas:
+{sessoes}
+
+📍 *Endereço:* [Inserir endereço]
+
+Estaremos te esperando! 😊
+        """.strip()
+
+    def _enviar_whatsapp_confirmacao_lote(self, cliente, agendamentos):
+        """Envia WhatsApp de confirmação com todas as sessões do lote"""
+        self._enviar_whatsapp(cliente.whatsapp, self._mensagem_whatsapp_confirmacao_lote(cliente, agendamentos))
+
+    def _mensagem_whatsapp_lembrete(self, agendamento):
+        """Texto do WhatsApp de lembrete"""
+        return f"""
 🔔 *Lembrete de Agendamento*
 
 Olá {agendamento.cliente.nome}!
@@ -182,11 +268,13 @@ Lembramos que você tem um agendamento:
 Aguardamos você! 💆‍♀️
         """.strip()
 
-        self._enviar_whatsapp(agendamento.cliente.whatsapp, mensagem)
+    def _enviar_whatsapp_lembrete(self, agendamento):
+        """Envia WhatsApp de lembrete"""
+        self._enviar_whatsapp(agendamento.cliente.whatsapp, self._mensagem_whatsapp_lembrete(agendamento))
 
-    def _enviar_whatsapp_cancelamento(self, agendamento):
-        """Envia WhatsApp de cancelamento"""
-        mensagem = """
+    def _mensagem_whatsapp_cancelamento(self, agendamento):
+        """Texto do WhatsApp de cancelamento"""
+        return f"""
 ❌ *Agendamento Cancelado*
 
 Olá {agendamento.cliente.nome}!
@@ -198,7 +286,21 @@ Seu agendamento foi cancelado:
 Para reagendar, entre em contato conosco.
         """.strip()
 
-        self._enviar_whatsapp(agendamento.cliente.whatsapp, mensagem)
+    def _enviar_whatsapp_cancelamento(self, agendamento):
+        """Envia WhatsApp de cancelamento"""
+        self._enviar_whatsapp(agendamento.cliente.whatsapp, self._mensagem_whatsapp_cancelamento(agendamento))
+
+    def montar_email(self, tipo, cliente, agendamentos):
+        """Email de uma notificação do outbox"""
+        if tipo == 'confirmacao_lote':
+            return self._email_confirmacao_lote(cliente, agendamentos)
+        return getattr(self, f'_email_{tipo}')(agendamentos[0])
+
+    def montar_whatsapp(self, tipo, cliente, agendamentos):
+        """Texto do WhatsApp de uma notificação do outbox"""
+        if tipo == 'confirmacao_lote':
+            return self._mensagem_whatsapp_confirmacao_lote(cliente, agendamentos)
+        return getattr(self, f'_mensagem_whatsapp_{tipo}')(agendamentos[0])
 
     def _enviar_whatsapp(self, numero, mensagem):
         """Envia mensagem via API do WhatsApp"""
@@ -207,11 +309,6 @@ Para reagendar, entre em contato conosco.
             return False
 
         try:
-            headers = {
-                'Authorization': f'Bearer {self.whatsapp_token}',
-                'Content-Type': 'application/json'
-            }
-
             data = {
                 'messaging_product': 'whatsapp',
                 'to': numero.replace('+', '').replace(' ', ''),
@@ -221,9 +318,8 @@ Para reagendar, entre em contato conosco.
                 }
             }
 
-            response = requests.post(
+            response = self.session.post(
                 f"{self.whatsapp_api_url}/messages",
-                headers=headers,
                 json=data,
                 timeout=10
             )
@@ -247,6 +343,12 @@ def enviar_confirmacao_agendamento(agendamento):
     return service.enviar_confirmacao_agendamento(agendamento)
 
 
+def enviar_confirmacao_lote(agendamentos):
+    """Função de conveniência para enviar confirmação de um lote"""
+    service = NotificationService()
+    return service.enviar_confirmacao_lote(agendamentos)
+
+
 def enviar_lembrete_agendamento(agendamento, horas_antes=24):
     """Função de conveniência para enviar lembrete"""
     service = NotificationService()
@@ -259,6 +361,206 @@ def enviar_cancelamento_agendamento(agendamento):
     return service.enviar_cancelamento(agendamento)
 
 
+# Outbox de notificações
+def _chave_idempotencia(tipo, canal, agendamentos):
+    """Mesma notificação dos mesmos agendamentos (no mesmo horário) gera a mesma chave"""
+    partes = [tipo, canal] + [
+        f"{agendamento.pk}@{agendamento.horario.isoformat()}" for agendamento in agendamentos
+    ]
+    return hashlib.blake2b('|'.join(partes).encode(), digest_size=32).hexdigest()
+
+
+def enfileirar_notificacoes(tipo, agendamentos):
+    """
+    Grava no outbox as notificações dos agendamentos, por canal disponível
+
+    Deve ser chamada dentro da transação que altera os agendamentos: as
+    notificações só existem se a alteração for gravada. O despacho é
+    agendado para depois do commit. Com tipo 'confirmacao_lote' os
+    agendamentos de cada cliente viram uma única notificação.
+    """
+    from .models import NotificacaoOutbox
+
+    service = NotificationService()
+    if tipo == 'confirmacao_lote':
+        grupos = {}
+        for agendamento in agendamentos:
+            grupos.setdefault(agendamento.cliente_id, []).append(agendamento)
+        grupos = [sorted(grupo, key=lambda agendamento: agendamento.horario) for grupo in grupos.values()]
+    else:
+        grupos = [[agendamento] for agendamento in agendamentos]
+
+    notificacoes = []
+    for grupo in grupos:
+        cliente = grupo[0].cliente
+        tipo_grupo = 'confirmacao' if tipo == 'confirmacao_lote' and len(grupo) == 1 else tipo
+        canais = []
+        if cliente.email:
+            canais.append('email')
+        if service.whatsapp_configurado and cliente.whatsapp:
+            canais.append('whatsapp')
+
+        for canal in canais:
+            notificacoes.append(NotificacaoOutbox(
+                tipo=tipo_grupo,
+                canal=canal,
+                cliente=cliente,
+                agendamentos=[agendamento.pk for agendamento in grupo],
+                chave_idempotencia=_chave_idempotencia(tipo_grupo, canal, grupo)
+            ))
+
+    # Chaves repetidas (ex.: lembrete já enfileirado) são ignoradas
+    NotificacaoOutbox.objects.bulk_create(notificacoes, ignore_conflicts=True)
+    if notificacoes:
+        transaction.on_commit(agendar_despacho)
+    return len(notificacoes)
+
+
+def agendar_despacho():
+    """
+    Dispara o worker sem prender a request: uma única tentativa de publicação,
+    com timeout curto de conexão. Broker lento ou fora do ar: o despacho
+    periódico drena o outbox.
+    """
+    timeout = getattr(settings, 'NOTIFICACOES_PUBLICACAO_TIMEOUT', 1)
+    try:
+        # delay() herdaria a política de retentativas de publicação do Celery
+        with despachar_notificacoes.app.connection_for_write(connect_timeout=timeout) as conexao:
+            despachar_notificacoes.apply_async(connection=conexao, retry=False)
+    except Exception as e:
+        logger.warning(f"Despacho de notificações não agendado: {e}")
+
+
+def _reservar(limite):
+    """Marca como 'enviando' até `limite` notificações vencidas (sem disputa entre workers)"""
+    from .models import NotificacaoOutbox
+
+    agora = timezone.now()
+    # 'enviando' há muito tempo: worker interrompido no meio do envio
+    abandonadas = agora - timedelta(minutes=getattr(settings, 'NOTIFICACOES_TEMPO_ENVIO_MINUTOS', 10))
+    with transaction.atomic():
+        notificacoes = list(
+            NotificacaoOutbox.objects.select_for_update(skip_locked=True, of=('self',)).filter(
+                Q(status='pendente', proxima_tentativa__lte=agora) |
+                Q(status='enviando', atualizado_em__lt=abandonadas)
+            ).select_related('cliente')[:limite]
+        )
+        NotificacaoOutbox.objects.filter(
+            pk__in=[notificacao.pk for notificacao in notificacoes]
+        ).update(status='enviando', atualizado_em=agora)
+    return notificacoes
+
+
+def _backoff(tentativas):
+    """Espera exponencial com jitter antes da próxima tentativa"""
+    base = getattr(settings, 'NOTIFICACOES_BACKOFF_SEGUNDOS', 30)
+    segundos = min(base * 2 ** (tentativas - 1), 6 * 3600)
+    return timedelta(seconds=segundos * random.uniform(0.8, 1.2))
+
+
+def despachar_outbox(limite=200):
+    """
+    Envia as notificações pendentes do outbox
+
+    Emails vão todos por uma única conexão SMTP; WhatsApps por uma sessão
+    HTTP com pool, com no máximo NOTIFICACOES_CONCORRENCIA envios
+    simultâneos. Falhas voltam para a fila com backoff até
+    NOTIFICACOES_MAX_TENTATIVAS tentativas.
+    """
+    from .models import Agendamento, NotificacaoOutbox
+
+    notificacoes = _reservar(limite)
+    if not notificacoes:
+        return 0
+
+    ids = {pk for notificacao in notificacoes for pk in notificacao.agendamentos}
+    agendamentos = Agendamento.objects.select_related('cliente', 'servico').in_bulk(ids)
+    service = NotificationService()
+    erros = {}
+
+    def agendamentos_de(notificacao):
+        return [agendamentos[pk] for pk in notificacao.agendamentos if pk in agendamentos]
+
+    # Agendamentos excluídos ou arquivados: nada a enviar, e tentar de novo não muda isso
+    orfas = {notificacao.pk for notificacao in notificacoes if not agendamentos_de(notificacao)}
+
+    # Email: uma conexão para o lote inteiro
+    emails = [
+        notificacao for notificacao in notificacoes
+        if notificacao.canal == 'email' and notificacao.pk not in orfas
+    ]
+    if emails:
+        try:
+            with get_connection(fail_silently=False) as conexao:
+                for notificacao in emails:
+                    try:
+                        mensagem = service.montar_email(
+                            notificacao.tipo, notificacao.cliente, agendamentos_de(notificacao)
+                        )
+                        conexao.send_messages([mensagem])
+                    except Exception as e:
+                        erros[notificacao.pk] = str(e)
+        except Exception as e:
+            # Falha ao abrir a conexão: todos os emails voltam para a fila
+            for notificacao in emails:
+                erros.setdefault(notificacao.pk, str(e))
+
+    # WhatsApp: envios concorrentes pela sessão compartilhada
+    def enviar_whatsapp(notificacao):
+        try:
+            mensagem = service.montar_whatsapp(
+                notificacao.tipo, notificacao.cliente, agendamentos_de(notificacao)
+            )
+            if not service._enviar_whatsapp(notificacao.cliente.whatsapp, mensagem):
+                return 'Falha na API do WhatsApp'
+        except Exception as e:
+            return str(e)
+        return None
+
+    whatsapps = [
+        notificacao for notificacao in notificacoes
+        if notificacao.canal == 'whatsapp' and notificacao.pk not in orfas
+    ]
+    if whatsapps:
+        with ThreadPoolExecutor(max_workers=getattr(settings, 'NOTIFICACOES_CONCORRENCIA', 4)) as executor:
+            for notificacao, erro in zip(whatsapps, executor.map(enviar_whatsapp, whatsapps)):
+                if erro:
+                    erros[notificacao.pk] = erro
+
+    agora = timezone.now()
+    maximo = getattr(settings, 'NOTIFICACOES_MAX_TENTATIVAS', 5)
+    for notificacao in notificacoes:
+        notificacao.tentativas += 1
+        notificacao.atualizado_em = agora
+        if notificacao.pk in orfas:
+            notificacao.status = 'falhou'
+            notificacao.ultimo_erro = 'Agendamento não encontrado (excluído ou arquivado)'
+        elif notificacao.pk not in erros:
+            notificacao.status = 'enviado'
+            notificacao.enviado_em = agora
+            notificacao.ultimo_erro = ''
+        else:
+            notificacao.ultimo_erro = erros[notificacao.pk]
+            if notificacao.tentativas >= maximo:
+                notificacao.status = 'falhou'
+                logger.error(f"Notificação {notificacao.pk} descartada: {notificacao.ultimo_erro}")
+            else:
+                notificacao.status = 'pendente'
+                notificacao.proxima_tentativa = agora + _backoff(notificacao.tentativas)
+
+    NotificacaoOutbox.objects.bulk_update(
+        notificacoes,
+        ['status', 'tentativas', 'proxima_tentativa', 'ultimo_erro', 'enviado_em', 'atualizado_em']
+    )
+
+    enviados = len(notificacoes) - len(erros) - len(orfas)
+    logger.info(
+        f"Outbox: {enviados} notificações enviadas, {len(erros)} com erro, "
+        f"{len(orfas)} sem agendamento"
+    )
+    return enviados
+
+
 # Tarefa Celery para processamento assíncrono
 from celery import shared_task
 
@@ -276,37 +578,88 @@ def processar_lembretes_agendamentos():
         horario__gte=inicio_janela,
         horario__lte=fim_janela,
         status='confirmado'
-    )
-
-    service = NotificationService()
-    count = 0
+    ).select_related('cliente')
 
-    for agendamento in agendamentos_lembrete:
-        if service.enviar_lembrete_agendamento(agendamento):
-            count += 1
+    # A chave de idempotência evita lembrete duplicado entre execuções
+    with transaction.atomic():
+        count = enfileirar_notificacoes('lembrete', list(agendamentos_lembrete))
 
-    logger.info(f"Processados {count} lembretes de agendamento")
+    logger.info(f"Enfileirados {count} lembretes de agendamento")
     return count
 
 
 @shared_task
-def processar_agendamentos_atrasados():
-    """Tarefa para identificar e notificar agendamentos atrasados"""
-    from .models import Agendamento
+def despachar_notificacoes(limite=200):
+    """Tarefa que drena o outbox (agendada após cada commit e periodicamente no beat)"""
+    return despachar_outbox(limite)
+
+
+def marcar_faltas(agora=None, tolerancia_minutos=15, limite=1000):
+    """
+    Marca como falta, em lote, até `limite` agendamentos confirmados atrasados
+
+    Uma consulta para reservar as linhas, um UPDATE para status e
+    observações, um INSERT para o histórico e a atualização das
+    estatísticas dos clientes; sem save() por linha (o
+    full_clean rejeitaria o horário no passado). Retorna os horários
+    alterados para a invalidação de cache.
+    """
+    from django.db.models import F, TextField, Value
+    from django.db.models.functions import Concat
+    from . import estatisticas
+    from .models import Agendamento, HistoricoStatusAgendamento
+
+    agora = agora or timezone.now()
+    with transaction.atomic():
+        atrasados = list(
+            Agendamento.objects.select_for_update(skip_locked=True).filter(
+                horario__lt=agora - timedelta(minutes=tolerancia_minutos),
+                status='confirmado'
+            ).order_by('horario').values_list('id', 'horario', 'cliente_id')[:limite]
+        )
+        if not atrasados:
+            return []
+
+        ids = [pk for pk, _, _ in atrasados]
+        Agendamento.objects.filter(pk__in=ids).update(
+            status='falta',
+            observacoes=Concat(
+                F('observacoes'),
+                Value(f"\nMarcado como falta automaticamente em {agora}"),
+                output_field=TextField()
+            ),
+            atualizado_em=agora
+        )
+        HistoricoStatusAgendamento.objects.bulk_create([
+            HistoricoStatusAgendamento(
+                agendamento_id=pk,
+                status_anterior='confirmado',
+                status_novo='falta',
+                motivo='atraso automatico'
+            )
+            for pk in ids
+        ])
+        estatisticas.atualizar({cliente_id for _, _, cliente_id in atrasados})
+    return [horario for _, horario, _ in atrasados]
 
-    agora = timezone.now()
-    agendamentos_atrasados = Agendamento.objects.filter(
-        horario__lt=agora - timedelta(minutes=15),
-        status='confirmado'
-    )
 
-    count = 0
-    for agendamento in agendamentos_atrasados:
-        # Marcar como perdido
-        agendamento.status = 'falta'
-        agendamento.observacoes += f"\nMarcado como falta automaticamente em {agora}"
-        agendamento.save()
-        count += 1
+@shared_task
+def processar_agendamentos_atrasados(limite=1000):
+    """Tarefa para identificar e marcar agendamentos atrasados"""
+    from .cache import CacheService
 
-    logger.info(f"Processados {count} agendamentos atrasados")
-    return count
+    agora = timezone.now()
+    horarios = []
+    # Lotes de `limite` linhas: transações curtas mesmo com muitos atrasados
+    while True:
+        lote = marcar_faltas(agora, limite=limite)
+        horarios += lote
+        if len(lote) < limite:
+            break
+
+    # update() não dispara signals: uma invalidação para todos os dias afetados
+    if horarios:
+        CacheService.invalidate_agendamentos(*set(horarios))
+
+    logger.info(f"Processados {len(horarios)} agendamentos atrasados")
+    return len(horarios)
@@ -1,28 +1,100 @@
 from rest_framework import serializers
+from django.db import transaction
+from django.db.models import Count, Q
 from django.utils import timezone
 from datetime import timedelta
-from .models import Cliente, Servico, Agendamento
+from .models import Cliente, ClienteEstatisticas, Servico, Agendamento, AgendamentoArquivado
+from . import estatisticas
+from .disponibilidade import Agenda, HORA_ABERTURA, HORA_FECHAMENTO, DOMINGO
+
+
+class ClienteListSerializer(serializers.ListSerializer):
+    """Listagem de clientes: últimos agendamentos arquivados em uma consulta por página"""
+
+    def to_representation(self, data):
+        clientes = list(data.all() if hasattr(data, 'all') else data)
+        ClienteSerializer.carregar_ultimos_arquivados(clientes)
+        return super().to_representation(clientes)
 
 
 class ClienteSerializer(serializers.ModelSerializer):
     """Serializer completo para Cliente com validações"""
 
     idade = serializers.ReadOnlyField()
-    total_agendamentos = serializers.ReadOnlyField()
+    total_agendamentos = serializers.SerializerMethodField()
     ultimo_agendamento = serializers.SerializerMethodField()
+    valor_total_pago = serializers.SerializerMethodField()
+    total_faltas = serializers.SerializerMethodField()
 
     class Meta:
         model = Cliente
         fields = [
             'id', 'nome', 'whatsapp', 'email', 'data_nascimento',
             'ativo', 'observacoes', 'criado_em', 'atualizado_em',
-            'idade', 'total_agendamentos', 'ultimo_agendamento'
+            'idade', 'total_agendamentos', 'ultimo_agendamento',
+            'valor_total_pago', 'total_faltas'
         ]
         read_only_fields = ['criado_em', 'atualizado_em']
+        list_serializer_class = ClienteListSerializer
+
+    @staticmethod
+    def preparar_queryset(queryset):
+        """Traz as estatísticas desnormalizadas no mesmo SELECT (evita consultas por cliente)"""
+        return queryset.select_related('estatisticas__ultimo_agendamento__servico')
+
+    @classmethod
+    def _ultimo_arquivado(cls, obj):
+        """Horário do último agendamento se ele já foi arquivado, senão None"""
+        dados = cls._estatisticas(obj)
+        ultimo, horario = dados.ultimo_agendamento, dados.ultimo_agendamento_horario
+        # A FK só aponta para a tabela principal
+        if horario and (not ultimo or ultimo.horario < horario):
+            return horario
+        return None
+
+    @classmethod
+    def carregar_ultimos_arquivados(cls, clientes):
+        """Busca de uma vez os últimos agendamentos já arquivados dos clientes"""
+        horarios = {}
+        for cliente in clientes:
+            cliente.ultimo_arquivado = None
+            horario = cls._ultimo_arquivado(cliente)
+            if horario:
+                horarios[cliente.pk] = horario
+        if not horarios:
+            return
+
+        arquivados = {
+            arquivado.cliente_id: arquivado
+            for arquivado in AgendamentoArquivado.objects.select_related('servico').filter(
+                cliente_id__in=horarios, horario__in=set(horarios.values())
+            )
+            if horarios[arquivado.cliente_id] == arquivado.horario
+        }
+        for cliente in clientes:
+            cliente.ultimo_arquivado = arquivados.get(cliente.pk)
+
+    @staticmethod
+    def _estatisticas(obj):
+        """Estatísticas do cliente; sem a linha (dados anteriores ao recalcular_estatisticas_clientes) são calculadas"""
+        try:
+            return obj.estatisticas
+        except ClienteEstatisticas.DoesNotExist:
+            obj.estatisticas = estatisticas.calcular([obj.pk])[obj.pk]
+            return obj.estatisticas
+
+    def get_total_agendamentos(self, obj):
+        """Total de agendamentos"""
+        return self._estatisticas(obj).total_agendamentos
 
     def get_ultimo_agendamento(self, obj):
         """Retorna dados do último agendamento"""
-        ultimo = obj.ultimo_agendamento()
+        ultimo = self._estatisticas(obj).ultimo_agendamento
+        if self._ultimo_arquivado(obj):
+            # Listagens já carregaram (ClienteListSerializer); detalhe busca aqui
+            if not hasattr(obj, 'ultimo_arquivado'):
+                self.carregar_ultimos_arquivados([obj])
+            ultimo = obj.ultimo_arquivado or ultimo
         if ultimo:
             return {
                 'id': ultimo.id,
@@ -32,6 +104,14 @@ class ClienteSerializer(serializers.ModelSerializer):
             }
         return None
 
+    def get_valor_total_pago(self, obj):
+        """Soma do valor cobrado dos agendamentos concluídos"""
+        return self._estatisticas(obj).valor_total_pago
+
+    def get_total_faltas(self, obj):
+        """Agendamentos marcados como falta"""
+        return self._estatisticas(obj).total_faltas
+
     def validate_whatsapp(self, value):
         """Validação específica para WhatsApp"""
         import re
@@ -58,7 +138,7 @@ class ClienteSerializer(serializers.ModelSerializer):
 class ServicoSerializer(serializers.ModelSerializer):
     """Serializer completo para Serviço com métricas"""
 
-    agendamentos_mes_atual = serializers.ReadOnlyField()
+    agendamentos_mes_atual = serializers.SerializerMethodField()
 
     class Meta:
         model = Servico
@@ -69,6 +149,26 @@ class ServicoSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['criado_em', 'atualizado_em']
 
+    @staticmethod
+    def preparar_queryset(queryset):
+        """Anota os agendamentos do mês atual (mesma regra de Servico.agendamentos_mes_atual)"""
+        inicio_mes = timezone.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        return queryset.annotate(
+            num_agendamentos_mes=Count(
+                'agendamento',
+                filter=Q(
+                    agendamento__horario__gte=inicio_mes,
+                    agendamento__status__in=['confirmado', 'concluido']
+                )
+            )
+        )
+
+    def get_agendamentos_mes_atual(self, obj):
+        """Agendamentos do mês atual (anotado por preparar_queryset)"""
+        if hasattr(obj, 'num_agendamentos_mes'):
+            return obj.num_agendamentos_mes
+        return obj.agendamentos_mes_atual()
+
     def validate_duracao_minutos(self, value):
         """Validação para duração do serviço"""
         if value < 15:
@@ -88,14 +188,93 @@ class ServicoSerializer(serializers.ModelSerializer):
         return value
 
 
+class PreCarregadoRelatedField(serializers.PrimaryKeyRelatedField):
+    """PrimaryKeyRelatedField que usa os objetos já carregados pelo lote"""
+
+    def to_internal_value(self, data):
+        precarregados = self.context.get('precarregados', {}).get(self.field_name, {})
+        try:
+            return precarregados[int(data)]
+        except (KeyError, TypeError, ValueError):
+            return super().to_internal_value(data)
+
+
+class AgendamentoLoteSerializer(serializers.ListSerializer):
+    """
+    Criação de agendamentos em lote (ex.: pacote de sessões semanais)
+
+    Conflitos com a agenda são verificados em uma única consulta e, entre os
+    próprios itens, em memória; a gravação é um bulk_create numa transação.
+    """
+
+    MAXIMO = 100
+
+    def to_internal_value(self, data):
+        # Clientes e serviços do lote em uma consulta por modelo
+        if isinstance(data, list):
+            for campo, modelo in (('cliente', Cliente), ('servico', Servico)):
+                ids = {
+                    int(item[campo]) for item in data
+                    if isinstance(item, dict) and str(item.get(campo, '')).isdigit()
+                }
+                self._context.setdefault('precarregados', {})[campo] = modelo.objects.in_bulk(ids)
+        return super().to_internal_value(data)
+
+    def validate(self, attrs):
+        """Conflitos com agendamentos confirmados e entre os itens do lote"""
+        periodos = [
+            (item['horario'], item['horario'] + timedelta(minutes=item['servico'].duracao_minutos))
+            for item in attrs
+        ]
+        agenda = Agenda.carregar_periodos(periodos)
+
+        # Mesmo formato dos erros dos itens: {posição: erros}
+        erros = {}
+        fim_lote = None
+        for indice in sorted(range(len(attrs)), key=lambda i: periodos[i]):
+            inicio, fim = periodos[indice]
+            if agenda.conflita(inicio, fim):
+                erros[indice] = {'horario': 'Existe conflito de horário com outro agendamento'}
+            elif fim_lote and inicio < fim_lote:
+                erros[indice] = {'horario': 'Conflito de horário com outro agendamento do lote'}
+            fim_lote = max(fim_lote, fim) if fim_lote else fim
+
+        if erros:
+            raise serializers.ValidationError(erros)
+        return attrs
+
+    def create(self, validated_data):
+        """bulk_create em uma transação, com invalidação de cache única"""
+        from .cache import CacheService
+
+        agendamentos = [Agendamento(**item) for item in validated_data]
+        for agendamento in agendamentos:
+            # Mesma regra do Agendamento.save()
+            if not agendamento.valor_cobrado:
+                agendamento.valor_cobrado = agendamento.servico.valor
+
+        with transaction.atomic():
+            Agendamento.objects.bulk_create(agendamentos)
+            estatisticas.atualizar({agendamento.cliente_id for agendamento in agendamentos})
+            # bulk_create não dispara os signals de invalidação; como neles,
+            # só após o commit
+            horarios = [agendamento.horario for agendamento in agendamentos]
+            transaction.on_commit(lambda: CacheService.invalidate_agendamentos(*horarios))
+        return agendamentos
+
+
 class AgendamentoCreateSerializer(serializers.ModelSerializer):
     """Serializer específico para criação de agendamentos"""
 
+    cliente = PreCarregadoRelatedField(queryset=Cliente.objects.all())
+    servico = PreCarregadoRelatedField(queryset=Servico.objects.all())
+
     class Meta:
         model = Agendamento
         fields = [
             'cliente', 'servico', 'horario', 'observacoes', 'valor_cobrado'
         ]
+        list_serializer_class = AgendamentoLoteSerializer
 
     def validate_horario(self, value):
         """Validação específica para horário"""
@@ -110,11 +289,14 @@ class AgendamentoCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Não é possível agendar com mais de 1 ano de antecedência")
 
         # Verificar horário comercial (8h às 19h)
-        if value.hour < 8 or value.hour >= 19:
-            raise serializers.ValidationError("Agendamentos devem ser entre 8h e 19h")
+        local = timezone.localtime(value)
+        if local.hour < HORA_ABERTURA or local.hour >= HORA_FECHAMENTO:
+            raise serializers.ValidationError(
+                f"Agendamentos devem ser entre {HORA_ABERTURA}h e {HORA_FECHAMENTO}h"
+            )
 
         # Verificar se não é domingo
-        if value.weekday() == 6:  # 6 = domingo
+        if local.weekday() == DOMINGO:
             raise serializers.ValidationError("Não atendemos aos domingos")
 
         return value
@@ -124,23 +306,26 @@ class AgendamentoCreateSerializer(serializers.ModelSerializer):
         horario = data.get('horario')
         servico = data.get('servico')
 
-        if horario and servico:
+        # Em lote o conflito é verificado pelo AgendamentoLoteSerializer
+        if horario and servico and not isinstance(self.parent, AgendamentoLoteSerializer):
             # Verificar conflito de horários
             fim_agendamento = horario + timedelta(minutes=servico.duracao_minutos)
+            self._agenda = Agenda.carregar(horario, fim_agendamento)
 
-            conflitos = Agendamento.objects.filter(
-                status='confirmado',
-                horario__lt=fim_agendamento,
-                horario__gte=horario - timedelta(minutes=servico.duracao_minutos)
-            )
-
-            if conflitos.exists():
+            if self._agenda.conflita(horario, fim_agendamento):
                 raise serializers.ValidationError({
                     'horario': 'Existe conflito de horário com outro agendamento'
                 })
 
         return data
 
+    def create(self, validated_data):
+        """Cria o agendamento reaproveitando a agenda da validação no clean() do modelo"""
+        agendamento = Agendamento(**validated_data)
+        agendamento._agenda = getattr(self, '_agenda', None)
+        agendamento.save()
+        return agendamento
+
 
 class AgendamentoDetailSerializer(serializers.ModelSerializer):
     """Serializer completo para visualização de agendamentos"""
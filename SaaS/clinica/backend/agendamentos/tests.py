@@ -5,11 +5,43 @@ Cobertura mínima para garantir funcionalidade crítica
 
 from django.test import TestCase, Client
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from datetime import datetime, timedelta
-from .models import Cliente, Servico, Agendamento
+from io import StringIO
+import json
+import time
+from unittest.mock import patch
+from .models import (
+    Cliente, ClienteEstatisticas, Servico, Agendamento, AgendamentoArquivado,
+    HistoricoStatusAgendamento, NotificacaoOutbox
+)
+from .notifications import (
+    despachar_outbox, enfileirar_notificacoes, processar_agendamentos_atrasados
+)
+from .cache import (
+    CacheLocal, CacheService, cache_key_generator, cache_result, clear_all_cache,
+    get_cache_stats, get_or_compute, memoizacao_request
+)
+from .disponibilidade import Agenda, horarios_livres
+from . import arquivo, dashboard, estatisticas, instrumentation
+
+
+def proximo_horario_comercial(dias=1, hora=10):
+    """Horário futuro em dia útil dentro do expediente"""
+    data = timezone.localdate() + timedelta(days=dias)
+    while data.weekday() == 6:
+        data += timedelta(days=1)
+    return timezone.make_aware(datetime.combine(data, datetime.min.time())) + timedelta(hours=hora)
 
 
 class ClienteModelTest(TestCase):
@@ -18,14 +50,14 @@ class ClienteModelTest(TestCase):
     def setUp(self):
         self.cliente = Cliente.objects.create(
             nome="João Silva",
-            telefone="11999999999",
+            whatsapp="+5511999999999",
             email="joao@email.com"
         )
 
     def test_cliente_creation(self):
         """Testa criação do cliente"""
         self.assertEqual(self.cliente.nome, "João Silva")
-        self.assertEqual(self.cliente.telefone, "11999999999")
+        self.assertEqual(self.cliente.whatsapp, "+5511999999999")
         self.assertEqual(self.cliente.email, "joao@email.com")
         self.assertTrue(self.cliente.ativo)
 
@@ -38,15 +70,16 @@ class AgendamentoAPITest(APITestCase):
     """Testes para a API de agendamentos"""
 
     def setUp(self):
+        self.client.force_authenticate(User.objects.create_user('recepcao', password='senha'))
         self.cliente = Cliente.objects.create(
             nome="Pedro Costa",
-            telefone="11777777777",
+            whatsapp="+5511777777777",
             email="pedro@email.com"
         )
         self.servico = Servico.objects.create(
             nome="Reflexologia",
-            duracao=45,
-            preco=60.00
+            duracao_minutos=45,
+            valor=60.00
         )
 
     def test_list_agendamentos(self):
@@ -54,7 +87,7 @@ class AgendamentoAPITest(APITestCase):
         Agendamento.objects.create(
             cliente=self.cliente,
             servico=self.servico,
-            horario=datetime.now() + timedelta(days=1)
+            horario=proximo_horario_comercial(dias=1)
         )
 
         url = '/api/agendamentos/'
@@ -69,10 +102,739 @@ class AgendamentoAPITest(APITestCase):
         data = {
             'cliente': self.cliente.id,
             'servico': self.servico.id,
-            'horario': (datetime.now() + timedelta(days=2)).isoformat(),
+            'horario': proximo_horario_comercial(dias=2).isoformat(),
             'observacoes': 'Teste API'
         }
         response = self.client.post(url, data)
 
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(Agendamento.objects.count(), 1)
+
+
+class ConsultasConstantesTest(APITestCase):
+    """Número de consultas das listagens não deve crescer com o número de linhas"""
+
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user('recepcao', password='senha'))
+        self.servicos = [
+            Servico.objects.create(nome=f"Serviço {n}", duracao_minutos=30, valor=50)
+            for n in range(2)
+        ]
+        self.horario = proximo_horario_comercial(dias=1, hora=8)
+        self.total_clientes = 0
+
+    def _criar_clientes(self, quantidade):
+        """Clientes com agendamentos confirmados e concluídos"""
+        for _ in range(quantidade):
+            self.total_clientes += 1
+            cliente = Cliente.objects.create(
+                nome=f"Cliente {self.total_clientes}",
+                whatsapp=f"+55119{self.total_clientes:08d}",
+                email=f"cliente{self.total_clientes}@email.com"
+            )
+            for servico in self.servicos:
+                agendamento = Agendamento.objects.create(
+                    cliente=cliente, servico=servico, horario=self.horario
+                )
+                self.horario += timedelta(minutes=30)
+                Agendamento.objects.filter(pk=agendamento.pk).update(status='concluido')
+            # update() não dispara signals: estatísticas atualizadas explicitamente
+            estatisticas.atualizar([cliente.pk])
+            self.cliente = cliente
+
+    def _consultas(self, url):
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(consultas)
+
+    def assertConsultasConstantes(self, url, esperado):
+        self._criar_clientes(1)
+        poucos = self._consultas(url)
+        self._criar_clientes(5)
+        self.assertEqual(self._consultas(url), poucos)
+        self.assertEqual(poucos, esperado)
+
+    def test_lista_clientes(self):
+        """Total e último agendamento vêm anotados na consulta da lista"""
+        self.assertConsultasConstantes('/api/clientes/', 1)
+
+    def _criar_clientes_arquivados(self, quantidade):
+        """Clientes cujo último agendamento já foi arquivado"""
+        for _ in range(quantidade):
+            self.total_clientes += 1
+            cliente = Cliente.objects.create(
+                nome=f"Cliente {self.total_clientes}",
+                whatsapp=f"+55119{self.total_clientes:08d}"
+            )
+            # bulk_create: save() não aceita horários no passado
+            Agendamento.objects.bulk_create([Agendamento(
+                cliente=cliente, servico=self.servicos[0], status='concluido', valor_cobrado=50,
+                horario=timezone.now() - timedelta(days=700 + self.total_clientes)
+            )])
+        # arquivar_lote atualiza as estatísticas dos clientes afetados
+        arquivo.arquivar()
+
+    def test_lista_clientes_com_ultimo_agendamento_arquivado(self):
+        """Últimos agendamentos arquivados vêm em uma consulta para a página inteira"""
+        self._criar_clientes(1)
+        self._criar_clientes_arquivados(1)
+        poucos = self._consultas('/api/clientes/')
+        self._criar_clientes_arquivados(10)
+        self.assertEqual(self._consultas('/api/clientes/'), poucos)
+        self.assertEqual(poucos, 2)
+
+        response = self.client.get('/api/clientes/')
+        self.assertEqual(len(response.data), 12)
+        self.assertTrue(all(cliente['ultimo_agendamento'] for cliente in response.data))
+
+    def test_lista_servicos(self):
+        """Agendamentos do mês vêm anotados na consulta da lista"""
+        self.assertConsultasConstantes('/api/servicos/', 1)
+
+    def test_estatisticas_servicos(self):
+        """Estatísticas por serviço em uma consulta"""
+        self.assertConsultasConstantes('/api/servicos/estatisticas/', 1)
+
+    def test_agendamentos_do_cliente(self):
+        """Agendamentos do cliente com cliente e serviço no mesmo select"""
+        self._criar_clientes(1)
+        poucos = self._consultas(f'/api/clientes/{self.cliente.pk}/agendamentos/')
+        for _ in range(4):
+            Agendamento.objects.create(
+                cliente=self.cliente, servico=self.servicos[0], horario=self.horario
+            )
+            self.horario += timedelta(minutes=30)
+        self.assertEqual(self._consultas(f'/api/clientes/{self.cliente.pk}/agendamentos/'), poucos)
+        self.assertEqual(poucos, 2)
+
+    def test_historico_cliente(self):
+        """Histórico em três consultas (cliente com estatísticas e status nas duas camadas)"""
+        self._criar_clientes(1)
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/api/clientes/{self.cliente.pk}/historico/')
+        self.assertEqual(response.data['total_agendamentos'], 2)
+        self.assertEqual(response.data['valor_total_pago'], 100)
+        self.assertEqual(response.data['ultimo_agendamento']['servico'], self.servicos[1].nome)
+
+
+class CalendarioAPITest(APITestCase):
+    """Testes para o feed do calendário"""
+
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user('recepcao', password='senha'))
+        self.servico = Servico.objects.create(nome="Drenagem", duracao_minutos=90, valor=120)
+        self.cliente = Cliente.objects.create(nome="Carla Dias", whatsapp="+5511966665555")
+        self.agendamento = Agendamento.objects.create(
+            cliente=self.cliente, servico=self.servico, horario=proximo_horario_comercial()
+        )
+
+    def test_eventos_com_fim_calculado(self):
+        """Testa formato dos eventos e fim calculado no banco"""
+        response = self.client.get('/api/agendamentos/calendario/')
+        eventos = json.loads(b''.join(response.streaming_content))
+
+        self.assertEqual(len(eventos), 1)
+        self.assertEqual(eventos[0]['title'], "Carla Dias - Drenagem")
+        self.assertEqual(
+            parse_datetime(eventos[0]['end']),
+            self.agendamento.horario + timedelta(minutes=90)
+        )
+
+    def test_etag(self):
+        """Sem alterações o calendário responde 304"""
+        etag = self.client.get('/api/agendamentos/calendario/')['ETag']
+
+        response = self.client.get('/api/agendamentos/calendario/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.agendamento.observacoes = "Trazer exames"
+        self.agendamento.save()
+        response = self.client.get('/api/agendamentos/calendario/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class AgendaDisponibilidadeTest(TestCase):
+    """Testes para o motor de disponibilidade"""
+
+    def setUp(self):
+        cache.clear()
+        self.dia = timezone.make_aware(datetime(2030, 1, 7, 8))  # segunda-feira
+        self.servico = Servico.objects.create(nome="Massagem", duracao_minutos=60, valor=100)
+        self.cliente = Cliente.objects.create(nome="Ana Souza", whatsapp="+5511988887777")
+
+    def test_blocos_sobrepostos_sao_unidos(self):
+        """Testa união de intervalos sobrepostos"""
+        agenda = Agenda([
+            (self.dia, self.dia + timedelta(hours=1)),
+            (self.dia + timedelta(minutes=30), self.dia + timedelta(hours=2)),
+            (self.dia + timedelta(hours=3), self.dia + timedelta(hours=4)),
+        ])
+        self.assertEqual(agenda.inicios, [self.dia, self.dia + timedelta(hours=3)])
+        self.assertEqual(agenda.fins, [self.dia + timedelta(hours=2), self.dia + timedelta(hours=4)])
+
+    def test_conflito(self):
+        """Testa conflito por sobreposição de intervalos"""
+        agenda = Agenda([(self.dia + timedelta(hours=1), self.dia + timedelta(hours=3))])
+        self.assertTrue(agenda.conflita(self.dia + timedelta(hours=2), self.dia + timedelta(hours=4)))
+        self.assertTrue(agenda.conflita(self.dia, self.dia + timedelta(minutes=75)))
+        self.assertFalse(agenda.conflita(self.dia, self.dia + timedelta(hours=1)))
+        self.assertFalse(agenda.conflita(self.dia + timedelta(hours=3), self.dia + timedelta(hours=4)))
+
+    def test_horarios_livres(self):
+        """Testa horários livres na grade de 15 minutos"""
+        agenda = Agenda([(self.dia + timedelta(minutes=60), self.dia + timedelta(minutes=100))])
+        livres = agenda.livres(30, self.dia, self.dia + timedelta(hours=3))
+        self.assertEqual(
+            [int((h - self.dia).total_seconds() // 60) for h in livres],
+            [0, 15, 30, 105, 120, 135, 150, 165]
+        )
+
+    def test_conflito_com_servico_longo(self):
+        """Agendamento que começa antes e ainda está em andamento gera conflito"""
+        longo = Servico.objects.create(nome="Terapia", duracao_minutos=120, valor=200)
+        Agendamento.objects.create(cliente=self.cliente, servico=longo, horario=self.dia)
+
+        with self.assertRaises(ValidationError):
+            Agendamento.objects.create(
+                cliente=self.cliente, servico=self.servico, horario=self.dia + timedelta(hours=1)
+            )
+        Agendamento.objects.create(
+            cliente=self.cliente, servico=self.servico, horario=self.dia + timedelta(hours=2)
+        )
+
+    def test_disponibilidade_invalidada_ao_salvar(self):
+        """Testa invalidação do cache de ocupação pelos signals"""
+        livres = horarios_livres(60, self.dia.date(), dias=1)[0]['horarios']
+        self.assertIn(self.dia, livres)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Agendamento.objects.create(cliente=self.cliente, servico=self.servico, horario=self.dia)
+        livres = horarios_livres(60, self.dia.date(), dias=1)[0]['horarios']
+        self.assertNotIn(self.dia, livres)
+        self.assertEqual(livres[0], self.dia + timedelta(hours=1))
+
+
+class AgendamentoLoteAPITest(APITestCase):
+    """Testes para criação de agendamentos em lote"""
+
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user('recepcao', password='senha'))
+        self.servico = Servico.objects.create(nome="Pilates", duracao_minutos=60, valor=80)
+        self.cliente = Cliente.objects.create(
+            nome="Maria Lima", whatsapp="+5511977776666", email="maria@example.com"
+        )
+        hoje = timezone.localdate()
+        segunda = hoje + timedelta(days=7 - hoje.weekday())
+        self.horario = timezone.make_aware(datetime.combine(segunda, datetime.min.time())) + timedelta(hours=9)
+
+    def _item(self, horario):
+        return {'cliente': self.cliente.id, 'servico': self.servico.id, 'horario': horario.isoformat()}
+
+    def test_pacote_semanal(self):
+        """Testa criação de um pacote de sessões com consultas constantes"""
+        itens = [self._item(self.horario + timedelta(weeks=n)) for n in range(10)]
+
+        with self.assertNumQueries(11):
+            response = self.client.post('/api/agendamentos/bulk_create/', itens, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Agendamento.objects.filter(status='confirmado').count(), 10)
+        # Uma única confirmação para o pacote, enfileirada no outbox
+        notificacao = NotificacaoOutbox.objects.get()
+        self.assertEqual(notificacao.tipo, 'confirmacao_lote')
+        self.assertEqual(len(notificacao.agendamentos), 10)
+
+    def test_conflitos_no_lote(self):
+        """Testa conflito com a agenda e entre itens do próprio lote"""
+        Agendamento.objects.create(cliente=self.cliente, servico=self.servico, horario=self.horario)
+        itens = [
+            self._item(self.horario + timedelta(minutes=30)),
+            self._item(self.horario + timedelta(hours=2)),
+            self._item(self.horario + timedelta(hours=2, minutes=45)),
+        ]
+
+        response = self.client.post('/api/agendamentos/bulk_create/', itens, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(response.data), {0, 2})
+        self.assertEqual(Agendamento.objects.count(), 1)
+
+
+class CacheVersionadoTest(TestCase):
+    """Invalidação por versão: só as entradas afetadas deixam de valer"""
+
+    def setUp(self):
+        cache.clear()
+        self.servico = Servico.objects.create(nome="Acupuntura", duracao_minutos=30, valor=90)
+        self.cliente = Cliente.objects.create(nome="Bruno Reis", whatsapp="+5511955554444")
+
+    def test_agendamento_invalida_apenas_seu_dia_e_mes(self):
+        """Alterar agendamento de outro mês não derruba os dados de hoje"""
+        CacheService.get_agendamentos_hoje()
+        estatisticas = CacheService.get_estatisticas_mes(mes=1, ano=2030)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            agendamento = Agendamento.objects.create(
+                cliente=self.cliente, servico=self.servico,
+                horario=timezone.make_aware(datetime(2030, 1, 8, 10))
+            )
+
+        with self.assertNumQueries(0):
+            CacheService.get_agendamentos_hoje()
+        self.assertEqual(estatisticas['total_agendamentos'], 0)
+        self.assertEqual(CacheService.get_estatisticas_mes(mes=1, ano=2030)['total_agendamentos'], 1)
+
+        # Mudança de horário invalida o mês antigo e o novo
+        agendamento = Agendamento.objects.get(pk=agendamento.pk)
+        agendamento.horario = timezone.make_aware(datetime(2030, 2, 5, 10))
+        with self.captureOnCommitCallbacks(execute=True):
+            agendamento.save()
+        self.assertEqual(CacheService.get_estatisticas_mes(mes=1, ano=2030)['total_agendamentos'], 0)
+        self.assertEqual(CacheService.get_estatisticas_mes(mes=2, ano=2030)['total_agendamentos'], 1)
+
+    def test_invalidacao_apenas_apos_commit(self):
+        """Versões só mudam no commit: leitura concorrente não grava dado antigo sob a versão nova"""
+        horario = timezone.make_aware(datetime(2030, 3, 4, 10))
+        CacheService.get_estatisticas_mes(mes=3, ano=2030)
+        versao = CacheService._versoes(['agendamentos', CacheService.ns_mes(2030, 3)])
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            Agendamento.objects.create(cliente=self.cliente, servico=self.servico, horario=horario)
+            self.assertEqual(CacheService._versoes(['agendamentos', CacheService.ns_mes(2030, 3)]), versao)
+        self.assertEqual(len(callbacks), 1)
+
+        callbacks[0]()
+        self.assertNotEqual(CacheService._versoes(['agendamentos', CacheService.ns_mes(2030, 3)]), versao)
+        self.assertEqual(CacheService.get_estatisticas_mes(mes=3, ano=2030)['total_agendamentos'], 1)
+
+    def test_lote_invalida_apos_commit(self):
+        """Criação em lote também só invalida no commit"""
+        from .serializers import AgendamentoCreateSerializer
+
+        horario = proximo_horario_comercial()
+        data = timezone.localtime(horario).date()
+        namespaces = ['agendamentos', CacheService.ns_mes(data.year, data.month)]
+        CacheService.get_estatisticas_mes(mes=data.month, ano=data.year)
+        versao = CacheService._versoes(namespaces)
+
+        serializer = AgendamentoCreateSerializer(data=[
+            {'cliente': self.cliente.pk, 'servico': self.servico.pk, 'horario': horario.isoformat()}
+        ], many=True)
+        serializer.is_valid(raise_exception=True)
+        with self.captureOnCommitCallbacks() as callbacks:
+            serializer.save()
+        self.assertEqual(CacheService._versoes(namespaces), versao)
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(CacheService.get_estatisticas_mes(mes=data.month, ano=data.year)['total_agendamentos'], 1)
+
+    def test_versao_perdida_nao_reaproveita_entrada_antiga(self):
+        """Versão removida do cache recomeça acima das anteriores"""
+        CacheService.get_servicos_ativos()
+        versao = cache.get(f"{CacheService.VERSAO_PREFIX}_servicos")
+
+        Servico.objects.filter(pk=self.servico.pk).update(nome="Acupuntura Sistêmica")
+        cache.delete(f"{CacheService.VERSAO_PREFIX}_servicos")
+
+        self.assertEqual(CacheService.get_servicos_ativos()[0]['nome'], "Acupuntura Sistêmica")
+        self.assertGreater(cache.get(f"{CacheService.VERSAO_PREFIX}_servicos"), versao)
+
+
+class GetOrComputeTest(TestCase):
+    """Proteção contra stampede no get_or_compute"""
+
+    def setUp(self):
+        cache.clear()
+        self.chamadas = 0
+
+    def calcular(self):
+        self.chamadas += 1
+        return self.chamadas
+
+    def test_valor_vencido_servido_enquanto_outro_recalcula(self):
+        """Com o lock ocupado, o valor vencido é servido sem recálculo"""
+        self.assertEqual(get_or_compute('chave', self.calcular, timeout=60), 1)
+
+        item = cache.get('chave')
+        item['expira'] = time.time() - 1
+        cache.set('chave', item, 60)
+        cache.add('chave_lock', 'outro-worker', 30)
+
+        self.assertEqual(get_or_compute('chave', self.calcular, timeout=60), 1)
+        self.assertEqual(self.chamadas, 1)
+
+        cache.delete('chave_lock')
+        self.assertEqual(get_or_compute('chave', self.calcular, timeout=60), 2)
+        self.assertIn('recomputes', get_cache_stats()['get_or_compute'])
+
+    def test_cache_result_guarda_none(self):
+        """O decorator não recalcula resultados None"""
+        @cache_result(timeout=60, key_prefix='teste')
+        def vazio():
+            self.chamadas += 1
+
+        vazio()
+        vazio()
+        self.assertEqual(self.chamadas, 1)
+
+
+class CacheLocalTest(TestCase):
+    """Cache em dois níveis (L1 no processo + cache do Django)"""
+
+    def setUp(self):
+        clear_all_cache()
+        self.servico = Servico.objects.create(nome="Corte", valor=50, duracao_minutos=30)
+
+    def test_lru_descarta_o_mais_antigo(self):
+        l1 = CacheLocal(maximo=2)
+        l1.set('a', 1, 60)
+        l1.set('b', 2, 60)
+        l1.get('a')
+        l1.set('c', 3, 60)
+        self.assertIsNone(l1.get('b'))
+        self.assertEqual(l1.get('a'), 1)
+        self.assertEqual(l1.stats()['tamanho'], 2)
+
+    def test_servicos_do_l1_e_invalidados_ao_salvar(self):
+        """Hit no L1 não lê o valor do cache do Django; salvar troca a versão"""
+        CacheService.get_servicos_ativos()
+        chave = CacheService.chave(f"{CacheService.SERVICOS_PREFIX}_ativos", 'servicos')
+
+        with patch.object(cache, 'get', wraps=cache.get) as leitura:
+            self.assertEqual(len(CacheService.get_servicos_ativos()), 1)
+        self.assertNotIn(chave, [args[0] for args, _ in leitura.call_args_list])
+        self.assertGreater(get_cache_stats()['get_or_compute']['l1']['hits'], 0)
+
+        Servico.objects.create(nome="Barba", valor=30, duracao_minutos=15)
+        self.assertEqual(len(CacheService.get_servicos_ativos()), 2)
+
+
+class CacheKeyTest(TestCase):
+    """Chaves do cache_result e memoização por request"""
+
+    def setUp(self):
+        clear_all_cache()
+        self.chamadas = 0
+        self.cliente = Cliente.objects.create(nome="Ana", whatsapp="+5511999990000")
+
+    def test_model_entra_pela_identidade(self):
+        """A chave de uma instância muda quando o registro é alterado"""
+        antes = cache_key_generator(self.cliente)
+        self.assertEqual(antes, cache_key_generator(Cliente.objects.get(pk=self.cliente.pk)))
+
+        self.cliente.nome = "Ana Maria"
+        self.cliente.save()
+        self.assertNotEqual(antes, cache_key_generator(self.cliente))
+
+    def test_objeto_sem_representacao_estavel(self):
+        with self.assertRaises(TypeError):
+            cache_key_generator(object())
+
+    def test_campos_ignoram_self(self):
+        """Métodos com campos declarados compartilham a chave entre instâncias"""
+        teste = self
+
+        class Relatorio:
+            @cache_result(timeout=60, key_prefix='teste', campos=['cliente'])
+            def total(self, cliente):
+                teste.chamadas += 1
+                return teste.chamadas
+
+        self.assertEqual(Relatorio().total(self.cliente), 1)
+        self.assertEqual(Relatorio().total(cliente=self.cliente), 1)
+
+    def test_memoizacao_por_request(self):
+        """Dentro do request a função não volta ao cache"""
+        @cache_result(timeout=60, key_prefix='teste', por_request=True)
+        def calcular(valor):
+            self.chamadas += 1
+            return valor
+
+        with memoizacao_request():
+            calcular(1)
+            with patch.object(cache, 'get', side_effect=AssertionError):
+                self.assertEqual(calcular(1), 1)
+        self.assertEqual(self.chamadas, 1)
+
+
+class InstrumentacaoTest(TestCase):
+    """Métricas por snapshot e labels por rota"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_scrape_le_o_snapshot_sem_consultas(self):
+        instrumentation.exportar()
+
+        with CaptureQueriesContext(connection) as consultas:
+            conteudo, _ = instrumentation.exportar()
+        self.assertEqual(len(consultas), 0)
+        self.assertIn('agendamentos_total', str(conteudo))
+
+    def test_atualizacao_em_segundo_plano_fecha_conexoes(self):
+        """A thread de atualização não deixa conexão com o banco aberta"""
+        with patch('agendamentos.instrumentation.connections') as conexoes:
+            instrumentation._atualizar_em_segundo_plano()
+        conexoes.close_all.assert_called_once_with()
+        self.assertIsNotNone(cache.get(instrumentation.SNAPSHOT_CHAVE))
+
+    def test_rota_usa_nome_da_url(self):
+        response = self.client.get('/health/')
+        self.assertEqual(instrumentation.nome_da_rota(response.wsgi_request), 'health_check')
+        response = self.client.get('/api/agendamentos/12345/')
+        self.assertEqual(
+            instrumentation.nome_da_rota(response.wsgi_request), 'agendamento-detail'
+        )
+
+
+class NotificacaoOutboxTest(TestCase):
+    """Despacho das notificações pelo outbox"""
+
+    def setUp(self):
+        servico = Servico.objects.create(nome="Massagem", duracao_minutos=60, valor=120)
+        cliente = Cliente.objects.create(
+            nome="Paula Dias", whatsapp="+5511966665555", email="paula@example.com"
+        )
+        self.agendamento = Agendamento.objects.create(
+            cliente=cliente, servico=servico, horario=proximo_horario_comercial()
+        )
+
+    def test_enfileirar_e_idempotente(self):
+        enfileirar_notificacoes('lembrete', [self.agendamento])
+        enfileirar_notificacoes('lembrete', [self.agendamento])
+        self.assertEqual(NotificacaoOutbox.objects.count(), 1)
+
+    def test_emails_em_uma_conexao_e_retentativa(self):
+        """Falha volta para a fila com backoff; sucesso marca como enviado"""
+        enfileirar_notificacoes('cancelamento', [self.agendamento])
+
+        with patch('agendamentos.notifications.get_connection') as conexao:
+            conexao.return_value.__enter__.return_value.send_messages.side_effect = OSError('SMTP')
+            self.assertEqual(despachar_outbox(), 0)
+        notificacao = NotificacaoOutbox.objects.get()
+        self.assertEqual((notificacao.status, notificacao.tentativas), ('pendente', 1))
+        self.assertGreater(notificacao.proxima_tentativa, timezone.now())
+
+        NotificacaoOutbox.objects.update(proxima_tentativa=timezone.now())
+        with patch('agendamentos.notifications.get_connection') as conexao, \
+                patch('agendamentos.notifications.render_to_string', return_value=''):
+            self.assertEqual(despachar_outbox(), 1)
+        self.assertEqual(conexao.call_count, 1)
+        self.assertEqual(NotificacaoOutbox.objects.get().status, 'enviado')
+
+    def test_publicacao_do_despacho_nao_retenta(self):
+        """Após o commit, uma tentativa de publicação com timeout curto; falha não chega à request"""
+        from .notifications import agendar_despacho, despachar_notificacoes
+
+        with patch.object(despachar_notificacoes.app, 'connection_for_write') as conexao, \
+                patch.object(despachar_notificacoes, 'apply_async') as publicar:
+            with self.captureOnCommitCallbacks(execute=True):
+                enfileirar_notificacoes('lembrete', [self.agendamento])
+        conexao.assert_called_once_with(connect_timeout=1)
+        self.assertIs(publicar.call_args.kwargs['retry'], False)
+
+        with patch.object(despachar_notificacoes, 'apply_async', side_effect=OSError('broker fora')):
+            agendar_despacho()
+
+    def test_agendamento_removido_falha_sem_retentativa(self):
+        """Sem agendamento (excluído ou arquivado) a notificação é descartada na hora"""
+        enfileirar_notificacoes('lembrete', [self.agendamento])
+        self.agendamento.delete()
+
+        with patch('agendamentos.notifications.get_connection') as conexao:
+            self.assertEqual(despachar_outbox(), 0)
+        conexao.return_value.__enter__.return_value.send_messages.assert_not_called()
+        notificacao = NotificacaoOutbox.objects.get()
+        self.assertEqual((notificacao.status, notificacao.tentativas), ('falhou', 1))
+
+
+class AgendamentosAtrasadosTest(TestCase):
+    """Marcação de faltas em lote"""
+
+    def setUp(self):
+        servico = Servico.objects.create(nome="Drenagem", duracao_minutos=30, valor=90)
+        cliente = Cliente.objects.create(nome="Rita Alves", whatsapp="+5511955554444")
+        inicio = timezone.now() - timedelta(days=2)
+        # bulk_create: save() não aceita horários no passado
+        Agendamento.objects.bulk_create([
+            Agendamento(cliente=cliente, servico=servico, horario=inicio + timedelta(hours=n), valor_cobrado=90)
+            for n in range(5)
+        ])
+
+    def test_consultas_independem_do_numero_de_atrasados(self):
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(processar_agendamentos_atrasados(limite=2), 5)
+        # 3 lotes (2 + 2 + 1): SELECT, UPDATE, INSERT do histórico e estatísticas (2)
+        self.assertLessEqual(len([q for q in consultas if 'agendamentos_' in q['sql']]), 15)
+
+        self.assertFalse(Agendamento.objects.filter(status='confirmado').exists())
+        self.assertEqual(HistoricoStatusAgendamento.objects.filter(status_novo='falta').count(), 5)
+        self.assertIn('Marcado como falta', Agendamento.objects.first().observacoes)
+
+
+class ClienteEstatisticasTest(APITestCase):
+    """Estatísticas desnormalizadas dos clientes"""
+
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user('recepcao', password='senha'))
+        self.servico = Servico.objects.create(nome="Limpeza de pele", duracao_minutos=60, valor=150)
+        self.cliente = Cliente.objects.create(nome="Bia Souza", whatsapp="+5511944443333")
+
+    def test_transicoes_de_status_atualizam_estatisticas(self):
+        agendamento = Agendamento.objects.create(
+            cliente=self.cliente, servico=self.servico, horario=proximo_horario_comercial()
+        )
+        agendamento.status = 'concluido'
+        agendamento.save()
+
+        dados = self.client.get('/api/clientes/').data
+        dados = dados['results'][0] if 'results' in dados else dados[0]
+        self.assertEqual(dados['total_agendamentos'], 1)
+        self.assertEqual(dados['valor_total_pago'], 150)
+        self.assertEqual(dados['ultimo_agendamento']['id'], agendamento.pk)
+
+        agendamento.delete()
+        self.assertEqual(ClienteEstatisticas.objects.get(cliente=self.cliente).total_agendamentos, 0)
+
+    def test_alteracao_e_estatisticas_na_mesma_transacao(self):
+        """Falha ao atualizar as estatísticas desfaz a mudança de status"""
+        agendamento = Agendamento.objects.create(
+            cliente=self.cliente, servico=self.servico, horario=proximo_horario_comercial()
+        )
+        url = f'/api/agendamentos/{agendamento.pk}/'
+
+        with patch('agendamentos.estatisticas.atualizar', side_effect=RuntimeError('falha')):
+            with self.assertRaises(RuntimeError):
+                self.client.post(f'{url}concluir/')
+            with self.assertRaises(RuntimeError):
+                self.client.patch(url, {'observacoes': 'Alterado'}, format='json')
+
+        agendamento.refresh_from_db()
+        self.assertEqual(agendamento.status, 'confirmado')
+        self.assertEqual(agendamento.observacoes, '')
+
+    def test_verificacao_e_reconstrucao(self):
+        Agendamento.objects.create(
+            cliente=self.cliente, servico=self.servico, horario=proximo_horario_comercial()
+        )
+        ClienteEstatisticas.objects.update(total_agendamentos=7)
+
+        with self.assertRaises(CommandError):
+            call_command('verificar_estatisticas_clientes', stdout=StringIO())
+        call_command('recalcular_estatisticas_clientes', stdout=StringIO())
+        call_command('verificar_estatisticas_clientes', stdout=StringIO())
+        self.assertEqual(ClienteEstatisticas.objects.get().total_agendamentos, 1)
+
+
+class DashboardTest(APITestCase):
+    """Dashboard com contadores agregados em uma consulta"""
+
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user('recepcao', password='senha'))
+        servico = Servico.objects.create(nome="Reflexologia", duracao_minutos=60, valor=100)
+        cliente = Cliente.objects.create(nome="Lia Campos", whatsapp="+5511922221111")
+        self.agendamento = Agendamento.objects.create(
+            cliente=cliente, servico=servico, horario=proximo_horario_comercial()
+        )
+        # Fora da janela de popularidade: não entra no ranking
+        Agendamento.objects.bulk_create([Agendamento(
+            cliente=cliente, servico=Servico.objects.create(nome="Antigo", duracao_minutos=30, valor=10),
+            horario=timezone.now() - timedelta(days=400), status='concluido', valor_cobrado=10
+        )])
+
+    def test_consultas_e_ranking_da_janela(self):
+        with self.assertNumQueries(4):
+            dados = dashboard.dados_dashboard()
+
+        self.assertEqual([servico['nome'] for servico in dados['servicos_mais_procurados']], ['Reflexologia'])
+        self.assertEqual(dados['proximos_agendamentos'][0]['id'], self.agendamento.pk)
+        self.assertEqual(dados['clientes_ativos'], 1)
+
+    def test_endpoint(self):
+        response = self.client.get('/api/agendamentos/dashboard/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, CacheService.get_dashboard_data())
+
+
+class ArquivamentoTest(APITestCase):
+    """Arquivamento de agendamentos antigos e leitura unificada"""
+
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user('recepcao', password='senha'))
+        self.servico = Servico.objects.create(nome="Acupuntura", duracao_minutos=60, valor=100)
+        self.cliente = Cliente.objects.create(nome="Vera Lopes", whatsapp="+5511911110000")
+        antigo = timezone.now() - timedelta(days=800)
+        # bulk_create: save() não aceita horários no passado
+        Agendamento.objects.bulk_create([
+            Agendamento(
+                cliente=self.cliente, servico=self.servico, horario=antigo + timedelta(days=n),
+                status=status_antigo, valor_cobrado=100
+            )
+            for n, status_antigo in enumerate(['concluido', 'concluido', 'falta', 'confirmado'])
+        ])
+        self.recente = Agendamento.objects.create(
+            cliente=self.cliente, servico=self.servico, horario=proximo_horario_comercial()
+        )
+        estatisticas.atualizar([self.cliente.pk])
+
+    def test_arquivar_mantem_relatorios_e_estatisticas(self):
+        antes = ClienteEstatisticas.objects.get(cliente=self.cliente)
+        call_command('arquivar_agendamentos', stdout=StringIO())
+
+        # Confirmados nunca são arquivados
+        self.assertEqual(AgendamentoArquivado.objects.count(), 3)
+        self.assertEqual(Agendamento.objects.count(), 2)
+
+        depois = ClienteEstatisticas.objects.get(cliente=self.cliente)
+        self.assertEqual(depois.total_agendamentos, antes.total_agendamentos)
+        self.assertEqual(depois.valor_total_pago, 200)
+        self.assertEqual(depois.total_faltas, 1)
+
+        inicio = (timezone.now() - timedelta(days=900)).date()
+        fim = timezone.localtime(self.recente.horario).date()
+        response = self.client.get(f'/api/agendamentos/relatorio/?inicio={inicio}&fim={fim}')
+        self.assertEqual(response.data['total_agendamentos'], 5)
+        self.assertEqual(response.data['receita_total'], 200)
+        self.assertEqual(response.data['top_clientes'][0]['total'], 5)
+        self.assertEqual(arquivo.consultar(cliente=self.cliente).count(), 5)
+
+    def test_estatisticas_mes_e_snapshot_somam_as_duas_camadas(self):
+        """Arquivar não altera as estatísticas mensais nem as métricas"""
+        data = timezone.localtime(Agendamento.objects.order_by('horario')[0].horario).date()
+
+        def estatisticas_mes():
+            dados = CacheService.get_estatisticas_mes(mes=data.month, ano=data.year)
+            por_status = sorted((item['status'], item['count']) for item in dados['por_status'])
+            return dados['total_agendamentos'], dados['receita_total'], por_status
+
+        antes = estatisticas_mes()
+        snapshot = instrumentation.calcular_snapshot()
+        arquivo.arquivar()
+
+        self.assertEqual(estatisticas_mes(), antes)
+        depois = instrumentation.calcular_snapshot()
+        self.assertEqual(depois['agendamentos_total'], 5)
+        self.assertEqual(depois['agendamentos_por_status'], snapshot['agendamentos_por_status'])
+        self.assertEqual(depois['agendamentos_por_status']['concluido'], 2)
+
+    def test_ultimo_agendamento_arquivado(self):
+        """Cliente só com histórico arquivado continua exibindo o último agendamento"""
+        cliente = Cliente.objects.create(nome="Rita Alves", whatsapp="+5511922223333")
+        antigo = Agendamento.objects.bulk_create([Agendamento(
+            cliente=cliente, servico=self.servico, horario=timezone.now() - timedelta(days=700),
+            status='concluido', valor_cobrado=100
+        )])[0]
+        estatisticas.atualizar([cliente.pk])
+        arquivo.arquivar()
+
+        self.assertIsNone(ClienteEstatisticas.objects.get(cliente=cliente).ultimo_agendamento_id)
+        response = self.client.get(f'/api/clientes/{cliente.pk}/')
+        self.assertEqual(response.data['ultimo_agendamento']['id'], antigo.pk)
+        self.assertEqual(response.data['ultimo_agendamento']['servico'], "Acupuntura")
+
+    def test_horizonte_em_meses_inteiros(self):
+        limite = timezone.localtime(arquivo.horizonte(meses=1))
+        self.assertEqual((limite.day, limite.hour), (1, 0))
+        self.assertLess(limite, timezone.now())
@@ -3,14 +3,30 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django_filters.rest_framework import DjangoFilterBackend
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.http import HttpResponseNotModified, StreamingHttpResponse
 from django.utils import timezone
-from django.db.models import Count, Sum, Q
+from django.utils.cache import patch_cache_control
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.http import parse_etags, quote_etag
+from django.db.models import (
+    CharField, Count, DateTimeField, DurationField, ExpressionWrapper, F, Max, Q, Sum, Value
+)
+from django.db.models.functions import Concat
 from datetime import datetime, timedelta
+import hashlib
+import json
 from .models import Cliente, Servico, Agendamento
+from . import arquivo
+from .cache import CacheService
+from .dashboard import dados_dashboard
+from .disponibilidade import horarios_livres, horario_disponivel
+from .notifications import enfileirar_notificacoes
 from .serializers import (
     ClienteSerializer, ServicoSerializer,
-    AgendamentoCreateSerializer, AgendamentoDetailSerializer,
-    AgendamentoUpdateSerializer, DashboardSerializer, CalendarioSerializer
+    AgendamentoCreateSerializer, AgendamentoLoteSerializer, AgendamentoDetailSerializer,
+    AgendamentoUpdateSerializer
 )
 
 
@@ -26,11 +42,15 @@ class ClienteViewSet(viewsets.ModelViewSet):
     ordering_fields = ['nome', 'criado_em']
     ordering = ['nome']
 
+    def get_queryset(self):
+        """Queryset com as estatísticas do cliente (ClienteEstatisticas)"""
+        return ClienteSerializer.preparar_queryset(super().get_queryset())
+
     @action(detail=True, methods=['get'])
     def agendamentos(self, request, pk=None):
         """Lista agendamentos de um cliente específico"""
         cliente = self.get_object()
-        agendamentos = cliente.agendamento_set.all().order_by('-horario')
+        agendamentos = cliente.agendamento_set.select_related('cliente', 'servico').order_by('-horario')
 
         # Filtros opcionais
         status_filter = request.query_params.get('status')
@@ -50,16 +70,19 @@ class ClienteViewSet(viewsets.ModelViewSet):
     def historico(self, request, pk=None):
         """Histórico completo do cliente"""
         cliente = self.get_object()
+        dados = ClienteSerializer(cliente).data
+
+        # Contagem por status (inclui arquivados); totais vêm de ClienteEstatisticas
+        por_status = arquivo.agregar(['status'], {'count': Count('id')}, cliente=cliente)
+
         return Response({
-            'cliente': ClienteSerializer(cliente).data,
-            'total_agendamentos': cliente.total_agendamentos(),
-            'agendamentos_por_status': cliente.agendamento_set.values('status').annotate(
-                count=Count('id')
-            ),
-            'valor_total_pago': cliente.agendamento_set.filter(
-                status='concluido'
-            ).aggregate(total=Sum('valor_cobrado'))['total'] or 0,
-            'ultimo_agendamento': cliente.ultimo_agendamento()
+            'cliente': dados,
+            'total_agendamentos': dados['total_agendamentos'],
+            'agendamentos_por_status': [
+                {'status': item['status'], 'count': item['count']} for item in por_status
+            ],
+            'valor_total_pago': dados['valor_total_pago'],
+            'ultimo_agendamento': dados['ultimo_agendamento']
         })
 
 
@@ -75,46 +98,49 @@ class ServicoViewSet(viewsets.ModelViewSet):
     ordering_fields = ['nome', 'valor', 'duracao_minutos']
     ordering = ['nome']
 
+    def get_queryset(self):
+        """Queryset com agendamentos do mês anotados"""
+        return ServicoSerializer.preparar_queryset(super().get_queryset())
+
     @action(detail=False, methods=['get'])
     def estatisticas(self, request):
         """Estatísticas dos serviços"""
         hoje = timezone.now()
         inicio_mes = hoje.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
 
-        stats = []
-        for servico in self.get_queryset():
-            agendamentos_mes = servico.agendamento_set.filter(
-                horario__gte=inicio_mes,
-                status__in=['confirmado', 'concluido']
+        # Todas as métricas em uma consulta (agregação condicional)
+        no_mes = Q(agendamento__horario__gte=inicio_mes)
+        ate_agora = no_mes & Q(agendamento__horario__lt=hoje)
+        servicos = self.get_queryset().annotate(
+            receita_mes=Sum(
+                'agendamento__valor_cobrado',
+                filter=no_mes & Q(agendamento__status='concluido')
+            ),
+            total_periodo=Count('agendamento', filter=ate_agora),
+            concluidos_periodo=Count(
+                'agendamento',
+                filter=ate_agora & Q(agendamento__status='concluido')
             )
+        )
 
+        stats = []
+        for servico in servicos:
             stats.append({
                 'servico': ServicoSerializer(servico).data,
-                'agendamentos_mes': agendamentos_mes.count(),
-                'receita_mes': agendamentos_mes.filter(
-                    status='concluido'
-                ).aggregate(total=Sum('valor_cobrado'))['total'] or 0,
-                'taxa_conclusao': self._calcular_taxa_conclusao(servico, inicio_mes)
+                'agendamentos_mes': servico.num_agendamentos_mes,
+                'receita_mes': servico.receita_mes or 0,
+                'taxa_conclusao': self._calcular_taxa_conclusao(
+                    servico.total_periodo, servico.concluidos_periodo
+                )
             })
 
         return Response(stats)
 
-    def _calcular_taxa_conclusao(self, servico, inicio_periodo):
+    def _calcular_taxa_conclusao(self, total, concluidos):
         """Calcula taxa de conclusão do serviço"""
-        total = servico.agendamento_set.filter(
-            horario__gte=inicio_periodo,
-            horario__lt=timezone.now()
-        ).count()
-
         if total == 0:
             return 0
 
-        concluidos = servico.agendamento_set.filter(
-            horario__gte=inicio_periodo,
-            horario__lt=timezone.now(),
-            status='concluido'
-        ).count()
-
         return round((concluidos / total) * 100, 2)
 
 
@@ -138,6 +164,17 @@ class AgendamentoViewSet(viewsets.ModelViewSet):
         else:
             return AgendamentoDetailSerializer
 
+    def perform_create(self, serializer):
+        """Cria o agendamento e enfileira a confirmação na mesma transação"""
+        with transaction.atomic():
+            agendamento = serializer.save()
+            enfileirar_notificacoes('confirmacao', [agendamento])
+
+    def perform_update(self, serializer):
+        """Salva na mesma transação das estatísticas do cliente (signals)"""
+        with transaction.atomic():
+            serializer.save()
+
     def get_queryset(self):
         """Queryset com filtros específicos"""
         queryset = super().get_queryset()
@@ -169,68 +206,17 @@ class AgendamentoViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def dashboard(self, request):
         """Dados para dashboard principal"""
-        hoje = timezone.now()
-        inicio_semana = hoje - timedelta(days=hoje.weekday())
-        inicio_mes = hoje.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-
-        # Agendamentos
-        agendamentos_hoje = Agendamento.objects.filter(
-            horario__date=hoje.date()
-        ).count()
-
-        agendamentos_semana = Agendamento.objects.filter(
-            horario__gte=inicio_semana
-        ).count()
-
-        agendamentos_mes = Agendamento.objects.filter(
-            horario__gte=inicio_mes
-        ).count()
-
-        # Receita do mês
-        receita_mes = Agendamento.objects.filter(
-            horario__gte=inicio_mes,
-            status='concluido'
-        ).aggregate(total=Sum('valor_cobrado'))['total'] or 0
-
-        # Clientes ativos
-        clientes_ativos = Cliente.objects.filter(ativo=True).count()
-
-        # Serviços mais procurados
-        servicos_populares = Servico.objects.annotate(
-            total_agendamentos=Count('agendamento')
-        ).order_by('-total_agendamentos')[:5]
-
-        servicos_mais_procurados = [
-            {
-                'nome': s.nome,
-                'total': s.total_agendamentos,
-                'valor': float(s.valor)
-            }
-            for s in servicos_populares
-        ]
-
-        # Próximos agendamentos
-        proximos = Agendamento.objects.filter(
-            horario__gte=hoje,
-            status='confirmado'
-        ).order_by('horario')[:10]
-
-        data = {
-            'agendamentos_hoje': agendamentos_hoje,
-            'agendamentos_semana': agendamentos_semana,
-            'agendamentos_mes': agendamentos_mes,
-            'receita_mes': receita_mes,
-            'clientes_ativos': clientes_ativos,
-            'servicos_mais_procurados': servicos_mais_procurados,
-            'proximos_agendamentos': AgendamentoDetailSerializer(proximos, many=True).data
-        }
-
-        serializer = DashboardSerializer(data)
-        return Response(serializer.data)
+        return Response(dados_dashboard())
 
     @action(detail=False, methods=['get'])
     def calendario(self, request):
-        """Dados para visualização em calendário"""
+        """
+        Dados para visualização em calendário
+
+        Projeção com values() (fim calculado no banco) enviada em streaming.
+        A ETag depende do total e do maior atualizado_em (agendamento, cliente
+        e serviço) do período: recarregar o calendário sem mudanças dá 304.
+        """
         start = request.query_params.get('start')
         end = request.query_params.get('end')
 
@@ -241,22 +227,156 @@ class AgendamentoViewSet(viewsets.ModelViewSet):
         if end:
             queryset = queryset.filter(horario__lte=end)
 
-        eventos = []
-        for agendamento in queryset:
-            eventos.append({
-                'id': agendamento.id,
-                'title': f"{agendamento.cliente.nome} - {agendamento.servico.nome}",
-                'start': agendamento.horario,
-                'end': agendamento.horario_fim,
-                'color': agendamento.servico.cor_calendario,
-                'cliente': agendamento.cliente.nome,
-                'servico': agendamento.servico.nome,
-                'status': agendamento.status,
-                'observacoes': agendamento.observacoes or ''
+        versao = queryset.order_by().aggregate(
+            total=Count('id'),
+            agendamento=Max('atualizado_em'),
+            cliente=Max('cliente__atualizado_em'),
+            servico=Max('servico__atualizado_em')
+        )
+        etag = quote_etag(hashlib.md5(
+            json.dumps([request.query_params.urlencode(), versao], default=str).encode()
+        ).hexdigest())
+
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match:
+            # Comparação fraca: proxies com gzip enviam W/"..."
+            recebidas = [tag.removeprefix('W/') for tag in parse_etags(if_none_match)]
+            if '*' in recebidas or etag in recebidas:
+                response = HttpResponseNotModified()
+                response['ETag'] = etag
+                return response
+
+        eventos = queryset.annotate(
+            title=Concat('cliente__nome', Value(' - '), 'servico__nome', output_field=CharField()),
+            end=ExpressionWrapper(
+                F('horario') + ExpressionWrapper(
+                    F('servico__duracao_minutos') * Value(timedelta(minutes=1)),
+                    output_field=DurationField()
+                ),
+                output_field=DateTimeField()
+            )
+        ).values_list(
+            'id', 'title', 'horario', 'end', 'servico__cor_calendario',
+            'cliente__nome', 'servico__nome', 'status', 'observacoes'
+        )
+
+        response = StreamingHttpResponse(
+            self._stream_calendario(eventos.iterator(chunk_size=2000)),
+            content_type='application/json'
+        )
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def _stream_calendario(self, linhas, tamanho_bloco=500):
+        """JSON do calendário em blocos (mesmo formato do CalendarioSerializer)"""
+        campos = ('id', 'title', 'start', 'end', 'color', 'cliente', 'servico', 'status', 'observacoes')
+        fuso = timezone.get_current_timezone()
+        separador = '['
+        bloco = []
+        for linha in linhas:
+            evento = dict(zip(campos, linha))
+            evento['start'] = evento['start'].astimezone(fuso)
+            evento['end'] = evento['end'].astimezone(fuso)
+            evento['observacoes'] = evento['observacoes'] or ''
+            bloco.append(evento)
+            if len(bloco) >= tamanho_bloco:
+                yield separador + json.dumps(bloco, cls=DjangoJSONEncoder, ensure_ascii=False)[1:-1]
+                separador = ','
+                bloco = []
+        if bloco:
+            yield separador + json.dumps(bloco, cls=DjangoJSONEncoder, ensure_ascii=False)[1:-1]
+            separador = ','
+        yield '[]' if separador == '[' else ']'
+
+    @action(detail=False, methods=['post'])
+    def bulk_create(self, request):
+        """Cria vários agendamentos de uma vez (ex.: pacote de sessões)"""
+        dados = request.data.get('agendamentos') if hasattr(request.data, 'get') else request.data
+        if not isinstance(dados, list):
+            return Response(
+                {'error': 'Envie uma lista de agendamentos'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        serializer = AgendamentoCreateSerializer(
+            data=dados,
+            many=True,
+            allow_empty=False,
+            max_length=AgendamentoLoteSerializer.MAXIMO,
+            context=self.get_serializer_context()
+        )
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            agendamentos = serializer.save()
+            # Uma confirmação por cliente em vez de uma por agendamento
+            enfileirar_notificacoes('confirmacao_lote', agendamentos)
+
+        return Response(
+            AgendamentoDetailSerializer(agendamentos, many=True).data,
+            status=status.HTTP_201_CREATED
+        )
+
+    @action(detail=False, methods=['get'])
+    def disponibilidade(self, request):
+        """
+        Horários livres para um serviço
+
+        ?servico=<id> (ou ?duracao=<minutos>) &data=AAAA-MM-DD &dias=7
+        ?servico=<id> &horario=<ISO 8601> apenas verifica um horário
+        """
+        servico_id = request.query_params.get('servico')
+        duracao = request.query_params.get('duracao')
+        if servico_id:
+            servico = next(
+                (s for s in CacheService.get_servicos_ativos() if str(s['id']) == servico_id),
+                None
+            )
+            if servico is None:
+                return Response(
+                    {'error': 'Serviço não encontrado ou inativo'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            duracao = servico['duracao_minutos']
+        elif not duracao or not duracao.isdigit() or int(duracao) < 15:
+            return Response(
+                {'error': 'Informe servico ou duracao (mínimo 15 minutos)'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        duracao = int(duracao)
+
+        horario = request.query_params.get('horario')
+        if horario:
+            try:
+                horario = parse_datetime(horario)
+            except ValueError:
+                horario = None
+            if horario is None:
+                return Response({'error': 'Horário inválido'}, status=status.HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(horario):
+                horario = timezone.make_aware(horario)
+            return Response({
+                'horario': horario,
+                'duracao_minutos': duracao,
+                'disponivel': horario_disponivel(horario, duracao)
             })
 
-        serializer = CalendarioSerializer(eventos, many=True)
-        return Response(serializer.data)
+        data = request.query_params.get('data')
+        try:
+            data = parse_date(data) if data else timezone.localdate()
+        except ValueError:
+            data = None
+        dias = request.query_params.get('dias', '7')
+        if data is None or not dias.isdigit() or not 1 <= int(dias) <= 31:
+            return Response(
+                {'error': 'Use data=AAAA-MM-DD e dias entre 1 e 31'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response({
+            'duracao_minutos': duracao,
+            'dias': horarios_livres(duracao, data, int(dias))
+        })
 
     @action(detail=True, methods=['post'])
     def cancelar(self, request, pk=None):
@@ -271,7 +391,9 @@ class AgendamentoViewSet(viewsets.ModelViewSet):
 
         agendamento.status = 'cancelado'
         agendamento.observacoes += f"\nCancelado em {timezone.now()}"
-        agendamento.save()
+        with transaction.atomic():
+            agendamento.save()
+            enfileirar_notificacoes('cancelamento', [agendamento])
 
         serializer = self.get_serializer(agendamento)
         return Response(serializer.data)
@@ -294,7 +416,9 @@ class AgendamentoViewSet(viewsets.ModelViewSet):
         if observacoes_atendimento:
             agendamento.observacoes += f"\nAtendimento: {observacoes_atendimento}"
 
-        agendamento.save()
+        # Status e estatísticas do cliente (signals) confirmados juntos
+        with transaction.atomic():
+            agendamento.save()
 
         serializer = self.get_serializer(agendamento)
         return Response(serializer.data)
@@ -306,38 +430,37 @@ class AgendamentoViewSet(viewsets.ModelViewSet):
         inicio = request.query_params.get('inicio', timezone.now().replace(day=1).date())
         fim = request.query_params.get('fim', timezone.now().date())
 
-        agendamentos = Agendamento.objects.filter(
-            horario__date__gte=inicio,
-            horario__date__lte=fim
-        )
+        # Tabela principal e arquivo (agendamentos antigos)
+        filtros = {'horario__date__gte': inicio, 'horario__date__lte': fim}
 
         # Estatísticas
-        total_agendamentos = agendamentos.count()
-        por_status = agendamentos.values('status').annotate(count=Count('id'))
-        receita_total = agendamentos.filter(
-            status='concluido'
-        ).aggregate(total=Sum('valor_cobrado'))['total'] or 0
+        resumo = arquivo.totais(
+            {'total': Count('id'), 'receita': Sum('valor_cobrado', filter=Q(status='concluido'))},
+            **filtros
+        )
+        total_agendamentos = resumo['total']
+        por_status = arquivo.agregar(['status'], {'count': Count('id')}, **filtros)
+        receita_total = resumo['receita']
 
         # Top clientes
-        top_clientes = agendamentos.values(
-            'cliente__nome'
-        ).annotate(
-            total=Count('id')
-        ).order_by('-total')[:10]
+        top_clientes = sorted(
+            arquivo.agregar(['cliente__nome'], {'total': Count('id')}, **filtros),
+            key=lambda item: -item['total']
+        )[:10]
 
         # Top serviços
-        top_servicos = agendamentos.values(
-            'servico__nome'
-        ).annotate(
-            total=Count('id'),
-            receita=Sum('valor_cobrado')
-        ).order_by('-total')[:10]
+        top_servicos = sorted(
+            arquivo.agregar(
+                ['servico__nome'], {'total': Count('id'), 'receita': Sum('valor_cobrado')}, **filtros
+            ),
+            key=lambda item: -item['total']
+        )[:10]
 
         return Response({
             'periodo': {'inicio': inicio, 'fim': fim},
             'total_agendamentos': total_agendamentos,
-            'por_status': list(por_status),
+            'por_status': por_status,
             'receita_total': receita_total,
-            'top_clientes': list(top_clientes),
-            'top_servicos': list(top_servicos)
+            'top_clientes': top_clientes,
+            'top_servicos': top_servicos
         })
@@ -47,6 +47,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Memoização de cache_result(por_request=True) limitada a cada request
+    'agendamentos.cache.MemoizacaoRequestMiddleware',
 ]
 
 ROOT_URLCONF = 'espacokaren_backend.urls'
@@ -120,3 +122,26 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Cache local (L1) do app agendamentos, na frente do cache do Django
+# Namespaces de CacheService atendidos pela memória do processo
+CACHE_L1_NAMESPACES = ('servicos',)
+CACHE_L1_MAXIMO = 256
+CACHE_L1_TTL = 60
+# Segundos entre releituras da versão dos namespaces (0: a cada leitura)
+CACHE_L1_VERIFICACAO = 0
+
+# Métricas Prometheus (agendamentos.instrumentation)
+PROMETHEUS_METRICS = False
+# Segundos entre recálculos do snapshot de métricas de negócio
+METRICAS_SNAPSHOT_INTERVALO = 60
+
+# Outbox de notificações (agendamentos.notifications.despachar_outbox)
+NOTIFICACOES_CONCORRENCIA = 4
+NOTIFICACOES_MAX_TENTATIVAS = 5
+NOTIFICACOES_BACKOFF_SEGUNDOS = 30
+# Timeout (s) da conexão ao broker ao publicar o despacho após o commit
+NOTIFICACOES_PUBLICACAO_TIMEOUT = 1
+
+# Meses mantidos na tabela principal de agendamentos (agendamentos.arquivo)
+AGENDAMENTOS_ARQUIVO_MESES = 12
@@ -29,6 +29,8 @@ urlpatterns = [
     # Endpoints específicos (já incluídos via router actions)
     # /api/agendamentos/dashboard/
     # /api/agendamentos/calendario/
+    # /api/agendamentos/disponibilidade/
+    # /api/agendamentos/bulk_create/
     # /api/agendamentos/relatorio/
     # /api/agendamentos/{id}/cancelar/
     # /api/agendamentos/{id}/concluir/
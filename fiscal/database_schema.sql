@@ -78,6 +78,7 @@ CREATE TABLE IF NOT EXISTS nfe_itens (
     valor_cofins DECIMAL(15,2),
     
     FOREIGN KEY (nfe_id) REFERENCES nfe(id) ON DELETE CASCADE,
+    UNIQUE KEY uk_nfe_item (nfe_id, numero_item),
     INDEX idx_nfe_id (nfe_id),
     INDEX idx_chave (chave_acesso),
     INDEX idx_produto (codigo_produto)
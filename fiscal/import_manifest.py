@@ -0,0 +1,229 @@
+"""
+Manifesto local de importação de XMLs
+Registra em um sqlite ao lado do importador quais arquivos já foram importados,
+para que novas execuções pulem os arquivos inalterados antes do parsing
+"""
+
+import hashlib
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+
+# Situações em que o arquivo não precisa ser processado de novo
+STATUS_CONCLUIDOS = ('sucesso', 'existente')
+
+
+class ImportManifest:
+    """
+    Manifesto de arquivos importados (caminho + tamanho + mtime + hash)
+    
+    Cada arquivo processado fica registrado com a chave de acesso e a situação
+    ('sucesso', 'existente', 'erro' ou 'ausente'). Arquivos concluídos e
+    inalterados são pulados; os com erro são reprocessados. Pode ser usado
+    pelas threads de gravação do modo paralelo ao mesmo tempo.
+    """
+    
+    def __init__(self, caminho: str):
+        """
+        Abre (ou cria) o manifesto
+        
+        Args:
+            caminho: Arquivo sqlite do manifesto
+        """
+        self.caminho = caminho
+        self._lock = threading.Lock()
+        # caminho do XML -> (tamanho, mtime, hash) dos arquivos enviados ao parsing
+        self._pendentes = {}
+        
+        self.connection = sqlite3.connect(caminho, check_same_thread=False)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS arquivos (
+                caminho TEXT PRIMARY KEY,
+                tipo TEXT NOT NULL,
+                tamanho INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                hash TEXT NOT NULL,
+                chave_acesso TEXT,
+                status TEXT NOT NULL,
+                mensagem TEXT,
+                atualizado_em TEXT NOT NULL
+            )
+        """)
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS idx_arquivos_hash ON arquivos (hash)"
+        )
+        self.connection.commit()
+    
+    def fechar(self):
+        """Fecha o manifesto"""
+        with self._lock:
+            self.connection.close()
+    
+    @staticmethod
+    def calcular_hash(caminho: Path) -> str:
+        """Hash SHA-256 do conteúdo do arquivo"""
+        digest = hashlib.sha256()
+        with open(caminho, 'rb') as f:
+            for bloco in iter(lambda: f.read(1 << 20), b''):
+                digest.update(bloco)
+        return digest.hexdigest()
+    
+    def filtrar(self, arquivos: List[Path], tipo: str, completo: bool = False) -> List[Path]:
+        """
+        Seleciona os arquivos que precisam ser processados
+        
+        Arquivos com mesmo caminho, tamanho e mtime de um registro concluído
+        são pulados sem leitura. Se só o tamanho/mtime mudou, o hash decide: o
+        mesmo conteúdo já importado (ex.: arquivo copiado ou tocado) também é
+        pulado e o registro é atualizado.
+        
+        Args:
+            arquivos: XMLs encontrados no diretório
+            tipo: 'NFe' ou 'CTe'
+            completo: Se True, processa todos os arquivos (--full)
+        
+        Returns:
+            Lista dos arquivos a processar
+        """
+        with self._lock:
+            registros = {
+                caminho: (tamanho, mtime, status)
+                for caminho, tamanho, mtime, status in self.connection.execute(
+                    "SELECT caminho, tamanho, mtime, status FROM arquivos WHERE tipo = ?",
+                    (tipo,)
+                )
+            }
+            concluidos = dict(self.connection.execute(
+                f"SELECT hash, chave_acesso FROM arquivos "
+                f"WHERE tipo = ? AND status IN ({', '.join('?' * len(STATUS_CONCLUIDOS))})",
+                (tipo, *STATUS_CONCLUIDOS)
+            ))
+        
+        processar = []
+        copias = []
+        
+        for arquivo in arquivos:
+            caminho = str(arquivo.resolve())
+            info = arquivo.stat()
+            registro = registros.get(caminho)
+            
+            if (
+                not completo
+                and registro is not None
+                and registro[2] in STATUS_CONCLUIDOS
+                and registro[0] == info.st_size
+                and registro[1] == info.st_mtime
+            ):
+                continue
+            
+            conteudo = self.calcular_hash(arquivo)
+            
+            if not completo and conteudo in concluidos:
+                copias.append((
+                    caminho, tipo, info.st_size, info.st_mtime, conteudo,
+                    concluidos[conteudo], 'existente', None, self._agora()
+                ))
+                continue
+            
+            with self._lock:
+                self._pendentes[caminho] = (info.st_size, info.st_mtime, conteudo)
+            processar.append(arquivo)
+        
+        if copias:
+            with self._lock:
+                self._gravar(copias)
+        
+        return processar
+    
+    def registrar(self, resultados: List[Tuple]):
+        """
+        Registra o resultado de arquivos enviados ao parsing por filtrar()
+        
+        Args:
+            resultados: Tuplas (caminho, tipo, status, chave_acesso, mensagem)
+        """
+        linhas = []
+        with self._lock:
+            for caminho, tipo, status, chave, mensagem in resultados:
+                caminho = str(Path(caminho).resolve())
+                impressao = self._pendentes.pop(caminho, None)
+                if impressao is None:
+                    continue
+                tamanho, mtime, conteudo = impressao
+                linhas.append((
+                    caminho, tipo, tamanho, mtime, conteudo,
+                    chave, status, mensagem and mensagem[:500], self._agora()
+                ))
+            if linhas:
+                self._gravar(linhas)
+    
+    def verificar(self, connection, tamanho_bloco: int = 1000) -> Dict[str, int]:
+        """
+        Confere o manifesto com as tabelas nfe/cte do banco
+        
+        Registros concluídos cuja chave não está mais no banco passam a
+        'ausente' e são reimportados na próxima execução.
+        
+        Args:
+            connection: Conexão MySQL do importador
+            tamanho_bloco: Chaves consultadas por SELECT ... IN
+        
+        Returns:
+            Dicionário com o total de registros verificados e de ausentes
+        """
+        resultado = {'verificados': 0, 'ausentes': 0}
+        cursor = connection.cursor()
+        
+        for tipo, tabela in (('NFe', 'nfe'), ('CTe', 'cte')):
+            with self._lock:
+                chaves = [
+                    chave for (chave,) in self.connection.execute(
+                        f"SELECT DISTINCT chave_acesso FROM arquivos "
+                        f"WHERE tipo = ? AND chave_acesso IS NOT NULL "
+                        f"AND status IN ({', '.join('?' * len(STATUS_CONCLUIDOS))})",
+                        (tipo, *STATUS_CONCLUIDOS)
+                    )
+                ]
+            
+            ausentes = []
+            for inicio in range(0, len(chaves), tamanho_bloco):
+                bloco = chaves[inicio:inicio + tamanho_bloco]
+                cursor.execute(
+                    f"SELECT chave_acesso FROM {tabela} "
+                    f"WHERE chave_acesso IN ({', '.join(['%s'] * len(bloco))})",
+                    bloco
+                )
+                encontradas = {chave for (chave,) in cursor.fetchall()}
+                ausentes.extend(chave for chave in bloco if chave not in encontradas)
+            
+            if ausentes:
+                with self._lock:
+                    self.connection.executemany(
+                        "UPDATE arquivos SET status = 'ausente', atualizado_em = ? "
+                        "WHERE tipo = ? AND chave_acesso = ?",
+                        [(self._agora(), tipo, chave) for chave in ausentes]
+                    )
+                    self.connection.commit()
+            
+            resultado['verificados'] += len(chaves)
+            resultado['ausentes'] += len(ausentes)
+        
+        cursor.close()
+        return resultado
+    
+    def _gravar(self, linhas: List[Tuple]):
+        """Insere ou substitui registros (chamar com o lock adquirido)"""
+        self.connection.executemany("""
+            INSERT OR REPLACE INTO arquivos (
+                caminho, tipo, tamanho, mtime, hash,
+                chave_acesso, status, mensagem, atualizado_em
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, linhas)
+        self.connection.commit()
+    
+    @staticmethod
+    def _agora() -> str:
+        return datetime.now().isoformat(timespec='seconds')
@@ -5,15 +5,113 @@ Processa todos os XMLs de NFe e CTe e insere no banco de dados
 
 import os
 import sys
+import argparse
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
 from typing import List, Dict
 import mysql.connector
 from mysql.connector import Error
-from xml_parser import XMLParser
+from xml_parser import criar_parser
+from import_manifest import ImportManifest
 import json
 from datetime import datetime
 
 
+# Inserções compartilhadas pela gravação unitária e em lote. O ON DUPLICATE
+# KEY torna a inserção idempotente quando outro gravador chega antes.
+SQL_INSERIR_NFE = """
+INSERT INTO nfe (
+    chave_acesso, numero_nf, serie, data_emissao,
+    emit_cnpj, emit_nome, emit_fantasia, emit_ie,
+    emit_endereco, emit_municipio, emit_uf, emit_cep,
+    dest_cnpj_cpf, dest_nome, dest_ie,
+    dest_endereco, dest_municipio, dest_uf, dest_cep,
+    valor_total, valor_produtos, valor_icms, valor_ipi,
+    valor_pis, valor_cofins, valor_tributos,
+    status_nfe, protocolo, motivo,
+    xml_content, arquivo_nome
+) VALUES (
+    %s, %s, %s, %s,
+    %s, %s, %s, %s,
+    %s, %s, %s, %s,
+    %s, %s, %s,
+    %s, %s, %s, %s,
+    %s, %s, %s, %s,
+    %s, %s, %s,
+    %s, %s, %s,
+    %s, %s
+)
+ON DUPLICATE KEY UPDATE id = id
+"""
+
+SQL_INSERIR_ITEM = """
+INSERT INTO nfe_itens (
+    nfe_id, chave_acesso, numero_item,
+    codigo_produto, descricao, ncm, cfop, cest,
+    unidade, quantidade, valor_unitario, valor_total,
+    ean, valor_icms, valor_ipi, valor_pis, valor_cofins
+) VALUES (
+    %s, %s, %s,
+    %s, %s, %s, %s, %s,
+    %s, %s, %s, %s,
+    %s, %s, %s, %s, %s
+)
+ON DUPLICATE KEY UPDATE id = id
+"""
+
+SQL_INSERIR_CTE = """
+INSERT INTO cte (
+    chave_acesso, numero_ct, serie, data_emissao,
+    emit_cnpj, emit_nome, emit_fantasia, emit_ie,
+    emit_endereco, emit_municipio, emit_uf,
+    rem_cnpj, rem_nome, rem_ie, rem_municipio, rem_uf,
+    dest_cnpj, dest_nome, dest_ie, dest_municipio, dest_uf,
+    modal, tipo_servico, cfop, natureza_operacao,
+    municipio_inicio, uf_inicio, municipio_fim, uf_fim,
+    valor_total, valor_receber, valor_carga, valor_icms,
+    status_cte, protocolo, motivo,
+    xml_content, arquivo_nome
+) VALUES (
+    %s, %s, %s, %s,
+    %s, %s, %s, %s,
+    %s, %s, %s,
+    %s, %s, %s, %s, %s,
+    %s, %s, %s, %s, %s,
+    %s, %s, %s, %s,
+    %s, %s, %s, %s,
+    %s, %s, %s, %s,
+    %s, %s, %s,
+    %s, %s
+)
+ON DUPLICATE KEY UPDATE id = id
+"""
+
+SQL_INSERIR_LOG = """
+INSERT INTO import_log (tipo_documento, arquivo_nome, status, chave_acesso, mensagem)
+VALUES (%s, %s, %s, %s, %s)
+"""
+
+
+# Parser de cada processo do pool (criado uma vez pelo initializer)
+_parser_processo = None
+
+
+def _inicializar_processo(engine: str):
+    """Cria o parser usado pelo processo de parsing"""
+    global _parser_processo
+    _parser_processo = criar_parser(engine)
+
+
+def _parse_arquivo(xml_path: str, tipo: str) -> Dict:
+    """Faz o parse de um XML dentro do processo do pool"""
+    if tipo == 'NFe':
+        return _parser_processo.parse_nfe(xml_path)
+    return _parser_processo.parse_cte(xml_path)
+
+
 class CloudSQLImporter:
     """Classe para importar XMLs para Google Cloud SQL"""
     
@@ -28,12 +126,22 @@ class CloudSQLImporter:
                     'user': 'usuário',
                     'password': 'senha',
                     'database': 'nome do banco',
-                    'port': 3306
+                    'port': 3306,
+                    'parser': 'etree' ou 'stream' (opcional),
+                    'workers': processos de parsing (opcional, 1 = sequencial),
+                    'writers': conexões de gravação no modo paralelo (opcional),
+                    'lote': documentos por lote de gravação (opcional),
+                    'fila': tamanho máximo da fila de gravação (opcional),
+                    'janela': segundos de espera para completar um lote (opcional)
                 }
         """
         self.config = config
-        self.parser = XMLParser()
+        self.parser = criar_parser(config.get('parser', 'etree'))
         self.connection = None
+        self.verbose = True
+        # Manifesto de arquivos já importados (None = processa tudo sem registrar)
+        self.manifesto = None
+        self.reprocessar_tudo = False
         self.stats = {
             'nfe_sucesso': 0,
             'nfe_erro': 0,
@@ -103,12 +211,24 @@ class CloudSQLImporter:
         Returns:
             True se sucesso, False caso contrário
         """
-        try:
-            # Parse do XML
-            dados = self.parser.parse_nfe(xml_path)
+        # Parse do XML
+        dados = self.parser.parse_nfe(xml_path)
+        return self._inserir_nfe(dados, os.path.basename(xml_path))
+    
+    def _inserir_nfe(self, dados: Dict, arquivo: str) -> bool:
+        """
+        Insere no banco uma NFe já processada pelo parser
+        
+        Args:
+            dados: Dicionário retornado por parse_nfe
+            arquivo: Nome do arquivo XML de origem
             
+        Returns:
+            True se sucesso, False caso contrário
+        """
+        try:
             if 'error' in dados:
-                self.log_erro('NFe', os.path.basename(xml_path), dados['error'])
+                self.log_erro('NFe', arquivo, dados['error'])
                 self.stats['nfe_erro'] += 1
                 return False
             
@@ -121,129 +241,51 @@ class CloudSQLImporter:
             )
             
             if cursor.fetchone():
-                print(f"  ⊳ NFe {dados['numero_nf']} já existe - pulando")
+                if self.verbose:
+                    print(f"  ⊳ NFe {dados['numero_nf']} já existe - pulando")
                 cursor.close()
                 return True
             
             # Insere NFe
-            sql = """
-                INSERT INTO nfe (
-                    chave_acesso, numero_nf, serie, data_emissao,
-                    emit_cnpj, emit_nome, emit_fantasia, emit_ie,
-                    emit_endereco, emit_municipio, emit_uf, emit_cep,
-                    dest_cnpj_cpf, dest_nome, dest_ie,
-                    dest_endereco, dest_municipio, dest_uf, dest_cep,
-                    valor_total, valor_produtos, valor_icms, valor_ipi,
-                    valor_pis, valor_cofins, valor_tributos,
-                    status_nfe, protocolo, motivo,
-                    xml_content, arquivo_nome
-                ) VALUES (
-                    %s, %s, %s, %s,
-                    %s, %s, %s, %s,
-                    %s, %s, %s, %s,
-                    %s, %s, %s,
-                    %s, %s, %s, %s,
-                    %s, %s, %s, %s,
-                    %s, %s, %s,
-                    %s, %s, %s,
-                    %s, %s
-                )
-            """
-            
-            valores = (
-                dados.get('chave_acesso'),
-                dados.get('numero_nf'),
-                dados.get('serie'),
-                dados.get('data_emissao'),
-                dados.get('cnpj'),
-                dados.get('nome'),
-                dados.get('fantasia'),
-                dados.get('ie'),
-                dados.get('endereco'),
-                dados.get('municipio'),
-                dados.get('uf'),
-                dados.get('cep'),
-                dados.get('dest_cnpj_cpf'),
-                dados.get('dest_nome'),
-                dados.get('dest_ie'),
-                dados.get('dest_endereco'),
-                dados.get('dest_municipio'),
-                dados.get('dest_uf'),
-                dados.get('dest_cep'),
-                dados.get('valor_total'),
-                dados.get('valor_produtos'),
-                dados.get('valor_icms'),
-                dados.get('valor_ipi'),
-                dados.get('valor_pis'),
-                dados.get('valor_cofins'),
-                dados.get('valor_tributos'),
-                dados.get('status'),
-                dados.get('protocolo'),
-                dados.get('motivo'),
-                dados.get('xml_content'),
-                os.path.basename(xml_path)
-            )
-            
-            cursor.execute(sql, valores)
+            cursor.execute(SQL_INSERIR_NFE, self._valores_nfe(dados, arquivo))
             nfe_id = cursor.lastrowid
             
+            if not nfe_id:
+                # Outro gravador inseriu a mesma chave entre a verificação e o INSERT
+                self.connection.rollback()
+                cursor.close()
+                return True
+            
             # Insere itens
             if 'itens' in dados and dados['itens']:
-                sql_item = """
-                    INSERT INTO nfe_itens (
-                        nfe_id, chave_acesso, numero_item,
-                        codigo_produto, descricao, ncm, cfop, cest,
-                        unidade, quantidade, valor_unitario, valor_total,
-                        ean, valor_icms, valor_ipi, valor_pis, valor_cofins
-                    ) VALUES (
-                        %s, %s, %s,
-                        %s, %s, %s, %s, %s,
-                        %s, %s, %s, %s,
-                        %s, %s, %s, %s, %s
-                    )
-                """
-                
                 for item in dados['itens']:
-                    valores_item = (
-                        nfe_id,
-                        dados['chave_acesso'],
-                        item.get('numero_item'),
-                        item.get('codigo_produto'),
-                        item.get('descricao'),
-                        item.get('ncm'),
-                        item.get('cfop'),
-                        item.get('cest'),
-                        item.get('unidade'),
-                        item.get('quantidade'),
-                        item.get('valor_unitario'),
-                        item.get('valor_total'),
-                        item.get('ean'),
-                        item.get('valor_icms'),
-                        item.get('valor_ipi'),
-                        item.get('valor_pis'),
-                        item.get('valor_cofins')
+                    cursor.execute(
+                        SQL_INSERIR_ITEM,
+                        self._valores_item(nfe_id, dados['chave_acesso'], item)
                     )
-                    cursor.execute(sql_item, valores_item)
                     self.stats['itens_inseridos'] += 1
             
+            # Log na mesma transação: um rollback do documento seguinte
+            # não o descarta
+            self.log_sucesso('NFe', arquivo, dados['chave_acesso'])
             self.connection.commit()
             cursor.close()
             
-            self.log_sucesso('NFe', os.path.basename(xml_path), dados['chave_acesso'])
             self.stats['nfe_sucesso'] += 1
             
-            print(f"  ✓ NFe {dados['numero_nf']} importada ({len(dados.get('itens', []))} itens)")
+            if self.verbose:
+                print(f"  ✓ NFe {dados['numero_nf']} importada ({len(dados.get('itens', []))} itens)")
             return True
             
         except Error as e:
             self.connection.rollback()
-            self.log_erro('NFe', os.path.basename(xml_path), str(e))
+            self.log_erro('NFe', arquivo, str(e))
             self.stats['nfe_erro'] += 1
             print(f"  ✗ Erro ao importar NFe: {e}")
             return False
         except Exception as e:
             self.connection.rollback()
-            self.log_erro('NFe', os.path.basename(xml_path), str(e))
+            self.log_erro('NFe', arquivo, str(e))
             self.stats['nfe_erro'] += 1
             print(f"  ✗ Erro inesperado: {e}")
             return False
@@ -258,12 +300,24 @@ class CloudSQLImporter:
         Returns:
             True se sucesso, False caso contrário
         """
-        try:
-            # Parse do XML
-            dados = self.parser.parse_cte(xml_path)
+        # Parse do XML
+        dados = self.parser.parse_cte(xml_path)
+        return self._inserir_cte(dados, os.path.basename(xml_path))
+    
+    def _inserir_cte(self, dados: Dict, arquivo: str) -> bool:
+        """
+        Insere no banco um CTe já processado pelo parser
+        
+        Args:
+            dados: Dicionário retornado por parse_cte
+            arquivo: Nome do arquivo XML de origem
             
+        Returns:
+            True se sucesso, False caso contrário
+        """
+        try:
             if 'error' in dados:
-                self.log_erro('CTe', os.path.basename(xml_path), dados['error'])
+                self.log_erro('CTe', arquivo, dados['error'])
                 self.stats['cte_erro'] += 1
                 return False
             
@@ -276,101 +330,140 @@ class CloudSQLImporter:
             )
             
             if cursor.fetchone():
-                print(f"  ⊳ CTe {dados['numero_ct']} já existe - pulando")
+                if self.verbose:
+                    print(f"  ⊳ CTe {dados['numero_ct']} já existe - pulando")
                 cursor.close()
                 return True
             
             # Insere CTe
-            sql = """
-                INSERT INTO cte (
-                    chave_acesso, numero_ct, serie, data_emissao,
-                    emit_cnpj, emit_nome, emit_fantasia, emit_ie,
-                    emit_endereco, emit_municipio, emit_uf,
-                    rem_cnpj, rem_nome, rem_ie, rem_municipio, rem_uf,
-                    dest_cnpj, dest_nome, dest_ie, dest_municipio, dest_uf,
-                    modal, tipo_servico, cfop, natureza_operacao,
-                    municipio_inicio, uf_inicio, municipio_fim, uf_fim,
-                    valor_total, valor_receber, valor_carga, valor_icms,
-                    status_cte, protocolo, motivo,
-                    xml_content, arquivo_nome
-                ) VALUES (
-                    %s, %s, %s, %s,
-                    %s, %s, %s, %s,
-                    %s, %s, %s,
-                    %s, %s, %s, %s, %s,
-                    %s, %s, %s, %s, %s,
-                    %s, %s, %s, %s,
-                    %s, %s, %s, %s,
-                    %s, %s, %s, %s,
-                    %s, %s, %s,
-                    %s, %s
-                )
-            """
-            
-            valores = (
-                dados.get('chave_acesso'),
-                dados.get('numero_ct'),
-                dados.get('serie'),
-                dados.get('data_emissao'),
-                dados.get('emit_cnpj'),
-                dados.get('emit_nome'),
-                dados.get('emit_fantasia'),
-                dados.get('emit_ie'),
-                dados.get('emit_endereco'),
-                dados.get('emit_municipio'),
-                dados.get('emit_uf'),
-                dados.get('rem_cnpj'),
-                dados.get('rem_nome'),
-                dados.get('rem_ie'),
-                dados.get('rem_municipio'),
-                dados.get('rem_uf'),
-                dados.get('dest_cnpj'),
-                dados.get('dest_nome'),
-                dados.get('dest_ie'),
-                dados.get('dest_municipio'),
-                dados.get('dest_uf'),
-                dados.get('modal'),
-                dados.get('tipo_servico'),
-                dados.get('cfop'),
-                dados.get('natureza_operacao'),
-                dados.get('municipio_inicio'),
-                dados.get('uf_inicio'),
-                dados.get('municipio_fim'),
-                dados.get('uf_fim'),
-                dados.get('valor_total'),
-                dados.get('valor_receber'),
-                dados.get('valor_carga'),
-                dados.get('valor_icms'),
-                dados.get('status'),
-                dados.get('protocolo'),
-                dados.get('motivo'),
-                dados.get('xml_content'),
-                os.path.basename(xml_path)
-            )
-            
-            cursor.execute(sql, valores)
+            cursor.execute(SQL_INSERIR_CTE, self._valores_cte(dados, arquivo))
+            self.log_sucesso('CTe', arquivo, dados['chave_acesso'])
             self.connection.commit()
             cursor.close()
             
-            self.log_sucesso('CTe', os.path.basename(xml_path), dados['chave_acesso'])
             self.stats['cte_sucesso'] += 1
             
-            print(f"  ✓ CTe {dados['numero_ct']} importado")
+            if self.verbose:
+                print(f"  ✓ CTe {dados['numero_ct']} importado")
             return True
             
         except Error as e:
             self.connection.rollback()
-            self.log_erro('CTe', os.path.basename(xml_path), str(e))
+            self.log_erro('CTe', arquivo, str(e))
             self.stats['cte_erro'] += 1
             print(f"  ✗ Erro ao importar CTe: {e}")
             return False
         except Exception as e:
             self.connection.rollback()
-            self.log_erro('CTe', os.path.basename(xml_path), str(e))
+            self.log_erro('CTe', arquivo, str(e))
             self.stats['cte_erro'] += 1
             print(f"  ✗ Erro inesperado: {e}")
             return False
     
+    @staticmethod
+    def _valores_nfe(dados: Dict, arquivo: str) -> tuple:
+        """Parâmetros de SQL_INSERIR_NFE"""
+        return (
+            dados.get('chave_acesso'),
+            dados.get('numero_nf'),
+            dados.get('serie'),
+            dados.get('data_emissao'),
+            dados.get('cnpj'),
+            dados.get('nome'),
+            dados.get('fantasia'),
+            dados.get('ie'),
+            dados.get('endereco'),
+            dados.get('municipio'),
+            dados.get('uf'),
+            dados.get('cep'),
+            dados.get('dest_cnpj_cpf'),
+            dados.get('dest_nome'),
+            dados.get('dest_ie'),
+            dados.get('dest_endereco'),
+            dados.get('dest_municipio'),
+            dados.get('dest_uf'),
+            dados.get('dest_cep'),
+            dados.get('valor_total'),
+            dados.get('valor_produtos'),
+            dados.get('valor_icms'),
+            dados.get('valor_ipi'),
+            dados.get('valor_pis'),
+            dados.get('valor_cofins'),
+            dados.get('valor_tributos'),
+            dados.get('status'),
+            dados.get('protocolo'),
+            dados.get('motivo'),
+            dados.get('xml_content'),
+            arquivo
+        )
+    
+    @staticmethod
+    def _valores_item(nfe_id: int, chave_acesso: str, item: Dict) -> tuple:
+        """Parâmetros de SQL_INSERIR_ITEM"""
+        return (
+            nfe_id,
+            chave_acesso,
+            item.get('numero_item'),
+            item.get('codigo_produto'),
+            item.get('descricao'),
+            item.get('ncm'),
+            item.get('cfop'),
+            item.get('cest'),
+            item.get('unidade'),
+            item.get('quantidade'),
+            item.get('valor_unitario'),
+            item.get('valor_total'),
+            item.get('ean'),
+            item.get('valor_icms'),
+            item.get('valor_ipi'),
+            item.get('valor_pis'),
+            item.get('valor_cofins')
+        )
+    
+    @staticmethod
+    def _valores_cte(dados: Dict, arquivo: str) -> tuple:
+        """Parâmetros de SQL_INSERIR_CTE"""
+        return (
+            dados.get('chave_acesso'),
+            dados.get('numero_ct'),
+            dados.get('serie'),
+            dados.get('data_emissao'),
+            dados.get('emit_cnpj'),
+            dados.get('emit_nome'),
+            dados.get('emit_fantasia'),
+            dados.get('emit_ie'),
+            dados.get('emit_endereco'),
+            dados.get('emit_municipio'),
+            dados.get('emit_uf'),
+            dados.get('rem_cnpj'),
+            dados.get('rem_nome'),
+            dados.get('rem_ie'),
+            dados.get('rem_municipio'),
+            dados.get('rem_uf'),
+            dados.get('dest_cnpj'),
+            dados.get('dest_nome'),
+            dados.get('dest_ie'),
+            dados.get('dest_municipio'),
+            dados.get('dest_uf'),
+            dados.get('modal'),
+            dados.get('tipo_servico'),
+            dados.get('cfop'),
+            dados.get('natureza_operacao'),
+            dados.get('municipio_inicio'),
+            dados.get('uf_inicio'),
+            dados.get('municipio_fim'),
+            dados.get('uf_fim'),
+            dados.get('valor_total'),
+            dados.get('valor_receber'),
+            dados.get('valor_carga'),
+            dados.get('valor_icms'),
+            dados.get('status'),
+            dados.get('protocolo'),
+            dados.get('motivo'),
+            dados.get('xml_content'),
+            arquivo
+        )
+    
     def log_sucesso(self, tipo: str, arquivo: str, chave: str):
         """Registra sucesso no log"""
         try:
@@ -419,19 +512,354 @@ class CloudSQLImporter:
         
         # Lista todos os XMLs
         xml_files = list(path.glob('*.xml'))
+        encontrados = len(xml_files)
+        
+        # Pula os arquivos inalterados já importados, antes do parsing
+        if self.manifesto is not None:
+            xml_files = self.manifesto.filtrar(xml_files, tipo, completo=self.reprocessar_tudo)
         total = len(xml_files)
         
         print(f"\n{'='*60}")
         print(f"Processando {tipo}: {total} arquivos")
+        if total < encontrados:
+            print(f"Manifesto: {encontrados - total} arquivos inalterados pulados")
         print(f"{'='*60}")
         
+        if not xml_files:
+            return
+        
+        if self.config.get('workers', 1) > 1:
+            self.processar_paralelo(xml_files, tipo)
+            return
+        
+        if tipo == 'NFe':
+            parse = self.parser.parse_nfe
+        elif tipo == 'CTe':
+            parse = self.parser.parse_cte
+        else:
+            return
+        
+        tamanho_lote = max(1, self.config.get('lote', 100))
+        lote = []
+        
         for idx, xml_file in enumerate(xml_files, 1):
-            print(f"[{idx}/{total}] {xml_file.name}")
+            lote.append((tipo, str(xml_file), parse(str(xml_file))))
+            
+            if len(lote) >= tamanho_lote or idx == total:
+                self._gravar_lote(lote)
+                print(f"[{idx}/{total}] lote de {len(lote)} {tipo} gravado")
+                lote = []
+    
+    def processar_paralelo(self, xml_files: List[Path], tipo: str):
+        """
+        Importa os XMLs com parsing em vários processos e gravação em lotes
+        
+        Um pool de processos faz o parse dos arquivos; os resultados passam por
+        uma fila limitada para as threads de gravação, cada uma com sua própria
+        conexão. A fila cheia bloqueia o envio de novos arquivos ao pool, então
+        a memória fica limitada mesmo com o banco mais lento que o parsing.
+        
+        Args:
+            xml_files: Arquivos a importar
+            tipo: 'NFe' ou 'CTe'
+        """
+        workers = self.config.get('workers', os.cpu_count() or 1)
+        n_writers = max(1, self.config.get('writers', 1))
+        tamanho_lote = max(1, self.config.get('lote', 100))
+        fila = queue.Queue(maxsize=self.config.get('fila', tamanho_lote * n_writers * 2))
+        
+        escritores = []
+        for _ in range(n_writers):
+            escritor = CloudSQLImporter(self.config)
+            escritor.verbose = False
+            escritor.manifesto = self.manifesto
+            if not escritor.connect():
+                for aberto in escritores:
+                    aberto.disconnect()
+                print(f"✗ Importação paralela de {tipo} cancelada")
+                return
+            escritores.append(escritor)
+        
+        janela = self.config.get('janela', 1.0)
+        threads = [
+            threading.Thread(
+                target=escritor._consumir_fila,
+                args=(fila, tamanho_lote, janela),
+                daemon=True
+            )
+            for escritor in escritores
+        ]
+        for thread in threads:
+            thread.start()
+        
+        total = len(xml_files)
+        passo = max(1, total // 20)
+        # Limita arquivos em voo no pool além da fila de gravação
+        max_pendentes = workers * 4
+        
+        try:
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_inicializar_processo,
+                initargs=(self.config.get('parser', 'etree'),)
+            ) as pool:
+                pendentes = {}
+                arquivos = iter(xml_files)
+                processados = 0
+                
+                while True:
+                    for xml_file in arquivos:
+                        futuro = pool.submit(_parse_arquivo, str(xml_file), tipo)
+                        pendentes[futuro] = str(xml_file)
+                        if len(pendentes) >= max_pendentes:
+                            break
+                    
+                    if not pendentes:
+                        break
+                    
+                    prontos, _ = wait(pendentes, return_when=FIRST_COMPLETED)
+                    for futuro in prontos:
+                        caminho = pendentes.pop(futuro)
+                        try:
+                            dados = futuro.result()
+                        except Exception as e:
+                            dados = {'error': f'Falha no processo de parsing: {e}'}
+                        # Bloqueia quando a fila está cheia (backpressure)
+                        fila.put((tipo, caminho, dados))
+                        
+                        processados += 1
+                        if processados % passo == 0 or processados == total:
+                            print(f"[{processados}/{total}] {tipo} processados")
+        finally:
+            for _ in threads:
+                fila.put(None)
+            for thread in threads:
+                thread.join()
+            for escritor in escritores:
+                self._mesclar_stats(escritor.stats)
+                escritor.disconnect()
+    
+    def _consumir_fila(self, fila: queue.Queue, tamanho_lote: int, janela: float = 1.0):
+        """
+        Grava os documentos da fila em lotes até receber o sinal de fim
+        
+        O lote é gravado ao chegar a `tamanho_lote` documentos ou `janela`
+        segundos depois do seu primeiro documento, o que vier antes. A fila
+        esvaziar por um instante (parsing mais lento que a gravação) não
+        encerra o lote.
+        """
+        lote = []
+        prazo = None
+        while True:
+            try:
+                espera = None if not lote else max(0.0, prazo - time.monotonic())
+                documento = fila.get(timeout=espera)
+            except queue.Empty:
+                self._gravar_lote_seguro(lote)
+                lote = []
+                continue
+            if documento is None:
+                break
+            if not lote:
+                prazo = time.monotonic() + janela
+            lote.append(documento)
+            if len(lote) >= tamanho_lote:
+                self._gravar_lote_seguro(lote)
+                lote = []
+        if lote:
+            self._gravar_lote_seguro(lote)
+    
+    def _gravar_lote_seguro(self, lote: List[tuple]):
+        """
+        Grava o lote sem deixar uma falha interromper o consumo da fila
+        
+        Estatísticas, import_log e manifesto ficam todos em _gravar_lote;
+        aqui só chega uma falha anterior a qualquer commit do lote (ex.: a
+        conexão caiu e nem o rollback funcionou), então nada foi contado.
+        """
+        try:
+            self._gravar_lote(lote)
+        except Exception as e:
+            for tipo, caminho, _ in lote:
+                self.log_erro(tipo, os.path.basename(caminho), str(e))
+                self.stats['nfe_erro' if tipo == 'NFe' else 'cte_erro'] += 1
+    
+    def _gravar_lote(self, lote: List[tuple]):
+        """
+        Grava um lote de documentos já processados com poucas idas ao banco
+        
+        Verifica as chaves existentes com um SELECT ... IN por tabela, insere
+        documentos, itens e registros de log com executemany e confirma uma
+        única vez. Se o lote falhar, é desfeito e refeito documento a documento.
+        
+        Args:
+            lote: Lista de tuplas (tipo, caminho do XML, dados)
+        """
+        nfes = {}
+        ctes = {}
+        erros = []
+        for tipo, caminho, dados in lote:
+            arquivo = os.path.basename(caminho)
+            if 'error' in dados:
+                erros.append((tipo, arquivo, dados['error']))
+            elif tipo == 'NFe':
+                nfes.setdefault(dados['chave_acesso'], (arquivo, dados))
+            else:
+                ctes.setdefault(dados['chave_acesso'], (arquivo, dados))
+        
+        cursor = self.connection.cursor()
+        try:
+            novas_nfe = self._remover_existentes(cursor, 'nfe', nfes)
+            novas_cte = self._remover_existentes(cursor, 'cte', ctes)
+            itens = 0
             
-            if tipo == 'NFe':
-                self.importar_nfe(str(xml_file))
-            elif tipo == 'CTe':
-                self.importar_cte(str(xml_file))
+            if novas_nfe:
+                cursor.executemany(SQL_INSERIR_NFE, [
+                    self._valores_nfe(dados, arquivo)
+                    for arquivo, dados in novas_nfe.values()
+                ])
+                ids = self._ids_por_chave(cursor, 'nfe', list(novas_nfe))
+                valores_itens = [
+                    self._valores_item(ids[chave], chave, item)
+                    for chave, (_, dados) in novas_nfe.items()
+                    for item in dados.get('itens') or ()
+                ]
+                if valores_itens:
+                    cursor.executemany(SQL_INSERIR_ITEM, valores_itens)
+                itens = len(valores_itens)
+            
+            if novas_cte:
+                cursor.executemany(SQL_INSERIR_CTE, [
+                    self._valores_cte(dados, arquivo)
+                    for arquivo, dados in novas_cte.values()
+                ])
+            
+            logs = [
+                (tipo, arquivo, 'sucesso', chave, None)
+                for tipo, novas in (('NFe', novas_nfe), ('CTe', novas_cte))
+                for chave, (arquivo, _) in novas.items()
+            ]
+            logs += [
+                (tipo, arquivo, 'erro', None, mensagem[:500])
+                for tipo, arquivo, mensagem in erros
+            ]
+            if logs:
+                cursor.executemany(SQL_INSERIR_LOG, logs)
+            
+            self.connection.commit()
+            
+        except Exception as e:
+            # Não só erros do banco: KeyError/TypeError ao montar os valores
+            # também deixariam o lote pela metade na transação
+            self.connection.rollback()
+            cursor.close()
+            print(f"  ✗ Falha no lote ({e}) - gravando documento a documento")
+            self._gravar_documentos(lote)
+            return
+        
+        cursor.close()
+        self.stats['nfe_sucesso'] += len(novas_nfe)
+        self.stats['cte_sucesso'] += len(novas_cte)
+        self.stats['itens_inseridos'] += itens
+        for tipo, arquivo, mensagem in erros:
+            self.stats['nfe_erro' if tipo == 'NFe' else 'cte_erro'] += 1
+            self.stats['erros'].append({
+                'tipo': tipo,
+                'arquivo': arquivo,
+                'mensagem': mensagem
+            })
+        
+        resultados = []
+        for tipo, caminho, dados in lote:
+            if 'error' in dados:
+                resultados.append((caminho, tipo, 'erro', None, dados['error']))
+                continue
+            chave = dados['chave_acesso']
+            novas = novas_nfe if tipo == 'NFe' else novas_cte
+            inserida = chave in novas and novas[chave][1] is dados
+            resultados.append((
+                caminho, tipo, 'sucesso' if inserida else 'existente', chave, None
+            ))
+        self._registrar_manifesto(resultados)
+    
+    def _gravar_documentos(self, lote: List[tuple]):
+        """
+        Regrava documento a documento um lote desfeito
+        
+        Cada documento tem a própria transação e é contado uma única vez:
+        por _inserir_nfe/_inserir_cte ou, se até o rollback deles falhar,
+        aqui.
+        """
+        resultados = []
+        for tipo, caminho, dados in lote:
+            arquivo = os.path.basename(caminho)
+            inserir = self._inserir_nfe if tipo == 'NFe' else self._inserir_cte
+            mensagem = dados.get('error')
+            try:
+                sucesso = inserir(dados, arquivo)
+            except Exception as e:
+                sucesso = False
+                mensagem = str(e)
+                self.stats['nfe_erro' if tipo == 'NFe' else 'cte_erro'] += 1
+                self.stats['erros'].append({
+                    'tipo': tipo,
+                    'arquivo': arquivo,
+                    'mensagem': mensagem
+                })
+            resultados.append((
+                caminho, tipo,
+                'sucesso' if sucesso else 'erro',
+                dados.get('chave_acesso'),
+                mensagem
+            ))
+        
+        # Confirma os registros de erro do import_log ainda pendentes
+        try:
+            self.connection.commit()
+        except Error:
+            pass  # Log é secundário
+        self._registrar_manifesto(resultados)
+    
+    def _registrar_manifesto(self, resultados: List[tuple]):
+        """Registra no manifesto o resultado dos arquivos de um lote"""
+        if self.manifesto is None:
+            return
+        try:
+            self.manifesto.registrar(resultados)
+        except Exception as e:
+            # Os documentos já foram confirmados no banco; sem o registro,
+            # a próxima execução só os encontra como existentes
+            print(f"  ⚠ Falha ao registrar o lote no manifesto: {e}")
+    
+    @staticmethod
+    def _ids_por_chave(cursor, tabela: str, chaves: List[str]) -> Dict[str, int]:
+        """Busca de uma vez os ids das chaves de acesso informadas"""
+        if not chaves:
+            return {}
+        marcadores = ', '.join(['%s'] * len(chaves))
+        cursor.execute(
+            f"SELECT chave_acesso, id FROM {tabela} WHERE chave_acesso IN ({marcadores})",
+            chaves
+        )
+        return {chave: id_ for chave, id_ in cursor.fetchall()}
+    
+    def _remover_existentes(self, cursor, tabela: str, documentos: Dict) -> Dict:
+        """Descarta do lote os documentos cuja chave já está no banco"""
+        existentes = self._ids_por_chave(cursor, tabela, list(documentos))
+        return {
+            chave: documento
+            for chave, documento in documentos.items()
+            if chave not in existentes
+        }
+    
+    def _mesclar_stats(self, stats: Dict):
+        """Soma as estatísticas de um gravador às do importador"""
+        for chave, valor in stats.items():
+            if chave != 'erros':
+                self.stats[chave] += valor
+        self.stats['erros'].extend(stats['erros'])
+        # Ordem independente da distribuição entre gravadores
+        self.stats['erros'].sort(key=lambda erro: (erro['tipo'], erro['arquivo']))
     
     def exibir_estatisticas(self):
         """Exibe estatísticas da importação"""
@@ -463,6 +891,17 @@ class CloudSQLImporter:
 def main():
     """Função principal"""
     
+    arg_parser = argparse.ArgumentParser(description='Importa XMLs de NFe e CTe para o Cloud SQL')
+    arg_parser.add_argument(
+        '--full', action='store_true',
+        help='reprocessa todos os arquivos, ignorando o manifesto de importação'
+    )
+    arg_parser.add_argument(
+        '--verify', action='store_true',
+        help='confere o manifesto com as tabelas nfe/cte e marca as chaves ausentes'
+    )
+    args = arg_parser.parse_args()
+    
     # Verifica se o arquivo de configuração existe
     config_path = Path(__file__).parent / 'config.json'
     
@@ -488,13 +927,29 @@ def main():
     
     # Inicializa importador
     importer = CloudSQLImporter(config)
+    importer.manifesto = ImportManifest(
+        config.get('manifesto', str(Path(__file__).parent / 'import_manifest.sqlite3'))
+    )
+    importer.reprocessar_tudo = args.full
     
     # Conecta ao banco
     if not importer.connect():
+        importer.manifesto.fechar()
+        return
+    
+    if args.verify:
+        try:
+            resultado = importer.manifesto.verificar(importer.connection)
+            print(f"✓ Manifesto verificado: {resultado['verificados']} chaves, "
+                  f"{resultado['ausentes']} ausentes no banco (serão reimportadas)")
+        finally:
+            importer.manifesto.fechar()
+            importer.disconnect()
         return
     
     # Cria tabelas
     if not importer.criar_tabelas():
+        importer.manifesto.fechar()
         importer.disconnect()
         return
     
@@ -511,6 +966,7 @@ def main():
         importer.exibir_estatisticas()
         
     finally:
+        importer.manifesto.fechar()
         importer.disconnect()
 
 
@@ -0,0 +1,122 @@
+"""
+Testes do manifesto de importação incremental
+
+Uso:
+    python -m pytest test_import_manifest.py
+"""
+
+import os
+import tempfile
+from pathlib import Path
+
+from import_manifest import ImportManifest
+
+
+class CursorFalso:
+    """Cursor mínimo que responde ao SELECT ... IN de verificar()"""
+
+    def __init__(self, chaves):
+        self.chaves = chaves
+        self.resultado = []
+
+    def execute(self, sql, parametros):
+        self.resultado = [(chave,) for chave in parametros if chave in self.chaves]
+
+    def fetchall(self):
+        return self.resultado
+
+    def close(self):
+        pass
+
+
+class ConexaoFalsa:
+    def __init__(self, chaves):
+        self.chaves = set(chaves)
+
+    def cursor(self):
+        return CursorFalso(self.chaves)
+
+
+def criar_xmls(diretorio: Path, quantidade: int):
+    arquivos = []
+    for i in range(quantidade):
+        arquivo = diretorio / f'{i}.xml'
+        arquivo.write_text(f'<NFe>{i}</NFe>')
+        arquivos.append(arquivo)
+    return arquivos
+
+
+def test_pula_concluidos_e_reprocessa_erros():
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        arquivos = criar_xmls(tmp, 3)
+        manifesto = ImportManifest(str(tmp / 'manifesto.sqlite3'))
+
+        assert manifesto.filtrar(arquivos, 'NFe') == arquivos
+        manifesto.registrar([
+            (str(arquivos[0]), 'NFe', 'sucesso', 'chave0', None),
+            (str(arquivos[1]), 'NFe', 'existente', 'chave1', None),
+            (str(arquivos[2]), 'NFe', 'erro', None, 'XML inválido'),
+        ])
+
+        assert manifesto.filtrar(arquivos, 'NFe') == [arquivos[2]]
+        # O mesmo arquivo como CTe é outro registro
+        assert manifesto.filtrar(arquivos[:1], 'CTe') == arquivos[:1]
+        manifesto.fechar()
+
+
+def test_arquivo_alterado_e_copia():
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        arquivos = criar_xmls(tmp, 2)
+        manifesto = ImportManifest(str(tmp / 'manifesto.sqlite3'))
+        manifesto.filtrar(arquivos, 'NFe')
+        manifesto.registrar([
+            (str(arquivo), 'NFe', 'sucesso', f'chave{i}', None)
+            for i, arquivo in enumerate(arquivos)
+        ])
+
+        # Conteúdo novo é reprocessado; só o mtime alterado, não
+        arquivos[0].write_text('<NFe>alterada</NFe>')
+        stat = arquivos[1].stat()
+        os.utime(arquivos[1], (stat.st_atime, stat.st_mtime + 10))
+        # Cópia de um XML já importado é pulada pelo hash
+        copia = tmp / 'copia.xml'
+        copia.write_text(arquivos[1].read_text())
+
+        assert manifesto.filtrar(arquivos + [copia], 'NFe') == [arquivos[0]]
+        manifesto.fechar()
+
+
+def test_full_reprocessa_tudo():
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        arquivos = criar_xmls(tmp, 2)
+        manifesto = ImportManifest(str(tmp / 'manifesto.sqlite3'))
+        manifesto.filtrar(arquivos, 'NFe')
+        manifesto.registrar([
+            (str(arquivo), 'NFe', 'sucesso', f'chave{i}', None)
+            for i, arquivo in enumerate(arquivos)
+        ])
+
+        assert manifesto.filtrar(arquivos, 'NFe') == []
+        assert manifesto.filtrar(arquivos, 'NFe', completo=True) == arquivos
+        manifesto.fechar()
+
+
+def test_verificar_marca_ausentes():
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        arquivos = criar_xmls(tmp, 5)
+        manifesto = ImportManifest(str(tmp / 'manifesto.sqlite3'))
+        manifesto.filtrar(arquivos, 'NFe')
+        manifesto.registrar([
+            (str(arquivo), 'NFe', 'sucesso', f'chave{i}', None)
+            for i, arquivo in enumerate(arquivos)
+        ])
+
+        resultado = manifesto.verificar(ConexaoFalsa({'chave0', 'chave2', 'chave4'}), tamanho_bloco=2)
+
+        assert resultado == {'verificados': 5, 'ausentes': 2}
+        assert manifesto.filtrar(arquivos, 'NFe') == [arquivos[1], arquivos[3]]
+        manifesto.fechar()
@@ -0,0 +1,291 @@
+"""
+Testes da gravação em lote do importador (sem banco: conexão falsa)
+
+Uso:
+    python -m pytest test_import_to_cloudsql.py
+"""
+
+import queue
+import re
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from import_to_cloudsql import CloudSQLImporter
+from test_xml_parser import NFE_PROC, XML_INVALIDO
+
+
+class BancoFalso:
+    """Tabelas em memória com transação: commit grava, rollback descarta"""
+
+    def __init__(self):
+        self.tabelas = {'nfe': {}, 'cte': {}, 'nfe_itens': [], 'import_log': []}
+        self.pendentes = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.proximo_id = 1
+
+    def chaves(self, tabela):
+        """Chaves gravadas e pendentes da transação ({chave: id})"""
+        chaves = dict(self.tabelas[tabela])
+        chaves.update({
+            linha[0]: id_ for nome, linha, id_ in self.pendentes if nome == tabela
+        })
+        return chaves
+
+
+class CursorFalso:
+    def __init__(self, banco):
+        self.banco = banco
+        self.resultado = []
+        self.lastrowid = None
+
+    def execute(self, sql, parametros):
+        consulta = re.search(r'SELECT (.+?) FROM (\w+)', sql)
+        if consulta:
+            chaves = self.banco.chaves(consulta.group(2))
+            self.resultado = [
+                (chave, chaves[chave]) if ',' in consulta.group(1) else (chaves[chave],)
+                for chave in parametros if chave in chaves
+            ]
+            return
+        tabela = re.search(r'INSERT INTO (\w+)', sql).group(1)
+        self.lastrowid = None
+        if tabela in ('nfe', 'cte'):
+            if parametros[0] in self.banco.chaves(tabela):
+                return
+            self.lastrowid = self.banco.proximo_id
+            self.banco.proximo_id += 1
+        elif tabela == 'import_log' and len(parametros) == 3:
+            # log_sucesso/log_erro: status literal no SQL
+            status = re.search(r"'(sucesso|erro)'", sql).group(1)
+            parametros = (parametros[0], parametros[1], status)
+        self.banco.pendentes.append((tabela, tuple(parametros), self.lastrowid))
+
+    def executemany(self, sql, lista):
+        for parametros in lista:
+            self.execute(sql, parametros)
+
+    def fetchone(self):
+        return self.resultado[0] if self.resultado else None
+
+    def fetchall(self):
+        return self.resultado
+
+    def close(self):
+        pass
+
+
+class ConexaoFalsa:
+    def __init__(self, banco):
+        self.banco = banco
+
+    def cursor(self):
+        return CursorFalso(self.banco)
+
+    def commit(self):
+        for tabela, linha, id_ in self.banco.pendentes:
+            if tabela in ('nfe', 'cte'):
+                self.banco.tabelas[tabela][linha[0]] = id_
+            else:
+                self.banco.tabelas[tabela].append(linha)
+        self.banco.pendentes = []
+        self.banco.commits += 1
+
+    def rollback(self):
+        self.banco.pendentes = []
+        self.banco.rollbacks += 1
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        pass
+
+
+def criar_importador():
+    banco = BancoFalso()
+    importador = CloudSQLImporter({})
+    importador.verbose = False
+    importador.connection = ConexaoFalsa(banco)
+    return importador, banco
+
+
+def nfe(chave, itens=()):
+    return {'chave_acesso': chave, 'numero_nf': chave, 'itens': list(itens)}
+
+
+def status_do_log(banco):
+    return sorted((linha[1], linha[2]) for linha in banco.tabelas['import_log'])
+
+
+def test_lote_gravado_com_um_commit():
+    importador, banco = criar_importador()
+    banco.tabelas['nfe']['existente'] = 99
+
+    importador._gravar_lote_seguro([
+        ('NFe', '/xml/a.xml', nfe('a', [{'numero_item': 1}, {'numero_item': 2}])),
+        ('NFe', '/xml/b.xml', nfe('existente')),
+        ('CTe', '/xml/c.xml', {'chave_acesso': 'c', 'numero_ct': 'c'}),
+        ('NFe', '/xml/d.xml', {'error': 'XML inválido'}),
+    ])
+
+    assert (banco.commits, banco.rollbacks) == (1, 0)
+    assert set(banco.tabelas['nfe']) == {'a', 'existente'}
+    assert set(banco.tabelas['cte']) == {'c'}
+    assert len(banco.tabelas['nfe_itens']) == 2
+    assert status_do_log(banco) == [('a.xml', 'sucesso'), ('c.xml', 'sucesso'), ('d.xml', 'erro')]
+    assert importador.stats['nfe_sucesso'] == 1
+    assert importador.stats['cte_sucesso'] == 1
+    assert importador.stats['nfe_erro'] == 1
+    assert importador.stats['itens_inseridos'] == 2
+
+
+def test_falha_nos_dados_desfaz_e_refaz_por_documento():
+    importador, banco = criar_importador()
+
+    # Item inválido: AttributeError em _valores_item, não um erro do banco
+    importador._gravar_lote_seguro([
+        ('NFe', '/xml/a.xml', nfe('a', [{'numero_item': 1}])),
+        ('NFe', '/xml/b.xml', nfe('b', [None])),
+        ('CTe', '/xml/c.xml', {'chave_acesso': 'c', 'numero_ct': 'c'}),
+    ])
+
+    assert banco.rollbacks >= 1
+    assert banco.pendentes == []
+    # Nada do lote desfeito sobra pela metade: só 'a' e 'c' gravados, com seus itens
+    assert set(banco.tabelas['nfe']) == {'a'}
+    assert set(banco.tabelas['cte']) == {'c'}
+    assert [linha[1] for linha in banco.tabelas['nfe_itens']] == ['a']
+    assert status_do_log(banco) == [('a.xml', 'sucesso'), ('b.xml', 'erro'), ('c.xml', 'sucesso')]
+    assert importador.stats['nfe_sucesso'] == 1
+    assert importador.stats['nfe_erro'] == 1
+    assert importador.stats['cte_sucesso'] == 1
+    assert importador.stats['itens_inseridos'] == 1
+
+
+class ManifestoComFalha:
+    def registrar(self, resultados):
+        raise OSError('disco cheio')
+
+
+def test_falha_apos_o_commit_nao_conta_o_lote_como_erro():
+    importador, banco = criar_importador()
+    importador.manifesto = ManifestoComFalha()
+
+    importador._gravar_lote_seguro([('NFe', '/xml/a.xml', nfe('a'))])
+
+    assert set(banco.tabelas['nfe']) == {'a'}
+    assert status_do_log(banco) == [('a.xml', 'sucesso')]
+    assert importador.stats['nfe_sucesso'] == 1
+    assert importador.stats['nfe_erro'] == 0
+    assert importador.stats['erros'] == []
+
+
+def test_conexao_perdida_conta_cada_documento_uma_vez():
+    importador, banco = criar_importador()
+
+    def falhar(*args):
+        raise ConnectionError('conexão perdida')
+
+    importador.connection.cursor = falhar
+    importador.connection.rollback = falhar
+
+    importador._gravar_lote_seguro([
+        ('NFe', '/xml/a.xml', nfe('a')),
+        ('CTe', '/xml/c.xml', {'chave_acesso': 'c', 'numero_ct': 'c'}),
+    ])
+
+    assert banco.tabelas['nfe'] == {}
+    assert importador.stats['nfe_erro'] == 1
+    assert importador.stats['cte_erro'] == 1
+    assert len(importador.stats['erros']) == 2
+
+
+def registrar_lotes(monkeypatch):
+    """Tamanho de cada lote gravado (em qualquer gravador)"""
+    tamanhos = []
+    original = CloudSQLImporter._gravar_lote
+
+    def gravar_lote(self, lote):
+        tamanhos.append(len(lote))
+        return original(self, lote)
+
+    monkeypatch.setattr(CloudSQLImporter, '_gravar_lote', gravar_lote)
+    return tamanhos
+
+
+def test_fila_lenta_nao_fragmenta_os_lotes(monkeypatch):
+    tamanhos = registrar_lotes(monkeypatch)
+    importador, banco = criar_importador()
+    fila = queue.Queue()
+    gravador = threading.Thread(target=importador._consumir_fila, args=(fila, 5, 5.0))
+    gravador.start()
+
+    # Parsing mais lento que a gravação: a fila esvazia entre um documento e outro
+    for n in range(10):
+        fila.put(('NFe', f'/xml/{n}.xml', nfe(f'{n}')))
+        time.sleep(0.01)
+    fila.put(None)
+    gravador.join()
+
+    assert tamanhos == [5, 5]
+    assert len(banco.tabelas['nfe']) == 10
+
+
+def test_lote_incompleto_gravado_apos_a_janela(monkeypatch):
+    tamanhos = registrar_lotes(monkeypatch)
+    importador, banco = criar_importador()
+    fila = queue.Queue()
+    gravador = threading.Thread(target=importador._consumir_fila, args=(fila, 100, 0.05))
+    gravador.start()
+
+    for n in range(3):
+        fila.put(('NFe', f'/xml/{n}.xml', nfe(f'{n}')))
+    time.sleep(0.5)
+    # Gravado sem esperar o fim da fila
+    assert tamanhos == [3]
+    assert len(banco.tabelas['nfe']) == 3
+
+    fila.put(None)
+    gravador.join()
+    assert tamanhos == [3]
+
+
+def test_processar_paralelo_soma_estatisticas_dos_gravadores(monkeypatch):
+    tamanhos = registrar_lotes(monkeypatch)
+    bancos = []
+
+    def conectar(self):
+        bancos.append(BancoFalso())
+        self.connection = ConexaoFalsa(bancos[-1])
+        return True
+
+    monkeypatch.setattr(CloudSQLImporter, 'connect', conectar)
+    chave = '35240112345678000190550010000012341000012345'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        arquivos = []
+        for n in range(12):
+            arquivo = tmp / f'nfe{n:02d}.xml'
+            arquivo.write_text(NFE_PROC.replace(chave, f'{chave[:-2]}{n:02d}'))
+            arquivos.append(arquivo)
+        invalido = tmp / 'invalido.xml'
+        invalido.write_text(XML_INVALIDO)
+        arquivos.append(invalido)
+
+        importador = CloudSQLImporter({'workers': 2, 'writers': 2, 'lote': 5, 'janela': 5.0})
+        importador.processar_paralelo(arquivos, 'NFe')
+
+    assert len(bancos) == 2
+    assert sum(len(banco.tabelas['nfe']) for banco in bancos) == 12
+    assert importador.stats['nfe_sucesso'] == 12
+    assert importador.stats['nfe_erro'] == 1
+    assert importador.stats['itens_inseridos'] == 24
+    assert [erro['arquivo'] for erro in importador.stats['erros']] == ['invalido.xml']
+    # Lotes cheios, exceto o último de cada gravador
+    assert sum(tamanhos) == 13
+    assert max(tamanhos) == 5
+    assert len(tamanhos) <= 4
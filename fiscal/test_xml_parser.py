@@ -0,0 +1,440 @@
+"""
+Teste de paridade entre as engines de parsing (etree x stream)
+Garante que XMLStreamParser produz exatamente o mesmo dicionário que XMLParser
+
+Uso:
+    python test_xml_parser.py            # corpus embutido + ./NFe e ./CTe
+    python -m pytest test_xml_parser.py
+
+Defina XML_CORPUS_DIR para apontar para um diretório com subpastas NFe/ e CTe/.
+"""
+
+import os
+import tempfile
+from pathlib import Path
+
+from xml_parser import XMLParser, XMLStreamParser, criar_parser
+
+
+NFE_PROC = """<?xml version="1.0" encoding="UTF-8"?>
+<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00">
+  <NFe>
+    <infNFe Id="NFe35240112345678000190550010000012341000012345" versao="4.00">
+      <ide>
+        <cUF>35</cUF>
+        <natOp>VENDA DE MERCADORIA</natOp>
+        <mod>55</mod>
+        <serie>1</serie>
+        <nNF>1234</nNF>
+        <dhEmi>2024-01-15T10:30:00-03:00</dhEmi>
+        <NFref>
+          <refNF>
+            <cUF>35</cUF>
+            <serie>9</serie>
+            <nNF>999</nNF>
+          </refNF>
+        </NFref>
+      </ide>
+      <emit>
+        <CNPJ>12345678000190</CNPJ>
+        <xNome>  Empresa   Emitente LTDA </xNome>
+        <xFant>Emitente</xFant>
+        <enderEmit>
+          <xLgr>Rua das Flores</xLgr>
+          <nro>100</nro>
+          <xBairro>Centro</xBairro>
+          <xMun>São Paulo</xMun>
+          <UF>SP</UF>
+          <CEP>01001000</CEP>
+        </enderEmit>
+        <IE>123456789</IE>
+      </emit>
+      <dest>
+        <CPF>12345678909</CPF>
+        <xNome>Cliente Final</xNome>
+        <enderDest>
+          <xLgr>Av. Brasil</xLgr>
+          <nro>S/N</nro>
+          <xBairro>Jardim</xBairro>
+          <xMun>Campinas</xMun>
+          <UF>SP</UF>
+        </enderDest>
+      </dest>
+      <det nItem="1">
+        <prod>
+          <cProd>P001</cProd>
+          <cEAN>7891234567895</cEAN>
+          <xProd>Produto   Um</xProd>
+          <NCM>12345678</NCM>
+          <CFOP>5102</CFOP>
+          <uCom>UN</uCom>
+          <qCom>2.0000</qCom>
+          <vUnCom>10.5000000000</vUnCom>
+          <vProd>21.00</vProd>
+          <cEANTrib>7891234567895</cEANTrib>
+        </prod>
+        <imposto>
+          <vTotTrib>3.15</vTotTrib>
+          <ICMS>
+            <ICMS00>
+              <orig>0</orig>
+              <CST>00</CST>
+              <vBC>21.00</vBC>
+              <pICMS>18.00</pICMS>
+              <vICMS>3.78</vICMS>
+            </ICMS00>
+          </ICMS>
+          <IPI>
+            <cEnq>999</cEnq>
+            <IPITrib>
+              <CST>50</CST>
+              <vIPI>1.05</vIPI>
+            </IPITrib>
+          </IPI>
+          <PIS>
+            <PISAliq>
+              <CST>01</CST>
+              <vPIS>0.35</vPIS>
+            </PISAliq>
+          </PIS>
+          <COFINS>
+            <COFINSAliq>
+              <CST>01</CST>
+              <vCOFINS>1.60</vCOFINS>
+            </COFINSAliq>
+          </COFINS>
+        </imposto>
+      </det>
+      <det nItem="2">
+        <prod>
+          <cProd>P002</cProd>
+          <cEAN>SEM GTIN</cEAN>
+          <xProd>Produto Dois</xProd>
+          <NCM>87654321</NCM>
+          <CEST>0100100</CEST>
+          <CFOP>5405</CFOP>
+          <uCom>KG</uCom>
+          <qCom>1,5</qCom>
+          <vUnCom>4.00</vUnCom>
+          <vProd>6.00</vProd>
+        </prod>
+        <imposto>
+          <ICMS>
+            <ICMS60>
+              <orig>0</orig>
+              <CST>60</CST>
+            </ICMS60>
+          </ICMS>
+          <PIS>
+            <PISNT>
+              <CST>04</CST>
+            </PISNT>
+          </PIS>
+        </imposto>
+      </det>
+      <det nItem="3">
+        <infAdProd>Item sem produto</infAdProd>
+      </det>
+      <total>
+        <ICMSTot>
+          <vBC>21.00</vBC>
+          <vICMS>3.78</vICMS>
+          <vProd>27.00</vProd>
+          <vIPI>1.05</vIPI>
+          <vPIS>0.35</vPIS>
+          <vCOFINS>1.60</vCOFINS>
+          <vNF>28.05</vNF>
+          <vTotTrib>3.15</vTotTrib>
+        </ICMSTot>
+      </total>
+    </infNFe>
+  </NFe>
+  <protNFe versao="4.00">
+    <infProt>
+      <tpAmb>1</tpAmb>
+      <chNFe>35240112345678000190550010000012341000012345</chNFe>
+      <nProt>135240000012345</nProt>
+      <cStat>100</cStat>
+      <xMotivo>Autorizado o uso da NF-e</xMotivo>
+    </infProt>
+  </protNFe>
+</nfeProc>
+"""
+
+NFE_SEM_PROTOCOLO = """<?xml version="1.0" encoding="UTF-8"?>
+<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00">
+  <NFe>
+    <infNFe Id="NFe35240112345678000190550010000055551000055555" versao="4.00">
+      <ide>
+        <serie>2</serie>
+        <nNF>5555</nNF>
+        <dhEmi>data-invalida</dhEmi>
+      </ide>
+      <emit>
+        <CNPJ>98765432000110</CNPJ>
+        <xNome></xNome>
+      </emit>
+      <det>
+        <nItem>7</nItem>
+        <prod>
+          <cProd>X</cProd>
+          <vProd>abc</vProd>
+        </prod>
+      </det>
+    </infNFe>
+  </NFe>
+</nfeProc>
+"""
+
+CTE_PROC = """<?xml version="1.0" encoding="UTF-8"?>
+<cteProc xmlns="http://www.portalfiscal.inf.br/cte" versao="4.00">
+  <CTe>
+    <infCte Id="CTe35240198765432000110570010000004321000004321" versao="4.00">
+      <ide>
+        <cUF>35</cUF>
+        <CFOP>6353</CFOP>
+        <natOp>PRESTACAO DE SERVICO DE TRANSPORTE</natOp>
+        <mod>57</mod>
+        <serie>1</serie>
+        <nCT>4321</nCT>
+        <dhEmi>2024-01-20T08:00:00-03:00</dhEmi>
+        <modal>01</modal>
+        <tpServ>0</tpServ>
+        <xMunIni>Santos</xMunIni>
+        <UFIni>SP</UFIni>
+        <xMunFim>Curitiba</xMunFim>
+        <UFFim>PR</UFFim>
+        <toma4>
+          <toma>4</toma>
+          <CNPJ>11111111000111</CNPJ>
+          <xNome>Tomador</xNome>
+          <enderToma>
+            <xMun>Osasco</xMun>
+            <UF>SP</UF>
+          </enderToma>
+        </toma4>
+      </ide>
+      <emit>
+        <CNPJ>98765432000110</CNPJ>
+        <IE>111222333</IE>
+        <xNome>Transportadora Rápida</xNome>
+        <xFant>Rápida</xFant>
+        <enderEmit>
+          <xLgr>Rod. Anchieta</xLgr>
+          <nro>km 10</nro>
+          <xBairro>Industrial</xBairro>
+          <xMun>Santos</xMun>
+          <UF>SP</UF>
+        </enderEmit>
+      </emit>
+      <rem>
+        <CNPJ>12345678000190</CNPJ>
+        <IE>123456789</IE>
+        <xNome>Empresa Remetente</xNome>
+        <enderReme>
+          <xMun>Santos</xMun>
+          <UF>SP</UF>
+        </enderReme>
+      </rem>
+      <dest>
+        <CNPJ>22222222000122</CNPJ>
+        <xNome>Empresa Destino</xNome>
+        <enderDest>
+          <xMun>Curitiba</xMun>
+          <UF>PR</UF>
+        </enderDest>
+      </dest>
+      <vPrest>
+        <vTPrest>1500.00</vTPrest>
+        <vRec>1500.00</vRec>
+        <Comp>
+          <xNome>FRETE PESO</xNome>
+          <vComp>1500.00</vComp>
+        </Comp>
+      </vPrest>
+      <imp>
+        <ICMS>
+          <ICMS00>
+            <CST>00</CST>
+            <vBC>1500.00</vBC>
+            <pICMS>12.00</pICMS>
+            <vICMS>180.00</vICMS>
+          </ICMS00>
+        </ICMS>
+      </imp>
+      <infCTeNorm>
+        <infCarga>
+          <vCarga>25000.00</vCarga>
+          <proPred>DIVERSOS</proPred>
+        </infCarga>
+      </infCTeNorm>
+    </infCte>
+  </CTe>
+  <protCTe versao="4.00">
+    <infProt>
+      <nProt>135240000004321</nProt>
+      <cStat>100</cStat>
+      <xMotivo>Autorizado o uso do CT-e</xMotivo>
+    </infProt>
+  </protCTe>
+</cteProc>
+"""
+
+NFE_SEM_PROC = """<?xml version="1.0" encoding="UTF-8"?>
+<NFe xmlns="http://www.portalfiscal.inf.br/nfe">
+  <infNFe Id="NFe35240112345678000190550010000000011000000011"/>
+</NFe>
+"""
+
+XML_INVALIDO = """<?xml version="1.0" encoding="UTF-8"?>
+<nfeProc><NFe><infNFe>
+"""
+
+
+def sem_namespace(xml: str) -> str:
+    """Remove as declarações de namespace para gerar a variante sem namespace"""
+    return xml.replace(' xmlns="http://www.portalfiscal.inf.br/nfe"', '').replace(
+        ' xmlns="http://www.portalfiscal.inf.br/cte"', ''
+    )
+
+
+CORPUS = {
+    'NFe': {
+        'nfe_proc.xml': NFE_PROC,
+        'nfe_proc_sem_ns.xml': sem_namespace(NFE_PROC),
+        'nfe_sem_protocolo.xml': NFE_SEM_PROTOCOLO,
+        'nfe_sem_proc.xml': NFE_SEM_PROC,
+        'nfe_invalido.xml': XML_INVALIDO,
+        'cte_como_nfe.xml': CTE_PROC,
+    },
+    'CTe': {
+        'cte_proc.xml': CTE_PROC,
+        'cte_proc_sem_ns.xml': sem_namespace(CTE_PROC),
+        'cte_invalido.xml': XML_INVALIDO,
+        'nfe_como_cte.xml': NFE_PROC,
+    },
+}
+
+
+def comparar(tipo: str, xml_path: str):
+    """Compara a saída das duas engines para um arquivo"""
+    metodo = 'parse_nfe' if tipo == 'NFe' else 'parse_cte'
+    esperado = getattr(XMLParser(), metodo)(xml_path)
+    obtido = getattr(XMLStreamParser(), metodo)(xml_path)
+    
+    # Mensagens de erro podem variar entre engines; basta ambas falharem
+    if 'error' in esperado or 'error' in obtido:
+        assert 'error' in esperado and 'error' in obtido, (xml_path, esperado, obtido)
+        return esperado
+    
+    assert obtido == esperado, f"Divergência em {xml_path}"
+    return esperado
+
+
+def gravar_corpus(diretorio: Path):
+    """Grava o corpus embutido em disco"""
+    arquivos = []
+    for tipo, documentos in CORPUS.items():
+        for nome, conteudo in documentos.items():
+            caminho = diretorio / nome
+            caminho.write_text(conteudo, encoding='utf-8')
+            arquivos.append((tipo, str(caminho)))
+    return arquivos
+
+
+def test_paridade_corpus_embutido():
+    """As duas engines produzem o mesmo dicionário para o corpus embutido"""
+    with tempfile.TemporaryDirectory() as tmp:
+        for tipo, caminho in gravar_corpus(Path(tmp)):
+            comparar(tipo, caminho)
+
+
+def test_nfe_campos_extraidos():
+    """Confere valores de referência da NFe (primeira ocorrência, impostos por item)"""
+    with tempfile.TemporaryDirectory() as tmp:
+        caminho = Path(tmp) / 'nfe.xml'
+        caminho.write_text(NFE_PROC, encoding='utf-8')
+        dados = comparar('NFe', str(caminho))
+    
+    assert dados['chave_acesso'] == '35240112345678000190550010000012341000012345'
+    assert dados['numero_nf'] == '1234'
+    assert dados['serie'] == '1'
+    assert dados['data_emissao'] == '2024-01-15 10:30:00'
+    assert dados['nome'] == 'Empresa Emitente LTDA'
+    assert dados['endereco'] == 'Rua das Flores, 100 - Centro'
+    assert dados['dest_cnpj_cpf'] == '12345678909'
+    assert dados['dest_cep'] is None
+    assert dados['valor_total'] == 28.05
+    assert dados['protocolo'] == '135240000012345'
+    
+    assert [item['numero_item'] for item in dados['itens']] == [1, 2]
+    primeiro, segundo = dados['itens']
+    assert primeiro['valor_icms'] == 3.78
+    assert primeiro['valor_ipi'] == 1.05
+    assert primeiro['valor_pis'] == 0.35
+    assert primeiro['valor_cofins'] == 1.60
+    assert segundo['quantidade'] == 1.5
+    assert 'valor_icms' not in segundo
+    assert 'valor_pis' not in segundo
+
+
+def test_cte_campos_extraidos():
+    """Confere valores de referência do CTe"""
+    with tempfile.TemporaryDirectory() as tmp:
+        caminho = Path(tmp) / 'cte.xml'
+        caminho.write_text(CTE_PROC, encoding='utf-8')
+        dados = comparar('CTe', str(caminho))
+    
+    assert dados['numero_ct'] == '4321'
+    assert dados['cfop'] == '6353'
+    assert dados['emit_nome'] == 'Transportadora Rápida'
+    assert dados['rem_municipio'] == 'Santos'
+    assert dados['dest_uf'] == 'PR'
+    assert dados['valor_total'] == 1500.0
+    assert dados['valor_carga'] == 25000.0
+    assert dados['valor_icms'] == 180.0
+    assert dados['status'] == '100'
+
+
+def comparar_corpus_local() -> int:
+    """Compara as engines nos XMLs reais de XML_CORPUS_DIR (ou ./NFe e ./CTe)"""
+    base = Path(os.getenv('XML_CORPUS_DIR', Path(__file__).parent))
+    total = 0
+    for tipo in ('NFe', 'CTe'):
+        diretorio = base / tipo
+        if not diretorio.is_dir():
+            continue
+        for xml_file in sorted(diretorio.glob('*.xml')):
+            comparar(tipo, str(xml_file))
+            total += 1
+    return total
+
+
+def test_paridade_corpus_local():
+    """As duas engines produzem o mesmo dicionário para os XMLs reais disponíveis"""
+    comparar_corpus_local()
+
+
+def test_criar_parser():
+    """A engine é selecionável por nome"""
+    assert type(criar_parser()) is XMLParser
+    assert type(criar_parser('stream')) is XMLStreamParser
+    try:
+        criar_parser('lxml')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('engine inválida deveria falhar')
+
+
+if __name__ == '__main__':
+    print("="*60)
+    print("PARIDADE XMLParser x XMLStreamParser")
+    print("="*60)
+    test_paridade_corpus_embutido()
+    test_nfe_campos_extraidos()
+    test_cte_campos_extraidos()
+    test_criar_parser()
+    print("✓ Corpus embutido idêntico nas duas engines")
+    total = comparar_corpus_local()
+    print(f"✓ Corpus local: {total} arquivos idênticos")
@@ -0,0 +1,14 @@
+"""
+Filtros da API REST
+"""
+from rest_framework import filters
+
+from core import busca
+
+
+class BuscaDocumentosFilter(filters.SearchFilter):
+    """?search= de NFe/CTe pela busca indexada de core.busca (sem icontains)"""
+    
+    def filter_queryset(self, request, queryset, view):
+        termo = request.query_params.get(self.search_param, '')
+        return busca.filtrar(queryset, termo)
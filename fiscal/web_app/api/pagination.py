@@ -0,0 +1,89 @@
+"""
+Paginação por cursor para a API mobile
+
+Usa core.paginacao: páginas por (campo de ordenação, id) com cursores opacos,
+sem OFFSET e sem COUNT(*). O total só é calculado com ?contar=1 e é estimado.
+
+Resposta:
+    {"next": url, "previous": url, "results": [...]}
+    {"count": 1234, "count_exato": false, ...}  (com ?contar=1)
+"""
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from core.paginacao import CursorInvalido, contar_estimado, paginar, solicitado
+
+
+class CursorPaginacaoDocumentos(BasePagination):
+    """Paginação keyset de NFe/CTe ordenada pela ordenação do queryset"""
+    
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordem_padrao = '-data_emissao'
+    
+    def get_page_size(self, request):
+        tamanho = api_settings.PAGE_SIZE or 20
+        try:
+            pedido = int(request.query_params.get(self.page_size_query_param, tamanho))
+        except ValueError:
+            return tamanho
+        return max(1, min(pedido, self.max_page_size))
+    
+    def get_ordem(self, queryset):
+        # A primeira ordenação vinda do OrderingFilter (ou do queryset) guia o cursor
+        ordem = queryset.query.order_by
+        if ordem and isinstance(ordem[0], str) and ordem[0].lstrip('-') not in ('pk', 'id'):
+            return ordem[0]
+        return self.ordem_padrao
+    
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        cursor = request.query_params.get(self.cursor_query_param) or None
+        try:
+            self.pagina = paginar(queryset, self.get_ordem(queryset), cursor, self.get_page_size(request))
+        except CursorInvalido as e:
+            raise NotFound(str(e))
+        
+        self.total = None
+        if solicitado(request.query_params, 'contar'):
+            self.total = contar_estimado(queryset)
+        return list(self.pagina)
+    
+    def _link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(remove_query_param(url, 'page'), self.cursor_query_param, cursor)
+    
+    def get_next_link(self):
+        return self._link(self.pagina.cursor_proximo)
+    
+    def get_previous_link(self):
+        return self._link(self.pagina.cursor_anterior)
+    
+    def get_paginated_response(self, data):
+        resposta = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+        }
+        if self.total is not None:
+            resposta['count'], resposta['count_exato'] = self.total
+        resposta['results'] = data
+        return Response(resposta)
+    
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'count': {'type': 'integer'},
+                'count_exato': {'type': 'boolean'},
+                'results': schema,
+            },
+        }
@@ -34,10 +34,11 @@ class NFeDetailSerializer(serializers.ModelSerializer):
     
     itens = NFeItemSerializer(many=True, read_only=True)
     total_itens = serializers.SerializerMethodField()
+    xml_content = serializers.CharField(source='xml', read_only=True)
     
     class Meta:
         model = NFe
-        fields = '__all__'
+        exclude = ['xml_hash']
     
     def get_total_itens(self, obj):
         return obj.itens.count()
@@ -58,9 +59,11 @@ class CTeListSerializer(serializers.ModelSerializer):
 class CTeDetailSerializer(serializers.ModelSerializer):
     """Serializer para detalhes completos de CTe"""
     
+    xml_content = serializers.CharField(source='xml', read_only=True)
+    
     class Meta:
         model = CTe
-        fields = '__all__'
+        exclude = ['xml_hash']
 
 
 class ImportLogSerializer(serializers.ModelSerializer):
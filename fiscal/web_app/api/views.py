@@ -6,11 +6,14 @@ from rest_framework import viewsets, filters, status
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from django.db.models import Sum, Count, Q
-from django.db.models.functions import TruncMonth
-from datetime import datetime, timedelta
+from django.db.models import Sum, Count
+from django.utils import timezone
+from datetime import timedelta
 
-from core.models import NFe, NFeItem, CTe, ImportLog
+from core import busca, rollups
+from core.models import NFe, CTe, ImportLog
+from .filters import BuscaDocumentosFilter
+from .pagination import CursorPaginacaoDocumentos
 from .serializers import (
     NFeListSerializer, NFeDetailSerializer,
     CTeListSerializer, CTeDetailSerializer,
@@ -28,12 +31,15 @@ class NFeViewSet(viewsets.ReadOnlyModelViewSet):
     - GET /api/nfe/{id}/ - Detalhes de uma NFe
     - GET /api/nfe/search/?q=termo - Busca por termo
     - GET /api/nfe/by_emitente/?cnpj=00000000000000 - Filtra por emitente
+    
+    Paginação por cursor: siga os links next/previous; ?contar=1 inclui o
+    total estimado.
     """
     
     queryset = NFe.objects.all().order_by('-data_emissao')
     permission_classes = [IsAuthenticated]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
-    search_fields = ['numero_nf', 'emit_nome', 'dest_nome', 'chave_acesso']
+    pagination_class = CursorPaginacaoDocumentos
+    filter_backends = [BuscaDocumentosFilter, filters.OrderingFilter]
     ordering_fields = ['data_emissao', 'valor_total', 'numero_nf']
     
     def get_serializer_class(self):
@@ -98,12 +104,15 @@ class CTeViewSet(viewsets.ReadOnlyModelViewSet):
     - GET /api/cte/ - Lista todos os CTes
     - GET /api/cte/{id}/ - Detalhes de um CTe
     - GET /api/cte/search/?q=termo - Busca por termo
+    
+    Paginação por cursor: siga os links next/previous; ?contar=1 inclui o
+    total estimado.
     """
     
     queryset = CTe.objects.all().order_by('-data_emissao')
     permission_classes = [IsAuthenticated]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
-    search_fields = ['numero_ct', 'emit_nome', 'dest_nome', 'chave_acesso']
+    pagination_class = CursorPaginacaoDocumentos
+    filter_backends = [BuscaDocumentosFilter, filters.OrderingFilter]
     ordering_fields = ['data_emissao', 'valor_total', 'numero_ct']
     
     def get_serializer_class(self):
@@ -183,36 +192,25 @@ def dashboard_api(request):
     """
     
     # Período: últimos 30 dias
-    data_inicio = datetime.now() - timedelta(days=30)
-    
-    # Estatísticas NFe
-    nfe_total = NFe.objects.count()
-    nfe_mes = NFe.objects.filter(data_emissao__gte=data_inicio).count()
-    nfe_valor_total = NFe.objects.aggregate(Sum('valor_total'))['valor_total__sum'] or 0
-    nfe_valor_mes = NFe.objects.filter(
-        data_emissao__gte=data_inicio
-    ).aggregate(Sum('valor_total'))['valor_total__sum'] or 0
-    
-    # Estatísticas CTe
-    cte_total = CTe.objects.count()
-    cte_mes = CTe.objects.filter(data_emissao__gte=data_inicio).count()
-    cte_valor_total = CTe.objects.aggregate(Sum('valor_total'))['valor_total__sum'] or 0
-    cte_valor_mes = CTe.objects.filter(
-        data_emissao__gte=data_inicio
-    ).aggregate(Sum('valor_total'))['valor_total__sum'] or 0
+    data_inicio = timezone.localdate() - timedelta(days=30)
+    
+    # Estatísticas NFe e CTe (resumos diários, uma consulta)
+    resumo = rollups.resumo_documentos(data_inicio)
+    nfe = resumo['NFe']
+    cte = resumo['CTe']
     
     # Últimos logs
     ultimos_logs = ImportLog.objects.order_by('-data_importacao')[:10]
     
     data = {
-        'nfe_total': nfe_total,
-        'nfe_mes': nfe_mes,
-        'nfe_valor_total': nfe_valor_total,
-        'nfe_valor_mes': nfe_valor_mes,
-        'cte_total': cte_total,
-        'cte_mes': cte_mes,
-        'cte_valor_total': cte_valor_total,
-        'cte_valor_mes': cte_valor_mes,
+        'nfe_total': nfe['total'],
+        'nfe_mes': nfe['mes_atual'],
+        'nfe_valor_total': nfe['valor_total'],
+        'nfe_valor_mes': nfe['valor_mes'],
+        'cte_total': cte['total'],
+        'cte_mes': cte['mes_atual'],
+        'cte_valor_total': cte['valor_total'],
+        'cte_valor_mes': cte['valor_mes'],
         'ultimos_logs': ImportLogSerializer(ultimos_logs, many=True).data,
     }
     
@@ -230,38 +228,13 @@ def statistics_api(request):
     Retorna análises detalhadas para dashboard mobile
     """
     
-    # Top 10 emitentes
-    top_emitentes = list(NFe.objects.values(
-        'emit_cnpj', 'emit_nome'
-    ).annotate(
-        total=Count('id'),
-        valor=Sum('valor_total')
-    ).order_by('-total')[:10])
-    
-    # Top 10 produtos
-    top_produtos = list(NFeItem.objects.values(
-        'codigo_produto', 'descricao'
-    ).annotate(
-        qtd_total=Sum('quantidade'),
-        valor_total=Sum('valor_total')
-    ).order_by('-qtd_total')[:10])
-    
-    # Top 10 rotas
-    top_rotas = list(CTe.objects.values(
-        'municipio_inicio', 'uf_inicio',
-        'municipio_fim', 'uf_fim'
-    ).annotate(
-        total=Count('id'),
-        valor=Sum('valor_total')
-    ).order_by('-total')[:10])
+    # Top 10 emitentes, produtos e rotas (resumos diários)
+    top_emitentes = rollups.top_emitentes(10)
+    top_produtos = rollups.top_produtos(10)
+    top_rotas = rollups.top_rotas(10)
     
     # Vendas por mês (últimos 12 meses)
-    vendas_por_mes = list(NFe.objects.annotate(
-        mes=TruncMonth('data_emissao')
-    ).values('mes').annotate(
-        total=Count('id'),
-        valor=Sum('valor_total')
-    ).order_by('-mes')[:12])
+    vendas_por_mes = rollups.vendas_por_mes(12)
     
     data = {
         'top_emitentes': top_emitentes,
@@ -281,7 +254,8 @@ def search_api(request):
     
     GET /api/search/?q=termo
     
-    Busca em múltiplos campos de NFes e CTes
+    Busca por número, emitente, destinatário, itens (NFe), chave de acesso
+    e CNPJ/CPF em NFes e CTes
     """
     
     query = request.GET.get('q', '')
@@ -289,26 +263,14 @@ def search_api(request):
     if not query:
         return Response({'error': 'Parâmetro q é obrigatório'}, status=400)
     
-    # Busca em NFes
-    nfes = NFe.objects.filter(
-        Q(numero_nf__icontains=query) |
-        Q(chave_acesso__icontains=query) |
-        Q(emit_nome__icontains=query) |
-        Q(dest_nome__icontains=query)
-    ).order_by('-data_emissao')[:20]
-    
-    # Busca em CTes
-    ctes = CTe.objects.filter(
-        Q(numero_ct__icontains=query) |
-        Q(chave_acesso__icontains=query) |
-        Q(emit_nome__icontains=query) |
-        Q(dest_nome__icontains=query)
-    ).order_by('-data_emissao')[:20]
+    # Busca indexada, mais relevantes primeiro (ver core/busca.py)
+    nfes = busca.buscar(NFe.objects.all(), query, 20)
+    ctes = busca.buscar(CTe.objects.all(), query, 20)
     
     data = {
         'nfes': NFeListSerializer(nfes, many=True).data,
         'ctes': CTeListSerializer(ctes, many=True).data,
-        'total_results': nfes.count() + ctes.count(),
+        'total_results': len(nfes) + len(ctes),
     }
     
     return Response(data)
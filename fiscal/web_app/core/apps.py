@@ -5,3 +5,7 @@ class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
     verbose_name = 'Core - Gestão de XMLs'
+    
+    def ready(self):
+        # Registra os sinais que mantêm os resumos diários e o índice de busca
+        from . import busca, rollups  # noqa: F401
@@ -0,0 +1,299 @@
+"""
+Busca de NFe/CTe por número, emitente, destinatário e itens
+
+Substitui as cadeias de icontains (que varrem a tabela inteira) por:
+
+- atalhos exatos: chave de acesso (44 dígitos), prefixo de chave e CNPJ/CPF,
+  que usam os índices já existentes;
+- PostgreSQL: icontains apoiado em índices de trigramas (pg_trgm), criados
+  por `manage.py indexar_busca`, com ranking por similaridade;
+- demais bancos: índice invertido TermoBusca (palavras normalizadas, sem
+  acento), consultado por prefixo de palavra e ordenado por relevância.
+
+O índice invertido é mantido pelos sinais deste módulo; documentos gravados
+com bulk_create ou fora do Django entram com indexar() ou
+`manage.py indexar_busca`.
+
+Backend em settings.BUSCA_BACKEND: 'auto' (padrão), 'trigrama' ou 'indice'.
+"""
+import re
+import unicodedata
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, Exists, F, IntegerField, Max, OuterRef, Q, When
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import NFe, NFeItem, CTe, TermoBusca
+
+
+TIPOS = {NFe: 'NFe', CTe: 'CTe'}
+
+# Campos indexados e peso de cada um no ranking
+PESOS = {
+    NFe: {'numero_nf': 8, 'emit_nome': 4, 'dest_nome': 4},
+    CTe: {'numero_ct': 8, 'emit_nome': 4, 'dest_nome': 4},
+}
+PESOS_ITEM = {'codigo_produto': 2, 'descricao': 1}
+
+# Campos de CNPJ/CPF com índice usados no atalho
+CAMPOS_DOCUMENTO = {
+    NFe: ('emit_cnpj', 'dest_cnpj_cpf'),
+    CTe: ('emit_cnpj',),
+}
+
+TAMANHO_TERMO = 40
+MAXIMO_TERMOS_CONSULTA = 8
+BLOCO_INDEXACAO = 500
+PALAVRAS_IGNORADAS = {'de', 'da', 'do', 'das', 'dos', 'e'}
+
+
+def backend():
+    """'trigrama' ou 'indice', conforme settings.BUSCA_BACKEND e o banco"""
+    escolhido = getattr(settings, 'BUSCA_BACKEND', 'auto')
+    if escolhido == 'auto':
+        return 'trigrama' if connection.vendor == 'postgresql' else 'indice'
+    if escolhido not in ('trigrama', 'indice'):
+        raise ValueError(f'BUSCA_BACKEND inválido: {escolhido}')
+    return escolhido
+
+
+# Termos
+
+def normalizar(texto):
+    """Minúsculas e sem acentos"""
+    decomposto = unicodedata.normalize('NFKD', str(texto))
+    return ''.join(c for c in decomposto if not unicodedata.combining(c)).lower()
+
+
+def extrair_termos(texto):
+    """Palavras indexáveis de um texto, na ordem em que aparecem"""
+    if not texto:
+        return []
+    return [
+        palavra[:TAMANHO_TERMO]
+        for palavra in re.findall(r'[a-z0-9]+', normalizar(texto))
+        if (len(palavra) >= 2 or palavra.isdigit()) and palavra not in PALAVRAS_IGNORADAS
+    ]
+
+
+def _acumular_termos(termos, valores, pesos):
+    for campo, peso in pesos.items():
+        for termo in extrair_termos(valores.get(campo)):
+            if termos.get(termo, 0) < peso:
+                termos[termo] = peso
+
+
+# Atalhos exatos
+
+def _filtro_exato(modelo, texto):
+    """Q dos atalhos por chave de acesso e CNPJ/CPF, ou None"""
+    if not re.fullmatch(r'[\d\s./-]+', texto):
+        return None
+    digitos = re.sub(r'\D', '', texto)
+    if len(digitos) == 44:
+        return Q(chave_acesso=digitos)
+    if len(digitos) in (11, 14):
+        return reduce(or_, [Q(**{campo: digitos}) for campo in CAMPOS_DOCUMENTO[modelo]])
+    if 15 <= len(digitos) < 44:
+        return Q(chave_acesso__startswith=digitos)
+    return None
+
+
+# Índice invertido
+
+def _consulta_indice(modelo, termos):
+    """
+    documento_id e relevância dos documentos que contêm todos os termos
+    
+    Cada termo da consulta casa com palavras que começam com ele (LIKE
+    'termo%', que usa o índice tipo+termo); palavra inteira vale o dobro do
+    peso do campo. Uma faixa [termo, sucessor) dependeria da collation:
+    na utf8mb4_0900_ai_ci do MySQL a pontuação ordena antes de letras e
+    dígitos e a faixa de 'luz' ficaria vazia.
+    """
+    tipo = TIPOS[modelo]
+    faixas = reduce(or_, [Q(termo__startswith=termo) for termo in termos])
+    notas = {
+        f'nota_{i}': Max(Case(
+            When(termo=termo, then=F('peso') * 2),
+            When(termo__startswith=termo, then=F('peso')),
+            default=0,
+            output_field=IntegerField(),
+        ))
+        for i, termo in enumerate(termos)
+    }
+    return (
+        TermoBusca.objects.filter(faixas, tipo=tipo)
+        .values('documento_id')
+        .annotate(**notas)
+        .filter(**{f'{nome}__gt': 0 for nome in notas})
+        .annotate(relevancia=reduce(lambda a, b: a + b, [F(nome) for nome in notas]))
+    )
+
+
+def _termos_consulta(texto):
+    termos = list(dict.fromkeys(extrair_termos(texto)))
+    return termos[:MAXIMO_TERMOS_CONSULTA]
+
+
+# Trigramas (PostgreSQL)
+
+def _filtro_trigrama(modelo, texto):
+    filtro = reduce(or_, [Q(**{f'{campo}__icontains': texto}) for campo in PESOS[modelo]])
+    filtro |= Q(chave_acesso__startswith=texto)
+    if modelo is NFe:
+        filtro |= Exists(NFeItem.objects.filter(nfe=OuterRef('pk'), descricao__icontains=texto))
+    return filtro
+
+
+# API
+
+def filtrar(queryset, texto):
+    """
+    Restringe `queryset` (NFe ou CTe) aos documentos que casam com `texto`
+    
+    Mantém a ordenação do queryset; para resultados por relevância use buscar().
+    """
+    texto = (texto or '').strip()
+    if not texto:
+        return queryset
+    modelo = queryset.model
+    
+    exato = _filtro_exato(modelo, texto)
+    if exato is not None:
+        return queryset.filter(exato)
+    
+    if backend() == 'trigrama':
+        return queryset.filter(_filtro_trigrama(modelo, texto))
+    
+    termos = _termos_consulta(texto)
+    if not termos:
+        return queryset.none()
+    return queryset.filter(pk__in=_consulta_indice(modelo, termos).values('documento_id'))
+
+
+def buscar(queryset, texto, limite=20):
+    """Até `limite` documentos de `queryset` que casam com `texto`, mais relevantes primeiro"""
+    texto = (texto or '').strip()
+    if not texto:
+        return []
+    modelo = queryset.model
+    
+    exato = _filtro_exato(modelo, texto)
+    if exato is not None:
+        return list(queryset.filter(exato).order_by('-data_emissao', '-pk')[:limite])
+    
+    if backend() == 'trigrama':
+        from django.contrib.postgres.search import TrigramWordSimilarity
+        from django.db.models.functions import Greatest
+        
+        relevancia = Greatest(*[TrigramWordSimilarity(texto, campo) for campo in PESOS[modelo]])
+        return list(
+            queryset.filter(_filtro_trigrama(modelo, texto))
+            .annotate(relevancia=relevancia)
+            .order_by('-relevancia', '-data_emissao', '-pk')[:limite]
+        )
+    
+    termos = _termos_consulta(texto)
+    if not termos:
+        return []
+    # O ranking é feito no índice; o queryset só restringe (filtros do chamador)
+    consulta = _consulta_indice(modelo, termos)
+    if queryset.query.where:
+        consulta = consulta.filter(documento_id__in=queryset.values('pk'))
+    ordenados = list(
+        consulta.order_by('-relevancia', '-documento_id')
+        .values_list('documento_id', 'relevancia')[:limite]
+    )
+    documentos = queryset.in_bulk([documento_id for documento_id, _ in ordenados])
+    resultado = []
+    for documento_id, relevancia in ordenados:
+        documento = documentos.get(documento_id)
+        if documento is not None:
+            documento.relevancia = relevancia
+            resultado.append(documento)
+    return resultado
+
+
+def indexar(modelo, ids):
+    """
+    (Re)indexa os documentos `ids` de `modelo` (NFe ou CTe)
+    
+    Ids de documentos que não existem mais têm os termos removidos. Use após
+    bulk_create ou gravações feitas fora do Django.
+    """
+    tipo = TIPOS[modelo]
+    pesos = PESOS[modelo]
+    ids = list(ids)
+    for inicio in range(0, len(ids), BLOCO_INDEXACAO):
+        bloco = ids[inicio:inicio + BLOCO_INDEXACAO]
+        termos_por_documento = {}
+        for valores in modelo.objects.filter(pk__in=bloco).values('pk', *pesos):
+            _acumular_termos(termos_por_documento.setdefault(valores['pk'], {}), valores, pesos)
+        if modelo is NFe:
+            for valores in NFeItem.objects.filter(nfe_id__in=bloco).values('nfe_id', *PESOS_ITEM):
+                termos = termos_por_documento.get(valores['nfe_id'])
+                if termos is not None:
+                    _acumular_termos(termos, valores, PESOS_ITEM)
+        
+        with transaction.atomic():
+            TermoBusca.objects.filter(tipo=tipo, documento_id__in=bloco).delete()
+            TermoBusca.objects.bulk_create(
+                [
+                    TermoBusca(tipo=tipo, documento_id=documento_id, termo=termo, peso=peso)
+                    for documento_id, termos in termos_por_documento.items()
+                    for termo, peso in termos.items()
+                ],
+                batch_size=1000,
+            )
+
+
+def _adicionar_item(item):
+    """Acrescenta ao índice os termos de um item novo (sem reindexar a nota)"""
+    termos = {}
+    _acumular_termos(termos, {campo: getattr(item, campo) for campo in PESOS_ITEM}, PESOS_ITEM)
+    TermoBusca.objects.bulk_create(
+        [
+            TermoBusca(tipo='NFe', documento_id=item.nfe_id, termo=termo, peso=peso)
+            for termo, peso in termos.items()
+        ],
+        ignore_conflicts=True,
+    )
+
+
+# Sinais
+
+@receiver(post_save, sender=NFe)
+@receiver(post_save, sender=CTe)
+def documento_salvo(sender, instance, raw=False, **kwargs):
+    if not raw and backend() == 'indice':
+        indexar(sender, [instance.pk])
+
+
+@receiver(post_delete, sender=NFe)
+@receiver(post_delete, sender=CTe)
+def documento_excluido(sender, instance, **kwargs):
+    if backend() == 'indice':
+        TermoBusca.objects.filter(tipo=TIPOS[sender], documento_id=instance.pk).delete()
+
+
+@receiver(post_save, sender=NFeItem)
+def item_salvo(sender, instance, created=False, raw=False, **kwargs):
+    if raw or backend() != 'indice':
+        return
+    if created:
+        _adicionar_item(instance)
+    else:
+        indexar(NFe, [instance.nfe_id])
+
+
+@receiver(post_delete, sender=NFeItem)
+def item_excluido(sender, instance, origin=None, **kwargs):
+    # Na exclusão em cascata a própria NFe sai do índice
+    if backend() != 'indice' or isinstance(origin, NFe):
+        return
+    indexar(NFe, [instance.nfe_id])
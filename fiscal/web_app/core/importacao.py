@@ -0,0 +1,250 @@
+"""
+Importação de XMLs baixados da SEFAZ para NFe/NFeItem/CTe
+
+Usa o mesmo parser da importação de arquivos (xml_parser.py na raiz do
+projeto) e grava em lote: XMLs no armazenamento comprimido (xml_store),
+documentos e itens com bulk_create, resumos diários (rollups) e índice de
+busca atualizados de uma vez, e os DocumentoConsultado marcados como
+importados com um único UPDATE.
+
+Uso:
+    importar_documentos(DocumentoConsultado.objects.filter(...), usuario)
+"""
+import io
+import sys
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import busca, rollups, xml_store
+from .models import NFe, NFeItem, CTe, ImportLog
+from .models_certificado import DocumentoConsultado
+
+
+TIPOS = {'NFE': 'NFe', 'CTE': 'CTe'}
+
+# Campos do parser (import_to_cloudsql) -> campos dos modelos
+CAMPOS_NFE = {
+    'chave_acesso': 'chave_acesso', 'numero_nf': 'numero_nf', 'serie': 'serie',
+    'cnpj': 'emit_cnpj', 'nome': 'emit_nome', 'fantasia': 'emit_fantasia', 'ie': 'emit_ie',
+    'endereco': 'emit_endereco', 'municipio': 'emit_municipio', 'uf': 'emit_uf', 'cep': 'emit_cep',
+    'dest_cnpj_cpf': 'dest_cnpj_cpf', 'dest_nome': 'dest_nome', 'dest_ie': 'dest_ie',
+    'dest_endereco': 'dest_endereco', 'dest_municipio': 'dest_municipio',
+    'dest_uf': 'dest_uf', 'dest_cep': 'dest_cep',
+    'valor_total': 'valor_total', 'valor_produtos': 'valor_produtos', 'valor_icms': 'valor_icms',
+    'valor_ipi': 'valor_ipi', 'valor_pis': 'valor_pis', 'valor_cofins': 'valor_cofins',
+    'valor_tributos': 'valor_tributos',
+    'status': 'status_nfe', 'protocolo': 'protocolo', 'motivo': 'motivo',
+}
+CAMPOS_CTE = {
+    'chave_acesso': 'chave_acesso', 'numero_ct': 'numero_ct', 'serie': 'serie',
+    'emit_cnpj': 'emit_cnpj', 'emit_nome': 'emit_nome', 'emit_fantasia': 'emit_fantasia',
+    'emit_ie': 'emit_ie', 'emit_endereco': 'emit_endereco', 'emit_municipio': 'emit_municipio',
+    'emit_uf': 'emit_uf',
+    'rem_cnpj': 'rem_cnpj', 'rem_nome': 'rem_nome', 'rem_ie': 'rem_ie',
+    'rem_municipio': 'rem_municipio', 'rem_uf': 'rem_uf',
+    'dest_cnpj': 'dest_cnpj', 'dest_nome': 'dest_nome', 'dest_ie': 'dest_ie',
+    'dest_municipio': 'dest_municipio', 'dest_uf': 'dest_uf',
+    'modal': 'modal', 'tipo_servico': 'tipo_servico', 'cfop': 'cfop',
+    'natureza_operacao': 'natureza_operacao',
+    'municipio_inicio': 'municipio_inicio', 'uf_inicio': 'uf_inicio',
+    'municipio_fim': 'municipio_fim', 'uf_fim': 'uf_fim',
+    'valor_total': 'valor_total', 'valor_receber': 'valor_receber',
+    'valor_carga': 'valor_carga', 'valor_icms': 'valor_icms',
+    'status': 'status_cte', 'protocolo': 'protocolo', 'motivo': 'motivo',
+}
+CAMPOS_ITEM = (
+    'numero_item', 'codigo_produto', 'descricao', 'ncm', 'cfop', 'cest', 'unidade',
+    'quantidade', 'valor_unitario', 'valor_total', 'ean',
+    'valor_icms', 'valor_ipi', 'valor_pis', 'valor_cofins',
+)
+
+_parser = None
+
+
+def obter_parser():
+    """Parser de xml_parser.py (engine em settings.XML_PARSER_ENGINE)"""
+    global _parser
+    if _parser is None:
+        raiz = str(settings.PROJECT_ROOT)
+        if raiz not in sys.path:
+            sys.path.append(raiz)
+        from xml_parser import criar_parser
+        _parser = criar_parser(getattr(settings, 'XML_PARSER_ENGINE', 'etree'))
+    return _parser
+
+
+def parsear(tipo: str, xml: str) -> Dict:
+    """Dados do XML ('NFE' ou 'CTE') no formato do parser ({'error': ...} se inválido)"""
+    arquivo = io.BytesIO(xml.encode('utf-8'))
+    if tipo == 'CTE':
+        return obter_parser().parse_cte(arquivo)
+    return obter_parser().parse_nfe(arquivo)
+
+
+def _valor(valor):
+    # O parser devolve float; str() evita levar o erro binário para o Decimal
+    if isinstance(valor, float):
+        return Decimal(str(valor))
+    return valor
+
+
+def _data(texto):
+    data = parse_datetime(texto) if texto else None
+    if data is not None and settings.USE_TZ and timezone.is_naive(data):
+        data = timezone.make_aware(data)
+    return data
+
+
+def _montar(modelo, campos, dados, usuario):
+    return modelo(
+        data_emissao=_data(dados.get('data_emissao')),
+        arquivo_nome=f"SEFAZ-{dados['chave_acesso']}.xml",
+        usuario_importacao=usuario,
+        **{campo: _valor(dados.get(origem)) for origem, campo in campos.items()},
+    )
+
+
+def _gravar(modelo, documentos: List, itens_por_chave: Dict[str, List[Dict]]):
+    """bulk_create dos documentos (e itens); retorna (documentos, itens) gravados"""
+    with transaction.atomic():
+        modelo.objects.bulk_create(documentos, batch_size=500)
+        # Nem todo banco devolve os ids no bulk_create (MySQL)
+        ids = dict(
+            modelo.objects.filter(chave_acesso__in=[d.chave_acesso for d in documentos])
+            .values_list('chave_acesso', 'pk')
+        )
+        itens = []
+        for documento in documentos:
+            documento.pk = ids[documento.chave_acesso]
+            for item in itens_por_chave.get(documento.chave_acesso, ()):
+                itens.append(NFeItem(
+                    nfe=documento,
+                    **{campo: _valor(item.get(campo)) for campo in CAMPOS_ITEM},
+                ))
+        NFeItem.objects.bulk_create(itens, batch_size=1000)
+    return documentos, itens
+
+
+def importar_documentos(documentos: Iterable[DocumentoConsultado], usuario=None) -> Dict:
+    """
+    Importa os DocumentoConsultado com XML completo ainda não importados
+    
+    Documentos cuja chave já existe em NFe/CTe são só marcados como importados.
+    
+    Returns:
+        Dict com importados, existentes, erros e mensagens (chave -> erro)
+    """
+    resultado = {'importados': 0, 'existentes': 0, 'erros': 0, 'mensagens': {}}
+    pendentes = [
+        documento for documento in documentos
+        if documento.xml_baixado and not documento.importado and documento.xml_completo
+    ]
+    if not pendentes:
+        return resultado
+    
+    tipos = dict(
+        DocumentoConsultado.objects.filter(pk__in=[d.pk for d in pendentes])
+        .values_list('pk', 'consulta__tipo_documento')
+    )
+    logs = []
+    concluidos = []
+    for tipo, modelo, campos in (('NFE', NFe, CAMPOS_NFE), ('CTE', CTe, CAMPOS_CTE)):
+        do_tipo = [d for d in pendentes if tipos.get(d.pk) == tipo]
+        if not do_tipo:
+            continue
+        existentes = set(
+            modelo.objects.filter(chave_acesso__in=[d.chave_acesso for d in do_tipo])
+            .values_list('chave_acesso', flat=True)
+        )
+        
+        novos, xmls, itens_por_chave = [], [], {}
+        for documento in do_tipo:
+            if documento.chave_acesso in existentes:
+                resultado['existentes'] += 1
+                concluidos.append(documento.pk)
+                continue
+            dados = parsear(tipo, documento.xml_completo)
+            if 'error' in dados or not dados.get('chave_acesso'):
+                erro = dados.get('error', 'Chave de acesso não encontrada no XML')
+                resultado['erros'] += 1
+                resultado['mensagens'][documento.chave_acesso] = erro
+                logs.append(ImportLog(
+                    tipo_documento=TIPOS[tipo], arquivo_nome=f"SEFAZ-{documento.chave_acesso}.xml",
+                    status='erro', mensagem=erro, chave_acesso=documento.chave_acesso, usuario=usuario,
+                ))
+                continue
+            concluidos.append(documento.pk)
+            if dados['chave_acesso'] in existentes:
+                resultado['existentes'] += 1
+                continue
+            existentes.add(dados['chave_acesso'])
+            novos.append(_montar(modelo, campos, dados, usuario))
+            xmls.append(documento.xml_completo)
+            itens_por_chave[dados['chave_acesso']] = dados.get('itens') or []
+        
+        if not novos:
+            continue
+        for documento, hash_xml in zip(novos, xml_store.salvar_xmls(xmls)):
+            documento.xml_hash = hash_xml
+        try:
+            gravados, itens = _gravar(modelo, novos, itens_por_chave)
+        except IntegrityError:
+            # Outra importação gravou alguma das chaves: grava só as que faltam
+            ja_gravadas = set(
+                modelo.objects.filter(chave_acesso__in=[d.chave_acesso for d in novos])
+                .values_list('chave_acesso', flat=True)
+            )
+            resultado['existentes'] += len(ja_gravadas)
+            gravados, itens = _gravar(
+                modelo, [d for d in novos if d.chave_acesso not in ja_gravadas], itens_por_chave
+            )
+        
+        resultado['importados'] += len(gravados)
+        logs.extend(
+            ImportLog(
+                tipo_documento=TIPOS[tipo], arquivo_nome=documento.arquivo_nome, status='sucesso',
+                chave_acesso=documento.chave_acesso, usuario=usuario,
+            )
+            for documento in gravados
+        )
+        # bulk_create não dispara os sinais de resumos e busca
+        if tipo == 'NFE':
+            rollups.registrar_lote(nfes=gravados, itens=itens)
+        else:
+            rollups.registrar_lote(ctes=gravados)
+        if busca.backend() == 'indice':
+            busca.indexar(modelo, [documento.pk for documento in gravados])
+    
+    ImportLog.objects.bulk_create(logs, batch_size=500)
+    DocumentoConsultado.objects.filter(pk__in=concluidos).update(
+        importado=True, data_importacao=timezone.now()
+    )
+    return resultado
+
+
+def importar_pendentes(usuario=None, limite: Optional[int] = None, lote: int = 200) -> Dict:
+    """Importa, em lotes, os documentos baixados e não importados (de `usuario`, se informado)"""
+    total = {'importados': 0, 'existentes': 0, 'erros': 0, 'mensagens': {}}
+    consulta = DocumentoConsultado.objects.filter(xml_baixado=True, importado=False)
+    if usuario is not None:
+        consulta = consulta.filter(consulta__certificado__usuario=usuario)
+    
+    ultimo_id = 0
+    processados = 0
+    while limite is None or processados < limite:
+        tamanho = lote if limite is None else min(lote, limite - processados)
+        documentos = list(consulta.filter(pk__gt=ultimo_id).order_by('pk')[:tamanho])
+        if not documentos:
+            break
+        ultimo_id = documentos[-1].pk
+        processados += len(documentos)
+        parcial = importar_documentos(documentos, usuario)
+        for chave in ('importados', 'existentes', 'erros'):
+            total[chave] += parcial[chave]
+        total['mensagens'].update(parcial['mensagens'])
+    return total
@@ -0,0 +1,69 @@
+"""
+Baixa da SEFAZ os XMLs completos das NFe consultadas só com resumo e os
+importa (ver core/sefaz_download.py e core/importacao.py)
+
+Uso:
+    python manage.py baixar_xml_sefaz
+    python manage.py baixar_xml_sefaz --certificado 3 --limite 500 --por-minuto 20
+    python manage.py baixar_xml_sefaz --sem-importar
+    python manage.py baixar_xml_sefaz --so-importar     # só importa o que já foi baixado
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from core import importacao, sefaz_download, sefaz_sessao
+from core.models_certificado import CertificadoDigital
+
+
+class Command(BaseCommand):
+    help = 'Baixa em lote os XMLs completos pendentes e importa as NFe'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--certificado', type=int, help='Id do certificado (padrão: todos os ativos)')
+        parser.add_argument('--limite', type=int, help='Máximo de documentos por certificado')
+        parser.add_argument('--trabalhadores', type=int, default=sefaz_download.TRABALHADORES)
+        parser.add_argument('--por-uf', type=int, default=sefaz_download.POR_UF,
+                            help='Requisições simultâneas por UF do documento')
+        parser.add_argument('--por-minuto', type=float, default=sefaz_download.POR_MINUTO,
+                            help='Requisições por minuto por certificado')
+        parser.add_argument('--sem-importar', action='store_true', help='Só baixa os XMLs')
+        parser.add_argument('--so-importar', action='store_true', help='Só importa os XMLs já baixados')
+    
+    def handle(self, *args, **options):
+        if options['so_importar']:
+            resultado = importacao.importar_pendentes(limite=options['limite'])
+            self.stdout.write(self.style.SUCCESS(
+                f"{resultado['importados']} importados, {resultado['existentes']} já existentes, "
+                f"{resultado['erros']} erros"
+            ))
+            return
+        
+        certificados = None
+        if options['certificado']:
+            certificados = CertificadoDigital.objects.filter(pk=options['certificado'])
+            if not certificados.exists():
+                raise CommandError(f"Certificado {options['certificado']} não encontrado")
+        
+        resultados = sefaz_download.baixar_pendentes(
+            certificados,
+            limite=options['limite'],
+            importar=not options['sem_importar'],
+            por_minuto=options['por_minuto'],
+            trabalhadores=options['trabalhadores'],
+            por_uf=options['por_uf'],
+        )
+        if not resultados:
+            self.stdout.write('Nenhum XML pendente')
+        for certificado, resultado in resultados.items():
+            estilo = self.style.SUCCESS if resultado['status'] == 'ok' else self.style.WARNING
+            self.stdout.write(estilo(
+                f"{certificado.cnpj}: {resultado['baixados']} baixados, "
+                f"{resultado['indisponiveis']} indisponíveis, {resultado['importados']} importados, "
+                f"{resultado['erros']} erros {resultado['mensagem']}".rstrip()
+            ))
+        
+        if options['verbosity'] >= 2:
+            uso = sefaz_sessao.metricas()
+            self.stdout.write(
+                f"Conexões SEFAZ: {uso['requisicoes']} requisições, {uso['handshakes']} handshakes, "
+                f"{uso['conexoes_reusadas']} reusadas"
+            )
@@ -0,0 +1,96 @@
+"""
+Compara a busca de core/busca.py com as cadeias de icontains antigas
+
+Para cada termo mede (mediana de N execuções) a primeira página de 20
+resultados e a contagem total, nas duas implementações.
+
+Uso:
+    python manage.py benchmark_busca
+    python manage.py benchmark_busca "transportes" 35240112345678000190 --repeticoes 10
+"""
+import statistics
+import time
+from functools import reduce
+from operator import or_
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from core import busca
+from core.models import NFe, NFeItem, CTe
+
+
+CAMPOS_LEGADOS = {
+    NFe: ('numero_nf', 'emit_nome', 'dest_nome', 'chave_acesso'),
+    CTe: ('numero_ct', 'emit_nome', 'dest_nome', 'chave_acesso'),
+}
+
+
+def filtro_legado(modelo, termo):
+    """Filtro usado antes por nfe_list/cte_list/search_api"""
+    return reduce(or_, [Q(**{f'{campo}__icontains': termo}) for campo in CAMPOS_LEGADOS[modelo]])
+
+
+def cronometrar(funcao, repeticoes):
+    tempos = []
+    resultado = None
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tempos), resultado
+
+
+class Command(BaseCommand):
+    help = 'Compara o tempo da busca indexada com a busca por icontains'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('termos', nargs='*', help='Termos (padrão: amostrados dos dados)')
+        parser.add_argument('--repeticoes', type=int, default=5)
+    
+    def handle(self, *args, **options):
+        termos = options['termos'] or self.amostrar_termos()
+        if not termos:
+            self.stdout.write('Sem documentos para amostrar termos; informe-os na linha de comando')
+            return
+        
+        self.stdout.write(f"Backend: {busca.backend()}")
+        self.stdout.write(
+            f"{'modelo':<5} {'termo':<46} {'legado ms':>10} {'novo ms':>10} "
+            f"{'cont. leg. ms':>14} {'cont. novo ms':>14} {'total leg.':>10} {'total novo':>10}"
+        )
+        for termo in termos:
+            for modelo in (NFe, CTe):
+                self.comparar(modelo, termo, options['repeticoes'])
+    
+    def comparar(self, modelo, termo, repeticoes):
+        legado = modelo.objects.filter(filtro_legado(modelo, termo))
+        novo = busca.filtrar(modelo.objects.all(), termo)
+        
+        ms_legado, _ = cronometrar(lambda: list(legado.order_by('-data_emissao')[:20]), repeticoes)
+        ms_novo, _ = cronometrar(lambda: busca.buscar(modelo.objects.all(), termo, 20), repeticoes)
+        ms_cont_legado, total_legado = cronometrar(legado.count, repeticoes)
+        ms_cont_novo, total_novo = cronometrar(novo.count, repeticoes)
+        
+        self.stdout.write(
+            f"{busca.TIPOS[modelo]:<5} {termo[:46]:<46} {ms_legado:>10.1f} {ms_novo:>10.1f} "
+            f"{ms_cont_legado:>14.1f} {ms_cont_novo:>14.1f} {total_legado:>10} {total_novo:>10}"
+        )
+    
+    def amostrar_termos(self):
+        """Um nome de emitente, uma palavra de produto, um número, uma chave e um CNPJ"""
+        termos = []
+        nfe = NFe.objects.exclude(emit_nome=None).order_by('-pk').values(
+            'emit_nome', 'numero_nf', 'chave_acesso', 'emit_cnpj'
+        ).first()
+        if nfe:
+            palavras = busca.extrair_termos(nfe['emit_nome'])
+            termos += [max(palavras, key=len)] if palavras else []
+            termos += [valor for valor in (nfe['numero_nf'], nfe['chave_acesso'], nfe['emit_cnpj']) if valor]
+        descricao = NFeItem.objects.exclude(descricao=None).order_by('-pk').values_list(
+            'descricao', flat=True
+        ).first()
+        if descricao:
+            palavras = busca.extrair_termos(descricao)
+            termos += [max(palavras, key=len)] if palavras else []
+        return termos
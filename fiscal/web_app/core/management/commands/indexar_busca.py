@@ -0,0 +1,97 @@
+"""
+Prepara a busca de NFe/CTe (ver core/busca.py)
+
+PostgreSQL: cria a extensão pg_trgm e os índices de trigramas.
+Demais bancos: alimenta o índice invertido TermoBusca.
+
+Uso:
+    python manage.py indexar_busca              # só documentos ainda sem termos
+    python manage.py indexar_busca --completo   # reindexa tudo
+"""
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Exists, OuterRef
+
+from core import busca
+from core.models import NFe, NFeItem, CTe, TermoBusca
+
+
+# (tabela, coluna) com índice GIN de trigramas; a expressão acompanha a
+# usada pelo Django no icontains do PostgreSQL: UPPER(coluna::text)
+COLUNAS_TRIGRAMA = [
+    (NFe, 'numero_nf'), (NFe, 'emit_nome'), (NFe, 'dest_nome'),
+    (CTe, 'numero_ct'), (CTe, 'emit_nome'), (CTe, 'dest_nome'),
+    (NFeItem, 'descricao'),
+]
+
+
+class Command(BaseCommand):
+    help = 'Cria os índices de trigramas (PostgreSQL) ou alimenta o índice invertido de busca'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--completo', action='store_true', help='Reindexa todos os documentos')
+        parser.add_argument('--lote', type=int, default=2000, help='Documentos por lote')
+    
+    def handle(self, *args, **options):
+        if busca.backend() == 'trigrama':
+            self.criar_indices_trigrama()
+            return
+        for modelo in (NFe, CTe):
+            self.indexar(modelo, options['completo'], options['lote'])
+        self.atualizar_estatisticas()
+    
+    def criar_indices_trigrama(self):
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            for modelo, coluna in COLUNAS_TRIGRAMA:
+                tabela = modelo._meta.db_table
+                nome = f"{tabela}_{coluna}_trgm"
+                cursor.execute(
+                    f'CREATE INDEX IF NOT EXISTS "{nome}" ON "{tabela}" '
+                    f'USING gin (UPPER("{coluna}"::text) gin_trgm_ops)'
+                )
+                self.stdout.write(f"  {nome}")
+        self.stdout.write(self.style.SUCCESS('Índices de trigramas prontos'))
+    
+    def atualizar_estatisticas(self):
+        # Sem estatísticas o SQLite prefere o índice único (tipo, documento_id, ...)
+        # e lê todos os termos do tipo em vez da faixa de (tipo, termo)
+        tabela = TermoBusca._meta.db_table
+        with connection.cursor() as cursor:
+            if connection.vendor == 'mysql':
+                cursor.execute(f"ANALYZE TABLE {tabela}")
+                cursor.fetchall()
+            elif connection.vendor == 'sqlite':
+                cursor.execute(f'ANALYZE "{tabela}"')
+    
+    def indexar(self, modelo, completo, tamanho_lote):
+        tipo = busca.TIPOS[modelo]
+        documentos = modelo.objects.all()
+        if not completo:
+            documentos = documentos.filter(~Exists(
+                TermoBusca.objects.filter(tipo=tipo, documento_id=OuterRef('pk'))
+            ))
+        
+        ultimo_id = 0
+        indexados = 0
+        while True:
+            ids = list(
+                documentos.filter(pk__gt=ultimo_id).order_by('pk')
+                .values_list('pk', flat=True)[:tamanho_lote]
+            )
+            if not ids:
+                break
+            ultimo_id = ids[-1]
+            busca.indexar(modelo, ids)
+            indexados += len(ids)
+            self.stdout.write(f"  {tipo}: {indexados} documentos indexados")
+        
+        if completo:
+            # Termos de documentos removidos fora do Django
+            orfaos = TermoBusca.objects.filter(tipo=tipo).exclude(
+                documento_id__in=modelo.objects.values('pk')
+            ).delete()[0]
+            if orfaos:
+                self.stdout.write(f"  {tipo}: {orfaos} termos órfãos removidos")
+        
+        self.stdout.write(self.style.SUCCESS(f"{tipo}: {indexados} documentos indexados"))
@@ -0,0 +1,119 @@
+"""
+Move o XML legado (xml_content) de NFe/CTe para o armazenamento comprimido
+
+Uso:
+    python manage.py migrar_xml_blobs
+    python manage.py migrar_xml_blobs --modelo nfe --lote 500 --otimizar
+"""
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection, transaction
+
+from core.models import NFe, CTe
+from core.xml_store import salvar_xmls
+
+
+MODELOS = {'nfe': NFe, 'cte': CTe}
+
+
+def tamanho_tabela(modelo):
+    """
+    Tamanho da tabela do modelo em bytes (dados + índices)
+    
+    No SQLite usa a tabela virtual dbstat; se ela não estiver disponível,
+    soma os tamanhos de xml_content como aproximação.
+    """
+    tabela = modelo._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute(
+                "SELECT data_length + index_length FROM information_schema.TABLES "
+                "WHERE table_schema = DATABASE() AND table_name = %s",
+                [tabela]
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute("SELECT pg_total_relation_size(%s)", [tabela])
+        else:
+            try:
+                cursor.execute(
+                    "SELECT SUM(pgsize) FROM dbstat WHERE name = %s "
+                    "OR name IN (SELECT name FROM sqlite_master WHERE tbl_name = %s)",
+                    [tabela, tabela]
+                )
+            except DatabaseError:
+                cursor.execute(f"SELECT COALESCE(SUM(LENGTH(xml_content)), 0) FROM {tabela}")
+        linha = cursor.fetchone()
+    return int(linha[0] or 0) if linha else 0
+
+
+def formatar_bytes(tamanho):
+    for unidade in ('B', 'KB', 'MB', 'GB'):
+        if tamanho < 1024 or unidade == 'GB':
+            return f"{tamanho:.1f} {unidade}"
+        tamanho /= 1024
+
+
+class Command(BaseCommand):
+    help = 'Move o xml_content de NFe/CTe para o armazenamento de XMLs comprimidos'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--modelo', choices=['nfe', 'cte', 'todos'], default='todos')
+        parser.add_argument('--lote', type=int, default=1000, help='Documentos por transação')
+        parser.add_argument(
+            '--otimizar', action='store_true',
+            help='Recompacta a tabela ao final (OPTIMIZE TABLE / VACUUM) para liberar o espaço'
+        )
+    
+    def handle(self, *args, **options):
+        nomes = list(MODELOS) if options['modelo'] == 'todos' else [options['modelo']]
+        for nome in nomes:
+            self.migrar(MODELOS[nome], options['lote'], options['otimizar'])
+    
+    def migrar(self, modelo, tamanho_lote, otimizar):
+        nome = modelo.__name__
+        antes = tamanho_tabela(modelo)
+        pendentes = modelo.objects.filter(
+            xml_hash__isnull=True, xml_content__isnull=False
+        ).exclude(xml_content='')
+        
+        ultimo_id = 0
+        migrados = 0
+        while True:
+            lote = list(
+                pendentes.filter(pk__gt=ultimo_id)
+                .order_by('pk')
+                .only('pk', 'xml_content')[:tamanho_lote]
+            )
+            if not lote:
+                break
+            ultimo_id = lote[-1].pk
+            
+            with transaction.atomic():
+                hashes = salvar_xmls([documento.xml_content for documento in lote])
+                for documento, hash_xml in zip(lote, hashes):
+                    documento.xml_hash = hash_xml
+                    documento.xml_content = None
+                modelo.objects.bulk_update(lote, ['xml_hash', 'xml_content'])
+            
+            migrados += len(lote)
+            self.stdout.write(f"  {nome}: {migrados} XMLs migrados (até id {ultimo_id})")
+        
+        if otimizar:
+            self.otimizar_tabela(modelo)
+        
+        depois = tamanho_tabela(modelo)
+        self.stdout.write(self.style.SUCCESS(
+            f"{nome}: {migrados} XMLs migrados - tabela {formatar_bytes(antes)} -> {formatar_bytes(depois)}"
+        ))
+        if connection.vendor == 'mysql' and not otimizar:
+            self.stdout.write("  (o InnoDB só devolve o espaço após OPTIMIZE TABLE; use --otimizar)")
+    
+    def otimizar_tabela(self, modelo):
+        tabela = modelo._meta.db_table
+        with connection.cursor() as cursor:
+            if connection.vendor == 'mysql':
+                cursor.execute(f"OPTIMIZE TABLE {tabela}")
+                cursor.fetchall()
+            elif connection.vendor == 'postgresql':
+                cursor.execute(f"VACUUM FULL {tabela}")
+            else:
+                cursor.execute("VACUUM")
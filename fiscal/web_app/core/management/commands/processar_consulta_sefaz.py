@@ -0,0 +1,31 @@
+"""
+Executa uma ConsultaSEFAZ pendente (distribuição DFe a partir do último NSU)
+
+Uso:
+    python manage.py processar_consulta_sefaz <consulta_id>
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from core import sefaz_sync
+from core.models_certificado import ConsultaSEFAZ
+
+
+class Command(BaseCommand):
+    help = 'Processa uma consulta SEFAZ pendente'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('consulta_id', type=int)
+    
+    def handle(self, *args, **options):
+        try:
+            consulta = ConsultaSEFAZ.objects.select_related('certificado').get(pk=options['consulta_id'])
+        except ConsultaSEFAZ.DoesNotExist:
+            raise CommandError(f"Consulta {options['consulta_id']} não encontrada")
+        
+        consulta = sefaz_sync.processar_consulta(consulta)
+        self.stdout.write(
+            f"Consulta {consulta.pk}: {consulta.status} - "
+            f"{consulta.total_encontrados} documentos novos, {consulta.total_erros} erros"
+        )
+        if consulta.mensagem_erro:
+            self.stdout.write(self.style.ERROR(consulta.mensagem_erro))
@@ -0,0 +1,41 @@
+"""
+Reconstrói os resumos diários do dashboard a partir de NFe/NFeItem/CTe
+
+Uso:
+    python manage.py reconstruir_resumos
+    python manage.py reconstruir_resumos --inicio 2024-01-01 --fim 2024-01-31
+"""
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import rollups
+from core.models import (
+    ResumoDiarioDocumento, ResumoDiarioEmitente,
+    ResumoDiarioProduto, ResumoDiarioRota,
+)
+
+
+def _data(texto):
+    try:
+        return date.fromisoformat(texto)
+    except ValueError:
+        raise CommandError(f'Data inválida: {texto} (use AAAA-MM-DD)')
+
+
+class Command(BaseCommand):
+    help = 'Recalcula os resumos diários (documentos, emitentes, produtos e rotas)'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--inicio', help='Primeiro dia a recalcular (AAAA-MM-DD)')
+        parser.add_argument('--fim', help='Último dia a recalcular (AAAA-MM-DD)')
+    
+    def handle(self, *args, **options):
+        inicio = _data(options['inicio']) if options['inicio'] else None
+        fim = _data(options['fim']) if options['fim'] else None
+        
+        rollups.reconstruir(inicio, fim)
+        
+        for modelo in (ResumoDiarioDocumento, ResumoDiarioEmitente, ResumoDiarioProduto, ResumoDiarioRota):
+            self.stdout.write(f"  {modelo._meta.verbose_name_plural}: {modelo.objects.count()} linhas")
+        self.stdout.write(self.style.SUCCESS('Resumos reconstruídos'))
@@ -0,0 +1,67 @@
+"""
+Worker da distribuição DFe: processa consultas pendentes e sincroniza os
+certificados com consulta automática cujo intervalo_consulta já passou
+
+Uso:
+    python manage.py sincronizar_sefaz                 # uma varredura
+    python manage.py sincronizar_sefaz --loop          # contínuo (a cada 60s)
+    python manage.py sincronizar_sefaz --loop --intervalo 120 --tipo NFE
+    python manage.py sincronizar_sefaz --loop --baixar  # também baixa e importa os XMLs completos
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core import sefaz_download, sefaz_sessao, sefaz_sync
+
+
+class Command(BaseCommand):
+    help = 'Sincroniza documentos da SEFAZ (DistDFe) a partir do último NSU de cada certificado'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Executa continuamente')
+        parser.add_argument('--intervalo', type=int, default=60, help='Segundos entre varreduras (--loop)')
+        parser.add_argument('--tipo', choices=['NFE', 'CTE', 'todos'], default='todos')
+        parser.add_argument('--baixar', action='store_true',
+                            help='Baixa e importa os XMLs completos pendentes após sincronizar')
+    
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        tipos = sefaz_sync.TIPOS_SINCRONIZADOS if options['tipo'] == 'todos' else (options['tipo'],)
+        while True:
+            close_old_connections()
+            self.varrer(tipos)
+            if options['baixar']:
+                self.baixar()
+            self.metricas()
+            if not options['loop']:
+                break
+            time.sleep(options['intervalo'])
+    
+    def varrer(self, tipos):
+        pendentes = sefaz_sync.processar_pendentes()
+        if pendentes:
+            self.stdout.write(f"{pendentes} consultas pendentes processadas")
+        
+        for consulta in sefaz_sync.sincronizar_automaticos(tipos):
+            estilo = self.style.ERROR if consulta.status == 'ERRO' else self.style.SUCCESS
+            self.stdout.write(estilo(
+                f"{consulta.certificado.cnpj} {consulta.tipo_documento}: {consulta.status} - "
+                f"{consulta.total_encontrados} novos {consulta.mensagem_erro}".rstrip()
+            ))
+    
+    def baixar(self):
+        for certificado, resultado in sefaz_download.baixar_pendentes().items():
+            self.stdout.write(
+                f"{certificado.cnpj} XML: {resultado['baixados']} baixados, "
+                f"{resultado['importados']} importados {resultado['mensagem']}".rstrip()
+            )
+    
+    def metricas(self):
+        if self.verbosity >= 2:
+            uso = sefaz_sessao.metricas()
+            self.stdout.write(
+                f"Conexões SEFAZ: {uso['requisicoes']} requisições, {uso['handshakes']} handshakes, "
+                f"{uso['conexoes_reusadas']} reusadas, {uso['sessoes_ativas']} sessões"
+            )
@@ -5,7 +5,52 @@ from django.db import models
 from django.contrib.auth.models import User
 
 
-class NFe(models.Model):
+class DocumentoFiscalManager(models.Manager):
+    """Não carrega o XML legado nas consultas; use o acessor `xml`"""
+    
+    def get_queryset(self):
+        return super().get_queryset().defer('xml_content')
+
+
+class XMLReferenciadoMixin:
+    """Acesso ao XML bruto guardado fora da linha (ver core.xml_store)"""
+    
+    @property
+    def xml(self):
+        """XML do documento, carregado do armazenamento só quando acessado"""
+        if not self.xml_hash:
+            return self.xml_content
+        if getattr(self, '_xml_carregado', None) is None:
+            from .xml_store import carregar_xml
+            self._xml_carregado = carregar_xml(self.xml_hash)
+        return self._xml_carregado
+    
+    def definir_xml(self, xml):
+        """Grava o XML no armazenamento e mantém só a referência na linha"""
+        from .xml_store import salvar_xml
+        self.xml_hash = salvar_xml(xml) if xml else None
+        self.xml_content = None
+        self._xml_carregado = xml or None
+
+
+class XMLArmazenado(models.Model):
+    """XML bruto comprimido, endereçado pelo SHA-256 do conteúdo"""
+    
+    hash = models.CharField(max_length=64, primary_key=True)
+    compressao = models.CharField(max_length=10)
+    tamanho_original = models.PositiveIntegerField()
+    conteudo = models.BinaryField()
+    criado_em = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = "XML armazenado"
+        verbose_name_plural = "XMLs armazenados"
+    
+    def __str__(self):
+        return self.hash
+
+
+class NFe(XMLReferenciadoMixin, models.Model):
     """Nota Fiscal Eletrônica"""
     
     # Identificação
@@ -47,12 +92,15 @@ class NFe(models.Model):
     protocolo = models.CharField(max_length=50, null=True, blank=True)
     motivo = models.TextField(null=True, blank=True)
     
-    # XML e controle
+    # XML e controle (xml_content é legado; o XML fica em XMLArmazenado)
     xml_content = models.TextField(null=True, blank=True)
+    xml_hash = models.CharField(max_length=64, null=True, blank=True, db_index=True)
     arquivo_nome = models.CharField(max_length=255, null=True, blank=True)
     data_importacao = models.DateTimeField(auto_now_add=True)
     usuario_importacao = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     
+    objects = DocumentoFiscalManager()
+    
     class Meta:
         verbose_name = "NFe - Nota Fiscal Eletrônica"
         verbose_name_plural = "NFe - Notas Fiscais Eletrônicas"
@@ -99,7 +147,7 @@ class NFeItem(models.Model):
         return f"Item {self.numero_item} - {self.descricao}"
 
 
-class CTe(models.Model):
+class CTe(XMLReferenciadoMixin, models.Model):
     """Conhecimento de Transporte Eletrônico"""
     
     # Identificação
@@ -152,12 +200,15 @@ class CTe(models.Model):
     protocolo = models.CharField(max_length=50, null=True, blank=True)
     motivo = models.TextField(null=True, blank=True)
     
-    # XML e controle
+    # XML e controle (xml_content é legado; o XML fica em XMLArmazenado)
     xml_content = models.TextField(null=True, blank=True)
+    xml_hash = models.CharField(max_length=64, null=True, blank=True, db_index=True)
     arquivo_nome = models.CharField(max_length=255, null=True, blank=True)
     data_importacao = models.DateTimeField(auto_now_add=True)
     usuario_importacao = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     
+    objects = DocumentoFiscalManager()
+    
     class Meta:
         verbose_name = "CTe - Conhecimento de Transporte"
         verbose_name_plural = "CTe - Conhecimentos de Transporte"
@@ -200,3 +251,117 @@ class ImportLog(models.Model):
     
     def __str__(self):
         return f"{self.tipo_documento} - {self.arquivo_nome} ({self.status})"
+
+
+class ResumoDiarioDocumento(models.Model):
+    """Total diário de documentos por tipo (mantido por core.rollups)"""
+    
+    dia = models.DateField(null=True, blank=True)
+    tipo = models.CharField(max_length=10)
+    quantidade = models.IntegerField(default=0)
+    valor = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    
+    class Meta:
+        verbose_name = "Resumo diário de documentos"
+        verbose_name_plural = "Resumos diários de documentos"
+        constraints = [
+            models.UniqueConstraint(fields=['dia', 'tipo'], name='uniq_resumo_documento'),
+        ]
+        indexes = [
+            models.Index(fields=['tipo', 'dia']),
+        ]
+    
+    def __str__(self):
+        return f"{self.tipo} {self.dia}: {self.quantidade}"
+
+
+class ResumoDiarioEmitente(models.Model):
+    """Total diário de NFes por emitente (mantido por core.rollups)"""
+    
+    dia = models.DateField(null=True, blank=True)
+    emit_cnpj = models.CharField(max_length=14, blank=True, default='')
+    emit_nome = models.CharField(max_length=255, blank=True, default='')
+    quantidade = models.IntegerField(default=0)
+    valor = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    
+    class Meta:
+        verbose_name = "Resumo diário por emitente"
+        verbose_name_plural = "Resumos diários por emitente"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dia', 'emit_cnpj', 'emit_nome'], name='uniq_resumo_emitente'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.emit_nome} {self.dia}: {self.quantidade}"
+
+
+class ResumoDiarioProduto(models.Model):
+    """Quantidade e valor diários por produto dos itens de NFe (mantido por core.rollups)"""
+    
+    dia = models.DateField(null=True, blank=True)
+    codigo_produto = models.CharField(max_length=60, blank=True, default='')
+    descricao = models.CharField(max_length=255, blank=True, default='')
+    quantidade = models.DecimalField(max_digits=20, decimal_places=4, default=0)
+    valor = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    
+    class Meta:
+        verbose_name = "Resumo diário por produto"
+        verbose_name_plural = "Resumos diários por produto"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dia', 'codigo_produto', 'descricao'], name='uniq_resumo_produto'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.codigo_produto} {self.dia}: {self.quantidade}"
+
+
+class ResumoDiarioRota(models.Model):
+    """Total diário de CTes por rota (mantido por core.rollups)"""
+    
+    dia = models.DateField(null=True, blank=True)
+    municipio_inicio = models.CharField(max_length=100, blank=True, default='')
+    uf_inicio = models.CharField(max_length=2, blank=True, default='')
+    municipio_fim = models.CharField(max_length=100, blank=True, default='')
+    uf_fim = models.CharField(max_length=2, blank=True, default='')
+    quantidade = models.IntegerField(default=0)
+    valor = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    
+    class Meta:
+        verbose_name = "Resumo diário por rota"
+        verbose_name_plural = "Resumos diários por rota"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dia', 'municipio_inicio', 'uf_inicio', 'municipio_fim', 'uf_fim'],
+                name='uniq_resumo_rota'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.municipio_inicio}/{self.uf_inicio} -> {self.municipio_fim}/{self.uf_fim} {self.dia}"
+
+
+class TermoBusca(models.Model):
+    """Índice invertido da busca de NFe/CTe (mantido por core.busca)"""
+    
+    tipo = models.CharField(max_length=10)
+    documento_id = models.BigIntegerField()
+    termo = models.CharField(max_length=40)
+    peso = models.PositiveSmallIntegerField(default=1)
+    
+    class Meta:
+        verbose_name = "Termo de busca"
+        verbose_name_plural = "Termos de busca"
+        constraints = [
+            models.UniqueConstraint(fields=['tipo', 'documento_id', 'termo'], name='uniq_termo_busca'),
+        ]
+        indexes = [
+            # Cobre a busca por prefixo: a consulta não precisa ler a tabela
+            models.Index(fields=['tipo', 'termo', 'documento_id', 'peso'], name='core_termo_busca_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.tipo} {self.documento_id}: {self.termo}"
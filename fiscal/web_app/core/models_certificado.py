@@ -177,3 +177,42 @@ class ConfiguracaoConsulta(models.Model):
     
     def __str__(self):
         return f"Configuração de {self.usuario.username}"
+
+
+class ControleNSU(models.Model):
+    """Último NSU da distribuição DFe (DistDFe) por certificado, tipo e UF autora"""
+    
+    NSU_INICIAL = '000000000000000'
+    
+    certificado = models.ForeignKey(CertificadoDigital, on_delete=models.CASCADE, related_name='controles_nsu')
+    tipo_documento = models.CharField(max_length=10, choices=ConsultaSEFAZ.TIPO_CHOICES)
+    uf = models.CharField(max_length=2)
+    
+    # Posição na fila de distribuição da SEFAZ
+    ult_nsu = models.CharField(max_length=15, default=NSU_INICIAL)
+    max_nsu = models.CharField(max_length=15, default=NSU_INICIAL)
+    
+    # Agendamento (a SEFAZ exige 1h de espera após cStat 137 ou 656)
+    ultima_sincronizacao = models.DateTimeField(null=True, blank=True)
+    proxima_consulta = models.DateTimeField(null=True, blank=True)
+    em_uso_ate = models.DateTimeField(null=True, blank=True, help_text="Trava da sincronização em andamento")
+    
+    # Último retorno
+    ultimo_status = models.CharField(max_length=3, blank=True)
+    ultima_mensagem = models.CharField(max_length=255, blank=True)
+    
+    class Meta:
+        verbose_name = "Controle de NSU"
+        verbose_name_plural = "Controles de NSU"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['certificado', 'tipo_documento', 'uf'], name='uniq_controle_nsu'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.certificado.cnpj} {self.tipo_documento}/{self.uf}: {self.ult_nsu} de {self.max_nsu}"
+    
+    def atualizado(self):
+        """Todos os documentos disponíveis já foram baixados"""
+        return int(self.ult_nsu or 0) >= int(self.max_nsu or 0)
@@ -0,0 +1,218 @@
+"""
+Paginação por cursor (keyset) das listas de NFe/CTe
+
+Em vez de OFFSET, cada página continua a partir da chave (campo de ordenação,
+id) do último documento exibido. Com a ordenação padrão -data_emissao a consulta
+usa os índices (-data_emissao) e (emit_cnpj, -data_emissao) e o custo não cresce
+com a profundidade da página. O COUNT(*) é substituído por contar_estimado(),
+calculado só quando pedido (?contar=1).
+
+Os cursores são opacos (JSON em base64 url-safe) e carregam a ordenação em que
+foram gerados; um cursor de outra ordenação é inválido.
+"""
+import base64
+import binascii
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.db import connections
+from django.db.models import Q
+
+
+class CursorInvalido(ValueError):
+    """Cursor malformado ou gerado para outra ordenação"""
+
+
+PROXIMA = 'p'
+ANTERIOR = 'a'
+
+
+def codificar_cursor(ordem, valor, pk, direcao=PROXIMA):
+    if isinstance(valor, (datetime, date)):
+        valor = valor.isoformat()
+    elif isinstance(valor, Decimal):
+        valor = str(valor)
+    conteudo = json.dumps({'o': ordem, 'v': valor, 'id': pk, 'd': direcao}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(conteudo.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decodificar_cursor(cursor, ordem):
+    """Retorna (valor, id, direção) de um cursor gerado para `ordem`"""
+    try:
+        preenchido = cursor + '=' * (-len(cursor) % 4)
+        dados = json.loads(base64.urlsafe_b64decode(preenchido.encode('ascii')))
+        valor, pk, direcao = dados['v'], int(dados['id']), dados['d']
+        ordem_cursor = dados['o']
+    except (binascii.Error, UnicodeError, ValueError, TypeError, KeyError):
+        raise CursorInvalido('Cursor inválido')
+    if ordem_cursor != ordem or direcao not in (PROXIMA, ANTERIOR):
+        raise CursorInvalido('Cursor inválido para esta ordenação')
+    return valor, pk, direcao
+
+
+def _depois_de(campo, valor, pk, crescente, nulos_maiores):
+    """
+    Filtro das linhas posteriores a (valor, pk) na ordenação (campo, id)
+    
+    NULL não é comparável, então a posição dos nulos segue a do banco:
+    no PostgreSQL eles contam como maiores, no MySQL/SQLite como menores.
+    """
+    operador = 'gt' if crescente else 'lt'
+    nulos_depois = nulos_maiores == crescente
+    if valor is None:
+        filtro = Q(**{f'{campo}__isnull': True, f'pk__{operador}': pk})
+        if not nulos_depois:
+            filtro |= Q(**{f'{campo}__isnull': False})
+        return filtro
+    filtro = Q(**{f'{campo}__{operador}': valor}) | Q(**{campo: valor, f'pk__{operador}': pk})
+    if nulos_depois:
+        filtro |= Q(**{f'{campo}__isnull': True})
+    return filtro
+
+
+class PaginaCursor:
+    """Página de uma lista paginada por cursor"""
+    
+    def __init__(self, object_list, cursor_proximo=None, cursor_anterior=None):
+        self.object_list = object_list
+        self.cursor_proximo = cursor_proximo
+        self.cursor_anterior = cursor_anterior
+    
+    @property
+    def tem_proxima(self):
+        return self.cursor_proximo is not None
+    
+    @property
+    def tem_anterior(self):
+        return self.cursor_anterior is not None
+    
+    def definir_links(self, parametros):
+        """Monta url_proxima/url_anterior mantendo os demais parâmetros da requisição"""
+        self.url_proxima = self.url_anterior = None
+        for atributo, cursor in (('url_proxima', self.cursor_proximo), ('url_anterior', self.cursor_anterior)):
+            if cursor is not None:
+                query = parametros.copy()
+                query['cursor'] = cursor
+                query.pop('page', None)
+                setattr(self, atributo, f'?{query.urlencode()}')
+    
+    def __iter__(self):
+        return iter(self.object_list)
+    
+    def __len__(self):
+        return len(self.object_list)
+
+
+def paginar(queryset, ordem='-data_emissao', cursor=None, tamanho=20):
+    """
+    Retorna uma PaginaCursor de `queryset` ordenado por (ordem, id)
+    
+    Args:
+        queryset: Documentos já filtrados
+        ordem: Campo de ordenação, com '-' para decrescente
+        cursor: Cursor recebido da página anterior (None = primeira página)
+        tamanho: Documentos por página
+    
+    Raises:
+        CursorInvalido: Cursor malformado ou de outra ordenação
+    """
+    campo = ordem.lstrip('-')
+    crescente = not ordem.startswith('-')
+    modelo = queryset.model
+    nulos_maiores = connections[queryset.db].features.nulls_order_largest
+    
+    direcao = PROXIMA
+    if cursor:
+        valor, pk, direcao = decodificar_cursor(cursor, ordem)
+        if valor is not None:
+            valor = modelo._meta.get_field(campo).to_python(valor)
+    
+    # Para voltar, percorre na ordem inversa e inverte o resultado
+    sentido = crescente if direcao == PROXIMA else not crescente
+    prefixo = '' if sentido else '-'
+    queryset = queryset.order_by(f'{prefixo}{campo}', f'{prefixo}pk')
+    if cursor:
+        queryset = queryset.filter(_depois_de(campo, valor, pk, sentido, nulos_maiores))
+    
+    linhas = list(queryset[:tamanho + 1])
+    mais = len(linhas) > tamanho
+    linhas = linhas[:tamanho]
+    if direcao == ANTERIOR:
+        linhas.reverse()
+    
+    def cursor_de(objeto, direcao_cursor):
+        return codificar_cursor(ordem, getattr(objeto, campo), objeto.pk, direcao_cursor)
+    
+    pagina = PaginaCursor(linhas)
+    if linhas:
+        if mais or direcao == ANTERIOR:
+            pagina.cursor_proximo = cursor_de(linhas[-1], PROXIMA)
+        if cursor and (mais or direcao == PROXIMA):
+            pagina.cursor_anterior = cursor_de(linhas[0], ANTERIOR)
+    return pagina
+
+
+def _linhas_estatisticas(queryset):
+    """Número de linhas da tabela pelas estatísticas do banco (None se indisponível)"""
+    conexao = connections[queryset.db]
+    tabela = queryset.model._meta.db_table
+    with conexao.cursor() as cursor:
+        if conexao.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [tabela])
+        elif conexao.vendor == 'mysql':
+            cursor.execute(
+                "SELECT table_rows FROM information_schema.TABLES "
+                "WHERE table_schema = DATABASE() AND table_name = %s",
+                [tabela]
+            )
+        else:
+            return None
+        linha = cursor.fetchone()
+    # reltuples = -1 em tabela nunca analisada
+    if not linha or linha[0] is None or linha[0] < 0:
+        return None
+    return int(linha[0])
+
+
+def contar_estimado(queryset, limite=10000):
+    """
+    Total aproximado de `queryset` sem COUNT(*) completo
+    
+    Sem filtros, usa as estatísticas da tabela (PostgreSQL/MySQL). Com filtros,
+    conta no máximo `limite` + 1 linhas.
+    
+    Returns:
+        (total, exato) - com exato=False o total é estimativa ou o limite
+    """
+    if not queryset.query.where:
+        total = _linhas_estatisticas(queryset)
+        if total is not None:
+            return total, False
+    total = queryset.order_by()[:limite + 1].count()
+    if total > limite:
+        return limite, False
+    return total, True
+
+
+def solicitado(parametros, nome):
+    """Parâmetro opcional ligado na requisição (?nome=1 ou ?nome=true)"""
+    return parametros.get(nome) in ('1', 'true')
+
+
+def paginar_requisicao(request, queryset, ordem='-data_emissao', tamanho=20):
+    """
+    paginar() para as views HTML: lê ?cursor=, volta à primeira página com
+    cursor inválido (como Paginator.get_page) e, com ?contar=1, calcula o
+    total estimado (senão total e total_exato ficam None)
+    """
+    cursor = request.GET.get('cursor') or None
+    try:
+        pagina = paginar(queryset, ordem, cursor, tamanho)
+    except CursorInvalido:
+        pagina = paginar(queryset, ordem, None, tamanho)
+    pagina.definir_links(request.GET)
+    pagina.total = pagina.total_exato = None
+    if solicitado(request.GET, 'contar'):
+        pagina.total, pagina.total_exato = contar_estimado(queryset)
+    return pagina
@@ -0,0 +1,428 @@
+"""
+Resumos diários (rollups) do dashboard e das análises
+
+Mantém ResumoDiarioDocumento/Emitente/Produto/Rota atualizados de forma
+incremental: sinais de save/delete para gravações unitárias e registrar_lote()
+para inserções com bulk_create, que não disparam sinais. reconstruir()
+recalcula um período a partir das tabelas de documentos. Dashboard, análises
+e API leem apenas os resumos, cujo tamanho cresce com dias x chaves e não com
+o número de documentos.
+"""
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, Q, Sum, Value
+from django.db.models.functions import Coalesce, Substr, TruncDate, TruncMonth
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import (
+    NFe, NFeItem, CTe,
+    ResumoDiarioDocumento, ResumoDiarioEmitente,
+    ResumoDiarioProduto, ResumoDiarioRota,
+)
+
+
+ZERO = Decimal('0')
+
+# Modelo de resumo -> campos que formam a chave (na ordem das tuplas de chave)
+CHAVES = {
+    ResumoDiarioDocumento: ('dia', 'tipo'),
+    ResumoDiarioEmitente: ('dia', 'emit_cnpj', 'emit_nome'),
+    ResumoDiarioProduto: ('dia', 'codigo_produto', 'descricao'),
+    ResumoDiarioRota: ('dia', 'municipio_inicio', 'uf_inicio', 'municipio_fim', 'uf_fim'),
+}
+
+# Campos dos documentos que alimentam os resumos
+CAMPOS_NFE = ('data_emissao', 'emit_cnpj', 'emit_nome', 'valor_total')
+CAMPOS_CTE = ('data_emissao', 'municipio_inicio', 'uf_inicio', 'municipio_fim', 'uf_fim', 'valor_total')
+CAMPOS_ITEM = ('nfe_id', 'codigo_produto', 'descricao', 'quantidade', 'valor_total')
+
+
+# Contribuição de cada documento
+
+def _dia(data_emissao):
+    """Dia local da emissão (aceita o texto ISO vindo do parser)"""
+    if data_emissao is None:
+        return None
+    if isinstance(data_emissao, str):
+        data_emissao = parse_datetime(data_emissao)
+        if data_emissao is None:
+            return None
+    if isinstance(data_emissao, datetime):
+        if timezone.is_aware(data_emissao):
+            return timezone.localtime(data_emissao).date()
+        return data_emissao.date()
+    return data_emissao
+
+
+def _decimal(valor):
+    if valor is None or valor == '':
+        return ZERO
+    return valor if isinstance(valor, Decimal) else Decimal(str(valor))
+
+
+def _texto(valor, tamanho):
+    return (valor or '')[:tamanho]
+
+
+def _contribuicoes_nfe(valores, sinal=1):
+    dia = _dia(valores['data_emissao'])
+    valor = sinal * _decimal(valores['valor_total'])
+    yield ResumoDiarioDocumento, (dia, 'NFe'), sinal, valor
+    yield ResumoDiarioEmitente, (
+        dia, _texto(valores['emit_cnpj'], 14), _texto(valores['emit_nome'], 255)
+    ), sinal, valor
+
+
+def _contribuicoes_cte(valores, sinal=1):
+    dia = _dia(valores['data_emissao'])
+    valor = sinal * _decimal(valores['valor_total'])
+    yield ResumoDiarioDocumento, (dia, 'CTe'), sinal, valor
+    yield ResumoDiarioRota, (
+        dia,
+        _texto(valores['municipio_inicio'], 100), _texto(valores['uf_inicio'], 2),
+        _texto(valores['municipio_fim'], 100), _texto(valores['uf_fim'], 2),
+    ), sinal, valor
+
+
+def _contribuicoes_item(valores, dia, sinal=1):
+    yield ResumoDiarioProduto, (
+        dia, _texto(valores['codigo_produto'], 60), _texto(valores['descricao'], 255)
+    ), sinal * _decimal(valores['quantidade']), sinal * _decimal(valores['valor_total'])
+
+
+def _valores(objeto, campos):
+    return {campo: getattr(objeto, campo) for campo in campos}
+
+
+def _dia_da_nfe(nfe_id):
+    data = NFe.objects.filter(pk=nfe_id).values_list('data_emissao', flat=True).first()
+    return _dia(data)
+
+
+# Aplicação dos deltas
+
+def _novos_deltas():
+    return defaultdict(lambda: [0, ZERO])
+
+
+def _acumular(deltas, contribuicoes):
+    for modelo, chave, quantidade, valor in contribuicoes:
+        delta = deltas[(modelo, chave)]
+        delta[0] += quantidade
+        delta[1] += valor
+
+
+def aplicar(deltas):
+    """Soma os deltas acumulados às linhas de resumo (uma atualização por chave)"""
+    for (modelo, chave), (quantidade, valor) in deltas.items():
+        if not quantidade and not valor:
+            continue
+        filtro = dict(zip(CHAVES[modelo], chave))
+        incremento = {'quantidade': F('quantidade') + quantidade, 'valor': F('valor') + valor}
+        
+        # Atualiza pelo pk: a unicidade não cobre dia nulo
+        pk = modelo.objects.filter(**filtro).values_list('pk', flat=True).first()
+        if pk is not None:
+            modelo.objects.filter(pk=pk).update(**incremento)
+            if quantidade < 0 or valor < 0:
+                # Sem documentos restantes a linha sai, como na reconstrução
+                modelo.objects.filter(pk=pk, quantidade=0, valor=0).delete()
+            continue
+        try:
+            with transaction.atomic():
+                modelo.objects.create(**filtro, quantidade=quantidade, valor=valor)
+        except IntegrityError:
+            # Criada por outra transação entre o SELECT e o INSERT
+            modelo.objects.filter(**filtro).update(**incremento)
+
+
+def registrar_lote(nfes=(), itens=(), ctes=()):
+    """
+    Aplica aos resumos documentos gravados com bulk_create
+    
+    Os itens precisam ter a NFe associada (item.nfe) para obter o dia.
+    """
+    deltas = _novos_deltas()
+    for nfe in nfes:
+        _acumular(deltas, _contribuicoes_nfe(_valores(nfe, CAMPOS_NFE)))
+    for item in itens:
+        _acumular(deltas, _contribuicoes_item(
+            _valores(item, CAMPOS_ITEM), _dia(item.nfe.data_emissao)
+        ))
+    for cte in ctes:
+        _acumular(deltas, _contribuicoes_cte(_valores(cte, CAMPOS_CTE)))
+    aplicar(deltas)
+
+
+# Sinais
+
+def _guardar_anterior(modelo, campos, instance, raw):
+    instance._resumo_anterior = None
+    if not raw and not instance._state.adding and instance.pk is not None:
+        instance._resumo_anterior = modelo.objects.filter(pk=instance.pk).values(*campos).first()
+
+
+@receiver(pre_save, sender=NFe)
+def nfe_antes_de_salvar(sender, instance, raw=False, **kwargs):
+    _guardar_anterior(NFe, CAMPOS_NFE, instance, raw)
+
+
+@receiver(post_save, sender=NFe)
+def nfe_salva(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    anterior = getattr(instance, '_resumo_anterior', None)
+    atual = _valores(instance, CAMPOS_NFE)
+    deltas = _novos_deltas()
+    if anterior:
+        _acumular(deltas, _contribuicoes_nfe(anterior, -1))
+    _acumular(deltas, _contribuicoes_nfe(atual))
+    
+    # Os itens acompanham o dia da nota
+    if anterior and _dia(anterior['data_emissao']) != _dia(atual['data_emissao']):
+        for item in NFeItem.objects.filter(nfe_id=instance.pk).values(*CAMPOS_ITEM):
+            _acumular(deltas, _contribuicoes_item(item, _dia(anterior['data_emissao']), -1))
+            _acumular(deltas, _contribuicoes_item(item, _dia(atual['data_emissao'])))
+    aplicar(deltas)
+
+
+@receiver(post_delete, sender=NFe)
+def nfe_excluida(sender, instance, **kwargs):
+    deltas = _novos_deltas()
+    _acumular(deltas, _contribuicoes_nfe(_valores(instance, CAMPOS_NFE), -1))
+    aplicar(deltas)
+
+
+@receiver(pre_save, sender=NFeItem)
+def item_antes_de_salvar(sender, instance, raw=False, **kwargs):
+    _guardar_anterior(NFeItem, CAMPOS_ITEM, instance, raw)
+
+
+@receiver(post_save, sender=NFeItem)
+def item_salvo(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    anterior = getattr(instance, '_resumo_anterior', None)
+    deltas = _novos_deltas()
+    if anterior:
+        _acumular(deltas, _contribuicoes_item(anterior, _dia_da_nfe(anterior['nfe_id']), -1))
+    _acumular(deltas, _contribuicoes_item(
+        _valores(instance, CAMPOS_ITEM), _dia_da_nfe(instance.nfe_id)
+    ))
+    aplicar(deltas)
+
+
+@receiver(post_delete, sender=NFeItem)
+def item_excluido(sender, instance, **kwargs):
+    # Na exclusão em cascata a NFe ainda existe quando os itens são removidos
+    deltas = _novos_deltas()
+    _acumular(deltas, _contribuicoes_item(
+        _valores(instance, CAMPOS_ITEM), _dia_da_nfe(instance.nfe_id), -1
+    ))
+    aplicar(deltas)
+
+
+@receiver(pre_save, sender=CTe)
+def cte_antes_de_salvar(sender, instance, raw=False, **kwargs):
+    _guardar_anterior(CTe, CAMPOS_CTE, instance, raw)
+
+
+@receiver(post_save, sender=CTe)
+def cte_salvo(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    anterior = getattr(instance, '_resumo_anterior', None)
+    deltas = _novos_deltas()
+    if anterior:
+        _acumular(deltas, _contribuicoes_cte(anterior, -1))
+    _acumular(deltas, _contribuicoes_cte(_valores(instance, CAMPOS_CTE)))
+    aplicar(deltas)
+
+
+@receiver(post_delete, sender=CTe)
+def cte_excluido(sender, instance, **kwargs):
+    deltas = _novos_deltas()
+    _acumular(deltas, _contribuicoes_cte(_valores(instance, CAMPOS_CTE), -1))
+    aplicar(deltas)
+
+
+# Reconstrução
+
+def _periodo(queryset, inicio, fim):
+    if inicio:
+        queryset = queryset.filter(dia__gte=inicio)
+    if fim:
+        queryset = queryset.filter(dia__lte=fim)
+    return queryset
+
+
+def _texto_sql(campo, tamanho):
+    return Substr(Coalesce(campo, Value('')), 1, tamanho)
+
+
+def _totais(quantidade):
+    decimal = models.DecimalField(max_digits=20, decimal_places=4)
+    return {
+        'n': quantidade,
+        'v': Coalesce(Sum('valor_total'), Value(ZERO), output_field=decimal),
+    }
+
+
+def _criar(modelo, linhas, campos, **fixos):
+    """bulk_create das linhas agrupadas; `campos` mapeia apelido -> campo do resumo"""
+    objetos = (
+        modelo(
+            **fixos,
+            **{campo: linha[apelido] for apelido, campo in campos.items()},
+            quantidade=linha['n'] or 0,
+            valor=linha['v'] or ZERO,
+        )
+        for linha in linhas.iterator()
+    )
+    lote = []
+    for objeto in objetos:
+        lote.append(objeto)
+        if len(lote) >= 1000:
+            modelo.objects.bulk_create(lote)
+            lote = []
+    if lote:
+        modelo.objects.bulk_create(lote)
+
+
+def reconstruir(inicio=None, fim=None):
+    """
+    Recalcula os resumos a partir de NFe, NFeItem e CTe
+    
+    Args:
+        inicio: Primeiro dia (date) a recalcular; None = desde o início
+        fim: Último dia (date) a recalcular; None = até o fim
+    
+    Sem período, recalcula tudo, inclusive documentos sem data de emissão.
+    """
+    decimal = models.DecimalField(max_digits=20, decimal_places=4)
+    with transaction.atomic():
+        for modelo in CHAVES:
+            _periodo(modelo.objects.all(), inicio, fim).delete()
+        
+        nfes = _periodo(NFe.objects.annotate(dia=TruncDate('data_emissao')), inicio, fim)
+        ctes = _periodo(CTe.objects.annotate(dia=TruncDate('data_emissao')), inicio, fim)
+        itens = _periodo(NFeItem.objects.annotate(dia=TruncDate('nfe__data_emissao')), inicio, fim)
+        
+        _criar(
+            ResumoDiarioDocumento,
+            nfes.values('dia').annotate(**_totais(Count('id'))).order_by(),
+            {'dia': 'dia'}, tipo='NFe'
+        )
+        _criar(
+            ResumoDiarioDocumento,
+            ctes.values('dia').annotate(**_totais(Count('id'))).order_by(),
+            {'dia': 'dia'}, tipo='CTe'
+        )
+        _criar(
+            ResumoDiarioEmitente,
+            nfes.annotate(
+                cnpj=_texto_sql('emit_cnpj', 14),
+                nome=_texto_sql('emit_nome', 255),
+            ).values('dia', 'cnpj', 'nome').annotate(**_totais(Count('id'))).order_by(),
+            {'dia': 'dia', 'cnpj': 'emit_cnpj', 'nome': 'emit_nome'}
+        )
+        _criar(
+            ResumoDiarioRota,
+            ctes.annotate(
+                mun_ini=_texto_sql('municipio_inicio', 100),
+                uf_ini=_texto_sql('uf_inicio', 2),
+                mun_fim=_texto_sql('municipio_fim', 100),
+                uf_fi=_texto_sql('uf_fim', 2),
+            ).values('dia', 'mun_ini', 'uf_ini', 'mun_fim', 'uf_fi').annotate(
+                **_totais(Count('id'))
+            ).order_by(),
+            {
+                'dia': 'dia', 'mun_ini': 'municipio_inicio', 'uf_ini': 'uf_inicio',
+                'mun_fim': 'municipio_fim', 'uf_fi': 'uf_fim',
+            }
+        )
+        _criar(
+            ResumoDiarioProduto,
+            itens.annotate(
+                codigo=_texto_sql('codigo_produto', 60),
+                desc=_texto_sql('descricao', 255),
+            ).values('dia', 'codigo', 'desc').annotate(
+                **_totais(Coalesce(Sum('quantidade'), Value(ZERO), output_field=decimal))
+            ).order_by(),
+            {'dia': 'dia', 'codigo': 'codigo_produto', 'desc': 'descricao'}
+        )
+
+
+# Leitura
+
+def _restaurar_nulos(linhas, campos):
+    """Os resumos guardam '' no lugar de NULL; devolve None como as consultas antigas"""
+    for linha in linhas:
+        for campo in campos:
+            if linha[campo] == '':
+                linha[campo] = None
+    return linhas
+
+
+def resumo_documentos(data_inicio):
+    """
+    Totais de NFe e CTe: geral e a partir de data_inicio (date), em uma consulta
+    
+    Returns:
+        {'NFe': {'total', 'mes_atual', 'valor_total', 'valor_mes'}, 'CTe': {...}}
+    """
+    no_periodo = Q(dia__gte=data_inicio)
+    linhas = ResumoDiarioDocumento.objects.values('tipo').annotate(
+        total=Sum('quantidade'),
+        mes_atual=Sum('quantidade', filter=no_periodo),
+        valor_total=Sum('valor'),
+        valor_mes=Sum('valor', filter=no_periodo),
+    ).order_by()
+    
+    campos = ('total', 'mes_atual', 'valor_total', 'valor_mes')
+    resumo = {tipo: dict.fromkeys(campos, 0) for tipo in ('NFe', 'CTe')}
+    for linha in linhas:
+        resumo[linha['tipo']] = {campo: linha[campo] or 0 for campo in campos}
+    return resumo
+
+
+def top_emitentes(limite):
+    linhas = ResumoDiarioEmitente.objects.values('emit_cnpj', 'emit_nome').annotate(
+        total=Sum('quantidade'),
+        valor=Sum('valor'),
+    ).order_by('-total')[:limite]
+    return _restaurar_nulos(list(linhas), ('emit_cnpj', 'emit_nome'))
+
+
+def top_produtos(limite):
+    linhas = ResumoDiarioProduto.objects.values('codigo_produto', 'descricao').annotate(
+        qtd_total=Sum('quantidade'),
+        valor_total=Sum('valor'),
+    ).order_by('-qtd_total')[:limite]
+    return _restaurar_nulos(list(linhas), ('codigo_produto', 'descricao'))
+
+
+def top_rotas(limite):
+    campos = ('municipio_inicio', 'uf_inicio', 'municipio_fim', 'uf_fim')
+    linhas = ResumoDiarioRota.objects.values(*campos).annotate(
+        total=Sum('quantidade'),
+        valor=Sum('valor'),
+    ).order_by('-total')[:limite]
+    return _restaurar_nulos(list(linhas), campos)
+
+
+def vendas_por_mes(limite):
+    return list(
+        ResumoDiarioDocumento.objects.filter(tipo='NFe').annotate(
+            mes=TruncMonth('dia')
+        ).values('mes').annotate(
+            total=Sum('quantidade'),
+            valor=Sum('valor'),
+        ).order_by('-mes')[:limite]
+    )
@@ -0,0 +1,212 @@
+"""
+Download em lote dos XMLs completos (procNFe) de DocumentoConsultado
+
+Depois de uma sincronização sobram muitos documentos só com o resumo
+(xml_baixado=False). Aqui eles são baixados pela distribuição DFe por chave
+(consChNFe) com:
+
+- um pool de threads que compartilha a sessão keep-alive do certificado
+  (sefaz_sessao);
+- limite de requisições simultâneas por UF do documento;
+- um limitador de taxa (token bucket) por certificado;
+- parada imediata em cStat 656 (consumo indevido): o CNPJ fica suspenso por
+  1 hora, registrado no ControleNSU como na sincronização.
+
+As threads só falam com a SEFAZ; gravação e importação (core.importacao)
+acontecem na thread principal, em lotes.
+
+Só NFe tem consulta por chave; CTe já chega completo pela distribuição.
+
+Uso:
+    baixar_certificado(certificado)     # pendentes de um certificado
+    baixar_pendentes()                  # todos (manage.py baixar_xml_sefaz)
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+from django.utils import timezone
+
+from . import importacao, sefaz_sync
+from .models_certificado import CertificadoDigital, ControleNSU, DocumentoConsultado
+from .sefaz_service import SEFAZConsultaService
+
+
+TRABALHADORES = 4
+POR_UF = 2
+POR_MINUTO = 30
+RAJADA = 5
+LOTE_GRAVACAO = 100
+
+
+class LimitadorTaxa:
+    """Token bucket: `por_minuto` requisições com rajadas de até `rajada`"""
+    
+    def __init__(self, por_minuto: float = POR_MINUTO, rajada: int = RAJADA):
+        self.intervalo = 60.0 / por_minuto
+        self.rajada = rajada
+        self.fichas = float(rajada)
+        self.ultimo = time.monotonic()
+        self.trava = threading.Lock()
+    
+    def _repor(self, agora):
+        self.fichas = min(self.rajada, self.fichas + (agora - self.ultimo) / self.intervalo)
+        self.ultimo = agora
+    
+    def aguardar(self, parar: Optional[threading.Event] = None) -> bool:
+        """Espera uma ficha; False se `parar` for sinalizado antes"""
+        while True:
+            with self.trava:
+                self._repor(time.monotonic())
+                if self.fichas >= 1:
+                    self.fichas -= 1
+                    return True
+                espera = (1 - self.fichas) * self.intervalo
+            if parar is None:
+                time.sleep(espera)
+            elif parar.wait(espera):
+                return False
+
+
+def _uf_do_documento(chave: str) -> str:
+    # cUF: dois primeiros dígitos da chave de acesso
+    return chave[:2]
+
+
+def suspenso_ate(certificado: CertificadoDigital):
+    """Fim da espera por 656 do certificado (None se não estiver suspenso)"""
+    controle = ControleNSU.objects.filter(
+        certificado=certificado, tipo_documento='NFE', ultimo_status='656',
+        proxima_consulta__gt=timezone.now(),
+    ).order_by('-proxima_consulta').first()
+    return controle.proxima_consulta if controle else None
+
+
+def _suspender(certificado, uf, motivo):
+    controle, _ = ControleNSU.objects.get_or_create(certificado=certificado, tipo_documento='NFE', uf=uf)
+    controle.ultimo_status = '656'
+    controle.ultima_mensagem = motivo[:255]
+    controle.proxima_consulta = timezone.now() + sefaz_sync.ESPERA_SEFAZ
+    controle.save(update_fields=['ultimo_status', 'ultima_mensagem', 'proxima_consulta'])
+
+
+def _gravar(baixados: List[DocumentoConsultado], importar: bool, resultado: Dict):
+    DocumentoConsultado.objects.bulk_update(baixados, ['xml_completo', 'xml_baixado'], batch_size=LOTE_GRAVACAO)
+    resultado['baixados'] += len(baixados)
+    if importar:
+        importados = importacao.importar_documentos(baixados, baixados[0].consulta.certificado.usuario)
+        for chave in ('importados', 'existentes', 'erros'):
+            resultado[chave] += importados[chave]
+
+
+def baixar_certificado(
+    certificado: CertificadoDigital,
+    limite: Optional[int] = None,
+    importar: bool = True,
+    service: Optional[SEFAZConsultaService] = None,
+    trabalhadores: int = TRABALHADORES,
+    por_uf: int = POR_UF,
+    limitador: Optional[LimitadorTaxa] = None,
+) -> Dict:
+    """
+    Baixa (e importa) os XMLs completos pendentes das NFe de um certificado
+    
+    Returns:
+        Dict com status ('ok', 'aguardando' ou 'erro'), baixados, indisponiveis,
+        importados, existentes, erros e mensagem
+    """
+    resultado = {
+        'status': 'ok', 'baixados': 0, 'indisponiveis': 0,
+        'importados': 0, 'existentes': 0, 'erros': 0, 'mensagem': '',
+    }
+    espera = suspenso_ate(certificado)
+    if espera:
+        resultado['status'] = 'aguardando'
+        resultado['mensagem'] = f"Consumo indevido (656): aguardar até {timezone.localtime(espera):%H:%M}"
+        return resultado
+    
+    documentos = DocumentoConsultado.objects.filter(
+        consulta__certificado=certificado, consulta__tipo_documento='NFE', xml_baixado=False,
+    ).select_related('consulta__certificado__usuario').order_by('-data_emissao', 'pk')
+    documentos = list(documentos[:limite] if limite else documentos)
+    if not documentos:
+        return resultado
+    
+    try:
+        service = service or SEFAZConsultaService(bytes(certificado.arquivo_pfx), certificado.senha_pfx)
+    except Exception as e:
+        resultado['status'] = 'erro'
+        resultado['mensagem'] = str(e)
+        return resultado
+    uf_autor = sefaz_sync.uf_autora(sefaz_sync.configuracao(certificado.usuario))
+    limitador = limitador or LimitadorTaxa()
+    semaforos = {uf: threading.Semaphore(por_uf) for uf in {_uf_do_documento(d.chave_acesso) for d in documentos}}
+    parar = threading.Event()
+    
+    def baixar(documento):
+        with semaforos[_uf_do_documento(documento.chave_acesso)]:
+            if parar.is_set() or not limitador.aguardar(parar):
+                return 'interrompido', None
+            try:
+                retorno = service.consultar_chave(certificado.cnpj, documento.chave_acesso, uf_autor)
+            except Exception as e:
+                return 'erro', str(e)
+            if retorno['cStat'] == '656':
+                parar.set()
+                return '656', retorno['xMotivo']
+            for item in retorno['documentos']:
+                if item['schema'].startswith('procNFe'):
+                    return 'ok', item['xml']
+            return 'indisponivel', f"{retorno['cStat']} - {retorno['xMotivo']}"
+    
+    baixados = []
+    with ThreadPoolExecutor(max_workers=trabalhadores) as executor:
+        futuros = {executor.submit(baixar, documento): documento for documento in documentos}
+        for futuro in as_completed(futuros):
+            documento = futuros[futuro]
+            situacao, conteudo = futuro.result()
+            if situacao == 'ok':
+                documento.xml_completo = conteudo
+                documento.xml_baixado = True
+                baixados.append(documento)
+                if len(baixados) >= LOTE_GRAVACAO:
+                    _gravar(baixados, importar, resultado)
+                    baixados = []
+            elif situacao == '656':
+                resultado['status'] = 'aguardando'
+                resultado['mensagem'] = f"656 - {conteudo}"
+            elif situacao == 'indisponivel':
+                resultado['indisponiveis'] += 1
+            elif situacao == 'erro':
+                resultado['erros'] += 1
+                resultado['mensagem'] = conteudo
+    if baixados:
+        _gravar(baixados, importar, resultado)
+    
+    if resultado['status'] == 'aguardando':
+        _suspender(certificado, uf_autor, resultado['mensagem'])
+    return resultado
+
+
+def baixar_pendentes(
+    certificados=None,
+    limite: Optional[int] = None,
+    importar: bool = True,
+    por_minuto: float = POR_MINUTO,
+    **opcoes
+) -> Dict[CertificadoDigital, Dict]:
+    """baixar_certificado() para cada certificado ativo com NFe sem XML completo"""
+    if certificados is None:
+        certificados = CertificadoDigital.objects.filter(ativo=True)
+    certificados = certificados.filter(
+        consultas__tipo_documento='NFE',
+        consultas__documentos__xml_baixado=False,
+    ).distinct()
+    return {
+        certificado: baixar_certificado(
+            certificado, limite=limite, importar=importar,
+            limitador=LimitadorTaxa(por_minuto), **opcoes
+        )
+        for certificado in certificados
+    }
@@ -3,13 +3,13 @@ Serviço de consulta automática na SEFAZ
 Integração com webservices da Receita Federal
 """
 
-import requests
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional
 import xml.etree.ElementTree as ET
-from cryptography.hazmat.primitives.serialization import pkcs12
-from cryptography.hazmat.backends import default_backend
 import base64
+import gzip
+
+from . import sefaz_sessao
 
 
 class SEFAZConsultaService:
@@ -34,6 +34,14 @@ class SEFAZConsultaService:
         'MG': 'https://cte.fazenda.mg.gov.br/cte/services/CTeStatusServico',
     }
     
+    # Distribuição DFe (ambiente nacional); a UF vai em cUFAutor
+    WEBSERVICES_DISTRIBUICAO = {
+        'NFE': 'https://www1.nfe.fazenda.gov.br/NFeDistribuicaoDFe/NFeDistribuicaoDFe.asmx',
+        'CTE': 'https://www1.cte.fazenda.gov.br/CTeDistribuicaoDFe/CTeDistribuicaoDFe.asmx',
+    }
+    
+    NSU_INICIAL = '000000000000000'
+    
     def __init__(self, certificado_pfx: bytes, senha: str):
         """
         Inicializa o serviço com certificado digital
@@ -44,33 +52,17 @@ class SEFAZConsultaService:
         """
         self.certificado_pfx = certificado_pfx
         self.senha = senha
+        self.material = None
         self.cert_pem = None
         self.key_pem = None
         self._carregar_certificado()
     
     def _carregar_certificado(self):
-        """Carrega e converte certificado PFX para PEM"""
+        """Carrega o PFX (decodificado uma vez por certificado, ver sefaz_sessao)"""
         try:
-            # Carregar certificado
-            private_key, certificate, additional_certificates = pkcs12.load_key_and_certificates(
-                self.certificado_pfx,
-                self.senha.encode(),
-                backend=default_backend()
-            )
-            
-            # Converter para PEM (necessário para requests)
-            from cryptography.hazmat.primitives import serialization
-            
-            self.key_pem = private_key.private_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PrivateFormat.PKCS8,
-                encryption_algorithm=serialization.NoEncryption()
-            )
-            
-            self.cert_pem = certificate.public_bytes(
-                encoding=serialization.Encoding.PEM
-            )
-            
+            self.material = sefaz_sessao.carregar_material(self.certificado_pfx, self.senha)
+            self.cert_pem = self.material.cert_pem
+            self.key_pem = self.material.key_pem
         except Exception as e:
             raise Exception(f"Erro ao carregar certificado: {e}")
     
@@ -79,7 +71,8 @@ class SEFAZConsultaService:
         cnpj: str,
         data_inicio: datetime,
         data_fim: datetime,
-        uf: str = 'SP'
+        uf: str = 'SP',
+        ult_nsu: str = NSU_INICIAL
     ) -> List[Dict]:
         """
         Consulta NFes destinadas ao CNPJ
@@ -89,45 +82,79 @@ class SEFAZConsultaService:
             data_inicio: Data inicial da consulta
             data_fim: Data final da consulta
             uf: UF para consulta
+            ult_nsu: Último NSU já recebido (só vêm documentos posteriores)
             
         Returns:
             Lista de dicionários com dados das NFes encontradas
         """
-        
-        # Montar SOAP envelope
-        soap_body = f"""<?xml version="1.0" encoding="UTF-8"?>
-        <soap:Envelope xmlns:soap="http://www.w3.org/2003/05/soap-envelope">
-            <soap:Body>
-                <nfeDistDFeInteresse xmlns="http://www.portalfiscal.inf.br/nfe">
-                    <nfeDadosMsg>
-                        <distDFeInt versao="1.01" xmlns="http://www.portalfiscal.inf.br/nfe">
-                            <tpAmb>1</tpAmb>
-                            <cUFAutor>{self._get_codigo_uf(uf)}</cUFAutor>
-                            <CNPJ>{cnpj}</CNPJ>
-                            <distNSU>
-                                <ultNSU>000000000000000</ultNSU>
-                            </distNSU>
-                        </distDFeInt>
-                    </nfeDadosMsg>
-                </nfeDistDFeInteresse>
-            </soap:Body>
-        </soap:Envelope>"""
-        
         try:
-            # Fazer requisição com certificado
-            response = requests.post(
-                self.WEBSERVICES_NFE.get(uf),
-                data=soap_body,
-                headers={'Content-Type': 'application/soap+xml; charset=utf-8'},
-                cert=(self.cert_pem, self.key_pem),
-                timeout=60
-            )
-            
-            # Parsear resposta XML
-            return self._parsear_resposta_nfe(response.text)
-            
+            retorno = self.consultar_distribuicao('NFE', cnpj, ult_nsu, uf)
         except Exception as e:
             raise Exception(f"Erro na consulta SEFAZ: {e}")
+        
+        documentos = []
+        for documento in retorno['documentos']:
+            if documento['schema'].startswith('procNFe'):
+                dados = self._extrair_dados_nfe(documento['xml'])
+                if dados:
+                    documentos.append(dados)
+        return documentos
+    
+    def consultar_distribuicao(self, tipo: str, cnpj: str, ult_nsu: str, uf: str = 'SP') -> Dict:
+        """
+        Um lote da distribuição DFe (até 50 documentos após ult_nsu)
+        
+        Args:
+            tipo: 'NFE' ou 'CTE'
+            cnpj: CNPJ interessado
+            ult_nsu: Último NSU já recebido
+            uf: UF autora (cUFAutor)
+            
+        Returns:
+            Dict com cStat, xMotivo, ultNSU, maxNSU e documentos
+            (lista de dicts com nsu, schema e xml já descompactado)
+        """
+        consulta = f'<distNSU><ultNSU>{str(ult_nsu).zfill(15)}</ultNSU></distNSU>'
+        return self._distribuicao(tipo, cnpj, uf, consulta)
+    
+    def consultar_chave(self, cnpj: str, chave_acesso: str, uf: str = 'SP') -> Dict:
+        """
+        Distribuição DFe de uma NFe pela chave de acesso (consChNFe)
+        
+        Retorna o mesmo Dict de consultar_distribuicao(); com cStat 138 o
+        procNFe vem em documentos. Só há consulta por chave para NFe.
+        """
+        return self._distribuicao('NFE', cnpj, uf, f'<consChNFe><chNFe>{chave_acesso}</chNFe></consChNFe>')
+    
+    def _distribuicao(self, tipo: str, cnpj: str, uf: str, consulta: str) -> Dict:
+        """Envia um distDFeInt (distNSU ou consChNFe) e parseia o retorno"""
+        if tipo == 'CTE':
+            operacao = (
+                '<cteDistDFeInteresse xmlns="http://www.portalfiscal.inf.br/cte/wsdl/CTeDistribuicaoDFe">'
+                '<cteDadosMsg><distDFeInt versao="1.00" xmlns="http://www.portalfiscal.inf.br/cte">'
+            )
+            fechamento = '</distDFeInt></cteDadosMsg></cteDistDFeInteresse>'
+        else:
+            operacao = (
+                '<nfeDistDFeInteresse xmlns="http://www.portalfiscal.inf.br/nfe/wsdl/NFeDistribuicaoDFe">'
+                '<nfeDadosMsg><distDFeInt versao="1.01" xmlns="http://www.portalfiscal.inf.br/nfe">'
+            )
+            fechamento = '</distDFeInt></nfeDadosMsg></nfeDistDFeInteresse>'
+        
+        soap_body = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<soap12:Envelope xmlns:soap12="http://www.w3.org/2003/05/soap-envelope"><soap12:Body>'
+            f'{operacao}'
+            '<tpAmb>1</tpAmb>'
+            f'<cUFAutor>{self._get_codigo_uf(uf)}</cUFAutor>'
+            f'<CNPJ>{cnpj}</CNPJ>'
+            f'{consulta}'
+            f'{fechamento}'
+            '</soap12:Body></soap12:Envelope>'
+        )
+        
+        response = self._enviar(self.WEBSERVICES_DISTRIBUICAO[tipo], soap_body, timeout=60)
+        return self._parsear_distribuicao(response.text)
     
     def consultar_nfe_emitidas(
         self,
@@ -165,67 +192,95 @@ class SEFAZConsultaService:
         # Implementação de consulta CTe
         pass
     
-    def baixar_xml_completo(self, chave_acesso: str, uf: str = 'SP') -> Optional[str]:
+    def baixar_xml_completo(self, chave_acesso: str, uf: str = 'SP', cnpj: Optional[str] = None) -> Optional[str]:
         """
-        Baixa XML completo pela chave de acesso
+        Baixa XML completo (procNFe) pela chave de acesso
         
         Args:
             chave_acesso: Chave de 44 dígitos
-            uf: UF emissora
+            uf: UF autora (cUFAutor)
+            cnpj: CNPJ interessado (padrão: o do certificado)
             
         Returns:
             String com XML completo ou None se erro
         """
-        
-        soap_body = f"""<?xml version="1.0" encoding="UTF-8"?>
-        <soap:Envelope xmlns:soap="http://www.w3.org/2003/05/soap-envelope">
-            <soap:Body>
-                <nfeConsultaNF xmlns="http://www.portalfiscal.inf.br/nfe">
-                    <nfeDadosMsg>
-                        <consSitNFe versao="4.00" xmlns="http://www.portalfiscal.inf.br/nfe">
-                            <tpAmb>1</tpAmb>
-                            <xServ>CONSULTAR</xServ>
-                            <chNFe>{chave_acesso}</chNFe>
-                        </consSitNFe>
-                    </nfeDadosMsg>
-                </nfeConsultaNF>
-            </soap:Body>
-        </soap:Envelope>"""
-        
         try:
-            response = requests.post(
-                self.WEBSERVICES_NFE.get(uf),
-                data=soap_body,
-                headers={'Content-Type': 'application/soap+xml; charset=utf-8'},
-                cert=(self.cert_pem, self.key_pem),
-                timeout=30
-            )
-            
-            # Extrair XML da resposta
-            root = ET.fromstring(response.text)
-            # Parsear e retornar XML
-            return response.text
+            retorno = self.consultar_chave(cnpj or self.cnpj_certificado(), chave_acesso, uf)
+            for documento in retorno['documentos']:
+                if documento['schema'].startswith('procNFe'):
+                    return documento['xml']
+            print(f"XML não disponível: {retorno['cStat']} - {retorno['xMotivo']}")
+            return None
             
         except Exception as e:
             print(f"Erro ao baixar XML: {e}")
             return None
     
+    def cnpj_certificado(self) -> Optional[str]:
+        """CNPJ do e-CNPJ ICP-Brasil (CN no formato 'RAZAO SOCIAL:CNPJ')"""
+        from cryptography import x509
+        from cryptography.x509.oid import NameOID
+        
+        cert = x509.load_pem_x509_certificate(self.cert_pem)
+        for atributo in cert.subject.get_attributes_for_oid(NameOID.COMMON_NAME):
+            _, _, cnpj = atributo.value.rpartition(':')
+            if cnpj.isdigit() and len(cnpj) == 14:
+                return cnpj
+        return None
+    
+    def _enviar(self, url: str, soap_body: str, timeout: int):
+        """POST SOAP pela sessão keep-alive do certificado (mTLS, com repetição)"""
+        return sefaz_sessao.obter_sessao(self.material).post(
+            url,
+            data=soap_body.encode('utf-8'),
+            timeout=timeout
+        )
+    
+    @staticmethod
+    def _nome_local(tag: str) -> str:
+        return tag.rsplit('}', 1)[-1]
+    
+    def _parsear_distribuicao(self, xml_response: str) -> Dict:
+        """Extrai o retDistDFeInt da resposta SOAP, descompactando os docZip"""
+        root = ET.fromstring(xml_response)
+        retorno = next(
+            (elem for elem in root.iter() if self._nome_local(elem.tag) == 'retDistDFeInt'),
+            None
+        )
+        if retorno is None:
+            raise Exception('Resposta da SEFAZ sem retDistDFeInt')
+        
+        campos = {}
+        documentos = []
+        for elem in retorno.iter():
+            nome = self._nome_local(elem.tag)
+            if nome in ('cStat', 'xMotivo', 'ultNSU', 'maxNSU'):
+                campos[nome] = (elem.text or '').strip()
+            elif nome == 'docZip':
+                documentos.append({
+                    'nsu': elem.get('NSU', ''),
+                    'schema': elem.get('schema', ''),
+                    'xml': gzip.decompress(base64.b64decode(elem.text or '')).decode('utf-8'),
+                })
+        
+        return {
+            'cStat': campos.get('cStat', ''),
+            'xMotivo': campos.get('xMotivo', ''),
+            'ultNSU': campos.get('ultNSU') or self.NSU_INICIAL,
+            'maxNSU': campos.get('maxNSU') or self.NSU_INICIAL,
+            'documentos': documentos,
+        }
+    
     def _parsear_resposta_nfe(self, xml_response: str) -> List[Dict]:
         """Parseia resposta XML da SEFAZ e extrai dados das NFes"""
         documentos = []
         
         try:
-            root = ET.fromstring(xml_response)
-            
-            # Navegar no XML e extrair dados
-            # (Implementação específica depende do formato de resposta da SEFAZ)
-            
-            for doc in root.findall('.//docZip'):
-                # Decodificar e parsear cada documento
-                xml_doc = base64.b64decode(doc.text).decode('utf-8')
-                dados = self._extrair_dados_nfe(xml_doc)
-                if dados:
-                    documentos.append(dados)
+            for documento in self._parsear_distribuicao(xml_response)['documentos']:
+                if documento['schema'].startswith('procNFe'):
+                    dados = self._extrair_dados_nfe(documento['xml'])
+                    if dados:
+                        documentos.append(dados)
             
         except Exception as e:
             print(f"Erro ao parsear resposta: {e}")
@@ -0,0 +1,254 @@
+"""
+Sessões HTTPS com certificado do cliente (mTLS) para os webservices da SEFAZ
+
+Antes cada SEFAZConsultaService decodificava o PFX de novo e cada chamada
+abria uma conexão nova (handshake TLS com certificado do cliente). Aqui:
+
+- o material do certificado (chave/certificado em PEM) é decodificado uma
+  vez por PFX e guardado em cache pelo digest do arquivo;
+- cada certificado tem um requests.Session com SSLContext próprio e pools
+  keep-alive por endpoint (um pool urllib3 por host de UF);
+- falhas de conexão e respostas 5xx são repetidas com backoff.
+
+As chaves só ficam em disco durante o load_cert_chain (arquivos temporários
+removidos em seguida). Contadores de uso em metricas().
+
+Configuração (settings):
+    SEFAZ_CA_BUNDLE         arquivo de CAs (ICP-Brasil); padrão: certifi
+    SEFAZ_POOL_CONEXOES     conexões mantidas por endpoint (padrão 10)
+    SEFAZ_TENTATIVAS        tentativas extras em falha (padrão 3)
+"""
+import hashlib
+import os
+import ssl
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import requests
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.serialization import pkcs12
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+
+MAXIMO_CERTIFICADOS = 32
+STATUS_REPETIDOS = (500, 502, 503, 504)
+
+_trava = threading.Lock()
+_materiais = OrderedDict()
+_sessoes = OrderedDict()
+_metricas = {
+    'material_decodificado': 0,
+    'material_cache': 0,
+    'sessoes_criadas': 0,
+    'sessoes_reusadas': 0,
+    'requisicoes': 0,
+    'handshakes': 0,
+}
+
+
+def _contar(nome, quantidade=1):
+    with _trava:
+        _metricas[nome] += quantidade
+
+
+def metricas():
+    """
+    Contadores do processo
+    
+    conexoes_reusadas = requisições atendidas por conexão já aberta
+    (pool hit); handshakes = conexões TLS novas.
+    """
+    with _trava:
+        dados = dict(_metricas)
+        dados['sessoes_ativas'] = len(_sessoes)
+    dados['conexoes_reusadas'] = max(dados['requisicoes'] - dados['handshakes'], 0)
+    return dados
+
+
+# Material do certificado
+
+@dataclass(frozen=True)
+class MaterialCertificado:
+    digest: str
+    cert_pem: bytes
+    key_pem: bytes
+    cadeia_pem: bytes
+
+
+def _guardar(cache, chave, valor):
+    cache[chave] = valor
+    cache.move_to_end(chave)
+    while len(cache) > MAXIMO_CERTIFICADOS:
+        _, antigo = cache.popitem(last=False)
+        if isinstance(antigo, requests.Session):
+            antigo.close()
+
+
+def carregar_material(certificado_pfx: bytes, senha: str) -> MaterialCertificado:
+    """Chave e certificado em PEM, decodificados uma vez por PFX/senha"""
+    digest = hashlib.sha256(bytes(certificado_pfx) + b'\0' + senha.encode()).hexdigest()
+    with _trava:
+        material = _materiais.get(digest)
+        if material is not None:
+            _materiais.move_to_end(digest)
+            _metricas['material_cache'] += 1
+            return material
+    
+    private_key, certificate, additional_certificates = pkcs12.load_key_and_certificates(
+        bytes(certificado_pfx),
+        senha.encode(),
+        backend=default_backend()
+    )
+    material = MaterialCertificado(
+        digest=digest,
+        cert_pem=certificate.public_bytes(serialization.Encoding.PEM),
+        key_pem=private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption()
+        ),
+        cadeia_pem=b''.join(
+            extra.public_bytes(serialization.Encoding.PEM) for extra in additional_certificates or ()
+        ),
+    )
+    with _trava:
+        _guardar(_materiais, digest, material)
+        _metricas['material_decodificado'] += 1
+    return material
+
+
+def criar_contexto_ssl(material: MaterialCertificado) -> ssl.SSLContext:
+    """SSLContext com o certificado do cliente e a cadeia intermediária"""
+    contexto = ssl.create_default_context(cafile=getattr(settings, 'SEFAZ_CA_BUNDLE', None))
+    # load_cert_chain só aceita caminhos: os PEMs ficam em disco só durante a carga
+    arquivos = []
+    try:
+        for conteudo in (material.cert_pem + material.cadeia_pem, material.key_pem):
+            descritor, caminho = tempfile.mkstemp(suffix='.pem')
+            arquivos.append(caminho)
+            with os.fdopen(descritor, 'wb') as arquivo:
+                arquivo.write(conteudo)
+        contexto.load_cert_chain(certfile=arquivos[0], keyfile=arquivos[1])
+    finally:
+        for caminho in arquivos:
+            os.unlink(caminho)
+    return contexto
+
+
+# Pools de conexão
+
+class _PoolHTTPSContado(HTTPSConnectionPool):
+    def _new_conn(self):
+        _contar('handshakes')
+        return super()._new_conn()
+
+
+class _PoolHTTPContado(HTTPConnectionPool):
+    def _new_conn(self):
+        _contar('handshakes')
+        return super()._new_conn()
+
+
+class AdaptadorSEFAZ(HTTPAdapter):
+    """HTTPAdapter com SSLContext do certificado e pools contados"""
+    
+    def __init__(self, contexto_ssl, **kwargs):
+        self.contexto_ssl = contexto_ssl
+        super().__init__(**kwargs)
+    
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['ssl_context'] = self.contexto_ssl
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _PoolHTTPContado,
+            'https': _PoolHTTPSContado,
+        }
+    
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        proxy_kwargs['ssl_context'] = self.contexto_ssl
+        return super().proxy_manager_for(proxy, **proxy_kwargs)
+    
+    def send(self, request, **kwargs):
+        _contar('requisicoes')
+        return super().send(request, **kwargs)
+
+
+def _politica_repeticao():
+    tentativas = getattr(settings, 'SEFAZ_TENTATIVAS', 3)
+    return Retry(
+        total=tentativas,
+        connect=tentativas,
+        read=1,
+        status=tentativas,
+        backoff_factor=0.5,
+        status_forcelist=STATUS_REPETIDOS,
+        # As chamadas SOAP usadas são consultas: repetir o POST é seguro
+        allowed_methods=frozenset({'POST'}),
+        raise_on_status=False,
+    )
+
+
+def _criar_sessao(material):
+    conexoes = getattr(settings, 'SEFAZ_POOL_CONEXOES', 10)
+    adaptador = AdaptadorSEFAZ(
+        criar_contexto_ssl(material),
+        pool_connections=len(_hosts_sefaz()) or 10,
+        pool_maxsize=conexoes,
+        max_retries=_politica_repeticao(),
+    )
+    sessao = requests.Session()
+    sessao.mount('https://', adaptador)
+    sessao.mount('http://', adaptador)
+    sessao.headers['Content-Type'] = 'application/soap+xml; charset=utf-8'
+    ca_bundle = getattr(settings, 'SEFAZ_CA_BUNDLE', None)
+    if ca_bundle:
+        sessao.verify = ca_bundle
+    return sessao
+
+
+def _hosts_sefaz():
+    from .sefaz_service import SEFAZConsultaService
+    
+    urls = [
+        *SEFAZConsultaService.WEBSERVICES_NFE.values(),
+        *SEFAZConsultaService.WEBSERVICES_CTE.values(),
+        *SEFAZConsultaService.WEBSERVICES_DISTRIBUICAO.values(),
+    ]
+    return {url.split('/')[2] for url in urls}
+
+
+def obter_sessao(material: MaterialCertificado) -> requests.Session:
+    """Sessão keep-alive do certificado, criada na primeira chamada"""
+    with _trava:
+        sessao = _sessoes.get(material.digest)
+        if sessao is not None:
+            _sessoes.move_to_end(material.digest)
+            _metricas['sessoes_reusadas'] += 1
+            return sessao
+    
+    nova = _criar_sessao(material)
+    with _trava:
+        # Outra thread pode ter criado a sessão durante o handshake de contexto
+        sessao = _sessoes.get(material.digest)
+        if sessao is None:
+            _guardar(_sessoes, material.digest, nova)
+            _metricas['sessoes_criadas'] += 1
+            return nova
+        _metricas['sessoes_reusadas'] += 1
+    nova.close()
+    return sessao
+
+
+def fechar_sessoes():
+    """Fecha todas as sessões (e conexões) abertas; o material continua em cache"""
+    with _trava:
+        sessoes = list(_sessoes.values())
+        _sessoes.clear()
+    for sessao in sessoes:
+        sessao.close()
@@ -0,0 +1,464 @@
+"""
+Sincronização da distribuição DFe (DistDFe) da SEFAZ
+
+Cada certificado guarda, por tipo de documento e UF autora, o último NSU
+recebido (ControleNSU). A sincronização pede os lotes seguintes até alcançar
+o maxNSU, grava os DocumentoConsultado em lote e salva o NSU a cada lote,
+então uma nova consulta só transfere documentos novos e uma interrupção
+retoma do último lote gravado.
+
+Regras da SEFAZ respeitadas:
+    - cStat 137 (nenhum documento) ou fila esgotada: aguardar 1 hora;
+    - cStat 656 (consumo indevido): aguardar 1 hora.
+
+A distribuição é nacional e a fila de NSU é do CNPJ; a UF informada em
+cUFAutor é a primeira de ConfiguracaoConsulta.ufs_habilitadas.
+
+Uso:
+    sincronizar(certificado, 'NFE', consulta)    # um certificado/tipo
+    processar_consulta(consulta)                 # ConsultaSEFAZ criada pela view
+    sincronizar_automaticos()                    # worker (manage.py sincronizar_sefaz)
+"""
+import threading
+import xml.etree.ElementTree as ET
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Optional
+
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models_certificado import (
+    CertificadoDigital, ConsultaSEFAZ, ControleNSU,
+    DocumentoConsultado, ConfiguracaoConsulta,
+)
+from .sefaz_service import SEFAZConsultaService
+
+
+ESPERA_SEFAZ = timedelta(hours=1)
+TIPOS_SINCRONIZADOS = ('NFE', 'CTE')
+UF_PADRAO = 'SP'
+
+# Papéis verificados em CTe, na ordem de prioridade
+PAPEIS_CTE = (
+    ('emit', 'EMITENTE'), ('toma', 'TOMADOR'), ('rem', 'REMETENTE'),
+    ('dest', 'DESTINATARIO'), ('exped', 'EXPEDIDOR'), ('receb', 'RECEBEDOR'),
+)
+# toma3/toma: código do tomador -> grupo do CTe
+TOMADOR_CTE = {'0': 'rem', '1': 'exped', '2': 'receb', '3': 'dest'}
+
+
+# Leitura dos documentos da distribuição
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _filho(elem, *caminho):
+    """Primeiro descendente seguindo os nomes locais de `caminho` (ignora namespace)"""
+    for nome in caminho:
+        if elem is None:
+            return None
+        elem = next((filho for filho in elem.iter() if filho is not elem and _local(filho.tag) == nome), None)
+    return elem
+
+
+def _texto(elem, *caminho):
+    alvo = _filho(elem, *caminho)
+    return (alvo.text or '').strip() if alvo is not None else ''
+
+
+def _decimal(texto):
+    try:
+        return Decimal(texto or '0')
+    except InvalidOperation:
+        return Decimal('0')
+
+
+def _numero_serie(chave):
+    """Série e número a partir da chave de acesso (posições 23-25 e 26-34)"""
+    return chave[22:25].lstrip('0') or '0', chave[25:34].lstrip('0') or '0'
+
+
+def _documento_cnpj(elem):
+    return _texto(elem, 'CNPJ') or _texto(elem, 'CPF')
+
+
+def _ler_resumo_nfe(root, cnpj):
+    chave = _texto(root, 'chNFe')
+    serie, numero = _numero_serie(chave)
+    return {
+        'chave_acesso': chave,
+        'numero': numero,
+        'serie': serie,
+        'data_emissao': _texto(root, 'dhEmi'),
+        'papel_cnpj': 'DESTINATARIO',
+        'emit_cnpj': _documento_cnpj(root),
+        'emit_nome': _texto(root, 'xNome'),
+        'dest_cnpj': cnpj,
+        'dest_nome': '',
+        'valor_total': _decimal(_texto(root, 'vNF')),
+        'xml_completo': '',
+    }
+
+
+def _ler_nfe(root, xml, cnpj):
+    inf = _filho(root, 'infNFe')
+    chave = (inf.get('Id', '') if inf is not None else '').replace('NFe', '')
+    emit = _filho(inf, 'emit')
+    dest = _filho(inf, 'dest')
+    emit_cnpj = _documento_cnpj(emit)
+    dest_cnpj = _documento_cnpj(dest)
+    if emit_cnpj == cnpj:
+        papel = 'EMITENTE'
+    elif dest_cnpj == cnpj:
+        papel = 'DESTINATARIO'
+    elif _documento_cnpj(_filho(inf, 'transporta')) == cnpj:
+        papel = 'TRANSPORTADOR'
+    else:
+        papel = 'DESTINATARIO'
+    return {
+        'chave_acesso': chave,
+        'numero': _texto(inf, 'ide', 'nNF'),
+        'serie': _texto(inf, 'ide', 'serie'),
+        'data_emissao': _texto(inf, 'ide', 'dhEmi'),
+        'papel_cnpj': papel,
+        'emit_cnpj': emit_cnpj,
+        'emit_nome': _texto(emit, 'xNome'),
+        'dest_cnpj': dest_cnpj,
+        'dest_nome': _texto(dest, 'xNome'),
+        'valor_total': _decimal(_texto(inf, 'ICMSTot', 'vNF')),
+        'xml_completo': xml,
+    }
+
+
+def _ler_cte(root, xml, cnpj):
+    inf = _filho(root, 'infCte')
+    chave = (inf.get('Id', '') if inf is not None else '').replace('CTe', '')
+    ide = _filho(inf, 'ide')
+    grupos = {nome: _filho(inf, nome) for nome in ('emit', 'rem', 'dest', 'exped', 'receb')}
+    
+    # Tomador: toma4 traz o próprio CNPJ; toma3 aponta para outro grupo
+    toma4 = _filho(ide, 'toma4')
+    if toma4 is not None:
+        grupos['toma'] = toma4
+    else:
+        grupos['toma'] = grupos.get(TOMADOR_CTE.get(_texto(ide, 'toma')))
+    
+    papel = next(
+        (papel for grupo, papel in PAPEIS_CTE if _documento_cnpj(grupos.get(grupo)) == cnpj),
+        'TOMADOR'
+    )
+    return {
+        'chave_acesso': chave,
+        'numero': _texto(ide, 'nCT'),
+        'serie': _texto(ide, 'serie'),
+        'data_emissao': _texto(ide, 'dhEmi'),
+        'papel_cnpj': papel,
+        'emit_cnpj': _documento_cnpj(grupos['emit']),
+        'emit_nome': _texto(grupos['emit'], 'xNome'),
+        'dest_cnpj': _documento_cnpj(grupos['dest']),
+        'dest_nome': _texto(grupos['dest'], 'xNome'),
+        'valor_total': _decimal(_texto(inf, 'vPrest', 'vTPrest')),
+        'xml_completo': xml,
+    }
+
+
+def ler_documento(schema: str, xml: str, cnpj: str) -> Optional[Dict]:
+    """
+    Campos de DocumentoConsultado de um documento da distribuição
+    
+    Returns:
+        Dict de campos ou None para eventos e schemas não tratados
+    """
+    root = ET.fromstring(xml)
+    if schema.startswith('resNFe'):
+        dados = _ler_resumo_nfe(root, cnpj)
+    elif schema.startswith('procNFe'):
+        dados = _ler_nfe(root, xml, cnpj)
+    elif schema.startswith('procCTe'):
+        dados = _ler_cte(root, xml, cnpj)
+    else:
+        return None
+    
+    dados['data_emissao'] = parse_datetime(dados['data_emissao']) if dados['data_emissao'] else None
+    if len(dados['chave_acesso']) != 44 or dados['data_emissao'] is None:
+        raise ValueError(f"Documento sem chave ou data de emissão ({schema})")
+    dados['xml_baixado'] = bool(dados['xml_completo'])
+    return dados
+
+
+# Gravação
+
+def _gravar_lote(consulta, documentos: List[Dict]) -> int:
+    """
+    Insere os documentos do lote; os que já existem só recebem o XML completo
+    quando antes eram apenas resumo
+    
+    Returns:
+        Quantidade de documentos novos
+    """
+    if not documentos:
+        return 0
+    # Resumo e XML completo podem vir no mesmo lote: fica o completo
+    unicos = {}
+    for dados in documentos:
+        anterior = unicos.get(dados['chave_acesso'])
+        if anterior is None or dados['xml_baixado'] and not anterior['xml_baixado']:
+            unicos[dados['chave_acesso']] = dados
+    documentos = list(unicos.values())
+    chaves = list(unicos)
+    existentes = set(
+        DocumentoConsultado.objects.filter(chave_acesso__in=chaves).values_list('chave_acesso', flat=True)
+    )
+    novos = [
+        DocumentoConsultado(consulta=consulta, **dados)
+        for dados in documentos if dados['chave_acesso'] not in existentes
+    ]
+    DocumentoConsultado.objects.bulk_create(novos, ignore_conflicts=True)
+    
+    completos = {
+        dados['chave_acesso']: dados['xml_completo']
+        for dados in documentos
+        if dados['chave_acesso'] in existentes and dados['xml_baixado']
+    }
+    if completos:
+        resumos = list(DocumentoConsultado.objects.filter(
+            chave_acesso__in=list(completos), xml_baixado=False
+        ))
+        for documento in resumos:
+            documento.xml_completo = completos[documento.chave_acesso]
+            documento.xml_baixado = True
+        DocumentoConsultado.objects.bulk_update(resumos, ['xml_completo', 'xml_baixado'])
+    return len(novos)
+
+
+def _registrar(consulta, mensagem):
+    horario = timezone.localtime().strftime('%H:%M:%S')
+    consulta.log_detalhado += f"[{horario}] {mensagem}\n"
+
+
+# Sincronização
+
+def configuracao(usuario) -> Optional[ConfiguracaoConsulta]:
+    return ConfiguracaoConsulta.objects.filter(usuario=usuario).first()
+
+
+def uf_autora(config: Optional[ConfiguracaoConsulta]) -> str:
+    if config and config.ufs_habilitadas:
+        ufs = [uf.strip().upper() for uf in config.ufs_habilitadas.split(',') if uf.strip()]
+        if ufs:
+            return ufs[0]
+    return UF_PADRAO
+
+
+def _travar(controle, duracao) -> bool:
+    """Reserva o controle para esta execução (evita duas sincronizações do mesmo NSU)"""
+    agora = timezone.now()
+    return ControleNSU.objects.filter(pk=controle.pk).filter(
+        Q(em_uso_ate__isnull=True) | Q(em_uso_ate__lt=agora)
+    ).update(em_uso_ate=agora + duracao) == 1
+
+
+def sincronizar(
+    certificado: CertificadoDigital,
+    tipo: str,
+    consulta: ConsultaSEFAZ,
+    service: Optional[SEFAZConsultaService] = None,
+) -> Dict:
+    """
+    Baixa os documentos novos de um certificado/tipo desde o último NSU
+    
+    Args:
+        certificado: Certificado com o CNPJ interessado
+        tipo: 'NFE' ou 'CTE'
+        consulta: ConsultaSEFAZ dona dos documentos; contadores e log são
+            atualizados a cada lote
+        service: Serviço já criado (padrão: a partir do certificado)
+    
+    Returns:
+        Dict com status ('ok', 'aguardando', 'em_uso' ou 'erro'), novos, lotes e mensagem
+    """
+    config = configuracao(certificado.usuario)
+    uf = uf_autora(config)
+    limite_documentos = config.max_documentos_por_consulta if config else 1000
+    tempo_limite = timedelta(seconds=config.timeout_consulta if config else 300)
+    
+    controle, _ = ControleNSU.objects.get_or_create(certificado=certificado, tipo_documento=tipo, uf=uf)
+    resultado = {'status': 'ok', 'novos': 0, 'lotes': 0, 'mensagem': ''}
+    
+    agora = timezone.now()
+    if controle.proxima_consulta and controle.proxima_consulta > agora:
+        resultado['status'] = 'aguardando'
+        resultado['mensagem'] = (
+            f"Próxima consulta permitida às {timezone.localtime(controle.proxima_consulta):%H:%M}"
+        )
+        _registrar(consulta, resultado['mensagem'])
+        return resultado
+    if not _travar(controle, tempo_limite + timedelta(minutes=1)):
+        resultado['status'] = 'em_uso'
+        resultado['mensagem'] = 'Sincronização já em andamento para este certificado'
+        _registrar(consulta, resultado['mensagem'])
+        return resultado
+    
+    try:
+        service = service or SEFAZConsultaService(bytes(certificado.arquivo_pfx), certificado.senha_pfx)
+        prazo = agora + tempo_limite
+        recebidos = 0
+        espera = max(ESPERA_SEFAZ, timedelta(minutes=certificado.intervalo_consulta))
+        
+        while True:
+            retorno = service.consultar_distribuicao(tipo, certificado.cnpj, controle.ult_nsu, uf)
+            cstat = retorno['cStat']
+            controle.ultimo_status = cstat
+            controle.ultima_mensagem = retorno['xMotivo'][:255]
+            
+            if cstat == '656':
+                controle.proxima_consulta = timezone.now() + ESPERA_SEFAZ
+                resultado['status'] = 'aguardando'
+                resultado['mensagem'] = f"656 - {retorno['xMotivo']}"
+                break
+            if cstat not in ('137', '138'):
+                resultado['status'] = 'erro'
+                resultado['mensagem'] = f"{cstat} - {retorno['xMotivo']}"
+                break
+            
+            documentos = []
+            erros = 0
+            for documento in retorno['documentos']:
+                try:
+                    dados = ler_documento(documento['schema'], documento['xml'], certificado.cnpj)
+                except (ET.ParseError, ValueError) as e:
+                    erros += 1
+                    _registrar(consulta, f"NSU {documento['nsu']}: {e}")
+                    continue
+                if dados:
+                    documentos.append(dados)
+            
+            # Documentos e NSU no mesmo commit: o lote nunca é perdido nem repetido
+            with transaction.atomic():
+                novos = _gravar_lote(consulta, documentos)
+                controle.ult_nsu = retorno['ultNSU']
+                controle.max_nsu = retorno['maxNSU']
+                controle.ultima_sincronizacao = timezone.now()
+                controle.save()
+                consulta.total_encontrados += novos
+                consulta.total_erros += erros
+                _registrar(consulta, f"Lote NSU {controle.ult_nsu}/{controle.max_nsu}: {novos} novos")
+                consulta.save(update_fields=['total_encontrados', 'total_erros', 'log_detalhado'])
+            
+            resultado['novos'] += novos
+            resultado['lotes'] += 1
+            recebidos += len(retorno['documentos'])
+            
+            if cstat == '137' or controle.atualizado():
+                controle.proxima_consulta = timezone.now() + espera
+                resultado['mensagem'] = f"Atualizado até o NSU {controle.ult_nsu}"
+                break
+            if recebidos >= limite_documentos or timezone.now() >= prazo:
+                # Continua na próxima execução, a partir do NSU salvo
+                controle.proxima_consulta = None
+                resultado['mensagem'] = f"Interrompido no NSU {controle.ult_nsu} de {controle.max_nsu}"
+                break
+    except Exception as e:
+        resultado['status'] = 'erro'
+        resultado['mensagem'] = str(e)
+    finally:
+        controle.em_uso_ate = None
+        controle.save()
+        certificado.ultima_consulta = timezone.now()
+        certificado.save(update_fields=['ultima_consulta'])
+    
+    _registrar(consulta, resultado['mensagem'])
+    return resultado
+
+
+def processar_consulta(consulta: ConsultaSEFAZ) -> ConsultaSEFAZ:
+    """Executa uma ConsultaSEFAZ PENDENTE; não faz nada se outra execução já a assumiu"""
+    assumida = ConsultaSEFAZ.objects.filter(pk=consulta.pk, status='PENDENTE').update(status='PROCESSANDO')
+    if not assumida:
+        return consulta
+    consulta.refresh_from_db()
+    
+    resultado = sincronizar(consulta.certificado, consulta.tipo_documento, consulta)
+    consulta.status = 'ERRO' if resultado['status'] == 'erro' else 'CONCLUIDA'
+    if resultado['status'] == 'erro':
+        consulta.mensagem_erro = resultado['mensagem']
+    consulta.data_conclusao = timezone.now()
+    consulta.save()
+    return consulta
+
+
+def processar_pendentes() -> int:
+    """Processa as ConsultaSEFAZ pendentes (criadas pela view ou interrompidas)"""
+    processadas = 0
+    for consulta in ConsultaSEFAZ.objects.filter(status='PENDENTE').select_related('certificado').order_by('pk'):
+        processar_consulta(consulta)
+        processadas += 1
+    return processadas
+
+
+def _no_horario(config: Optional[ConfiguracaoConsulta], certificado: CertificadoDigital, agora) -> bool:
+    """Com horario_consulta definido, uma execução automática por dia a partir dele"""
+    if not config or not config.horario_consulta:
+        return True
+    local = timezone.localtime(agora)
+    if local.time() < config.horario_consulta:
+        return False
+    ultima = certificado.ultima_consulta
+    return ultima is None or timezone.localtime(ultima).date() < local.date()
+
+
+def certificados_devidos(agora=None) -> List[CertificadoDigital]:
+    """Certificados com consulta automática cujo intervalo já passou"""
+    agora = agora or timezone.now()
+    devidos = []
+    hoje = timezone.localdate(agora)
+    candidatos = CertificadoDigital.objects.filter(
+        ativo=True, consulta_automatica=True,
+        validade_inicio__lte=hoje, validade_fim__gte=hoje,
+    ).select_related('usuario')
+    for certificado in candidatos:
+        config = configuracao(certificado.usuario)
+        if config and not config.consulta_automatica_ativa:
+            continue
+        if certificado.ultima_consulta and (
+            certificado.ultima_consulta + timedelta(minutes=certificado.intervalo_consulta) > agora
+        ):
+            continue
+        if _no_horario(config, certificado, agora):
+            devidos.append(certificado)
+    return devidos
+
+
+def sincronizar_automaticos(tipos=TIPOS_SINCRONIZADOS) -> List[ConsultaSEFAZ]:
+    """Uma ConsultaSEFAZ por certificado devido e tipo, já processada"""
+    consultas = []
+    hoje = timezone.localdate()
+    for certificado in certificados_devidos():
+        inicio = timezone.localdate(certificado.ultima_consulta) if certificado.ultima_consulta else hoje
+        for tipo in tipos:
+            consulta = ConsultaSEFAZ.objects.create(
+                certificado=certificado,
+                tipo_documento=tipo,
+                data_inicio=inicio,
+                data_fim=hoje,
+                status='PENDENTE',
+            )
+            consultas.append(processar_consulta(consulta))
+    return consultas
+
+
+def processar_em_segundo_plano(consulta_id: int):
+    """Processa a consulta numa thread, sem prender a requisição"""
+    def executar():
+        from django.core.management import call_command
+        close_old_connections()
+        try:
+            call_command('processar_consulta_sefaz', consulta_id)
+        finally:
+            connection.close()
+    
+    threading.Thread(target=executar, name=f'consulta-sefaz-{consulta_id}', daemon=True).start()
@@ -0,0 +1,87 @@
+"""
+Testes do app core: paginação por cursor (core.paginacao)
+
+Uso:
+    python manage.py test core
+"""
+from datetime import datetime, timedelta
+
+from django.test import RequestFactory, TestCase
+from django.utils import timezone
+
+from .models import NFe
+from .paginacao import (
+    ANTERIOR, CursorInvalido, codificar_cursor, paginar, paginar_requisicao
+)
+
+
+class PaginacaoCursorTest(TestCase):
+    """Percurso das páginas, nulos e cursores inválidos"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        inicio = timezone.make_aware(datetime(2024, 1, 1))
+        # Datas repetidas (desempate por id) e sem data de emissão
+        NFe.objects.bulk_create([
+            NFe(
+                chave_acesso=f'{n:044d}',
+                data_emissao=None if n % 4 == 0 else inicio + timedelta(days=n // 3),
+                valor_total=n
+            )
+            for n in range(23)
+        ])
+    
+    def _esperado(self, ordem):
+        prefixo = '-' if ordem.startswith('-') else ''
+        return list(NFe.objects.order_by(ordem, f'{prefixo}pk').values_list('pk', flat=True))
+    
+    def _percorrer(self, ordem, tamanho=5):
+        paginas = [paginar(NFe.objects.all(), ordem, None, tamanho)]
+        while paginas[-1].tem_proxima:
+            paginas.append(paginar(NFe.objects.all(), ordem, paginas[-1].cursor_proximo, tamanho))
+        return paginas
+    
+    def test_percorre_tudo_com_datas_nulas(self):
+        for ordem in ('-data_emissao', 'data_emissao', 'valor_total'):
+            with self.subTest(ordem=ordem):
+                paginas = self._percorrer(ordem)
+                ids = [nfe.pk for pagina in paginas for nfe in pagina]
+                self.assertEqual(ids, self._esperado(ordem))
+                self.assertEqual(len(paginas), 5)
+                self.assertFalse(paginas[0].tem_anterior)
+    
+    def test_voltar_uma_pagina(self):
+        for ordem in ('-data_emissao', 'data_emissao'):
+            with self.subTest(ordem=ordem):
+                paginas = self._percorrer(ordem)
+                for indice in range(1, len(paginas)):
+                    anterior = paginar(NFe.objects.all(), ordem, paginas[indice].cursor_anterior, 5)
+                    self.assertEqual(list(anterior), list(paginas[indice - 1]))
+                    # A página anterior continua levando para a seguinte
+                    self.assertTrue(anterior.tem_proxima)
+                # Voltando até o início não há mais página anterior
+                primeira = paginar(NFe.objects.all(), ordem, paginas[1].cursor_anterior, 5)
+                self.assertFalse(primeira.tem_anterior)
+    
+    def test_cursor_adulterado(self):
+        valido = codificar_cursor('-data_emissao', None, 1)
+        for cursor in ('nao-e-base64!', valido[:-3], 'eyJvIjoxfQ', codificar_cursor('-data_emissao', None, 1, 'x')):
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(CursorInvalido):
+                    paginar(NFe.objects.all(), '-data_emissao', cursor)
+        # Cursor de outra ordenação
+        with self.assertRaises(CursorInvalido):
+            paginar(NFe.objects.all(), 'valor_total', codificar_cursor('-data_emissao', None, 1, ANTERIOR))
+    
+    def test_requisicao_com_cursor_invalido_volta_ao_inicio(self):
+        request = RequestFactory().get('/nfe/', {'cursor': 'adulterado'})
+        pagina = paginar_requisicao(request, NFe.objects.all(), tamanho=5)
+        self.assertEqual([nfe.pk for nfe in pagina], self._esperado('-data_emissao')[:5])
+    
+    def test_contagem_opcional(self):
+        pagina = paginar_requisicao(RequestFactory().get('/nfe/'), NFe.objects.all())
+        self.assertIsNone(pagina.total)
+        
+        with self.assertNumQueries(2):
+            pagina = paginar_requisicao(RequestFactory().get('/nfe/', {'contar': '1'}), NFe.objects.all())
+        self.assertEqual((pagina.total, pagina.total_exato), (23, True))
@@ -6,10 +6,25 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import authenticate, login, logout
 from django.contrib import messages
-from django.db.models import Sum, Count, Q
+from django.db.models import Sum, Count
 from django.core.paginator import Paginator
-from .models import NFe, NFeItem, CTe, ImportLog
-from datetime import datetime, timedelta
+from django.utils import timezone
+from .models import NFe, CTe, ImportLog
+from . import busca, rollups
+from .paginacao import paginar_requisicao, solicitado
+from datetime import timedelta
+
+
+# Campos aceitos em ?ordem= (a paginação por cursor ordena por campo + id)
+ORDENACOES_NFE = ('data_emissao', 'valor_total', 'numero_nf')
+ORDENACOES_CTE = ('data_emissao', 'valor_total', 'numero_ct')
+
+
+def _ordem(request, permitidos):
+    ordem = request.GET.get('ordem', '-data_emissao')
+    if ordem.lstrip('-') not in permitidos:
+        return '-data_emissao'
+    return ordem
 
 
 def login_view(request):
@@ -42,38 +57,18 @@ def dashboard(request):
     """Dashboard principal com estatísticas mobile-first"""
     
     # Período padrão: últimos 30 dias
-    data_inicio = datetime.now() - timedelta(days=30)
-    
-    # Estatísticas NFe
-    nfe_stats = {
-        'total': NFe.objects.count(),
-        'mes_atual': NFe.objects.filter(data_emissao__gte=data_inicio).count(),
-        'valor_total': NFe.objects.aggregate(Sum('valor_total'))['valor_total__sum'] or 0,
-        'valor_mes': NFe.objects.filter(
-            data_emissao__gte=data_inicio
-        ).aggregate(Sum('valor_total'))['valor_total__sum'] or 0,
-    }
+    data_inicio = timezone.localdate() - timedelta(days=30)
     
-    # Estatísticas CTe
-    cte_stats = {
-        'total': CTe.objects.count(),
-        'mes_atual': CTe.objects.filter(data_emissao__gte=data_inicio).count(),
-        'valor_total': CTe.objects.aggregate(Sum('valor_total'))['valor_total__sum'] or 0,
-        'valor_mes': CTe.objects.filter(
-            data_emissao__gte=data_inicio
-        ).aggregate(Sum('valor_total'))['valor_total__sum'] or 0,
-    }
+    # Estatísticas NFe e CTe (resumos diários, uma consulta)
+    resumo = rollups.resumo_documentos(data_inicio)
+    nfe_stats = resumo['NFe']
+    cte_stats = resumo['CTe']
     
     # Últimas importações
     ultimos_logs = ImportLog.objects.select_related('usuario').order_by('-data_importacao')[:10]
     
     # Top 5 emitentes NFe
-    top_emitentes = NFe.objects.values(
-        'emit_cnpj', 'emit_nome'
-    ).annotate(
-        total=Count('id'),
-        valor=Sum('valor_total')
-    ).order_by('-total')[:5]
+    top_emitentes = rollups.top_emitentes(5)
     
     # Últimas NFes
     ultimas_nfes = NFe.objects.select_related('usuario_importacao').order_by('-data_emissao')[:5]
@@ -102,12 +97,7 @@ def nfe_list(request):
     
     search = request.GET.get('search', '')
     if search:
-        nfes = nfes.filter(
-            Q(numero_nf__icontains=search) |
-            Q(emit_nome__icontains=search) |
-            Q(dest_nome__icontains=search) |
-            Q(chave_acesso__icontains=search)
-        )
+        nfes = busca.filtrar(nfes, search)
     
     emit_cnpj = request.GET.get('emit_cnpj', '')
     if emit_cnpj:
@@ -121,27 +111,26 @@ def nfe_list(request):
     if data_fim:
         nfes = nfes.filter(data_emissao__lte=data_fim)
     
-    # Ordenação
-    ordem = request.GET.get('ordem', '-data_emissao')
-    nfes = nfes.order_by(ordem)
-    
-    # Paginação
-    paginator = Paginator(nfes, 20)
-    page = request.GET.get('page', 1)
-    nfes_page = paginator.get_page(page)
-    
-    # Totalizadores
-    totais = nfes.aggregate(
-        total_valor=Sum('valor_total'),
-        total_produtos=Sum('valor_produtos'),
-        total_icms=Sum('valor_icms')
-    )
+    # Ordenação e paginação por cursor (sem OFFSET nem COUNT completo)
+    ordem = _ordem(request, ORDENACOES_NFE)
+    nfes_page = paginar_requisicao(request, nfes, ordem, 20)
+    
+    # Totalizadores: percorrem todo o filtro, então só na primeira página
+    # (ou com ?totais=1); as demais páginas não pagam esse custo
+    totais = None
+    if not nfes_page.tem_anterior or solicitado(request.GET, 'totais'):
+        totais = nfes.aggregate(
+            total_valor=Sum('valor_total'),
+            total_produtos=Sum('valor_produtos'),
+            total_icms=Sum('valor_icms')
+        )
     
     context = {
         'nfes': nfes_page,
         'totais': totais,
         'search': search,
         'emit_cnpj': emit_cnpj,
+        'ordem': ordem,
     }
     
     return render(request, 'core/nfe_list.html', context)
@@ -170,33 +159,27 @@ def cte_list(request):
     
     search = request.GET.get('search', '')
     if search:
-        ctes = ctes.filter(
-            Q(numero_ct__icontains=search) |
-            Q(emit_nome__icontains=search) |
-            Q(dest_nome__icontains=search) |
-            Q(chave_acesso__icontains=search)
+        ctes = busca.filtrar(ctes, search)
+    
+    # Ordenação e paginação por cursor (sem OFFSET nem COUNT completo)
+    ordem = _ordem(request, ORDENACOES_CTE)
+    ctes_page = paginar_requisicao(request, ctes, ordem, 20)
+    
+    # Totalizadores: percorrem todo o filtro, então só na primeira página
+    # (ou com ?totais=1); as demais páginas não pagam esse custo
+    totais = None
+    if not ctes_page.tem_anterior or solicitado(request.GET, 'totais'):
+        totais = ctes.aggregate(
+            total_valor=Sum('valor_total'),
+            total_carga=Sum('valor_carga'),
+            total_icms=Sum('valor_icms')
         )
     
-    # Ordenação
-    ordem = request.GET.get('ordem', '-data_emissao')
-    ctes = ctes.order_by(ordem)
-    
-    # Paginação
-    paginator = Paginator(ctes, 20)
-    page = request.GET.get('page', 1)
-    ctes_page = paginator.get_page(page)
-    
-    # Totalizadores
-    totais = ctes.aggregate(
-        total_valor=Sum('valor_total'),
-        total_carga=Sum('valor_carga'),
-        total_icms=Sum('valor_icms')
-    )
-    
     context = {
         'ctes': ctes_page,
         'totais': totais,
         'search': search,
+        'ordem': ordem,
     }
     
     return render(request, 'core/cte_list.html', context)
@@ -254,30 +237,13 @@ def analytics(request):
     """Análises e relatórios mobile-first"""
     
     # Vendas por mês (NFe)
-    from django.db.models.functions import TruncMonth
-    
-    vendas_mes = NFe.objects.annotate(
-        mes=TruncMonth('data_emissao')
-    ).values('mes').annotate(
-        total=Count('id'),
-        valor=Sum('valor_total')
-    ).order_by('-mes')[:12]
+    vendas_mes = rollups.vendas_por_mes(12)
     
     # Top produtos (mais vendidos)
-    top_produtos = NFeItem.objects.values(
-        'codigo_produto', 'descricao'
-    ).annotate(
-        qtd_total=Sum('quantidade'),
-        valor_total=Sum('valor_total')
-    ).order_by('-qtd_total')[:10]
+    top_produtos = rollups.top_produtos(10)
     
     # Rotas mais usadas (CTe)
-    top_rotas = CTe.objects.values(
-        'municipio_inicio', 'uf_inicio', 'municipio_fim', 'uf_fim'
-    ).annotate(
-        total=Count('id'),
-        valor=Sum('valor_total')
-    ).order_by('-total')[:10]
+    top_rotas = rollups.top_rotas(10)
     
     context = {
         'vendas_mes': vendas_mes,
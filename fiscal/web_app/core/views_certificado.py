@@ -6,12 +6,14 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
+from django.utils import timezone
 from datetime import datetime, timedelta
 from .models_certificado import (
     CertificadoDigital, ConsultaSEFAZ, 
     DocumentoConsultado, ConfiguracaoConsulta
 )
 from .sefaz_service import SEFAZConsultaService
+from . import importacao, sefaz_download, sefaz_sync
 import base64
 
 
@@ -95,12 +97,12 @@ def consulta_sefaz(request, certificado_id):
                 tipo_documento=tipo_doc,
                 data_inicio=data_inicio,
                 data_fim=data_fim,
-                status='PROCESSANDO'
+                status='PENDENTE'
             )
             
-            # Iniciar consulta em background (ou síncrona para teste)
-            from django.core.management import call_command
-            # call_command('processar_consulta_sefaz', consulta.id)
+            # Processa em background a partir do último NSU; se o processo
+            # cair antes, o worker (sincronizar_sefaz) retoma as pendentes
+            sefaz_sync.processar_em_segundo_plano(consulta.id)
             
             messages.success(request, 'Consulta iniciada! Aguarde o processamento.')
             return redirect('consulta_resultado', consulta_id=consulta.id)
@@ -198,25 +200,32 @@ def importar_documento(request, documento_id):
     if documento.consulta.certificado.usuario != request.user:
         return JsonResponse({'erro': 'Acesso negado'}, status=403)
     
+    if documento.importado:
+        return JsonResponse({'sucesso': True, 'mensagem': 'Documento já importado'})
+    
     try:
-        # Importar para NFe ou CTe
-        if documento.consulta.tipo_documento == 'NFE':
-            from .models import NFe, NFeItem
-            from .xml_parser import parse_nfe_xml
-            
-            # Parsear XML e criar NFe
-            dados = parse_nfe_xml(documento.xml_completo)
-            # Criar NFe no banco...
-            
-            documento.importado = True
-            documento.data_importacao = datetime.now()
-            documento.save()
+        if not documento.xml_baixado:
+            # Só NFe tem download por chave; CTe chega completo na sincronização
+            if documento.consulta.tipo_documento != 'NFE':
+                return JsonResponse({'erro': 'XML completo ainda não disponível'}, status=409)
+            certificado = documento.consulta.certificado
+            espera = sefaz_download.suspenso_ate(certificado)
+            if espera:
+                return JsonResponse({'erro': f'SEFAZ bloqueou consultas até {timezone.localtime(espera):%H:%M} (consumo indevido)'}, status=429)
             
-            return JsonResponse({'sucesso': True, 'mensagem': 'Documento importado!'})
+            service = SEFAZConsultaService(bytes(certificado.arquivo_pfx), certificado.senha_pfx)
+            uf = sefaz_sync.uf_autora(sefaz_sync.configuracao(request.user))
+            xml = service.baixar_xml_completo(documento.chave_acesso, uf, certificado.cnpj)
+            if not xml:
+                return JsonResponse({'erro': 'XML completo não disponível na SEFAZ'}, status=409)
+            documento.xml_completo = xml
+            documento.xml_baixado = True
+            documento.save(update_fields=['xml_completo', 'xml_baixado'])
         
-        elif documento.consulta.tipo_documento == 'CTE':
-            # Similar para CTe
-            pass
+        resultado = importacao.importar_documentos([documento], request.user)
+        if resultado['erros']:
+            return JsonResponse({'erro': resultado['mensagens'][documento.chave_acesso]}, status=422)
+        return JsonResponse({'sucesso': True, 'mensagem': 'Documento importado!'})
         
     except Exception as e:
         return JsonResponse({'erro': str(e)}, status=500)
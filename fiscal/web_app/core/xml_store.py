@@ -0,0 +1,166 @@
+"""
+Armazenamento dos XMLs brutos fora das tabelas NFe/CTe
+
+Os XMLs são comprimidos (zstd quando disponível, senão gzip) e endereçados
+pelo SHA-256 do conteúdo, então o mesmo XML é gravado uma única vez. Os
+documentos guardam só o hash em `xml_hash`.
+
+Backends (settings.XML_STORE_BACKEND):
+    'db'      - tabela core_xmlarmazenado (padrão)
+    'arquivo' - arquivos em settings.XML_STORE_DIR
+"""
+import gzip
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+
+try:
+    import zstandard
+except ImportError:  # zstd é opcional; gzip está sempre disponível
+    zstandard = None
+
+
+EXTENSOES = {'zstd': '.xml.zst', 'gzip': '.xml.gz'}
+
+
+def calcular_hash(xml: str) -> str:
+    """SHA-256 do XML (texto em UTF-8)"""
+    return hashlib.sha256(xml.encode('utf-8')).hexdigest()
+
+
+def comprimir(xml: str) -> Tuple[str, bytes]:
+    """Comprime o XML e retorna (algoritmo, dados)"""
+    dados = xml.encode('utf-8')
+    if zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level=10).compress(dados)
+    return 'gzip', gzip.compress(dados, compresslevel=6)
+
+
+def descomprimir(algoritmo: str, dados: bytes) -> str:
+    """Descomprime dados gravados por comprimir()"""
+    if algoritmo == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('XML comprimido com zstd, mas o pacote zstandard não está instalado')
+        return zstandard.ZstdDecompressor().decompress(dados).decode('utf-8')
+    if algoritmo == 'gzip':
+        return gzip.decompress(dados).decode('utf-8')
+    raise ValueError(f'Compressão desconhecida: {algoritmo}')
+
+
+class XMLStoreBanco:
+    """Blobs na tabela XMLArmazenado"""
+    
+    def existentes(self, hashes: Iterable[str]) -> set:
+        from .models import XMLArmazenado
+        return set(
+            XMLArmazenado.objects.filter(hash__in=list(hashes)).values_list('hash', flat=True)
+        )
+    
+    def salvar(self, blobs: Dict[str, Tuple[str, bytes, int]]):
+        from .models import XMLArmazenado
+        XMLArmazenado.objects.bulk_create(
+            [
+                XMLArmazenado(
+                    hash=hash_xml,
+                    compressao=algoritmo,
+                    tamanho_original=tamanho,
+                    conteudo=dados,
+                )
+                for hash_xml, (algoritmo, dados, tamanho) in blobs.items()
+            ],
+            ignore_conflicts=True,
+        )
+    
+    def carregar(self, hash_xml: str) -> Optional[Tuple[str, bytes]]:
+        from .models import XMLArmazenado
+        blob = XMLArmazenado.objects.filter(hash=hash_xml).values_list(
+            'compressao', 'conteudo'
+        ).first()
+        if blob is None:
+            return None
+        return blob[0], bytes(blob[1])
+
+
+class XMLStoreArquivos:
+    """Blobs em arquivos, distribuídos em subdiretórios pelo prefixo do hash"""
+    
+    def __init__(self, diretorio):
+        self.diretorio = Path(diretorio)
+    
+    def _caminho(self, hash_xml: str, algoritmo: str) -> Path:
+        return self.diretorio / hash_xml[:2] / hash_xml[2:4] / f'{hash_xml}{EXTENSOES[algoritmo]}'
+    
+    def _encontrar(self, hash_xml: str) -> Optional[Tuple[str, Path]]:
+        for algoritmo in EXTENSOES:
+            caminho = self._caminho(hash_xml, algoritmo)
+            if caminho.exists():
+                return algoritmo, caminho
+        return None
+    
+    def existentes(self, hashes: Iterable[str]) -> set:
+        return {hash_xml for hash_xml in hashes if self._encontrar(hash_xml)}
+    
+    def salvar(self, blobs: Dict[str, Tuple[str, bytes, int]]):
+        for hash_xml, (algoritmo, dados, _) in blobs.items():
+            caminho = self._caminho(hash_xml, algoritmo)
+            caminho.parent.mkdir(parents=True, exist_ok=True)
+            # Grava em arquivo temporário e renomeia para nunca expor blob parcial
+            fd, temporario = tempfile.mkstemp(dir=caminho.parent)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(dados)
+            os.replace(temporario, caminho)
+    
+    def carregar(self, hash_xml: str) -> Optional[Tuple[str, bytes]]:
+        encontrado = self._encontrar(hash_xml)
+        if encontrado is None:
+            return None
+        algoritmo, caminho = encontrado
+        return algoritmo, caminho.read_bytes()
+
+
+def obter_store():
+    """Backend configurado em settings.XML_STORE_BACKEND"""
+    backend = getattr(settings, 'XML_STORE_BACKEND', 'db')
+    if backend == 'arquivo':
+        return XMLStoreArquivos(getattr(settings, 'XML_STORE_DIR', settings.BASE_DIR / 'xml_store'))
+    if backend == 'db':
+        return XMLStoreBanco()
+    raise ValueError(f'XML_STORE_BACKEND inválido: {backend}')
+
+
+def salvar_xmls(xmls: List[str]) -> List[str]:
+    """
+    Grava vários XMLs de uma vez, sem duplicar conteúdos já armazenados
+    
+    Returns:
+        Hashes na mesma ordem dos XMLs recebidos
+    """
+    hashes = [calcular_hash(xml) for xml in xmls]
+    store = obter_store()
+    existentes = store.existentes(set(hashes))
+    
+    novos = {}
+    for hash_xml, xml in zip(hashes, xmls):
+        if hash_xml not in existentes and hash_xml not in novos:
+            algoritmo, dados = comprimir(xml)
+            novos[hash_xml] = (algoritmo, dados, len(xml.encode('utf-8')))
+    if novos:
+        store.salvar(novos)
+    return hashes
+
+
+def salvar_xml(xml: str) -> str:
+    """Grava um XML e retorna seu hash"""
+    return salvar_xmls([xml])[0]
+
+
+def carregar_xml(hash_xml: str) -> Optional[str]:
+    """XML armazenado com o hash informado (None se não existir)"""
+    blob = obter_store().carregar(hash_xml)
+    if blob is None:
+        return None
+    return descomprimir(*blob)
@@ -166,3 +166,18 @@ XML_DIRECTORIES = {
     'nfe': PROJECT_ROOT / 'NFe',
     'cte': PROJECT_ROOT / 'CTe',
 }
+
+# Armazenamento dos XMLs brutos ('db' ou 'arquivo'), ver core/xml_store.py
+XML_STORE_BACKEND = os.getenv('XML_STORE_BACKEND', 'db')
+XML_STORE_DIR = Path(os.getenv('XML_STORE_DIR', BASE_DIR / 'xml_store'))
+
+# Busca de documentos ('auto', 'trigrama' ou 'indice'), ver core/busca.py
+BUSCA_BACKEND = os.getenv('BUSCA_BACKEND', 'auto')
+
+# Webservices SEFAZ (mTLS), ver core/sefaz_sessao.py
+SEFAZ_CA_BUNDLE = os.getenv('SEFAZ_CA_BUNDLE') or None
+SEFAZ_POOL_CONEXOES = int(os.getenv('SEFAZ_POOL_CONEXOES', '10'))
+SEFAZ_TENTATIVAS = int(os.getenv('SEFAZ_TENTATIVAS', '3'))
+
+# Engine do xml_parser.py usada ao importar XMLs baixados da SEFAZ ('etree' ou 'stream')
+XML_PARSER_ENGINE = os.getenv('XML_PARSER_ENGINE', 'stream')
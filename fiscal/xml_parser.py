@@ -77,7 +77,7 @@ class XMLParser:
             chave = inf_nfe.get('Id', '').replace('NFe', '')
             
             # Identificação
-            ide = inf_nfe.find('.//nfe:ide', self.NS_NFE) or inf_nfe.find('.//ide')
+            ide = self.find_elem(inf_nfe, 'ide', self.NS_NFE)
             numero = ide.find('.//nfe:nNF', self.NS_NFE) if ide is not None else None
             if numero is None and ide is not None:
                 numero = ide.find('.//nNF')
@@ -89,7 +89,7 @@ class XMLParser:
                 data_emissao = ide.find('.//dhEmi')
             
             # Emitente
-            emit = inf_nfe.find('.//nfe:emit', self.NS_NFE) or inf_nfe.find('.//emit')
+            emit = self.find_elem(inf_nfe, 'emit', self.NS_NFE)
             emit_data = {}
             if emit is not None:
                 emit_data = {
@@ -100,7 +100,7 @@ class XMLParser:
                 }
                 
                 # Endereço do emitente
-                ender_emit = emit.find('.//nfe:enderEmit', self.NS_NFE) or emit.find('.//enderEmit')
+                ender_emit = self.find_elem(emit, 'enderEmit', self.NS_NFE)
                 if ender_emit is not None:
                     logradouro = self.get_text(ender_emit, 'xLgr')
                     numero_end = self.get_text(ender_emit, 'nro')
@@ -111,7 +111,7 @@ class XMLParser:
                     emit_data['cep'] = self.get_text(ender_emit, 'CEP')
             
             # Destinatário
-            dest = inf_nfe.find('.//nfe:dest', self.NS_NFE) or inf_nfe.find('.//dest')
+            dest = self.find_elem(inf_nfe, 'dest', self.NS_NFE)
             dest_data = {}
             if dest is not None:
                 # Tenta CNPJ primeiro, depois CPF
@@ -126,7 +126,7 @@ class XMLParser:
                 }
                 
                 # Endereço do destinatário
-                ender_dest = dest.find('.//nfe:enderDest', self.NS_NFE) or dest.find('.//enderDest')
+                ender_dest = self.find_elem(dest, 'enderDest', self.NS_NFE)
                 if ender_dest is not None:
                     logradouro = self.get_text(ender_dest, 'xLgr')
                     numero_end = self.get_text(ender_dest, 'nro')
@@ -137,7 +137,7 @@ class XMLParser:
                     dest_data['cep'] = self.get_text(ender_dest, 'CEP')
             
             # Totais
-            total = inf_nfe.find('.//nfe:total', self.NS_NFE) or inf_nfe.find('.//total')
+            total = self.find_elem(inf_nfe, 'total', self.NS_NFE)
             icms_tot = total.find('.//nfe:ICMSTot', self.NS_NFE) if total is not None else None
             if icms_tot is None and total is not None:
                 icms_tot = total.find('.//ICMSTot')
@@ -155,10 +155,10 @@ class XMLParser:
                 }
             
             # Protocolo de autorização
-            prot_nfe = root.find('.//nfe:protNFe', self.NS_NFE) or root.find('.//protNFe')
+            prot_nfe = self.find_elem(root, 'protNFe', self.NS_NFE)
             protocolo_data = {}
             if prot_nfe is not None:
-                inf_prot = prot_nfe.find('.//nfe:infProt', self.NS_NFE) or prot_nfe.find('.//infProt')
+                inf_prot = self.find_elem(prot_nfe, 'infProt', self.NS_NFE)
                 if inf_prot is not None:
                     protocolo_data = {
                         'protocolo': self.get_text(inf_prot, 'nProt'),
@@ -206,11 +206,11 @@ class XMLParser:
         try:
             n_item = det_elem.get('nItem')
             if not n_item:
-                n_item_elem = det_elem.find('.//nfe:nItem', self.NS_NFE) or det_elem.find('.//nItem')
+                n_item_elem = self.find_elem(det_elem, 'nItem', self.NS_NFE)
                 n_item = n_item_elem.text if n_item_elem is not None else None
             
             # Produto
-            prod = det_elem.find('.//nfe:prod', self.NS_NFE) or det_elem.find('.//prod')
+            prod = self.find_elem(det_elem, 'prod', self.NS_NFE)
             if prod is None:
                 return None
             
@@ -229,35 +229,35 @@ class XMLParser:
             }
             
             # Impostos do item
-            imposto = det_elem.find('.//nfe:imposto', self.NS_NFE) or det_elem.find('.//imposto')
+            imposto = self.find_elem(det_elem, 'imposto', self.NS_NFE)
             if imposto is not None:
                 # ICMS
-                icms = imposto.find('.//nfe:ICMS', self.NS_NFE) or imposto.find('.//ICMS')
+                icms = self.find_elem(imposto, 'ICMS', self.NS_NFE)
                 if icms is not None:
                     for icms_tipo in icms:
-                        v_icms = icms_tipo.find('.//nfe:vICMS', self.NS_NFE) or icms_tipo.find('.//vICMS')
+                        v_icms = self.find_elem(icms_tipo, 'vICMS', self.NS_NFE)
                         if v_icms is not None:
                             item['valor_icms'] = self.extrair_numero(v_icms.text)
                             break
                 
                 # IPI
-                ipi = imposto.find('.//nfe:IPI', self.NS_NFE) or imposto.find('.//IPI')
+                ipi = self.find_elem(imposto, 'IPI', self.NS_NFE)
                 if ipi is not None:
-                    v_ipi = ipi.find('.//nfe:vIPI', self.NS_NFE) or ipi.find('.//vIPI')
+                    v_ipi = self.find_elem(ipi, 'vIPI', self.NS_NFE)
                     if v_ipi is not None:
                         item['valor_ipi'] = self.extrair_numero(v_ipi.text)
                 
                 # PIS
-                pis = imposto.find('.//nfe:PIS', self.NS_NFE) or imposto.find('.//PIS')
+                pis = self.find_elem(imposto, 'PIS', self.NS_NFE)
                 if pis is not None:
-                    v_pis = pis.find('.//nfe:vPIS', self.NS_NFE) or pis.find('.//vPIS')
+                    v_pis = self.find_elem(pis, 'vPIS', self.NS_NFE)
                     if v_pis is not None:
                         item['valor_pis'] = self.extrair_numero(v_pis.text)
                 
                 # COFINS
-                cofins = imposto.find('.//nfe:COFINS', self.NS_NFE) or imposto.find('.//COFINS')
+                cofins = self.find_elem(imposto, 'COFINS', self.NS_NFE)
                 if cofins is not None:
-                    v_cofins = cofins.find('.//nfe:vCOFINS', self.NS_NFE) or cofins.find('.//vCOFINS')
+                    v_cofins = self.find_elem(cofins, 'vCOFINS', self.NS_NFE)
                     if v_cofins is not None:
                         item['valor_cofins'] = self.extrair_numero(v_cofins.text)
             
@@ -282,12 +282,12 @@ class XMLParser:
             root = tree.getroot()
             
             # Tenta encontrar o CTe
-            cte_elem = root.find('.//cte:CTe', self.NS_CTE) or root.find('.//CTe')
+            cte_elem = self.find_elem(root, 'CTe', self.NS_CTE)
             if cte_elem is None:
                 return {'error': 'Estrutura CTe não encontrada no XML'}
             
             # Informações principais
-            inf_cte = cte_elem.find('.//cte:infCte', self.NS_CTE) or cte_elem.find('.//infCte')
+            inf_cte = self.find_elem(cte_elem, 'infCte', self.NS_CTE)
             if inf_cte is None:
                 return {'error': 'infCte não encontrado'}
             
@@ -295,7 +295,7 @@ class XMLParser:
             chave = inf_cte.get('Id', '').replace('CTe', '')
             
             # Identificação
-            ide = inf_cte.find('.//cte:ide', self.NS_CTE) or inf_cte.find('.//ide')
+            ide = self.find_elem(inf_cte, 'ide', self.NS_CTE)
             ide_data = {}
             if ide is not None:
                 ide_data = {
@@ -313,7 +313,7 @@ class XMLParser:
                 }
             
             # Emitente
-            emit = inf_cte.find('.//cte:emit', self.NS_CTE) or inf_cte.find('.//emit')
+            emit = self.find_elem(inf_cte, 'emit', self.NS_CTE)
             emit_data = {}
             if emit is not None:
                 emit_data = {
@@ -323,7 +323,7 @@ class XMLParser:
                     'ie': self.get_text(emit, 'IE'),
                 }
                 
-                ender_emit = emit.find('.//cte:enderEmit', self.NS_CTE) or emit.find('.//enderEmit')
+                ender_emit = self.find_elem(emit, 'enderEmit', self.NS_CTE)
                 if ender_emit is not None:
                     logradouro = self.get_text(ender_emit, 'xLgr')
                     numero_end = self.get_text(ender_emit, 'nro')
@@ -333,7 +333,7 @@ class XMLParser:
                     emit_data['uf'] = self.get_text(ender_emit, 'UF')
             
             # Remetente
-            rem = inf_cte.find('.//cte:rem', self.NS_CTE) or inf_cte.find('.//rem')
+            rem = self.find_elem(inf_cte, 'rem', self.NS_CTE)
             rem_data = {}
             if rem is not None:
                 rem_data = {
@@ -342,13 +342,13 @@ class XMLParser:
                     'ie': self.get_text(rem, 'IE'),
                 }
                 
-                ender_rem = rem.find('.//cte:enderReme', self.NS_CTE) or rem.find('.//enderReme')
+                ender_rem = self.find_elem(rem, 'enderReme', self.NS_CTE)
                 if ender_rem is not None:
                     rem_data['municipio'] = self.get_text(ender_rem, 'xMun')
                     rem_data['uf'] = self.get_text(ender_rem, 'UF')
             
             # Destinatário
-            dest = inf_cte.find('.//cte:dest', self.NS_CTE) or inf_cte.find('.//dest')
+            dest = self.find_elem(inf_cte, 'dest', self.NS_CTE)
             dest_data = {}
             if dest is not None:
                 dest_data = {
@@ -357,39 +357,39 @@ class XMLParser:
                     'ie': self.get_text(dest, 'IE'),
                 }
                 
-                ender_dest = dest.find('.//cte:enderDest', self.NS_CTE) or dest.find('.//enderDest')
+                ender_dest = self.find_elem(dest, 'enderDest', self.NS_CTE)
                 if ender_dest is not None:
                     dest_data['municipio'] = self.get_text(ender_dest, 'xMun')
                     dest_data['uf'] = self.get_text(ender_dest, 'UF')
             
             # Valores
-            vprest = inf_cte.find('.//cte:vPrest', self.NS_CTE) or inf_cte.find('.//vPrest')
+            vprest = self.find_elem(inf_cte, 'vPrest', self.NS_CTE)
             valores = {}
             if vprest is not None:
                 valores['valor_total'] = self.extrair_numero(self.get_text(vprest, 'vTPrest'))
                 valores['valor_receber'] = self.extrair_numero(self.get_text(vprest, 'vRec'))
             
             # Valor da carga
-            inf_carga = inf_cte.find('.//cte:infCarga', self.NS_CTE) or inf_cte.find('.//infCarga')
+            inf_carga = self.find_elem(inf_cte, 'infCarga', self.NS_CTE)
             if inf_carga is not None:
                 valores['valor_carga'] = self.extrair_numero(self.get_text(inf_carga, 'vCarga'))
             
             # ICMS
-            imp = inf_cte.find('.//cte:imp', self.NS_CTE) or inf_cte.find('.//imp')
+            imp = self.find_elem(inf_cte, 'imp', self.NS_CTE)
             if imp is not None:
-                icms = imp.find('.//cte:ICMS', self.NS_CTE) or imp.find('.//ICMS')
+                icms = self.find_elem(imp, 'ICMS', self.NS_CTE)
                 if icms is not None:
                     for icms_tipo in icms:
-                        v_icms = icms_tipo.find('.//cte:vICMS', self.NS_CTE) or icms_tipo.find('.//vICMS')
+                        v_icms = self.find_elem(icms_tipo, 'vICMS', self.NS_CTE)
                         if v_icms is not None:
                             valores['valor_icms'] = self.extrair_numero(v_icms.text)
                             break
             
             # Protocolo
-            prot_cte = root.find('.//cte:protCTe', self.NS_CTE) or root.find('.//protCTe')
+            prot_cte = self.find_elem(root, 'protCTe', self.NS_CTE)
             protocolo_data = {}
             if prot_cte is not None:
-                inf_prot = prot_cte.find('.//cte:infProt', self.NS_CTE) or prot_cte.find('.//infProt')
+                inf_prot = self.find_elem(prot_cte, 'infProt', self.NS_CTE)
                 if inf_prot is not None:
                     protocolo_data = {
                         'protocolo': self.get_text(inf_prot, 'nProt'),
@@ -414,6 +414,22 @@ class XMLParser:
         except Exception as e:
             return {'error': f'Erro ao processar CTe: {str(e)}'}
     
+    def find_elem(self, parent, tag_name: str, ns: Dict[str, str]):
+        """
+        Busca o primeiro descendente com namespace e, se não achar, sem namespace
+        
+        Não usa `busca_ns or busca_sem_ns`: elementos sem filhos são falsos no
+        ElementTree e o resultado com namespace seria descartado.
+        """
+        if parent is None:
+            return None
+        
+        prefixo = next(iter(ns))
+        elem = parent.find(f'.//{prefixo}:{tag_name}', ns)
+        if elem is None:
+            elem = parent.find(f'.//{tag_name}')
+        return elem
+    
     def get_text(self, parent, tag_name: str) -> Optional[str]:
         """Obtém o texto de um elemento, tentando com e sem namespace"""
         if parent is None:
@@ -435,3 +451,450 @@ class XMLParser:
             return self.limpar_texto(elem.text)
         
         return None
+
+
+class XMLStreamParser(XMLParser):
+    """
+    Parser de passada única para XMLs fiscais (NFe e CTe)
+    
+    Resolve o namespace uma vez pela raiz, localiza cada seção com iter() e
+    coleta os campos da seção numa única varredura, despachando por tabelas
+    tag -> campo pré-calculadas em vez de repetir buscas './/' (com fallback
+    sem namespace) para cada campo. Produz o mesmo dicionário que XMLParser.
+    """
+    
+    RAIZ = '#raiz'
+    
+    # Seções: tag -> seção pai (vale a primeira ocorrência dentro do pai)
+    SECOES_NFE = {
+        'NFe': RAIZ,
+        'infNFe': 'NFe',
+        'ide': 'infNFe',
+        'emit': 'infNFe',
+        'enderEmit': 'emit',
+        'dest': 'infNFe',
+        'enderDest': 'dest',
+        'total': 'infNFe',
+        'ICMSTot': 'total',
+        'det': 'infNFe',
+        'prod': 'det',
+        'imposto': 'det',
+        'ICMS': 'imposto',
+        'IPI': 'imposto',
+        'PIS': 'imposto',
+        'COFINS': 'imposto',
+        'protNFe': RAIZ,
+        'infProt': 'protNFe',
+    }
+    
+    SECOES_CTE = {
+        'CTe': RAIZ,
+        'infCte': 'CTe',
+        'ide': 'infCte',
+        'emit': 'infCte',
+        'enderEmit': 'emit',
+        'rem': 'infCte',
+        'enderReme': 'rem',
+        'dest': 'infCte',
+        'enderDest': 'dest',
+        'vPrest': 'infCte',
+        'infCarga': 'infCte',
+        'imp': 'infCte',
+        'ICMS': 'imp',
+        'protCTe': RAIZ,
+        'infProt': 'protCTe',
+    }
+    
+    # Seções que geram um registro por ocorrência
+    SECOES_REPETIDAS = {'det'}
+    
+    ENDERECO = {
+        'xLgr': 'logradouro',
+        'nro': 'numero',
+        'xBairro': 'bairro',
+        'xMun': 'municipio',
+        'UF': 'uf',
+        'CEP': 'cep',
+    }
+    
+    PROTOCOLO = {'nProt': 'protocolo', 'cStat': 'status', 'xMotivo': 'motivo'}
+    
+    # Campos: seção -> {tag: campo} (vale o primeiro descendente da seção)
+    CAMPOS_NFE = {
+        'ide': {'nNF': 'numero_nf', 'serie': 'serie', 'dhEmi': 'data_emissao'},
+        'emit': {'CNPJ': 'cnpj', 'xNome': 'nome', 'xFant': 'fantasia', 'IE': 'ie'},
+        'enderEmit': ENDERECO,
+        'dest': {'CNPJ': 'cnpj', 'CPF': 'cpf', 'xNome': 'nome', 'IE': 'ie'},
+        'enderDest': ENDERECO,
+        'ICMSTot': {
+            'vNF': 'valor_total',
+            'vProd': 'valor_produtos',
+            'vICMS': 'valor_icms',
+            'vIPI': 'valor_ipi',
+            'vPIS': 'valor_pis',
+            'vCOFINS': 'valor_cofins',
+            'vTotTrib': 'valor_tributos',
+        },
+        'infProt': PROTOCOLO,
+        'det': {'nItem': 'numero_item'},
+        'prod': {
+            'cProd': 'codigo_produto',
+            'xProd': 'descricao',
+            'NCM': 'ncm',
+            'CFOP': 'cfop',
+            'CEST': 'cest',
+            'uCom': 'unidade',
+            'qCom': 'quantidade',
+            'vUnCom': 'valor_unitario',
+            'vProd': 'valor_total',
+            'cEAN': 'ean',
+        },
+        'ICMS': {'vICMS': 'valor_icms'},
+        'IPI': {'vIPI': 'valor_ipi'},
+        'PIS': {'vPIS': 'valor_pis'},
+        'COFINS': {'vCOFINS': 'valor_cofins'},
+    }
+    
+    CAMPOS_CTE = {
+        'ide': {
+            'nCT': 'numero_ct',
+            'serie': 'serie',
+            'dhEmi': 'data_emissao',
+            'modal': 'modal',
+            'tpServ': 'tipo_servico',
+            'CFOP': 'cfop',
+            'natOp': 'natureza_operacao',
+            'xMunIni': 'municipio_inicio',
+            'UFIni': 'uf_inicio',
+            'xMunFim': 'municipio_fim',
+            'UFFim': 'uf_fim',
+        },
+        'emit': {'CNPJ': 'cnpj', 'xNome': 'nome', 'xFant': 'fantasia', 'IE': 'ie'},
+        'enderEmit': ENDERECO,
+        'rem': {'CNPJ': 'cnpj', 'xNome': 'nome', 'IE': 'ie'},
+        'enderReme': ENDERECO,
+        'dest': {'CNPJ': 'cnpj', 'xNome': 'nome', 'IE': 'ie'},
+        'enderDest': ENDERECO,
+        'vPrest': {'vTPrest': 'valor_total', 'vRec': 'valor_receber'},
+        'infCarga': {'vCarga': 'valor_carga'},
+        'ICMS': {'vICMS': 'valor_icms'},
+        'infProt': PROTOCOLO,
+    }
+    
+    def __init__(self):
+        # (namespace, tipo) -> ({tag qualificada: tag local}, {tag local: tag qualificada})
+        self._mapas_tags = {}
+        self._filhos = {
+            'NFe': self._agrupar_filhos(self.SECOES_NFE),
+            'CTe': self._agrupar_filhos(self.SECOES_CTE),
+        }
+    
+    @staticmethod
+    def _agrupar_filhos(secoes: Dict) -> Dict[str, List[str]]:
+        """Inverte a tabela seção -> pai para pai -> [seções]"""
+        filhos = {}
+        for secao, pai in secoes.items():
+            filhos.setdefault(pai, []).append(secao)
+        return filhos
+    
+    def _mapa_tags(self, tag_raiz: str, tipo: str, secoes: Dict):
+        """Resolve o namespace do documento e devolve os mapas de tags conhecidas"""
+        namespace = tag_raiz[1:].split('}', 1)[0] if tag_raiz.startswith('{') else ''
+        chave = (namespace, tipo)
+        
+        mapas = self._mapas_tags.get(chave)
+        if mapas is None:
+            campos = self.CAMPOS_NFE if tipo == 'NFe' else self.CAMPOS_CTE
+            conhecidas = set(secoes)
+            for tabela in campos.values():
+                conhecidas.update(tabela)
+            prefixo = f'{{{namespace}}}' if namespace else ''
+            locais = {f'{prefixo}{tag}': tag for tag in conhecidas}
+            qualificadas = {tag: qualificada for qualificada, tag in locais.items()}
+            mapas = self._mapas_tags[chave] = (locais, qualificadas)
+        return mapas
+    
+    def _percorrer(self, xml_path: str, tipo: str, secoes: Dict):
+        """
+        Carrega o XML e coleta as seções e seus campos
+        
+        Returns:
+            Tupla (raiz, unicas, repetidas): `unicas` mapeia seção -> registro e
+            `repetidas` traz um dicionário seção -> registro por ocorrência de
+            seção repetida (ex.: cada det com seu prod/imposto)
+        """
+        raiz = ET.parse(xml_path).getroot()
+        locais, qualificadas = self._mapa_tags(raiz.tag, tipo, secoes)
+        campos_secao = self.CAMPOS_NFE if tipo == 'NFe' else self.CAMPOS_CTE
+        filhos = self._filhos[tipo]
+        unicas = {}
+        repetidas = []
+        
+        def coletar(elem, tabela):
+            # Primeira ocorrência de cada campo entre os descendentes da seção
+            campos = {}
+            for sub in elem.iter():
+                campo = tabela.get(locais.get(sub.tag))
+                if campo is not None and campo not in campos and sub is not elem:
+                    campos[campo] = sub.text
+            return campos
+        
+        def primeira(elem, tag):
+            return next((sub for sub in elem.iter(tag) if sub is not elem), None)
+        
+        def abrir(secao, elem, destino):
+            tabela = campos_secao.get(secao)
+            # det só precisa varrer a subárvore quando nItem não é atributo
+            if tabela and not (secao == 'det' and elem.get('nItem')):
+                campos = coletar(elem, tabela)
+            else:
+                campos = {}
+            destino[secao] = {'attrib': elem.attrib, 'campos': campos}
+            
+            for filho in filhos.get(secao, ()):
+                if filho in self.SECOES_REPETIDAS:
+                    for sub in elem.iter(qualificadas[filho]):
+                        ocorrencia = {}
+                        repetidas.append(ocorrencia)
+                        abrir(filho, sub, ocorrencia)
+                else:
+                    sub = primeira(elem, qualificadas[filho])
+                    if sub is not None:
+                        abrir(filho, sub, destino)
+        
+        for secao in filhos.get(self.RAIZ, ()):
+            elem = primeira(raiz, qualificadas[secao])
+            if elem is not None:
+                abrir(secao, elem, unicas)
+        
+        return raiz, unicas, repetidas
+    
+    def _texto(self, campos: Dict, campo: str) -> Optional[str]:
+        """Equivalente a get_text sobre os campos coletados"""
+        texto = campos.get(campo)
+        return self.limpar_texto(texto) if texto else None
+    
+    def _endereco(self, secao: Dict, com_cep: bool = True) -> Dict:
+        """Monta os campos de endereço como o parser original"""
+        campos = secao['campos']
+        endereco = {
+            'endereco': f"{self._texto(campos, 'logradouro')}, "
+                        f"{self._texto(campos, 'numero')} - {self._texto(campos, 'bairro')}",
+            'municipio': self._texto(campos, 'municipio'),
+            'uf': self._texto(campos, 'uf'),
+        }
+        if com_cep:
+            endereco['cep'] = self._texto(campos, 'cep')
+        return endereco
+    
+    def _protocolo(self, unicas: Dict) -> Dict:
+        if 'infProt' not in unicas:
+            return {}
+        campos = unicas['infProt']['campos']
+        return {campo: self._texto(campos, campo) for campo in ('protocolo', 'status', 'motivo')}
+    
+    def parse_nfe(self, xml_path: str) -> Dict:
+        """
+        Faz parsing de um arquivo NFe em passada única
+        
+        Args:
+            xml_path: Caminho para o arquivo XML
+            
+        Returns:
+            Dicionário com os dados estruturados da NFe
+        """
+        try:
+            raiz, unicas, repetidas = self._percorrer(xml_path, 'NFe', self.SECOES_NFE)
+            
+            if 'NFe' not in unicas:
+                return {'error': 'Estrutura NFe não encontrada no XML'}
+            if 'infNFe' not in unicas:
+                return {'error': 'Erro ao processar NFe: infNFe não encontrado'}
+            
+            chave = unicas['infNFe']['attrib'].get('Id', '').replace('NFe', '')
+            
+            ide = unicas['ide']['campos'] if 'ide' in unicas else {}
+            
+            emit_data = {}
+            if 'emit' in unicas:
+                campos = unicas['emit']['campos']
+                emit_data = {
+                    'cnpj': self._texto(campos, 'cnpj'),
+                    'nome': self._texto(campos, 'nome'),
+                    'fantasia': self._texto(campos, 'fantasia'),
+                    'ie': self._texto(campos, 'ie'),
+                }
+                if 'enderEmit' in unicas:
+                    emit_data.update(self._endereco(unicas['enderEmit']))
+            
+            dest_data = {}
+            if 'dest' in unicas:
+                campos = unicas['dest']['campos']
+                dest_data = {
+                    'cnpj_cpf': self._texto(campos, 'cnpj') or self._texto(campos, 'cpf'),
+                    'nome': self._texto(campos, 'nome'),
+                    'ie': self._texto(campos, 'ie'),
+                }
+                if 'enderDest' in unicas:
+                    dest_data.update(self._endereco(unicas['enderDest']))
+            
+            valores = {}
+            if 'ICMSTot' in unicas:
+                campos = unicas['ICMSTot']['campos']
+                valores = {
+                    campo: self.extrair_numero(self._texto(campos, campo))
+                    for campo in self.CAMPOS_NFE['ICMSTot'].values()
+                }
+            
+            itens = []
+            for det in repetidas:
+                item = self._montar_item_nfe(det)
+                if item:
+                    itens.append(item)
+            
+            return {
+                'chave_acesso': chave,
+                'numero_nf': ide.get('numero_nf'),
+                'serie': ide.get('serie'),
+                'data_emissao': self.parse_datetime(ide.get('data_emissao')),
+                **emit_data,
+                **{f'dest_{k}': v for k, v in dest_data.items()},
+                **valores,
+                **self._protocolo(unicas),
+                'xml_content': ET.tostring(raiz, encoding='unicode'),
+                'itens': itens
+            }
+            
+        except Exception as e:
+            return {'error': f'Erro ao processar NFe: {str(e)}'}
+    
+    def _montar_item_nfe(self, det: Dict) -> Optional[Dict]:
+        """Monta um item da NFe a partir das seções coletadas de um det"""
+        try:
+            if 'prod' not in det:
+                return None
+            
+            n_item = det['det']['attrib'].get('nItem') or det['det']['campos'].get('numero_item')
+            campos = det['prod']['campos']
+            
+            item = {
+                'numero_item': int(n_item) if n_item else None,
+                'codigo_produto': self._texto(campos, 'codigo_produto'),
+                'descricao': self._texto(campos, 'descricao'),
+                'ncm': self._texto(campos, 'ncm'),
+                'cfop': self._texto(campos, 'cfop'),
+                'cest': self._texto(campos, 'cest'),
+                'unidade': self._texto(campos, 'unidade'),
+                'quantidade': self.extrair_numero(self._texto(campos, 'quantidade')),
+                'valor_unitario': self.extrair_numero(self._texto(campos, 'valor_unitario')),
+                'valor_total': self.extrair_numero(self._texto(campos, 'valor_total')),
+                'ean': self._texto(campos, 'ean'),
+            }
+            
+            # Impostos: a chave só existe quando o valor aparece no XML
+            if 'imposto' in det:
+                for secao in ('ICMS', 'IPI', 'PIS', 'COFINS'):
+                    if secao in det:
+                        for campo, texto in det[secao]['campos'].items():
+                            item[campo] = self.extrair_numero(texto)
+            
+            return item
+            
+        except Exception as e:
+            print(f"Erro ao processar item: {e}")
+            return None
+    
+    def parse_cte(self, xml_path: str) -> Dict:
+        """
+        Faz parsing de um arquivo CTe em passada única
+        
+        Args:
+            xml_path: Caminho para o arquivo XML
+            
+        Returns:
+            Dicionário com os dados estruturados do CTe
+        """
+        try:
+            raiz, unicas, _ = self._percorrer(xml_path, 'CTe', self.SECOES_CTE)
+            
+            if 'CTe' not in unicas:
+                return {'error': 'Estrutura CTe não encontrada no XML'}
+            if 'infCte' not in unicas:
+                return {'error': 'infCte não encontrado'}
+            
+            chave = unicas['infCte']['attrib'].get('Id', '').replace('CTe', '')
+            
+            ide_data = {}
+            if 'ide' in unicas:
+                campos = unicas['ide']['campos']
+                ide_data = {
+                    campo: self._texto(campos, campo)
+                    for campo in self.CAMPOS_CTE['ide'].values()
+                }
+                ide_data['data_emissao'] = self.parse_datetime(ide_data['data_emissao'])
+            
+            emit_data = {}
+            if 'emit' in unicas:
+                campos = unicas['emit']['campos']
+                emit_data = {
+                    'cnpj': self._texto(campos, 'cnpj'),
+                    'nome': self._texto(campos, 'nome'),
+                    'fantasia': self._texto(campos, 'fantasia'),
+                    'ie': self._texto(campos, 'ie'),
+                }
+                if 'enderEmit' in unicas:
+                    emit_data.update(self._endereco(unicas['enderEmit'], com_cep=False))
+            
+            participantes = {}
+            for secao, endereco in (('rem', 'enderReme'), ('dest', 'enderDest')):
+                dados = {}
+                if secao in unicas:
+                    campos = unicas[secao]['campos']
+                    dados = {
+                        'cnpj': self._texto(campos, 'cnpj'),
+                        'nome': self._texto(campos, 'nome'),
+                        'ie': self._texto(campos, 'ie'),
+                    }
+                    if endereco in unicas:
+                        campos = unicas[endereco]['campos']
+                        dados['municipio'] = self._texto(campos, 'municipio')
+                        dados['uf'] = self._texto(campos, 'uf')
+                participantes[secao] = dados
+            
+            valores = {}
+            for secao in ('vPrest', 'infCarga'):
+                if secao in unicas:
+                    campos = unicas[secao]['campos']
+                    for campo in self.CAMPOS_CTE[secao].values():
+                        valores[campo] = self.extrair_numero(self._texto(campos, campo))
+            if 'ICMS' in unicas and 'valor_icms' in unicas['ICMS']['campos']:
+                valores['valor_icms'] = self.extrair_numero(unicas['ICMS']['campos']['valor_icms'])
+            
+            return {
+                'chave_acesso': chave,
+                **ide_data,
+                **{f'emit_{k}': v for k, v in emit_data.items()},
+                **{f'rem_{k}': v for k, v in participantes['rem'].items()},
+                **{f'dest_{k}': v for k, v in participantes['dest'].items()},
+                **valores,
+                **self._protocolo(unicas),
+                'xml_content': ET.tostring(raiz, encoding='unicode'),
+            }
+            
+        except Exception as e:
+            return {'error': f'Erro ao processar CTe: {str(e)}'}
+
+
+# Engines de parsing disponíveis (selecionável via config 'parser')
+PARSERS = {
+    'etree': XMLParser,
+    'stream': XMLStreamParser,
+}
+
+
+def criar_parser(engine: str = 'etree') -> XMLParser:
+    """Instancia o parser da engine escolhida ('etree' ou 'stream')"""
+    try:
+        return PARSERS[engine]()
+    except KeyError:
+        raise ValueError(f"Engine de parser desconhecida: {engine} (opções: {', '.join(PARSERS)})")